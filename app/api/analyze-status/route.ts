@@ -1,15 +1,95 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { DynamoDBClient, GetItemCommand } from '@aws-sdk/client-dynamodb';
 import { unmarshall } from '@aws-sdk/util-dynamodb';
+import { inflateSync } from 'zlib';
+
+/**
+ * 結果テーブルの項目から分析結果をデコード
+ * schemaVersion 2以降: zlib圧縮したJSONのバイナリ、旧形式: JSON文字列
+ */
+function decodeResult(item: Record<string, unknown>) {
+  if (Number(item.schemaVersion ?? 1) >= 2) {
+    return JSON.parse(inflateSync(Buffer.from(item.result as Uint8Array)).toString('utf-8'));
+  }
+  return typeof item.result === 'string'
+    ? JSON.parse(item.result)
+    : item.result;
+}
+
+// ロングポーリングの最大待ち時間（秒）
+const MAX_WAIT_SECONDS = 25;
+
+// ロングポーリング中のDynamoDB読み取り間隔（ミリ秒、完了まで徐々に広げる）
+const INITIAL_READ_INTERVAL_MS = 500;
+const MAX_READ_INTERVAL_MS = 3000;
+
+/**
+ * 結果テーブルから分析ステータスを1回読み取る
+ * 待っている間は要約の属性（status、equipmentCountなど）だけを読み、完了した場合だけ結果本体を読み取ってデコードする
+ */
+async function readStatus(
+  dynamoClient: DynamoDBClient,
+  tableName: string,
+  imageKey: string
+): Promise<
+  | { status: 'processing' }
+  | { status: 'rejected'; reason: string }
+  | { status: 'completed'; result: unknown; equipmentCount: unknown }
+> {
+  const summaryResponse = await dynamoClient.send(new GetItemCommand({
+    TableName: tableName,
+    Key: {
+      imageKey: { S: imageKey }
+    },
+    // statusは予約語のため属性名のプレースホルダーを使う
+    ProjectionExpression: '#status, equipmentCount, schemaVersion, rejectionReason',
+    ExpressionAttributeNames: { '#status': 'status' }
+  }));
+
+  // 結果が見つからない場合は処理中
+  if (!summaryResponse.Item) {
+    return { status: 'processing' };
+  }
+
+  // 要約をアンマーシャル
+  const summary = unmarshall(summaryResponse.Item);
+
+  // 品質チェックで除外された画像は理由だけを返す
+  if (summary.status === 'rejected') {
+    return { status: 'rejected', reason: String(summary.rejectionReason ?? 'unknown') };
+  }
+
+  // 最上位のstatusだけで判定する（statusの無い旧形式の項目は完了済み）
+  if (summary.status && summary.status !== 'completed') {
+    return { status: 'processing' };
+  }
+
+  // 完了時のみ結果本体を読み取ってデコード
+  const resultResponse = await dynamoClient.send(new GetItemCommand({
+    TableName: tableName,
+    Key: {
+      imageKey: { S: imageKey }
+    },
+    ProjectionExpression: '#result, schemaVersion',
+    ExpressionAttributeNames: { '#result': 'result' }
+  }));
+  const result = decodeResult(unmarshall(resultResponse.Item ?? {}));
+  return { status: 'completed', result, equipmentCount: summary.equipmentCount ?? result.equipment?.length };
+}
 
 /**
  * 分析ステータス確認APIルート
- * GET /api/analyze-status?key=<imageKey>
+ * GET /api/analyze-status?key=<imageKey>[&wait=<秒>]
+ *
+ * waitを指定すると、完了するか待ち時間を過ぎるまでサーバー側で待ってから応答する（ロングポーリング）
+ * フロントエンドは分析完了通知のWebSocketで完了イベントを受け取ってから1回だけ呼ぶ（waitなし）
+ * waitによる読み直しは、WebSocketに接続できない場合の代替
  */
 export async function GET(request: NextRequest) {
   try {
     const searchParams = request.nextUrl.searchParams;
     const imageKey = searchParams.get('key');
+    const waitSeconds = Math.min(Math.max(Number(searchParams.get('wait')) || 0, 0), MAX_WAIT_SECONDS);
     
     if (!imageKey) {
       return NextResponse.json(
@@ -49,36 +129,36 @@ export async function GET(request: NextRequest) {
       }
     });
     
-    // DynamoDBから分析結果を取得
-    const command = new GetItemCommand({
-      TableName: tableName,
-      Key: {
-        imageKey: { S: imageKey }
-      }
-    });
-    
-    const response = await dynamoClient.send(command);
-    
-    // 結果が見つからない場合は処理中
-    if (!response.Item) {
+    // 完了するか待ち時間を過ぎるまで、間隔を広げながら読み取る
+    const deadline = Date.now() + waitSeconds * 1000;
+    let intervalMs = INITIAL_READ_INTERVAL_MS;
+    let status = await readStatus(dynamoClient, tableName, imageKey);
+
+    while (status.status === 'processing' && Date.now() + intervalMs < deadline) {
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+      intervalMs = Math.min(intervalMs * 1.5, MAX_READ_INTERVAL_MS);
+      status = await readStatus(dynamoClient, tableName, imageKey);
+    }
+
+    if (status.status === 'processing') {
       return NextResponse.json({
         status: 'processing'
       });
     }
-    
-    // 結果をアンマーシャル
-    const item = unmarshall(response.Item);
-    
-    // 結果をパース
-    const result = typeof item.result === 'string' 
-      ? JSON.parse(item.result) 
-      : item.result;
-    
-    console.log('分析結果取得成功:', { imageKey, equipmentCount: result.equipment?.length });
-    
+
+    if (status.status === 'rejected') {
+      console.log('品質チェックで除外:', { imageKey, reason: status.reason });
+      return NextResponse.json({
+        status: 'rejected',
+        reason: status.reason
+      });
+    }
+
+    console.log('分析結果取得成功:', { imageKey, equipmentCount: status.equipmentCount });
+
     return NextResponse.json({
       status: 'completed',
-      result: result
+      result: status.result
     });
   } catch (error) {
     console.error('分析ステータス確認エラー:', error);
@@ -3,13 +3,51 @@ import { S3Client, PutObjectCommand } from '@aws-sdk/client-s3';
 import { getSignedUrl } from '@aws-sdk/s3-request-presigner';
 import { v4 as uuidv4 } from 'uuid';
 
+// アップロードを受け付ける画像形式と拡張子（分析時にJPEG・PNG以外はLambdaがJPEGに変換する）
+const EXTENSIONS: Record<string, string> = {
+  'image/jpeg': 'jpg',
+  'image/png': 'png',
+  'image/webp': 'webp',
+  'image/gif': 'gif',
+  'image/heic': 'heic',
+  'image/heif': 'heif',
+  'image/avif': 'avif',
+  'image/tiff': 'tiff',
+  'image/bmp': 'bmp'
+};
+
 /**
  * S3署名付きURL生成APIルート
  * POST /api/upload-url
  */
 export async function POST(request: NextRequest) {
   try {
-    const { contentType } = await request.json();
+    const { contentType, sessionId, frameIndex } = await request.json();
+    
+    // 画像形式の検証（拡張子と異なる形式のオブジェクトを作らない）
+    const extension = EXTENSIONS[contentType];
+    if (!extension) {
+      return NextResponse.json(
+        { error: 'Unsupported content type' },
+        { status: 400 }
+      );
+    }
+    
+    // 撮影セッションIDの検証（同じ部屋の連続撮影をまとめて分析するため、キーに含める）
+    if (sessionId !== undefined && !/^[A-Za-z0-9-]{1,64}$/.test(sessionId)) {
+      return NextResponse.json(
+        { error: 'Invalid session id' },
+        { status: 400 }
+      );
+    }
+    
+    // 撮影番号の検証（撮影セッション内の連続撮影の順序。差分分析で直前の写真を特定するため、キーに含める）
+    if (frameIndex !== undefined && (sessionId === undefined || !Number.isInteger(frameIndex) || frameIndex < 0 || frameIndex > 999999)) {
+      return NextResponse.json(
+        { error: 'Invalid frame index' },
+        { status: 400 }
+      );
+    }
     
     // 環境変数の取得
     const region = process.env.NEXT_PUBLIC_REGION || process.env.AWS_REGION || 'us-east-1';
@@ -33,12 +71,13 @@ export async function POST(request: NextRequest) {
       );
     }
     
-    // ファイル名の生成: timestamp-uuid.jpg
+    // ファイル名の生成: timestamp-uuid.<拡張子>（セッションの場合は uploads/sessions/<sessionId>/ 以下）
+    // 撮影番号がある場合は f<6桁の撮影番号>-timestamp-uuid.<拡張子>（撮影順に並ぶ）
     const timestamp = Date.now();
     const uuid = uuidv4();
-    const extension = contentType === 'image/png' ? 'png' : 
-                     contentType === 'image/webp' ? 'webp' : 'jpg';
-    const key = `uploads/${timestamp}-${uuid}.${extension}`;
+    const prefix = sessionId ? `uploads/sessions/${sessionId}` : 'uploads';
+    const frame = frameIndex !== undefined ? `f${String(frameIndex).padStart(6, '0')}-` : '';
+    const key = `${prefix}/${frame}${timestamp}-${uuid}.${extension}`;
     
     // S3クライアントの初期化（Amplify環境では明示的に認証情報を渡す必要がある）
     const s3Client = new S3Client({
@@ -24,6 +24,33 @@ class UnsupportedFormatError extends Error {
   }
 }
 
+// HEIC/HEIF（iPhoneの写真）: デコードできるブラウザ（Safariなど）だけが圧縮・プレビューできる
+const HEIF_TYPES = ['image/heic', 'image/heif'];
+
+/**
+ * アップロードする画像を準備（5MB制限対応のため圧縮してJPEG形式に変換）
+ */
+async function prepareUpload(file: File): Promise<File> {
+  let compressedBlob: Blob;
+  try {
+    compressedBlob = await compressImage(file);
+  } catch (error) {
+    if (HEIF_TYPES.includes(file.type)) {
+      throw new UnsupportedFormatError(
+        'このブラウザではHEIC形式の画像を読み込めません。JPEGに変換してから選択してください'
+      );
+    }
+    throw error;
+  }
+
+  // BlobをFileに変換（拡張子を.jpgに変更）
+  const fileName = file.name.replace(/\.[^.]+$/, '.jpg');
+  return new File([compressedBlob], fileName, {
+    type: 'image/jpeg',
+    lastModified: Date.now(),
+  });
+}
+
 /**
  * ファイルアップロードコンポーネント
  * ローカルファイルシステムから画像を選択
@@ -37,7 +64,7 @@ export default function FileUpload({
 
   // ファイル検証
   const validateFile = useCallback((file: File) => {
-    const ALLOWED_TYPES = ['image/jpeg', 'image/png', 'image/webp'];
+    const ALLOWED_TYPES = ['image/jpeg', 'image/png', 'image/webp', 'image/gif', ...HEIF_TYPES];
     
     // ファイルサイズチェック
     if (file.size > maxSizeBytes) {
@@ -49,7 +76,7 @@ export default function FileUpload({
     // ファイル形式チェック
     if (!ALLOWED_TYPES.includes(file.type)) {
       throw new UnsupportedFormatError(
-        '対応していない画像形式です。JPEG、PNG、またはWEBP形式の画像を選択してください'
+        '対応していない画像形式です。JPEG、PNG、WEBP、GIF、またはHEIC形式の画像を選択してください'
       );
     }
   }, [maxSizeBytes]);
@@ -64,14 +91,7 @@ export default function FileUpload({
         console.log('[FileUpload] 圧縮開始:', file.name, file.size, 'bytes');
         
         // 画像を圧縮（5MB制限対応、JPEG形式に変換）
-        const compressedBlob = await compressImage(file);
-        
-        // BlobをFileに変換（拡張子を.jpgに変更）
-        const fileName = file.name.replace(/\.[^.]+$/, '.jpg');
-        const compressedFile = new File([compressedBlob], fileName, {
-          type: 'image/jpeg',
-          lastModified: Date.now(),
-        });
+        const compressedFile = await prepareUpload(file);
         
         console.log('[FileUpload] 圧縮完了:', compressedFile.name, compressedFile.size, 'bytes');
         
@@ -107,14 +127,7 @@ export default function FileUpload({
         console.log('[FileUpload] ドロップ - 圧縮開始:', file.name, file.size, 'bytes');
         
         // 画像を圧縮（5MB制限対応、JPEG形式に変換）
-        const compressedBlob = await compressImage(file);
-        
-        // BlobをFileに変換（拡張子を.jpgに変更）
-        const fileName = file.name.replace(/\.[^.]+$/, '.jpg');
-        const compressedFile = new File([compressedBlob], fileName, {
-          type: 'image/jpeg',
-          lastModified: Date.now(),
-        });
+        const compressedFile = await prepareUpload(file);
         
         console.log('[FileUpload] 圧縮完了:', compressedFile.name, compressedFile.size, 'bytes');
         
@@ -145,7 +158,7 @@ export default function FileUpload({
       >
         <input
           type="file"
-          accept="image/jpeg,image/png,image/webp"
+          accept="image/jpeg,image/png,image/webp,image/gif,image/heic,image/heif"
           onChange={handleFileChange}
           className="hidden"
         />
@@ -161,7 +174,7 @@ export default function FileUpload({
             クリックして画像を選択、またはドラッグ&ドロップ
           </p>
           <div className="text-sm text-slate-400 space-y-1">
-            <p>対応形式: JPEG, PNG, WEBP</p>
+            <p>対応形式: JPEG, PNG, WEBP, GIF, HEIC</p>
             <p>最大サイズ: {Math.round(maxSizeBytes / 1024 / 1024)}MB</p>
           </div>
         </div>
@@ -2,12 +2,28 @@
  * API関数
  */
 
-import { AnalysisResult } from '../types';
+import { AnalysisCompletionEvent, AnalysisResult, REJECTION_MESSAGES, RejectionReason } from '../types';
+
+// 分析完了を待つ最大時間（ミリ秒）
+const ANALYSIS_TIMEOUT_MS = 30000;
+
+// 分析完了通知のWebSocketに接続できるまでの最大時間（ミリ秒、超えたらポーリングで待つ）
+const EVENTS_CONNECT_TIMEOUT_MS = 5000;
+
+/**
+ * 撮影セッションIDを作成
+ * 同じ場所で続けて撮影した写真に同じIDを付け、まとめて分析・連続撮影の差分分析の対象にする
+ */
+export function createCaptureSessionId(): string {
+  return crypto.randomUUID();
+}
 
 /**
  * 署名付きURLを取得
+ * sessionIdを指定すると、同じ撮影セッションの画像としてまとめて分析される
+ * frameIndexはセッション内の撮影順の番号（前の写真との差分分析で直前の写真を特定する）
  */
-export async function getSignedUploadUrl(contentType: string): Promise<{
+export async function getSignedUploadUrl(contentType: string, sessionId?: string, frameIndex?: number): Promise<{
   uploadUrl: string;
   key: string;
 }> {
@@ -16,7 +32,7 @@ export async function getSignedUploadUrl(contentType: string): Promise<{
     headers: {
       'Content-Type': 'application/json'
     },
-    body: JSON.stringify({ contentType })
+    body: JSON.stringify({ contentType, sessionId, frameIndex })
   });
   
   if (!response.ok) {
@@ -70,15 +86,78 @@ export async function uploadToS3(
 }
 
 /**
- * 分析ステータスをポーリング
+ * 分析完了イベントの待ち受け
+ */
+export interface AnalysisEventSubscription {
+  // 完了イベントを待つ（タイムアウト・切断した場合はnull）
+  wait: (timeoutMs: number) => Promise<AnalysisCompletionEvent | null>;
+  close: () => void;
+}
+
+/**
+ * 分析完了通知のWebSocketに接続し、画像の完了イベントを待ち受ける
+ * アップロードの前に接続することで、完了を取りこぼさない（接続時にサーバー側で画像と接続を登録する）
+ * NEXT_PUBLIC_ANALYSIS_EVENTS_URLが未設定・接続できない場合はnull（ポーリングで待つ）
+ */
+export function subscribeAnalysisEvents(imageKey: string): Promise<AnalysisEventSubscription | null> {
+  const eventsUrl = process.env.NEXT_PUBLIC_ANALYSIS_EVENTS_URL;
+  if (!eventsUrl || typeof WebSocket === 'undefined') {
+    return Promise.resolve(null);
+  }
+
+  return new Promise(resolve => {
+    const socket = new WebSocket(`${eventsUrl}?key=${encodeURIComponent(imageKey)}`);
+    const connectTimer = setTimeout(() => {
+      socket.close();
+      resolve(null);
+    }, EVENTS_CONNECT_TIMEOUT_MS);
+
+    const completion = new Promise<AnalysisCompletionEvent | null>(resolveCompletion => {
+      socket.addEventListener('message', message => {
+        const event = JSON.parse(message.data);
+        if (event.type === 'analysis.completed' && event.imageKey === imageKey) {
+          resolveCompletion(event);
+        }
+      });
+      socket.addEventListener('close', () => resolveCompletion(null));
+    });
+
+    socket.addEventListener('open', () => {
+      clearTimeout(connectTimer);
+      resolve({
+        wait: (timeoutMs: number) => Promise.race([
+          completion,
+          new Promise<null>(resolveTimeout => setTimeout(() => resolveTimeout(null), timeoutMs))
+        ]),
+        close: () => socket.close()
+      });
+    });
+
+    socket.addEventListener('error', () => {
+      clearTimeout(connectTimer);
+      resolve(null);
+    });
+  });
+}
+
+/**
+ * 分析ステータスをロングポーリング
+ * 1回のリクエストでサーバー側が最大waitSeconds秒まで完了を待つため、固定間隔のポーリングより呼び出しが少ない
+ * 完了イベントを受け取った後は、最初の読み取りで結果が返る
  */
 export async function pollAnalysisStatus(
   imageKey: string,
-  maxAttempts: number = 30,
-  intervalMs: number = 1000
+  timeoutMs: number = ANALYSIS_TIMEOUT_MS,
+  waitSeconds: number = 20
 ): Promise<AnalysisResult> {
-  for (let attempt = 0; attempt < maxAttempts; attempt++) {
-    const response = await fetch(`/api/analyze-status?key=${encodeURIComponent(imageKey)}`);
+  const deadline = Date.now() + timeoutMs;
+
+  while (Date.now() < deadline) {
+    const remainingSeconds = Math.ceil((deadline - Date.now()) / 1000);
+    const wait = Math.max(1, Math.min(waitSeconds, remainingSeconds));
+    const response = await fetch(
+      `/api/analyze-status?key=${encodeURIComponent(imageKey)}&wait=${wait}`
+    );
     
     if (!response.ok) {
       throw new Error('分析ステータスの確認に失敗しました');
@@ -95,12 +174,16 @@ export async function pollAnalysisStatus(
       };
     }
     
+    if (data.status === 'rejected') {
+      // 品質チェックで除外された画像は分析されないため、撮り直しを促す
+      throw new Error(
+        REJECTION_MESSAGES[data.reason as RejectionReason] ?? '写真を分析できませんでした。もう一度撮影してください'
+      );
+    }
+    
     if (data.status === 'failed') {
       throw new Error(data.error || '分析に失敗しました');
     }
-    
-    // 次のポーリングまで待機
-    await new Promise(resolve => setTimeout(resolve, intervalMs));
   }
   
   throw new Error('分析がタイムアウトしました。もう一度お試しください');
@@ -111,16 +194,28 @@ export async function pollAnalysisStatus(
  */
 export async function uploadAndAnalyze(
   file: Blob,
-  onProgress?: (progress: number) => void
+  onProgress?: (progress: number) => void,
+  sessionId?: string,
+  frameIndex?: number
 ): Promise<AnalysisResult> {
   // 1. 署名付きURL取得
-  const { uploadUrl, key } = await getSignedUploadUrl(file.type);
+  const { uploadUrl, key } = await getSignedUploadUrl(file.type, sessionId, frameIndex);
   
-  // 2. S3にアップロード
-  await uploadToS3(uploadUrl, file, onProgress);
+  // 2. 分析完了イベントの待ち受け（アップロードの前に接続する）
+  const subscription = await subscribeAnalysisEvents(key);
   
-  // 3. 分析完了を待機
-  const result = await pollAnalysisStatus(key);
-  
-  return result;
+  try {
+    // 3. S3にアップロード
+    await uploadToS3(uploadUrl, file, onProgress);
+    
+    // 4. 分析完了を待機（完了イベントを受け取ってから結果を1回だけ読み取る）
+    const deadline = Date.now() + ANALYSIS_TIMEOUT_MS;
+    if (subscription) {
+      await subscription.wait(ANALYSIS_TIMEOUT_MS);
+    }
+    // イベントを受け取れなかった場合は、残りの時間でロングポーリング
+    return await pollAnalysisStatus(key, Math.max(deadline - Date.now(), 1000));
+  } finally {
+    subscription?.close();
+  }
 }
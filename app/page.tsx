@@ -1,6 +1,6 @@
 'use client';
 
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import ImageInputSelector from './components/ImageInputSelector';
 import CameraCapture from './components/CameraCapture';
 import FileUpload from './components/FileUpload';
@@ -10,7 +10,7 @@ import EquipmentDetailModal from './components/EquipmentDetailModal';
 import LoadingIndicator from './components/LoadingIndicator';
 import ErrorMessage from './components/ErrorMessage';
 import { InputMode, Equipment, AnalysisResult } from './types';
-import { uploadAndAnalyze } from './lib/api';
+import { uploadAndAnalyze, createCaptureSessionId } from './lib/api';
 
 type AppStatus = 'idle' | 'preview' | 'uploading' | 'analyzing' | 'completed' | 'error';
 
@@ -28,6 +28,24 @@ export default function Home() {
   const [selectedEquipment, setSelectedEquipment] = useState<Equipment | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [uploadProgress, setUploadProgress] = useState<number>(0);
+  // カメラ撮影の撮影セッションID（同じ場所の写真をまとめて分析する）
+  const [captureSessionId, setCaptureSessionId] = useState<string | null>(null);
+  // 撮影セッション内の次の撮影番号（前の写真との差分分析で直前の写真を特定する）
+  const nextFrameIndex = useRef(0);
+
+  // 入力モード切り替え（カメラに切り替えたら新しい撮影セッションを始める）
+  const handleModeChange = (mode: InputMode) => {
+    if (mode === inputMode) return;
+    setInputMode(mode);
+    setCaptureSessionId(mode === 'camera' ? createCaptureSessionId() : null);
+    nextFrameIndex.current = 0;
+  };
+
+  // 別の場所を撮影（新しい撮影セッションを始める）
+  const handleNewLocation = () => {
+    setCaptureSessionId(createCaptureSessionId());
+    nextFrameIndex.current = 0;
+  };
 
   // 画像選択ハンドラ
   const handleImageSelect = (blob: Blob) => {
@@ -64,6 +82,10 @@ export default function Home() {
       setStatus('uploading');
       setUploadProgress(0);
 
+      // カメラで撮影した写真だけを撮影セッションに含め、撮影順の番号を付ける
+      const sessionId = inputMode === 'camera' ? captureSessionId ?? undefined : undefined;
+      const frameIndex = sessionId ? nextFrameIndex.current++ : undefined;
+
       // 画像をアップロードして分析
       const result = await uploadAndAnalyze(
         selectedImage.blob,
@@ -72,7 +94,9 @@ export default function Home() {
           if (progress >= 100) {
             setStatus('analyzing');
           }
-        }
+        },
+        sessionId,
+        frameIndex
       );
 
       setAnalysisResult(result);
@@ -121,8 +145,17 @@ export default function Home() {
           <div className="flex-1 flex flex-col p-4 gap-4">
             <ImageInputSelector 
               mode={inputMode} 
-              onModeChange={setInputMode} 
+              onModeChange={handleModeChange} 
             />
+
+            {inputMode === 'camera' && (
+              <button
+                onClick={handleNewLocation}
+                className="px-4 py-2 bg-slate-800 hover:bg-slate-700 text-slate-300 text-sm rounded-lg transition-colors"
+              >
+                📍 別の場所を撮影
+              </button>
+            )}
             
             <div className="flex-1 overflow-hidden">
               {inputMode === 'camera' ? (
@@ -31,6 +31,27 @@ export interface AnalysisResult {
   error?: string;
 }
 
+// 分析完了イベント（WebSocketで受け取る、結果本体は含まない）
+export interface AnalysisCompletionEvent {
+  type: 'analysis.completed';
+  imageKey: string;
+  status: 'completed' | 'rejected';
+  equipmentCount: number;
+  completedAt: number;
+  reason?: string;
+}
+
+// 品質チェックで除外された理由
+export type RejectionReason = 'blurry' | 'too_dark' | 'too_bright' | 'no_objects';
+
+// 除外の理由ごとの撮り直しの案内
+export const REJECTION_MESSAGES: Record<RejectionReason, string> = {
+  blurry: '写真がぶれています。カメラを固定してもう一度撮影してください',
+  too_dark: '写真が暗すぎます。照明を当ててもう一度撮影してください',
+  too_bright: '写真が明るすぎます。逆光を避けてもう一度撮影してください',
+  no_objects: '機器が写っていません。機器に近づいてもう一度撮影してください'
+};
+
 // 入力モード
 export type InputMode = 'camera' | 'upload';
 
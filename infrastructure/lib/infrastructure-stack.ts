@@ -4,6 +4,10 @@ import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as s3n from 'aws-cdk-lib/aws-s3-notifications';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as apigwv2 from 'aws-cdk-lib/aws-apigatewayv2';
+import { WebSocketLambdaIntegration } from 'aws-cdk-lib/aws-apigatewayv2-integrations';
+import { SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
 import { Construct } from 'constructs';
 
 export class GijutsuKyokuchouStack extends cdk.Stack {
@@ -29,6 +33,13 @@ export class GijutsuKyokuchouStack extends cdk.Stack {
           id: 'DeleteAfter3Days',
           enabled: true,
           expiration: cdk.Duration.days(3)
+        },
+        {
+          // 段階の出力の記録は再試行・再分析の間だけ残せばよい
+          id: 'DeleteDerivedAfter1Day',
+          enabled: true,
+          prefix: 'derived/',
+          expiration: cdk.Duration.days(1)
         }
       ],
       blockPublicAccess: s3.BlockPublicAccess.BLOCK_ALL,
@@ -50,6 +61,84 @@ export class GijutsuKyokuchouStack extends cdk.Stack {
       removalPolicy: cdk.RemovalPolicy.DESTROY // 開発環境用
     });
 
+    // DynamoDBテーブル - Bedrockのレート制限用（1分単位の窓ごとの消費トークン数）
+    const rateLimitTable = new dynamodb.Table(this, 'RateLimitTable', {
+      tableName: 'gijutsu-kyokuchou-cteam-rate-limit',
+      partitionKey: {
+        name: 'limiterKey',
+        type: dynamodb.AttributeType.STRING
+      },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'ttl', // 窓の終了から1時間後に自動削除
+      removalPolicy: cdk.RemovalPolicy.DESTROY // 開発環境用
+    });
+
+    // DynamoDBテーブル - 撮影場所（セッション）ごとの機器台帳
+    const inventoryTable = new dynamodb.Table(this, 'InventoryTable', {
+      tableName: 'gijutsu-kyokuchou-cteam-inventory',
+      partitionKey: {
+        name: 'locationId',
+        type: dynamodb.AttributeType.STRING
+      },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'ttl', // 最後の更新から30日後に自動削除
+      removalPolicy: cdk.RemovalPolicy.DESTROY // 開発環境用
+    });
+
+    // DynamoDBテーブル - 機器カタログの2段目（同梱のdevice_catalog.jsonに無い機器を正規化名で登録）
+    const catalogTable = new dynamodb.Table(this, 'CatalogTable', {
+      tableName: 'gijutsu-kyokuchou-cteam-device-catalog',
+      partitionKey: {
+        name: 'normalizedName',
+        type: dynamodb.AttributeType.STRING
+      },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.RETAIN // 確認済みのデータのため保持
+    });
+
+    // DynamoDBテーブル - 分析完了を待つWebSocket接続（画像ごとに接続を登録し、完了時に送信）
+    const subscriptionsTable = new dynamodb.Table(this, 'SubscriptionsTable', {
+      tableName: 'gijutsu-kyokuchou-cteam-subscriptions',
+      partitionKey: {
+        name: 'imageKey',
+        type: dynamodb.AttributeType.STRING
+      },
+      sortKey: {
+        name: 'connectionId',
+        type: dynamodb.AttributeType.STRING
+      },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'ttl', // 送信されなかった登録は15分後に自動削除
+      removalPolicy: cdk.RemovalPolicy.DESTROY // 開発環境用
+    });
+
+    // Lambda関数 - WebSocket接続の登録用（$connectルート）
+    const subscribeFunction = new lambda.Function(this, 'SubscribeFunction', {
+      functionName: 'gijutsu-kyokuchou-cteam-subscribe',
+      runtime: lambda.Runtime.PYTHON_3_12,
+      handler: 'event_subscriptions.lambda_handler',
+      code: lambda.Code.fromAsset('../lambda/image_analyzer'),
+      timeout: cdk.Duration.seconds(10),
+      memorySize: 256,
+      environment: {
+        SUBSCRIPTIONS_TABLE_NAME: subscriptionsTable.tableName
+      }
+    });
+    subscriptionsTable.grantWriteData(subscribeFunction);
+
+    // WebSocket API - 分析完了の通知用（フロントエンドは?key=<imageKey>で接続して完了を待つ）
+    const analysisEventsApi = new apigwv2.WebSocketApi(this, 'AnalysisEventsApi', {
+      apiName: 'gijutsu-kyokuchou-cteam-analysis-events',
+      connectRouteOptions: {
+        integration: new WebSocketLambdaIntegration('SubscribeIntegration', subscribeFunction)
+      }
+    });
+    const analysisEventsStage = new apigwv2.WebSocketStage(this, 'AnalysisEventsStage', {
+      webSocketApi: analysisEventsApi,
+      stageName: 'prod',
+      autoDeploy: true
+    });
+
     // Lambda関数 - 画像分析用
     const analyzerFunction = new lambda.Function(this, 'AnalyzerFunction', {
       functionName: 'gijutsu-kyokuchou-cteam-analyzer',
@@ -61,10 +150,65 @@ export class GijutsuKyokuchouStack extends cdk.Stack {
       environment: {
         RESULTS_TABLE_NAME: resultsTable.tableName,
         BEDROCK_REGION: 'us-east-1',
-        BEDROCK_MODEL_ID: 'us.anthropic.claude-sonnet-4-5-20250929-v1:0'
+        BEDROCK_MODEL_ID: 'us.anthropic.claude-sonnet-4-5-20250929-v1:0',
+        RATE_LIMIT_TABLE_NAME: rateLimitTable.tableName,
+        INVENTORY_TABLE_NAME: inventoryTable.tableName,
+        // 機器台帳による識別の省略（例: -c inventory=true）
+        INVENTORY_ENABLED: String(this.node.tryGetContext('inventory') ?? false),
+        CATALOG_TABLE_NAME: catalogTable.tableName,
+        // 機器カタログによる補完（例: -c catalog=true）
+        CATALOG_ENABLED: String(this.node.tryGetContext('catalog') ?? false),
+        // 非同期パイプライン（例: -c asyncPipeline=true、aiobotocoreのレイヤーを追加する）
+        ASYNC_PIPELINE_ENABLED: String(this.node.tryGetContext('asyncPipeline') ?? false),
+        // 前面パネルの印字による識別（例: -c ocrFastPath=true）
+        OCR_FAST_PATH_ENABLED: String(this.node.tryGetContext('ocrFastPath') ?? false),
+        // ぶれ・露出不良の画像の除外（例: -c qualityGate=true）
+        QUALITY_GATE_ENABLED: String(this.node.tryGetContext('qualityGate') ?? false),
+        // 段階の出力の記録による再試行の再開（例: -c stageCheckpoint=true）
+        STAGE_CHECKPOINT_ENABLED: String(this.node.tryGetContext('stageCheckpoint') ?? false),
+        // 連続撮影の差分分析（例: -c incrementalMode=true、numpyのレイヤーを追加する）
+        INCREMENTAL_MODE_ENABLED: String(this.node.tryGetContext('incrementalMode') ?? false),
+        // Rekognitionを待たないClaudeの先読みの識別（例: -c speculativeIdentification=true）
+        SPECULATIVE_IDENTIFICATION_ENABLED: String(this.node.tryGetContext('speculativeIdentification') ?? false),
+        // 物体検出のバックエンド（例: -c detectorBackend=onnx、onnxruntimeのレイヤーを追加する）
+        DETECTOR_BACKEND: String(this.node.tryGetContext('detectorBackend') ?? 'rekognition'),
+        // 高解像度画像のタイル分析（0で無効、例: -c tilingMinMegapixels=20、タイル数 + 1回のBedrock呼び出しになる）
+        TILING_MIN_MEGAPIXELS: String(this.node.tryGetContext('tilingMinMegapixels') ?? 0),
+        // 関心領域だけをClaudeに送る（例: -c roiCrop=true）
+        ROI_CROP_ENABLED: String(this.node.tryGetContext('roiCrop') ?? false),
+        // 保存の成功時に、完了を待っているWebSocket接続へ通知する
+        NOTIFIER_BACKEND: 'websocket',
+        SUBSCRIPTIONS_TABLE_NAME: subscriptionsTable.tableName,
+        WEBSOCKET_CALLBACK_URL: analysisEventsStage.callbackUrl,
+        // Bedrockの1分あたりトークン数の上限（0で無効、例: -c bedrockTokensPerMinute=200000）
+        RATE_LIMIT_TOKENS_PER_MINUTE: String(this.node.tryGetContext('bedrockTokensPerMinute') ?? 0)
       }
     });
 
+    // 有効にした機能が使う依存のレイヤー（機能ごとのrequirements-<機能>.txtのうち、有効にしたものだけを入れる）
+    // 該当する機能を有効にした場合だけ作成する（作成時のバンドルにはDockerが必要）
+    // heic: iPhoneのHEIC/HEIFのアップロードを読み込む（例: -c heic=true）
+    const optionalRequirements = [
+      { file: 'requirements-async.txt', enabled: this.node.tryGetContext('asyncPipeline') },        // aiobotocore
+      { file: 'requirements-heic.txt', enabled: this.node.tryGetContext('heic') },                  // pillow-heif
+      { file: 'requirements-incremental.txt', enabled: this.node.tryGetContext('incrementalMode') }, // numpy
+      { file: 'requirements-onnx.txt', enabled: this.node.tryGetContext('detectorBackend') === 'onnx' } // onnxruntime、numpy
+    ].filter(requirement => String(requirement.enabled) === 'true').map(requirement => requirement.file);
+
+    if (optionalRequirements.length > 0) {
+      const installArgs = optionalRequirements.map(file => `-r ${file}`).join(' ');
+      analyzerFunction.addLayers(new lambda.LayerVersion(this, 'OptionalDependenciesLayer', {
+        code: lambda.Code.fromAsset('../lambda/image_analyzer', {
+          bundling: {
+            image: lambda.Runtime.PYTHON_3_12.bundlingImage,
+            command: ['bash', '-c', `pip install ${installArgs} -t /asset-output/python`]
+          }
+        }),
+        compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+        description: `技術局長 - 任意機能の依存パッケージ（${optionalRequirements.join(', ')}）`
+      }));
+    }
+
     // Lambda関数にBedrockアクセス権限を付与（inference profileとfoundation modelの両方）
     analyzerFunction.addToRolePolicy(new iam.PolicyStatement({
       actions: ['bedrock:InvokeModel'],
@@ -78,22 +222,90 @@ export class GijutsuKyokuchouStack extends cdk.Stack {
 
     // Lambda関数にRekognitionアクセス権限を付与
     analyzerFunction.addToRolePolicy(new iam.PolicyStatement({
-      actions: ['rekognition:DetectLabels'],
+      actions: ['rekognition:DetectLabels', 'rekognition:DetectText'],
       resources: ['*']  // Rekognitionはリソースレベルの権限をサポートしていない
     }));
 
     // Lambda関数にS3読み取り権限を付与
     imageBucket.grantRead(analyzerFunction);
 
-    // Lambda関数にDynamoDB書き込み権限を付与
-    resultsTable.grantWriteData(analyzerFunction);
+    // Lambda関数に段階の出力の記録（derived/）の書き込み権限を付与
+    imageBucket.grantPut(analyzerFunction, 'derived/*');
+
+    // Lambda関数にDynamoDB読み書き権限を付与（重複イベント排除のリース確認で読み取りも必要）
+    resultsTable.grantReadWriteData(analyzerFunction);
 
-    // S3イベント通知の設定
-    imageBucket.addEventNotification(
-      s3.EventType.OBJECT_CREATED,
-      new s3n.LambdaDestination(analyzerFunction),
-      { prefix: 'uploads/' }
-    );
+    // Lambda関数にレート制限テーブルの読み書き権限を付与
+    rateLimitTable.grantReadWriteData(analyzerFunction);
+
+    // Lambda関数に機器台帳の読み書き権限を付与
+    inventoryTable.grantReadWriteData(analyzerFunction);
+
+    // Lambda関数に機器カタログの読み取り権限を付与
+    catalogTable.grantReadData(analyzerFunction);
+
+    // Lambda関数に完了通知の送信権限を付与（登録の読み取り・送信済みの削除と、接続への送信）
+    subscriptionsTable.grantReadWriteData(analyzerFunction);
+    analysisEventsApi.grantManageConnections(analyzerFunction);
+
+    // 取り込み方式: direct（S3 → Lambda）または sqs（S3 → SQS → Lambda）
+    // 例: npx cdk deploy -c ingestion=sqs -c batchMaxConcurrency=4
+    const ingestion = this.node.tryGetContext('ingestion') ?? 'direct';
+
+    if (ingestion === 'sqs') {
+      // 処理に失敗し続けたメッセージの退避先
+      const ingestionDlq = new sqs.Queue(this, 'IngestionDeadLetterQueue', {
+        queueName: 'gijutsu-kyokuchou-cteam-ingestion-dlq',
+        retentionPeriod: cdk.Duration.days(3)
+      });
+
+      // アップロードの集中をならすキュー（可視性タイムアウトはLambdaタイムアウトの6倍）
+      const ingestionQueue = new sqs.Queue(this, 'IngestionQueue', {
+        queueName: 'gijutsu-kyokuchou-cteam-ingestion',
+        visibilityTimeout: cdk.Duration.seconds(360),
+        retentionPeriod: cdk.Duration.days(1),
+        deadLetterQueue: {
+          queue: ingestionDlq,
+          maxReceiveCount: 5
+        }
+      });
+
+      imageBucket.addEventNotification(
+        s3.EventType.OBJECT_CREATED,
+        new s3n.SqsDestination(ingestionQueue),
+        { prefix: 'uploads/' }
+      );
+
+      // 失敗した画像のメッセージだけを再試行（batchItemFailures）
+      // 撮影セッションの画像をまとめるため、待ち時間はsessionWindowSecondsで調整できる
+      analyzerFunction.addEventSource(new SqsEventSource(ingestionQueue, {
+        batchSize: 10,
+        maxBatchingWindow: cdk.Duration.seconds(Number(this.node.tryGetContext('sessionWindowSeconds') ?? 2)),
+        reportBatchItemFailures: true,
+        maxConcurrency: Number(this.node.tryGetContext('ingestionMaxConcurrency') ?? 5)
+      }));
+
+      // SQSは少なくとも1回配信のため、重複したメッセージはリースで分析を省く
+      analyzerFunction.addEnvironment('IDEMPOTENCY_ENABLED', 'true');
+
+      analyzerFunction.addEnvironment(
+        'BATCH_MAX_CONCURRENCY',
+        String(this.node.tryGetContext('batchMaxConcurrency') ?? 4)
+      );
+
+      // 撮影セッション単位の分析（例: -c sessionMode=true -c sessionWindowSeconds=10）
+      analyzerFunction.addEnvironment(
+        'SESSION_MODE_ENABLED',
+        String(this.node.tryGetContext('sessionMode') ?? false)
+      );
+    } else {
+      // S3イベント通知の設定
+      imageBucket.addEventNotification(
+        s3.EventType.OBJECT_CREATED,
+        new s3n.LambdaDestination(analyzerFunction),
+        { prefix: 'uploads/' }
+      );
+    }
 
     // 出力
     new cdk.CfnOutput(this, 'BucketName', {
@@ -108,6 +320,12 @@ export class GijutsuKyokuchouStack extends cdk.Stack {
       exportName: 'GijutsuKyokuchou-TableName'
     });
 
+    new cdk.CfnOutput(this, 'AnalysisEventsUrl', {
+      value: analysisEventsStage.url,
+      description: 'Analysis completion WebSocket URL (NEXT_PUBLIC_ANALYSIS_EVENTS_URL)',
+      exportName: 'GijutsuKyokuchou-AnalysisEventsUrl'
+    });
+
     new cdk.CfnOutput(this, 'FunctionName', {
       value: analyzerFunction.functionName,
       description: 'Lambda Function Name',
@@ -67,7 +67,7 @@ describe('GijutsuKyokuchouStack', () => {
     template.hasResourceProperties('AWS::Lambda::Function', {
       FunctionName: 'gijutsu-kyokuchou-cteam-analyzer',
       Runtime: 'python3.12',
-      Timeout: 30,
+      Timeout: 60,
       MemorySize: 1024
     });
   });
@@ -79,13 +79,132 @@ describe('GijutsuKyokuchouStack', () => {
           Match.objectLike({
             Action: 'bedrock:InvokeModel',
             Effect: 'Allow',
-            Resource: Match.stringLikeRegexp('.*anthropic.claude-3-5-sonnet.*')
+            Resource: Match.arrayWith([Match.stringLikeRegexp('.*foundation-model/anthropic\\.claude-.*')])
           })
         ])
       }
     });
   });
 
+  test('レート制限・機器台帳・機器カタログのテーブルが作成される', () => {
+    template.hasResourceProperties('AWS::DynamoDB::Table', {
+      TableName: 'gijutsu-kyokuchou-cteam-rate-limit',
+      KeySchema: [{ AttributeName: 'limiterKey', KeyType: 'HASH' }],
+      TimeToLiveSpecification: { AttributeName: 'ttl', Enabled: true }
+    });
+    template.hasResourceProperties('AWS::DynamoDB::Table', {
+      TableName: 'gijutsu-kyokuchou-cteam-inventory',
+      KeySchema: [{ AttributeName: 'locationId', KeyType: 'HASH' }],
+      TimeToLiveSpecification: { AttributeName: 'ttl', Enabled: true }
+    });
+    template.hasResource('AWS::DynamoDB::Table', {
+      Properties: Match.objectLike({
+        TableName: 'gijutsu-kyokuchou-cteam-device-catalog',
+        KeySchema: [{ AttributeName: 'normalizedName', KeyType: 'HASH' }]
+      }),
+      DeletionPolicy: 'Retain'
+    });
+  });
+
+  test('分析完了通知のWebSocket APIが作成され、Lambda関数に渡される', () => {
+    template.hasResourceProperties('AWS::ApiGatewayV2::Api', {
+      Name: 'gijutsu-kyokuchou-cteam-analysis-events',
+      ProtocolType: 'WEBSOCKET'
+    });
+    template.hasResourceProperties('AWS::ApiGatewayV2::Route', {
+      RouteKey: '$connect'
+    });
+    template.hasResourceProperties('AWS::DynamoDB::Table', {
+      TableName: 'gijutsu-kyokuchou-cteam-subscriptions',
+      KeySchema: [
+        { AttributeName: 'imageKey', KeyType: 'HASH' },
+        { AttributeName: 'connectionId', KeyType: 'RANGE' }
+      ],
+      TimeToLiveSpecification: { AttributeName: 'ttl', Enabled: true }
+    });
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      FunctionName: 'gijutsu-kyokuchou-cteam-analyzer',
+      Environment: {
+        Variables: Match.objectLike({
+          NOTIFIER_BACKEND: 'websocket',
+          SUBSCRIPTIONS_TABLE_NAME: { Ref: Match.stringLikeRegexp('SubscriptionsTable.*') }
+        })
+      }
+    });
+    template.hasResourceProperties('AWS::IAM::Policy', {
+      PolicyDocument: {
+        Statement: Match.arrayWith([
+          Match.objectLike({
+            Action: 'execute-api:ManageConnections',
+            Effect: 'Allow'
+          })
+        ])
+      }
+    });
+  });
+
+  test('既定の取り込み方式ではSQSキューを作成しない', () => {
+    template.resourceCountIs('AWS::SQS::Queue', 0);
+    template.resourceCountIs('AWS::Lambda::EventSourceMapping', 0);
+  });
+
+  test('既定では任意機能の依存のレイヤーを追加しない', () => {
+    template.resourceCountIs('AWS::Lambda::LayerVersion', 0);
+  });
+
+  test('非同期パイプラインを有効にするとaiobotocoreのレイヤーを追加する', () => {
+    // バンドル（Docker）を省略して合成する
+    const asyncApp = new cdk.App({ context: { asyncPipeline: true, 'aws:cdk:bundling-stacks': [] } });
+    const asyncStack = new GijutsuKyokuchouStack(asyncApp, 'AsyncStack', {
+      env: { account: '727598134232', region: 'us-east-1' }
+    });
+    const asyncTemplate = Template.fromStack(asyncStack);
+
+    asyncTemplate.hasResourceProperties('AWS::Lambda::LayerVersion', {
+      CompatibleRuntimes: ['python3.12']
+    });
+    asyncTemplate.hasResourceProperties('AWS::Lambda::Function', {
+      FunctionName: 'gijutsu-kyokuchou-cteam-analyzer',
+      Layers: [{ Ref: Match.stringLikeRegexp('OptionalDependenciesLayer.*') }],
+      Environment: {
+        Variables: Match.objectLike({ ASYNC_PIPELINE_ENABLED: 'true' })
+      }
+    });
+  });
+
+  test('差分分析・ローカル検出を有効にするとnumpy・onnxruntimeのレイヤーを追加する', () => {
+    for (const context of [{ incrementalMode: true }, { detectorBackend: 'onnx' }]) {
+      // バンドル（Docker）を省略して合成する
+      const featureApp = new cdk.App({ context: { ...context, 'aws:cdk:bundling-stacks': [] } });
+      const featureStack = new GijutsuKyokuchouStack(featureApp, 'FeatureStack', {
+        env: { account: '727598134232', region: 'us-east-1' }
+      });
+      Template.fromStack(featureStack).hasResourceProperties('AWS::Lambda::Function', {
+        FunctionName: 'gijutsu-kyokuchou-cteam-analyzer',
+        Layers: [{ Ref: Match.stringLikeRegexp('OptionalDependenciesLayer.*') }]
+      });
+    }
+  });
+
+  test('レイヤーには有効にした機能の依存だけを入れる', () => {
+    // バンドル（Docker）を省略して合成する
+    const heicApp = new cdk.App({ context: { heic: true, 'aws:cdk:bundling-stacks': [] } });
+    const heicStack = new GijutsuKyokuchouStack(heicApp, 'HeicStack', {
+      env: { account: '727598134232', region: 'us-east-1' }
+    });
+    Template.fromStack(heicStack).hasResourceProperties('AWS::Lambda::LayerVersion', {
+      Description: '技術局長 - 任意機能の依存パッケージ（requirements-heic.txt）'
+    });
+
+    const onnxApp = new cdk.App({ context: { incrementalMode: true, detectorBackend: 'onnx', 'aws:cdk:bundling-stacks': [] } });
+    const onnxStack = new GijutsuKyokuchouStack(onnxApp, 'OnnxStack', {
+      env: { account: '727598134232', region: 'us-east-1' }
+    });
+    Template.fromStack(onnxStack).hasResourceProperties('AWS::Lambda::LayerVersion', {
+      Description: '技術局長 - 任意機能の依存パッケージ（requirements-incremental.txt, requirements-onnx.txt）'
+    });
+  });
+
   test('S3イベント通知が設定される', () => {
     template.hasResourceProperties('Custom::S3BucketNotifications', {
       NotificationConfiguration: {
@@ -112,3 +231,80 @@ describe('GijutsuKyokuchouStack', () => {
     expect(template.toJSON()).toMatchSnapshot();
   });
 });
+
+describe('GijutsuKyokuchouStack（SQS経由の取り込み）', () => {
+  let template: Template;
+
+  beforeEach(() => {
+    const app = new cdk.App({ context: { ingestion: 'sqs' } });
+    const stack = new GijutsuKyokuchouStack(app, 'TestStack', {
+      env: { account: '727598134232', region: 'us-east-1' }
+    });
+    template = Template.fromStack(stack);
+  });
+
+  test('取り込みキューとDLQが作成される', () => {
+    template.hasResourceProperties('AWS::SQS::Queue', {
+      QueueName: 'gijutsu-kyokuchou-cteam-ingestion-dlq',
+      MessageRetentionPeriod: 259200
+    });
+    template.hasResourceProperties('AWS::SQS::Queue', {
+      QueueName: 'gijutsu-kyokuchou-cteam-ingestion',
+      VisibilityTimeout: 360,
+      MessageRetentionPeriod: 86400,
+      RedrivePolicy: {
+        deadLetterTargetArn: { 'Fn::GetAtt': [Match.stringLikeRegexp('IngestionDeadLetterQueue.*'), 'Arn'] },
+        maxReceiveCount: 5
+      }
+    });
+  });
+
+  test('可視性タイムアウトがLambdaタイムアウトの6倍以上', () => {
+    const functions = template.findResources('AWS::Lambda::Function', {
+      Properties: { FunctionName: 'gijutsu-kyokuchou-cteam-analyzer' }
+    });
+    const queues = template.findResources('AWS::SQS::Queue', {
+      Properties: { QueueName: 'gijutsu-kyokuchou-cteam-ingestion' }
+    });
+    const timeout = Object.values(functions)[0].Properties.Timeout;
+    const visibilityTimeout = Object.values(queues)[0].Properties.VisibilityTimeout;
+
+    expect(timeout).toBe(60);
+    expect(visibilityTimeout).toBeGreaterThanOrEqual(timeout * 6);
+  });
+
+  test('失敗したメッセージだけを再試行するイベントソースが設定される', () => {
+    template.hasResourceProperties('AWS::Lambda::EventSourceMapping', {
+      EventSourceArn: { 'Fn::GetAtt': [Match.stringLikeRegexp('IngestionQueue.*'), 'Arn'] },
+      BatchSize: 10,
+      MaximumBatchingWindowInSeconds: 2,
+      FunctionResponseTypes: ['ReportBatchItemFailures'],
+      ScalingConfig: { MaximumConcurrency: 5 }
+    });
+  });
+
+  test('S3イベント通知はキューに送られる', () => {
+    template.hasResourceProperties('Custom::S3BucketNotifications', {
+      NotificationConfiguration: {
+        QueueConfigurations: Match.arrayWith([
+          Match.objectLike({
+            Events: ['s3:ObjectCreated:*'],
+            QueueArn: { 'Fn::GetAtt': [Match.stringLikeRegexp('IngestionQueue.*'), 'Arn'] }
+          })
+        ])
+      }
+    });
+  });
+
+  test('バッチの同時分析数と重複イベントの排除が有効になる', () => {
+    template.hasResourceProperties('AWS::Lambda::Function', {
+      Environment: {
+        Variables: Match.objectLike({
+          BATCH_MAX_CONCURRENCY: '4',
+          SESSION_MODE_ENABLED: 'false',
+          IDEMPOTENCY_ENABLED: 'true'
+        })
+      }
+    });
+  });
+});
@@ -0,0 +1,457 @@
+"""
+技術局長 - 非同期の分析パイプライン
+
+SQSバッチなど複数の画像を1回の実行で分析する場合に、画像ごと・呼び出しごとにOSスレッドを
+使わず、1つのイベントループで多数の画像を同時に進める（aiobotocore、任意の依存）
+
+- 1回の実行で1つのイベントループと、全画像で共有するクライアント（コネクションプール）を使う
+- 実行の残り時間から期限を決め、期限を過ぎた画像の処理はまとめてキャンセルする（リースは解放）
+- 画像の圧縮・応答の解析などCPU処理はスレッドに逃がし、イベントループを止めない
+- Bedrockの同時呼び出し数は同期版と同じAIMDの上限で制限し、過負荷の応答・成功を上限の調整に反映する
+- 関心領域の切り出し・切り出し画像による位置調整・ローカル検出はこの経路でも行う（CPU処理・Bedrock呼び出しはスレッド）
+- 識別の前に同期版にしか無い処理（台帳・印字照合、段階の出力の記録など）が必要な画像は同期版で分析する
+
+handler.lambda_handlerは同期のまま、ASYNC_PIPELINE_ENABLEDの場合にrun_async_pipelineを呼ぶ
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import contextlib
+import logging
+from typing import Dict, List, Any
+
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+import handler
+from edge_snapping import snap_equipment_to_edges
+from roi_crop import equipment_from_roi
+from idempotency import LEASE_ACQUIRED, LEASE_IN_FLIGHT, LeaseInFlight
+from rate_limiter import estimate_request_tokens, current_priority, PRIORITY_INTERACTIVE
+from detectors import current_detector_backend, DETECTOR_REKOGNITION
+from quality_gate import evaluate_detections
+from tiled_analysis import should_tile_image, analyze_image_tiled
+
+logger = logging.getLogger()
+
+# 1回の実行で同時に分析する画像数の上限
+ASYNC_MAX_CONCURRENT_IMAGES = int(os.environ.get('ASYNC_MAX_CONCURRENT_IMAGES', '32'))
+# サービスごとのコネクションプールの大きさ
+ASYNC_MAX_POOL_CONNECTIONS = int(os.environ.get('ASYNC_MAX_POOL_CONNECTIONS', '50'))
+# 期限として残す余裕（リースの解放・結果の返却に使う時間、ミリ秒）
+ASYNC_DEADLINE_MARGIN_MS = int(os.environ.get('ASYNC_DEADLINE_MARGIN_MS', '5000'))
+
+# aiobotocoreのセッション（遅延初期化、ウォームスタートでは再利用）
+aio_session = None
+
+
+def get_aio_session():
+    """aiobotocoreのセッションを取得（遅延初期化）"""
+    global aio_session
+    if aio_session is None:
+        # 非同期パイプラインを使うデプロイだけが依存を持てばよいよう、ここで読み込む
+        from aiobotocore.session import get_session
+        aio_session = get_session()
+    return aio_session
+
+
+async def create_clients(stack: contextlib.AsyncExitStack) -> Dict[str, Any]:
+    """
+    実行中に全画像で共有する非同期クライアントを作成（イベントループごとに作り直す）
+
+    Args:
+        stack: クライアントを閉じるためのAsyncExitStack
+
+    Returns:
+        サービス名 -> クライアント（s3, rekognition, bedrock, dynamodb）
+    """
+    from aiobotocore.config import AioConfig
+
+    session = get_aio_session()
+    config = AioConfig(max_pool_connections=ASYNC_MAX_POOL_CONNECTIONS)
+    return {
+        's3': await stack.enter_async_context(session.create_client('s3', config=config)),
+        'rekognition': await stack.enter_async_context(session.create_client('rekognition', config=config)),
+        'bedrock': await stack.enter_async_context(
+            session.create_client('bedrock-runtime', region_name=handler.BEDROCK_REGION, config=config)
+        ),
+        'dynamodb': await stack.enter_async_context(session.create_client('dynamodb', config=config))
+    }
+
+
+def deadline_seconds(context: Any) -> float:
+    """
+    実行の残り時間から、パイプライン全体の期限（秒）を求める
+
+    Args:
+        context: Lambda実行コンテキスト（Noneの場合は期限なし）
+
+    Returns:
+        期限までの秒数（期限なしの場合はNone）
+    """
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return max(0.0, (context.get_remaining_time_in_millis() - ASYNC_DEADLINE_MARGIN_MS) / 1000)
+
+
+def requires_sync_pipeline() -> bool:
+    """
+    同期版にしか無い処理が必要かを判定
+
+    いずれも識別の前の段階を置き換えるため、非同期版では部分的に行えない
+    - 台帳・印字による識別の省略: 台帳の照合・DetectTextの結果でプロンプトの物体リストを変える
+    - 段階の出力の記録: 段階ごとにS3の記録を読み書きし、記録があれば呼び出しを省く
+    - 連続撮影の差分分析: 前の写真の状態を読み、新しく写った部分だけを分析する
+    - 先読みの識別: 物体検出を待たずにClaudeを呼び、座標で照合する
+    """
+    return (
+        handler.INVENTORY_ENABLED
+        or handler.OCR_FAST_PATH_ENABLED
+        or handler.STAGE_CHECKPOINT_ENABLED
+        or handler.INCREMENTAL_MODE_ENABLED
+        or handler.SPECULATIVE_IDENTIFICATION_ENABLED
+    )
+
+
+async def get_image_from_s3_async(s3: Any, bucket: str, key: str) -> bytes:
+    """
+    S3から画像を取得（get_image_from_s3の非同期版）
+
+    Args:
+        s3: 非同期S3クライアント
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+
+    Returns:
+        画像のバイトデータ
+    """
+    try:
+        response = await s3.get_object(Bucket=bucket, Key=key)
+        return await response['Body'].read()
+    except ClientError as e:
+        logger.error(f"S3画像取得エラー: {e}")
+        raise
+
+
+async def detect_objects_with_rekognition_async(
+    rekognition: Any,
+    bucket: str,
+    key: str,
+    image_bytes: bytes = None
+) -> List[Dict[str, Any]]:
+    """
+    AWS Rekognitionで物体検出を実行（detect_objects_with_rekognitionの非同期版）
+
+    Args:
+        rekognition: 非同期Rekognitionクライアント
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        image_bytes: 画像のバイトデータ（指定時はS3ではなくこちらを送信）
+
+    Returns:
+        検出された物体のリスト（バウンディングボックス座標付き）
+    """
+    image = await asyncio.to_thread(handler.rekognition_image, bucket, key, image_bytes)
+    response = await rekognition.detect_labels(Image=image, **handler.REKOGNITION_LABEL_PARAMS)
+    detected_objects = handler.parse_rekognition_labels(response)
+    logger.info(f"Rekognition検出: {len(detected_objects)}個の物体")
+    return detected_objects
+
+
+async def invoke_bedrock_model_async(bedrock: Any, body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Bedrockモデルを呼び出す（invoke_bedrock_modelの非同期版）
+
+    同時呼び出し数は同期版と同じAIMDの上限（handler.bedrock_concurrency）で制限し、
+    過負荷の応答・成功を上限の調整に反映する
+
+    Args:
+        bedrock: 非同期Bedrock Runtimeクライアント
+        body: リクエストボディ
+
+    Returns:
+        Bedrock API応答
+
+    Raises:
+        RateLimitExceeded: レート制限の空きを待ちきれなかった場合
+    """
+    limiter = handler.get_rate_limiter()
+    reservation = None
+    if limiter is not None:
+        # 空きを待つ間もイベントループを止めないよう、スレッドで待つ
+        reservation = await asyncio.to_thread(limiter.acquire, estimate_request_tokens(body), current_priority.get())
+
+    try:
+        async with handler.bedrock_concurrency.async_slot():
+            response = await bedrock.invoke_model(modelId=handler.BEDROCK_MODEL_ID, body=json.dumps(body))
+            response_body = json.loads(await response['body'].read())
+    except BaseException:
+        # 失敗・キャンセルされた呼び出しの見積もりは返す
+        if reservation is not None:
+            await asyncio.shield(asyncio.to_thread(limiter.refund, reservation))
+        raise
+
+    if reservation is not None and 'usage' in response_body:
+        usage = response_body['usage']
+        await asyncio.to_thread(limiter.settle, reservation, usage.get('input_tokens', 0) + usage.get('output_tokens', 0))
+
+    return response_body
+
+
+async def analyze_equipment_with_claude_async(
+    bedrock: Any,
+    image_base64: str,
+    detected_objects: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Claudeで機器識別とリスク判定を実行（analyze_equipment_with_claudeの非同期版）
+
+    Args:
+        bedrock: 非同期Bedrock Runtimeクライアント
+        image_base64: Base64エンコードされた画像
+        detected_objects: Rekognitionで検出された物体リスト
+
+    Returns:
+        機器情報（名前、説明、リスクレベル、object_index）
+    """
+    prompt_version = handler.PROMPT_VERSION
+    output_mode = handler.OUTPUT_MODE
+    body = handler.build_equipment_identification_body(image_base64, detected_objects, prompt_version, output_mode)
+    response_body = await invoke_bedrock_model_async(bedrock, body)
+    return await asyncio.to_thread(
+        handler.parse_equipment_identification_response, response_body, prompt_version, output_mode
+    )
+
+
+async def save_result_to_dynamodb_async(
+    dynamodb: Any,
+    image_key: str,
+    result: Dict[str, Any],
+    etag: str = None,
+    lease_owner: str = None
+) -> bool:
+    """
+    分析結果をDynamoDBに保存（save_result_to_dynamodbの非同期版）
+
+    Args:
+        dynamodb: 非同期DynamoDBクライアント
+        image_key: S3オブジェクトキー
+        result: 分析結果
+        etag: S3オブジェクトのETag
+        lease_owner: リースの所有者（指定時はリースを保持している場合のみ保存）
+
+    Returns:
+        保存した場合True（リースが引き継がれて保存しなかった場合False）
+    """
+    serializer = TypeSerializer()
+    item = handler.build_result_item(image_key, result, etag)
+    request = {
+        'TableName': handler.RESULTS_TABLE_NAME,
+        'Item': {name: serializer.serialize(value) for name, value in item.items()}
+    }
+    if lease_owner is not None:
+        # リース期限切れで他の実行に引き継がれた場合は保存しない
+        request['ConditionExpression'] = 'attribute_not_exists(imageKey) OR leaseOwner = :owner'
+        request['ExpressionAttributeValues'] = {':owner': {'S': lease_owner}}
+
+    try:
+        await dynamodb.put_item(**request)
+        logger.info(f"DynamoDBに保存完了: {image_key}")
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.warning(f"リースが引き継がれたため保存をスキップ: {image_key}")
+            return False
+        logger.error(f"DynamoDB保存エラー: {e}")
+        raise
+
+
+async def analyze_image_async(
+    clients: Dict[str, Any],
+    bucket: str,
+    key: str,
+    context: Any = None
+) -> Dict[str, Any]:
+    """
+    画像を取得し、RekognitionとClaudeで分析（analyze_imageの非同期版）
+
+    画像の圧縮とRekognitionの物体検出は並行して実行する（関心領域を切り出す場合は検出の後に圧縮）
+
+    Args:
+        clients: create_clientsで作成したクライアント
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        context: Lambda実行コンテキスト（位置調整の残り時間の判定に使う）
+
+    Returns:
+        マージされた最終結果
+    """
+    ingested = await asyncio.to_thread(
+        handler.ingest_image, await get_image_from_s3_async(clients['s3'], bucket, key)
+    )
+    handler.record_ingestion(key, ingested)
+    image_bytes = ingested['image_bytes']
+    # 変換した画像はS3上の画像と異なるため、Rekognitionには画像そのものを送る
+    send_bytes = ingested['converted']
+
+    rejected = await asyncio.to_thread(handler.check_image_quality, key, image_bytes)
+    if rejected:
+        return rejected
+
+    if await asyncio.to_thread(should_tile_image, image_bytes):
+        # 高解像度画像は同期版のタイル分析（タイルごとの呼び出しはスレッドプールで並列）
+        return await asyncio.to_thread(analyze_image_tiled, bucket, key, image_bytes, send_bytes)
+
+    backend = current_detector_backend.get() or handler.DETECTOR_BACKEND
+    if backend == DETECTOR_REKOGNITION:
+        detection = detect_objects_with_rekognition_async(
+            clients['rekognition'], bucket, key, image_bytes if send_bytes else None
+        )
+    else:
+        # ローカル検出はCPU処理のためスレッドで実行（検出バックエンドの指定はコンテキストごと引き継がれる）
+        detection = asyncio.to_thread(handler.detect_objects, bucket, key, image_bytes, send_bytes)
+
+    roi = None
+    if handler.ROI_CROP_ENABLED:
+        # 切り出す範囲は物体検出の結果で決まるため、検出の後にエンコード
+        detected_objects = await detection
+        image_base64, roi, _ = await asyncio.to_thread(handler.encode_identification_image, image_bytes, detected_objects)
+    else:
+        image_base64, detected_objects = await asyncio.gather(
+            asyncio.to_thread(handler.encode_image_to_base64, image_bytes), detection
+        )
+    reason = evaluate_detections(detected_objects) if handler.QUALITY_GATE_ENABLED else None
+    if reason:
+        return handler.reject_image(key, reason)
+
+    claude_result = await analyze_equipment_with_claude_async(
+        clients['bedrock'], image_base64, detected_objects
+    )
+    if roi:
+        # Claude追加検出分の座標を切り出し画像から画像全体に戻す
+        claude_result = dict(claude_result, equipment=equipment_from_roi(claude_result.get('equipment', []), roi))
+    final_result = handler.merge_results(detected_objects, claude_result)
+
+    if handler.ENABLE_EDGE_SNAPPING:
+        final_result['equipment'], _ = await asyncio.to_thread(
+            snap_equipment_to_edges, image_bytes, final_result['equipment']
+        )
+    if handler.ENABLE_CROP_REFINEMENT and handler.has_time_budget(context, handler.REFINEMENT_MIN_REMAINING_MS):
+        final_result['equipment'] = await asyncio.to_thread(
+            handler.refine_positions_with_crops, image_bytes, final_result['equipment']
+        )
+    return final_result
+
+
+async def process_image_async(
+    clients: Dict[str, Any],
+    image: Dict[str, str],
+    context: Any
+) -> Dict[str, Any]:
+    """
+    1枚の画像を分析して結果を保存（process_imageの非同期版）
+
+    Args:
+        clients: create_clientsで作成したクライアント
+        image: 画像情報（bucket, key, etag, 任意のpriority / detector）
+        context: Lambda実行コンテキスト
+
+    Returns:
+        分析結果のJSON（process_imageと同じ形式）
+    """
+    bucket, key, etag = image['bucket'], image['key'], image['etag']
+    # タスクごとのコンテキストで、この画像のBedrock呼び出しの優先度・検出バックエンドを指定
+    current_priority.set(image.get('priority', PRIORITY_INTERACTIVE))
+    current_detector_backend.set(image.get('detector'))
+
+    if requires_sync_pipeline():
+        return await asyncio.to_thread(handler.process_image, bucket, key, etag, context)
+
+    lease_owner = None
+    if handler.IDEMPOTENCY_ENABLED:
+        lease_owner = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+        lease_state = await asyncio.to_thread(handler.acquire_image_lease, key, etag, lease_owner)
+        if lease_state == LEASE_IN_FLIGHT:
+            raise LeaseInFlight(key)
+        if lease_state != LEASE_ACQUIRED:
+            return handler.skipped_response(key, lease_state)
+
+    try:
+        final_result = await analyze_image_async(clients, bucket, key, context)
+        saved = await save_result_to_dynamodb_async(clients['dynamodb'], key, final_result, etag, lease_owner)
+        if saved:
+            await asyncio.to_thread(handler.notify_completion, key, final_result)
+
+    except BaseException:
+        # 失敗・キャンセルされた場合はリースを解放し、再試行ですぐに処理できるようにする
+        if lease_owner is not None:
+            await asyncio.shield(asyncio.to_thread(handler.release_image_lease, key, lease_owner))
+        raise
+
+    return handler.completed_response(key, final_result)
+
+
+async def process_images_async(
+    images: List[Dict[str, str]],
+    context: Any,
+    clients: Dict[str, Any] = None
+) -> List[Any]:
+    """
+    複数の画像を1つのイベントループで分析
+
+    Args:
+        images: 画像情報のリスト
+        context: Lambda実行コンテキスト
+        clients: 共有するクライアント（省略時はaiobotocoreで作成）
+
+    Returns:
+        画像ごとの結果（process_imageと同じ形式のレスポンス、または発生した例外）
+    """
+    if not images:
+        return []
+
+    image_semaphore = asyncio.Semaphore(max(1, ASYNC_MAX_CONCURRENT_IMAGES))
+
+    async with contextlib.AsyncExitStack() as stack:
+        if clients is None:
+            clients = await create_clients(stack)
+
+        async def run(image: Dict[str, str]) -> Dict[str, Any]:
+            async with image_semaphore:
+                return await process_image_async(clients, image, context)
+
+        tasks = [asyncio.create_task(run(image)) for image in images]
+        try:
+            async with asyncio.timeout(deadline_seconds(context)):
+                await asyncio.wait(tasks)
+        except TimeoutError:
+            pending = sum(1 for task in tasks if not task.done())
+            logger.error(f"実行期限のため{pending}枚の分析をキャンセルします")
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # 期限でキャンセルした画像はタイムアウトとして扱う
+    return [
+        TimeoutError(f"実行期限までに分析が終わりませんでした: {image['key']}")
+        if isinstance(outcome, asyncio.CancelledError) else outcome
+        for image, outcome in zip(images, outcomes)
+    ]
+
+
+def run_async_pipeline(images: List[Dict[str, str]], context: Any) -> List[Any]:
+    """
+    同期のlambda_handlerから非同期パイプラインを実行
+
+    Args:
+        images: 画像情報のリスト
+        context: Lambda実行コンテキスト
+
+    Returns:
+        画像ごとの結果（レスポンス、または発生した例外）
+    """
+    return asyncio.run(process_images_async(images, context))
@@ -0,0 +1,325 @@
+"""
+技術局長 - プロンプト・モデル変更後の再分析（バックフィル）
+
+build_equipment_identification_promptやBEDROCK_MODEL_IDを変えた後に、アップロード済みの画像を
+キーの範囲で再分析する。変わっていない段階（圧縮した画像・物体検出の結果）は段階ごとの
+キャッシュ（stage_cache）から再利用し、Claudeの機器識別だけをやり直す
+
+- 結果は結果テーブルの項目に "backfill:<ラベル>" 属性として書き込み、既存の結果と並べて比較できる
+- Bedrockはbatch優先度で呼び出し、--tokens-per-minuteで自分自身の消費量も制限できる
+- ページごとにチェックポイント（最後に処理したキーと失敗したキー）をファイルに保存し、中断しても続きから再開できる
+
+使い方:
+    python backfill.py --bucket BUCKET --prefix uploads/ --label names-sonnet45 --prompt-version names
+    python backfill.py --bucket BUCKET --label haiku --model-id us.anthropic.claude-haiku-4-5-20251001-v1:0 \\
+        --start-after uploads/2025-01 --end-before uploads/2025-02 --tokens-per-minute 200000
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Iterator
+
+import handler
+from result_codec import encode_result
+from rate_limiter import LocalRateLimiter, current_priority, PRIORITY_BATCH
+from stage_cache import (
+    StageCache,
+    S3StageCache,
+    STAGE_DERIVATIVE,
+    STAGE_DETECTIONS,
+    STAGE_IDENTIFICATION
+)
+
+logger = logging.getLogger(__name__)
+
+# 再分析の結果を書き込む属性名の接頭辞
+BACKFILL_ATTRIBUTE_PREFIX = 'backfill:'
+
+
+def load_derivative(cache: StageCache, bucket: str, key: str, etag: str, stats: Dict[str, int]) -> str:
+    """
+    モデルに送る圧縮済みの画像（キャッシュに無ければS3から取得して圧縮）
+
+    Returns:
+        Base64エンコードされた画像
+    """
+    cached = cache.get(STAGE_DERIVATIVE, key, etag, handler.DERIVATIVE_STAGE_VERSION)
+    if cached is not None:
+        stats['derivative_hits'] += 1
+        return base64.b64encode(cached).decode('utf-8')
+
+    image_base64 = handler.encode_image_to_base64(handler.load_image(bucket, key)['image_bytes'])
+    cache.put(STAGE_DERIVATIVE, key, etag, handler.DERIVATIVE_STAGE_VERSION, base64.b64decode(image_base64))
+    return image_base64
+
+
+def load_detections(
+    cache: StageCache,
+    bucket: str,
+    key: str,
+    etag: str,
+    image_base64: str,
+    stats: Dict[str, int]
+) -> List[Dict[str, Any]]:
+    """物体検出の結果（キャッシュに無ければ検出）"""
+    version = handler.detections_stage_version(handler.DETECTOR_BACKEND)
+    cached = cache.get_json(STAGE_DETECTIONS, key, etag, version)
+    if cached is not None:
+        stats['detections_hits'] += 1
+        return cached
+
+    # 取り込みで向きを揃えた画像で検出する（S3上の画像はEXIFの回転が未反映の場合がある）
+    detected_objects = handler.detect_objects(bucket, key, base64.b64decode(image_base64), send_bytes=True)
+    cache.put_json(STAGE_DETECTIONS, key, etag, version, detected_objects)
+    return detected_objects
+
+
+def load_identification(
+    cache: StageCache,
+    key: str,
+    etag: str,
+    image_base64: str,
+    detected_objects: List[Dict[str, Any]],
+    options: Dict[str, str],
+    stats: Dict[str, int]
+) -> Dict[str, Any]:
+    """Claude機器識別の生の応答（同じプロンプト・モデルで処理済みなら再利用）"""
+    body = handler.build_equipment_identification_body(
+        image_base64, detected_objects, options['prompt_version'], options['output_mode']
+    )
+    version = handler.identification_stage_version(body, options['model_id'])
+    cached = cache.get_json(STAGE_IDENTIFICATION, key, etag, version)
+    if cached is not None:
+        stats['identification_hits'] += 1
+        return cached
+
+    response_body = handler.invoke_bedrock_model(body, PRIORITY_BATCH, options['model_id'])
+    cache.put_json(STAGE_IDENTIFICATION, key, etag, version, response_body)
+    return response_body
+
+
+def reanalyze_image(
+    cache: StageCache,
+    bucket: str,
+    key: str,
+    etag: str,
+    options: Dict[str, str],
+    stats: Dict[str, int]
+) -> Dict[str, Any]:
+    """
+    1枚の画像を新しいプロンプト・モデルで再分析
+
+    Args:
+        cache: 段階ごとのキャッシュ
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        etag: S3オブジェクトのETag
+        options: label, prompt_version, output_mode, model_id
+        stats: キャッシュの利用回数（更新する）
+
+    Returns:
+        マージされた最終結果
+    """
+    image_base64 = load_derivative(cache, bucket, key, etag, stats)
+    detected_objects = load_detections(cache, bucket, key, etag, image_base64, stats)
+    response_body = load_identification(cache, key, etag, image_base64, detected_objects, options, stats)
+    claude_result = handler.parse_equipment_identification_response(
+        response_body, options['prompt_version'], options['output_mode']
+    )
+    return handler.merge_results(detected_objects, claude_result)
+
+
+def save_versioned_result(key: str, result: Dict[str, Any], options: Dict[str, str]) -> None:
+    """
+    再分析の結果を結果テーブルの項目に別の属性として書き込む（既存の結果は変更しない）
+
+    Args:
+        key: S3オブジェクトキー
+        result: 分析結果
+        options: label, prompt_version, output_mode, model_id
+    """
+    table = handler.get_dynamodb().Table(handler.RESULTS_TABLE_NAME)
+    table.update_item(
+        Key={'imageKey': key},
+        UpdateExpression='SET #version = :version',
+        ExpressionAttributeNames={'#version': f"{BACKFILL_ATTRIBUTE_PREFIX}{options['label']}"},
+        ExpressionAttributeValues={':version': {
+            **encode_result(result),
+            'modelId': options['model_id'],
+            'promptVersion': options['prompt_version'],
+            'outputMode': options['output_mode'],
+            'analyzedAt': int(time.time())
+        }}
+    )
+
+
+def list_key_pages(
+    bucket: str,
+    prefix: str,
+    start_after: str = None,
+    end_before: str = None,
+    page_size: int = 100
+) -> Iterator[List[tuple]]:
+    """
+    キーの範囲のオブジェクトをページごとに列挙（キーの昇順）
+
+    Returns:
+        (キー, ETag) のリストのイテレータ
+    """
+    paginator = handler.get_s3_client().get_paginator('list_objects_v2')
+    params = {'Bucket': bucket, 'Prefix': prefix, 'PaginationConfig': {'PageSize': page_size}}
+    if start_after:
+        params['StartAfter'] = start_after
+
+    for page in paginator.paginate(**params):
+        objects = []
+        for obj in page.get('Contents', []):
+            if end_before and obj['Key'] >= end_before:
+                if objects:
+                    yield objects
+                return
+            if obj['Size'] > 0:
+                objects.append((obj['Key'], obj['ETag'].strip('"')))
+        if objects:
+            yield objects
+
+
+def load_checkpoint(path: str, label: str) -> Dict[str, Any]:
+    """チェックポイントを読み込む（別のラベルのチェックポイントは使わない）"""
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('label') == label:
+            return checkpoint
+        logger.warning(f"ラベルが異なるチェックポイントは使いません: {checkpoint.get('label')}")
+    return {'label': label, 'lastKey': None, 'failedKeys': [], 'processed': 0}
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """チェックポイントを書き込む（書き込み中に中断しても壊れないよう置き換える）"""
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(temporary, path)
+
+
+def run_backfill(
+    bucket: str,
+    prefix: str,
+    options: Dict[str, str],
+    cache: StageCache,
+    checkpoint_path: str = None,
+    start_after: str = None,
+    end_before: str = None,
+    workers: int = 4
+) -> Dict[str, int]:
+    """
+    キーの範囲の画像を再分析
+
+    Args:
+        bucket: S3バケット名
+        prefix: 対象のキーの接頭辞
+        options: label, prompt_version, output_mode, model_id
+        cache: 段階ごとのキャッシュ
+        checkpoint_path: チェックポイントのファイル
+        start_after: このキーより後から処理する（チェックポイントがあればそちらを優先）
+        end_before: このキーより前まで処理する
+        workers: 同時に再分析する画像数
+
+    Returns:
+        件数とキャッシュの利用回数
+    """
+    checkpoint = load_checkpoint(checkpoint_path, options['label'])
+    stats = {
+        'processed': 0, 'failed': 0,
+        'derivative_hits': 0, 'detections_hits': 0, 'identification_hits': 0
+    }
+
+    def run(job: tuple) -> bool:
+        key, etag = job
+        # 再分析はカメラからのアップロードに割り当てたクォータを使わない
+        current_priority.set(PRIORITY_BATCH)
+        try:
+            result = reanalyze_image(cache, bucket, key, etag, options, stats)
+            save_versioned_result(key, result, options)
+            return True
+        except Exception as e:
+            logger.error(f"再分析エラー: {key}: {e}")
+            return False
+
+    def process(jobs: List[tuple]) -> List[str]:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            succeeded = list(executor.map(run, jobs))
+        stats['processed'] += sum(succeeded)
+        stats['failed'] += len(jobs) - sum(succeeded)
+        return [key for (key, _), ok in zip(jobs, succeeded) if not ok]
+
+    # 前回失敗した画像から再試行
+    if checkpoint['failedKeys']:
+        retry = [(key, handler.get_s3_client().head_object(Bucket=bucket, Key=key)['ETag'].strip('"'))
+                 for key in checkpoint['failedKeys']]
+        checkpoint['failedKeys'] = process(retry)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    for jobs in list_key_pages(bucket, prefix, checkpoint['lastKey'] or start_after, end_before):
+        checkpoint['failedKeys'] += process(jobs)
+        checkpoint['lastKey'] = jobs[-1][0]
+        checkpoint['processed'] += len(jobs)
+        save_checkpoint(checkpoint_path, checkpoint)
+        logger.info(f"バックフィル: {checkpoint['lastKey']}まで処理 ({json.dumps(stats)})")
+
+    return stats
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='プロンプト・モデル変更後の再分析')
+    parser.add_argument('--bucket', required=True, help='画像のS3バケット')
+    parser.add_argument('--prefix', default='uploads/', help='対象のキーの接頭辞')
+    parser.add_argument('--start-after', help='このキーより後から処理する')
+    parser.add_argument('--end-before', help='このキーより前まで処理する')
+    parser.add_argument('--label', required=True, help='結果を書き込む属性のラベル（backfill:<ラベル>）')
+    parser.add_argument('--prompt-version', default=handler.PROMPT_VERSION, help='プロンプトバージョン')
+    parser.add_argument('--output-mode', default=handler.OUTPUT_MODE, help='出力モード（text / tool）')
+    parser.add_argument('--model-id', default=handler.BEDROCK_MODEL_ID, help='BedrockのモデルID')
+    parser.add_argument('--workers', type=int, default=4, help='同時に再分析する画像数')
+    parser.add_argument('--tokens-per-minute', type=int,
+                        help='共有のレート制限が無い場合の、このバックフィル自身の1分あたりトークン数')
+    parser.add_argument('--checkpoint', help='チェックポイントのファイル（省略時は<ラベル>.checkpoint.json）')
+    parser.add_argument('--cache-prefix', default=None, help='段階ごとのキャッシュのS3プレフィックス')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.tokens_per_minute and handler.get_rate_limiter() is None:
+        handler.rate_limiter = LocalRateLimiter(args.tokens_per_minute, batch_share=1.0)
+
+    options = {
+        'label': args.label,
+        'prompt_version': args.prompt_version,
+        'output_mode': args.output_mode,
+        'model_id': args.model_id
+    }
+    cache_args = {'prefix': args.cache_prefix} if args.cache_prefix else {}
+    cache = S3StageCache(handler.get_s3_client(), args.bucket, **cache_args)
+
+    stats = run_backfill(
+        args.bucket, args.prefix, options, cache,
+        checkpoint_path=args.checkpoint or f"{args.label}.checkpoint.json",
+        start_after=args.start_after,
+        end_before=args.end_before,
+        workers=args.workers
+    )
+    sys.stdout.write(json.dumps(stats) + '\n')
+    return 0 if stats['failed'] == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+"""
+技術局長 - 画像分析ベンチマーク
+
+記録済みコーパスを使って、機器識別プロンプトの形式ごとに
+出力トークン数・レイテンシ・JSON解析失敗率を計測する
+
+物体検出のバックエンドごとに、レイテンシと正解ボックスに対する再現率も計測できる
+
+コーパスの構成:
+    corpus/
+      rack-01.jpg
+      rack-01.rekognition.json   # detect_objects_with_rekognition の出力（記録済み）
+      rack-01.truth.json         # 正解ボックス（任意、無い場合は記録済みRekognition結果を基準にする）
+      studio-02.png
+      ...
+
+使い方:
+    python benchmark.py corpus/ --versions verbose,compact,names --modes text,tool --repeat 3
+    python benchmark.py corpus/ --detectors rekognition,onnx --batch-size 4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, List, Any
+
+import handler
+
+logger = logging.getLogger(__name__)
+
+# コーパスとして扱う画像の拡張子
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def load_corpus(corpus_dir: str) -> List[Dict[str, Any]]:
+    """
+    記録済みコーパスを読み込む
+
+    Args:
+        corpus_dir: コーパスのディレクトリ
+
+    Returns:
+        エントリのリスト（name, image_bytes, detections）
+    """
+    entries = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+
+        with open(os.path.join(corpus_dir, filename), 'rb') as f:
+            image_bytes = f.read()
+
+        # 記録済みのRekognition検出結果（無い場合はClaudeの追加検出のみになる）
+        detections = []
+        detections_path = os.path.join(corpus_dir, f"{stem}.rekognition.json")
+        if os.path.exists(detections_path):
+            with open(detections_path, 'r', encoding='utf-8') as f:
+                detections = json.load(f)
+        else:
+            logger.warning(f"Rekognition記録がありません: {filename}")
+
+        # 検出ベンチマークの正解ボックス
+        truth = None
+        truth_path = os.path.join(corpus_dir, f"{stem}.truth.json")
+        if os.path.exists(truth_path):
+            with open(truth_path, 'r', encoding='utf-8') as f:
+                truth = json.load(f)
+
+        entries.append({
+            'name': filename,
+            'image_bytes': image_bytes,
+            'detections': detections,
+            'truth': truth
+        })
+
+    return entries
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    """
+    パーセンタイルを計算（最近傍法）
+
+    Args:
+        values: 値のリスト
+        ratio: 0-1の割合
+
+    Returns:
+        パーセンタイル値
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def is_parse_failure(response_body: Dict[str, Any], output_mode: str) -> bool:
+    """
+    応答が機器リストとして読み取れなかったかを判定
+
+    Args:
+        response_body: Claude API応答
+        output_mode: 出力モード（text / tool）
+
+    Returns:
+        解析に失敗した場合True
+    """
+    if output_mode == 'tool':
+        return handler.find_tool_input(response_body, handler.EQUIPMENT_TOOL_NAME) is None
+
+    try:
+        content = response_body['content'][0]['text']
+        json.loads(handler.extract_json_text(content))
+        return False
+    except (KeyError, IndexError, TypeError, ValueError):
+        return True
+
+
+def parse_response(response_body: Dict[str, Any], prompt_version: str, output_mode: str) -> Dict[str, Any]:
+    """
+    analyze_equipment_with_claudeと同じ規則で応答を解析
+
+    Args:
+        response_body: Claude API応答
+        prompt_version: プロンプトバージョン
+        output_mode: 出力モード
+
+    Returns:
+        検証済みの機器識別結果
+    """
+    return handler.parse_equipment_identification_response(response_body, prompt_version, output_mode)
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    計測サンプルを集計
+
+    Args:
+        samples: 1回の呼び出しごとの計測結果
+
+    Returns:
+        集計結果
+    """
+    latencies = [s['latency'] for s in samples]
+    output_tokens = [s['output_tokens'] for s in samples]
+    input_tokens = [s['input_tokens'] for s in samples]
+    count = len(samples)
+
+    return {
+        'calls': count,
+        'latency_mean': sum(latencies) / count if count else 0.0,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'output_tokens_mean': sum(output_tokens) / count if count else 0.0,
+        'output_tokens_total': sum(output_tokens),
+        'input_tokens_mean': sum(input_tokens) / count if count else 0.0,
+        'equipment_mean': sum(s['equipment_count'] for s in samples) / count if count else 0.0,
+        'parse_failures': sum(1 for s in samples if s['parse_failure']),
+        'parse_failure_rate': sum(1 for s in samples if s['parse_failure']) / count if count else 0.0
+    }
+
+
+def run_prompt_benchmark(
+    corpus: List[Dict[str, Any]],
+    prompt_versions: List[str],
+    repeat: int = 1,
+    output_modes: List[str] = None
+) -> Dict[str, Any]:
+    """
+    プロンプト形式・出力モードごとに機器識別を実行し、
+    出力トークン数・レイテンシ・解析失敗率を計測
+
+    Args:
+        corpus: load_corpusで読み込んだエントリ
+        prompt_versions: 比較するプロンプトバージョン
+        repeat: 各画像の繰り返し回数
+        output_modes: 比較する出力モード（省略時はtextのみ）
+
+    Returns:
+        "バージョン/モード"ごとの集計結果
+    """
+    results = {}
+    for prompt_version in prompt_versions:
+        for output_mode in output_modes or ['text']:
+            samples = []
+            for entry in corpus:
+                image_base64 = handler.encode_image_to_base64(entry['image_bytes'])
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    response_body = handler.invoke_equipment_identification(
+                        image_base64, entry['detections'], prompt_version, output_mode
+                    )
+                    latency = time.perf_counter() - start
+
+                    parsed = parse_response(response_body, prompt_version, output_mode)
+
+                    usage = response_body.get('usage', {})
+                    samples.append({
+                        'name': entry['name'],
+                        'latency': latency,
+                        'output_tokens': usage.get('output_tokens', 0),
+                        'input_tokens': usage.get('input_tokens', 0),
+                        'equipment_count': len(parsed['equipment']),
+                        'parse_failure': is_parse_failure(response_body, output_mode)
+                    })
+
+            variant = f"{prompt_version}/{output_mode}"
+            results[variant] = summarize(samples)
+            logger.info(f"{variant}: {json.dumps(results[variant])}")
+
+    return results
+
+
+def detection_recall(
+    reference: List[Dict[str, Any]],
+    detections: List[Dict[str, Any]],
+    iou_threshold: float = 0.5
+) -> float:
+    """
+    基準のボックスのうち検出できた割合（ラベルは問わない、1つの検出は1つの基準にだけ対応させる）
+
+    Args:
+        reference: 基準のボックス（bboxを持つ辞書のリスト）
+        detections: 検出結果
+        iou_threshold: 一致とみなすIoU
+
+    Returns:
+        再現率（基準が空の場合は1.0）
+    """
+    if not reference:
+        return 1.0
+
+    unmatched = list(detections)
+    found = 0
+    for expected in reference:
+        best = max(unmatched, key=lambda d: handler.bbox_iou(expected['bbox'], d['bbox']), default=None)
+        if best is not None and handler.bbox_iou(expected['bbox'], best['bbox']) >= iou_threshold:
+            unmatched.remove(best)
+            found += 1
+    return found / len(reference)
+
+
+def run_detector_benchmark(
+    corpus: List[Dict[str, Any]],
+    backends: List[str],
+    repeat: int = 1,
+    batch_size: int = 1
+) -> Dict[str, Any]:
+    """
+    物体検出のバックエンドごとにレイテンシと再現率を計測
+
+    Args:
+        corpus: load_corpusで読み込んだエントリ
+        backends: 比較するバックエンド（rekognition / onnx）
+        repeat: 各画像の繰り返し回数
+        batch_size: onnxでまとめて推論する画像数
+
+    Returns:
+        "detector/バックエンド"ごとの集計結果
+    """
+    results = {}
+    for backend in backends:
+        samples = []
+        for _ in range(repeat):
+            for start_index in range(0, len(corpus), batch_size if backend == handler.DETECTOR_ONNX else 1):
+                entries = corpus[start_index:start_index + (batch_size if backend == handler.DETECTOR_ONNX else 1)]
+                start = time.perf_counter()
+                if backend == handler.DETECTOR_ONNX:
+                    detections_list = handler.get_local_detector().detect_batch([e['image_bytes'] for e in entries])
+                else:
+                    detections_list = [
+                        handler.detect_objects_with_rekognition(None, None, image_bytes=e['image_bytes'])
+                        for e in entries
+                    ]
+                # まとめて推論した場合は1枚あたりの時間として記録
+                latency = (time.perf_counter() - start) / len(entries)
+
+                for entry, detections in zip(entries, detections_list):
+                    reference = entry['truth'] if entry['truth'] is not None else entry['detections']
+                    samples.append({
+                        'name': entry['name'],
+                        'latency': latency,
+                        'detection_count': len(detections),
+                        'recall': detection_recall(reference, detections)
+                    })
+
+        latencies = [s['latency'] for s in samples]
+        count = len(samples)
+        variant = f"detector/{backend}"
+        results[variant] = {
+            'images': count,
+            'latency_mean': sum(latencies) / count if count else 0.0,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p95': percentile(latencies, 0.95),
+            'detections_mean': sum(s['detection_count'] for s in samples) / count if count else 0.0,
+            'recall_mean': sum(s['recall'] for s in samples) / count if count else 0.0
+        }
+        logger.info(f"{variant}: {json.dumps(results[variant])}")
+
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='機器識別プロンプトのベンチマーク')
+    parser.add_argument('corpus', help='記録済みコーパスのディレクトリ')
+    parser.add_argument('--versions', default='verbose,compact',
+                        help='比較するプロンプトバージョン（カンマ区切り）')
+    parser.add_argument('--modes', default='text',
+                        help='比較する出力モード（カンマ区切り、text / tool）')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='各画像の繰り返し回数')
+    parser.add_argument('--detectors',
+                        help='プロンプトの代わりに比較する物体検出のバックエンド（カンマ区切り、rekognition / onnx）')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='onnxでまとめて推論する画像数')
+    parser.add_argument('--output', help='集計結果を書き出すJSONファイル')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        sys.stderr.write(f"コーパスに画像がありません: {args.corpus}\n")
+        return 1
+
+    if args.detectors:
+        results = run_detector_benchmark(corpus, args.detectors.split(','), args.repeat, args.batch_size)
+    else:
+        results = run_prompt_benchmark(
+            corpus, args.versions.split(','), args.repeat, args.modes.split(',')
+        )
+
+    report = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    sys.stdout.write(report + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
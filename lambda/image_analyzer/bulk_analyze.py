@@ -0,0 +1,241 @@
+"""
+技術局長 - 施設写真の一括分析
+
+S3へのアップロードを経由せず、手元の写真アーカイブ（数千枚）をまとめて分析する
+
+- 画像の取り込み（形式の判定・EXIFの回転・変換）と圧縮（encode_image_to_base64）はプロセスプールで並列に実行
+- 物体検出とClaudeの機器識別は上限付きのスレッドプールから呼び出す（Bedrockの優先度はbatch）
+- 1枚ごとの結果と所要時間をJSON Linesファイルに追記し、中断しても完了済みの画像から再開できる
+
+高解像度画像もタイル分割せず、encode_image_to_base64の圧縮だけで分析する
+
+使い方:
+    python bulk_analyze.py photos/ --output results.jsonl
+    python bulk_analyze.py --manifest photos.txt --output results.jsonl --cpu-workers 4 --io-workers 8
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Any
+
+import handler
+from rate_limiter import current_priority, PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+# 分析する画像の拡張子
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def list_images(directory: str = None, manifest: str = None) -> List[str]:
+    """
+    分析する画像のパスを列挙
+
+    Args:
+        directory: 再帰的に探すディレクトリ
+        manifest: 1行に1つのパスを書いたファイル（相対パスはマニフェストの場所から）
+
+    Returns:
+        画像のパスのリスト（重複なし、ディレクトリの場合は名前順）
+    """
+    paths = []
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    paths.append(line if os.path.isabs(line) else os.path.join(base, line))
+    if directory:
+        for root, _, filenames in sorted(os.walk(directory)):
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                    paths.append(os.path.join(root, filename))
+    return list(dict.fromkeys(paths))
+
+
+def load_completed(output_path: str) -> set:
+    """
+    出力ファイルから分析済みの画像のパスを読み込む（途中で切れた最後の行は無視）
+
+    Args:
+        output_path: 結果のJSON Linesファイル
+
+    Returns:
+        status=completedの画像のパスの集合
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'completed':
+                completed.add(record['path'])
+    return completed
+
+
+def prepare_image(path: str) -> Dict[str, Any]:
+    """
+    画像を読み込み、形式・向きを揃えてモデルに送る形に圧縮（プロセスプールで実行）
+
+    Args:
+        path: 画像のパス
+
+    Returns:
+        image_base64, 元の形式・サイズ, 取り込みの処理ごとの所要時間, 所要時間
+    """
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        image_bytes = f.read()
+    ingested = handler.ingest_image(image_bytes)
+    image_base64 = handler.encode_image_to_base64(ingested['image_bytes'])
+    return {
+        'image_base64': image_base64,
+        'source_media_type': ingested['source_media_type'],
+        'source_bytes': len(image_bytes),
+        'ingest_timing': ingested['timing'],
+        'preprocess_seconds': time.perf_counter() - start
+    }
+
+
+def analyze_prepared(path: str, prepared: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    圧縮済みの画像を物体検出・機器識別し、結果の行を作成（スレッドプールで実行）
+
+    Args:
+        path: 画像のパス
+        prepared: prepare_imageの結果
+
+    Returns:
+        結果の行（path, status, equipment, timing）
+    """
+    # 一括分析はカメラからのアップロードに割り当てたクォータを使わない
+    current_priority.set(PRIORITY_BATCH)
+    timing = {'preprocess': round(prepared['preprocess_seconds'], 3)}
+    timing.update({f"ingest_{step}": round(seconds, 3) for step, seconds in prepared.get('ingest_timing', {}).items()})
+
+    try:
+        step_start = time.perf_counter()
+        # 物体検出にも圧縮後の画像を送る（Rekognitionの画像サイズ制限も5MB）
+        detected_objects = handler.detect_objects(None, None, base64.b64decode(prepared['image_base64']))
+        timing['detect'] = round(time.perf_counter() - step_start, 3)
+
+        step_start = time.perf_counter()
+        claude_result = handler.analyze_equipment_with_claude(prepared['image_base64'], detected_objects)
+        timing['identify'] = round(time.perf_counter() - step_start, 3)
+
+        final_result = handler.merge_results(detected_objects, claude_result)
+        return {
+            'path': path,
+            'status': 'completed',
+            'format': prepared.get('source_media_type'),
+            'equipment': final_result['equipment'],
+            'timing': timing
+        }
+
+    except Exception as e:
+        logger.error(f"画像分析エラー: {path}: {e}")
+        return {'path': path, 'status': 'failed', 'error': str(e), 'timing': timing}
+
+
+def run_bulk(
+    paths: List[str],
+    output_path: str,
+    cpu_workers: int = None,
+    io_workers: int = 4,
+    max_in_flight: int = None
+) -> Dict[str, int]:
+    """
+    画像を一括分析し、1枚ごとに結果を追記（完了済みの画像はスキップ）
+
+    Args:
+        paths: 画像のパスのリスト
+        output_path: 結果のJSON Linesファイル
+        cpu_workers: 前処理のプロセス数（省略時はCPU数）
+        io_workers: 物体検出・機器識別の同時実行数
+        max_in_flight: 前処理済みで分析待ちの画像を含む同時処理数の上限（メモリ使用量の制限）
+
+    Returns:
+        件数（total, skipped, completed, failed）
+    """
+    completed = load_completed(output_path)
+    remaining = [path for path in paths if path not in completed]
+    counts = {'total': len(paths), 'skipped': len(paths) - len(remaining), 'completed': 0, 'failed': 0}
+    logger.info(f"一括分析: {len(remaining)}枚（完了済み{counts['skipped']}枚をスキップ）")
+
+    max_in_flight = max_in_flight or max(1, io_workers) * 2
+    pending_paths = iter(remaining)
+    preprocessing = {}
+    analyzing = set()
+
+    with open(output_path, 'a', encoding='utf-8') as output, \
+            ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=max(1, io_workers)) as io_pool:
+
+        def write(record: Dict[str, Any]) -> None:
+            # 1行ずつ書き出し、中断しても完了済みの行は残す
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            output.flush()
+            counts[record['status']] += 1
+
+        def fill() -> None:
+            while len(preprocessing) + len(analyzing) < max_in_flight:
+                path = next(pending_paths, None)
+                if path is None:
+                    return
+                preprocessing[cpu_pool.submit(prepare_image, path)] = path
+
+        fill()
+        while preprocessing or analyzing:
+            done, _ = wait(list(preprocessing) + list(analyzing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in preprocessing:
+                    path = preprocessing.pop(future)
+                    try:
+                        analyzing.add(io_pool.submit(analyze_prepared, path, future.result()))
+                    except Exception as e:
+                        logger.error(f"画像の前処理エラー: {path}: {e}")
+                        write({'path': path, 'status': 'failed', 'error': str(e), 'timing': {}})
+                else:
+                    analyzing.remove(future)
+                    write(future.result())
+            fill()
+
+    logger.info(f"一括分析完了: {json.dumps(counts)}")
+    return counts
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='施設写真の一括分析')
+    parser.add_argument('directory', nargs='?', help='画像を再帰的に探すディレクトリ')
+    parser.add_argument('--manifest', help='1行に1つの画像のパスを書いたファイル')
+    parser.add_argument('--output', required=True, help='結果を追記するJSON Linesファイル（再開にも使う）')
+    parser.add_argument('--cpu-workers', type=int, help='前処理のプロセス数（省略時はCPU数）')
+    parser.add_argument('--io-workers', type=int, default=4, help='物体検出・機器識別の同時実行数')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    paths = list_images(args.directory, args.manifest)
+    if not paths:
+        sys.stderr.write("分析する画像がありません\n")
+        return 1
+
+    counts = run_bulk(paths, args.output, args.cpu_workers, args.io_workers)
+    sys.stdout.write(json.dumps(counts) + '\n')
+    return 0 if counts['failed'] == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+技術局長 - Bedrockの同時呼び出し数の自動調整（AIMD）
+
+1回の実行で複数のBedrock呼び出しを行う処理（SQSバッチの複数画像・タイル・切り出し画像・一括分析など）の
+同時呼び出し数を、応答の状況に合わせて増減する
+
+- 遅延とエラー率が正常な間は、1往復分（現在の上限と同じ数の成功）ごとに上限を1増やす（加算的増加）
+- ThrottlingExceptionなどの過負荷の応答では上限を半分にする（乗算的減少）
+- 同時に返ってくる一連の過負荷の応答で何度も減らさないよう、減少の後は一定時間減らさない
+
+状態はモジュールのグローバル変数に置くため、ウォームスタートの実行間で引き継がれる
+スレッドからはslot()、非同期パイプラインのイベントループからはasync_slot()で同じ上限を共有する
+"""
+
+import os
+import time
+import asyncio
+import threading
+import logging
+from contextlib import contextmanager, asynccontextmanager
+from typing import Callable
+
+from botocore.exceptions import ClientError
+
+from metrics import emit_metric
+
+logger = logging.getLogger()
+
+# 同時呼び出し数の下限・上限
+BEDROCK_CONCURRENCY_MIN = int(os.environ.get('BEDROCK_CONCURRENCY_MIN', '1'))
+BEDROCK_CONCURRENCY_MAX = int(os.environ.get('BEDROCK_CONCURRENCY_MAX', '16'))
+# 過負荷の応答で上限に掛ける係数
+BEDROCK_CONCURRENCY_DECREASE = float(os.environ.get('BEDROCK_CONCURRENCY_DECREASE', '0.5'))
+# 減少の後、次に減らすまでの最小間隔（秒）
+BEDROCK_CONCURRENCY_COOLDOWN = float(os.environ.get('BEDROCK_CONCURRENCY_COOLDOWN', '5'))
+# 遅延が基準（成功した呼び出しの遅延の指数移動平均）のこの倍数を超えたら増やさない
+BEDROCK_CONCURRENCY_LATENCY_TOLERANCE = float(os.environ.get('BEDROCK_CONCURRENCY_LATENCY_TOLERANCE', '2.0'))
+# エラー率（指数移動平均）がこれを超えたら増やさない
+BEDROCK_CONCURRENCY_MAX_ERROR_RATE = float(os.environ.get('BEDROCK_CONCURRENCY_MAX_ERROR_RATE', '0.1'))
+
+# 指数移動平均の重み
+SMOOTHING = 0.1
+
+# 呼び出しの結果
+OUTCOME_SUCCESS = 'success'
+OUTCOME_OVERLOADED = 'overloaded'
+OUTCOME_ERROR = 'error'
+
+# 過負荷とみなすエラーコード
+OVERLOAD_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException')
+
+
+def classify_error(error: Exception) -> str:
+    """例外を呼び出しの結果に分類（過負荷 / その他のエラー）"""
+    if isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in OVERLOAD_ERROR_CODES:
+        return OUTCOME_OVERLOADED
+    return OUTCOME_ERROR
+
+
+def wake_waiter(waiter: asyncio.Future) -> None:
+    """空きを待っている非同期の呼び出しを起こす（キャンセル済みの場合は何もしない）"""
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AimdConcurrencyLimit:
+    """
+    加算的増加・乗算的減少（AIMD）で上限を調整するセマフォ
+
+    slot()（非同期ではasync_slot()）で呼び出しを囲むと、上限に空きが出るまで待ち、結果と遅延から上限を更新する
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int = BEDROCK_CONCURRENCY_MIN,
+        max_limit: int = BEDROCK_CONCURRENCY_MAX,
+        decrease_factor: float = BEDROCK_CONCURRENCY_DECREASE,
+        cooldown_seconds: float = BEDROCK_CONCURRENCY_COOLDOWN,
+        latency_tolerance: float = BEDROCK_CONCURRENCY_LATENCY_TOLERANCE,
+        max_error_rate: float = BEDROCK_CONCURRENCY_MAX_ERROR_RATE,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.clock = clock
+
+        self.in_flight = 0
+        # 上限を最後に変えてからの同時呼び出し数の最大値（上限を使い切っているかの判定に使う）
+        self.peak_in_flight = 0
+        self.baseline_latency = None
+        self.error_rate = 0.0
+        self.last_decrease = None
+        self.condition = threading.Condition()
+        # 空きを待っている非同期の呼び出し（イベントループ, Future）
+        self.async_waiters = []
+
+    @property
+    def current_limit(self) -> int:
+        """現在の同時呼び出し数の上限"""
+        return max(self.min_limit, int(self.limit))
+
+    def acquire(self) -> float:
+        """
+        上限に空きが出るまで待って呼び出し枠を確保
+
+        Returns:
+            確保した時刻（releaseに渡す）
+        """
+        with self.condition:
+            while self.in_flight >= self.current_limit:
+                self.condition.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return self.clock()
+
+    async def acquire_async(self) -> float:
+        """
+        イベントループを止めずに、上限に空きが出るまで待って呼び出し枠を確保
+
+        Returns:
+            確保した時刻（releaseに渡す）
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.in_flight < self.current_limit:
+                    self.in_flight += 1
+                    self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                    return self.clock()
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self.condition:
+                    if (loop, waiter) in self.async_waiters:
+                        self.async_waiters.remove((loop, waiter))
+
+    def release(self, started: float, outcome: str) -> None:
+        """
+        呼び出し枠を返し、結果と遅延から上限を更新
+
+        Args:
+            started: acquireが返した時刻
+            outcome: 呼び出しの結果（OUTCOME_SUCCESS / OUTCOME_OVERLOADED / OUTCOME_ERROR）
+        """
+        now = self.clock()
+        with self.condition:
+            before = self.current_limit
+            self.in_flight -= 1
+
+            self.error_rate += SMOOTHING * ((0.0 if outcome == OUTCOME_SUCCESS else 1.0) - self.error_rate)
+            if outcome == OUTCOME_OVERLOADED:
+                self._decrease(now)
+            elif outcome == OUTCOME_SUCCESS:
+                self._increase(now - started)
+
+            after = self.current_limit
+            if after != before:
+                self.peak_in_flight = self.in_flight
+            self.condition.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+        # 待っている非同期の呼び出しを起こし、空きを確認し直させる（別スレッドからの返却にも対応）
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(wake_waiter, waiter)
+
+        if outcome == OUTCOME_OVERLOADED:
+            emit_metric('BedrockThrottled', 1, 'Count')
+        if after != before:
+            logger.info(f"Bedrockの同時呼び出し数の上限: {before} -> {after} ({outcome})")
+            emit_metric('BedrockConcurrencyLimit', after, 'Count')
+
+    def _decrease(self, now: float) -> None:
+        """乗算的減少（前回の減少から一定時間内は減らさない）"""
+        if self.last_decrease is not None and now - self.last_decrease < self.cooldown_seconds:
+            return
+        self.last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+
+    def _increase(self, latency: float) -> None:
+        """加算的増加（遅延・エラー率が正常で、上限を使い切りかけている場合のみ）"""
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        slow = latency > self.baseline_latency * self.latency_tolerance
+        self.baseline_latency += SMOOTHING * (latency - self.baseline_latency)
+
+        if slow or self.error_rate > self.max_error_rate:
+            return
+        # 上限の半分も使っていない間は、増やしても効果が確認できないため増やさない
+        if self.peak_in_flight * 2 < self.current_limit:
+            return
+        self.limit = min(float(self.max_limit), self.limit + 1 / self.current_limit)
+
+    @contextmanager
+    def slot(self):
+        """呼び出しを囲み、枠の確保・返却と上限の更新を行う"""
+        started = self.acquire()
+        outcome = OUTCOME_ERROR
+        try:
+            yield
+            outcome = OUTCOME_SUCCESS
+        except Exception as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            self.release(started, outcome)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """非同期の呼び出しを囲み、枠の確保・返却と上限の更新を行う（slotの非同期版）"""
+        started = await self.acquire_async()
+        outcome = OUTCOME_ERROR
+        try:
+            yield
+            outcome = OUTCOME_SUCCESS
+        except Exception as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            self.release(started, outcome)
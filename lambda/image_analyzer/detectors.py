@@ -0,0 +1,210 @@
+"""
+技術局長 - 物体検出のバックエンド
+
+Rekognitionへのネットワーク往復を省き、オフラインのベンチマークや負荷試験でも
+モックなしで物体検出を動かせるよう、検出処理を差し替え可能にする
+
+バックエンド:
+- rekognition: AWS Rekognition DetectLabels（既定、handler.detect_objects_with_rekognition）
+- onnx: ローカルCPUで動く小型の検出モデル（onnxruntime、任意の依存）
+
+どちらも {label, confidence, bbox（パーセンテージ）} のリストを返す
+"""
+
+import os
+import json
+import contextvars
+import logging
+from typing import Dict, List, Any
+
+logger = logging.getLogger()
+
+# 検出バックエンド
+DETECTOR_REKOGNITION = 'rekognition'
+DETECTOR_ONNX = 'onnx'
+DETECTOR_BACKENDS = [DETECTOR_REKOGNITION, DETECTOR_ONNX]
+
+# ONNXモデル（YOLOv8形式のエクスポート: 出力 [バッチ, 4 + クラス数, 候補数]）とクラス名の一覧
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', '/opt/models/detector.onnx')
+ONNX_LABELS_PATH = os.environ.get('ONNX_LABELS_PATH', '/opt/models/detector.labels.json')
+# モデルの入力サイズ（正方形、ピクセル）
+ONNX_INPUT_SIZE = int(os.environ.get('ONNX_INPUT_SIZE', '640'))
+# 検出とみなす最小スコア（RekognitionのMinConfidence=30に合わせる）
+ONNX_SCORE_THRESHOLD = float(os.environ.get('ONNX_SCORE_THRESHOLD', '0.3'))
+# 重複除去（NMS）で同一物体とみなすIoU
+ONNX_NMS_IOU = float(os.environ.get('ONNX_NMS_IOU', '0.5'))
+# 1枚あたりの最大検出数（RekognitionのMaxLabels=50に合わせる）
+ONNX_MAX_DETECTIONS = int(os.environ.get('ONNX_MAX_DETECTIONS', '50'))
+
+# 現在の処理の検出バックエンド（SQSメッセージ属性detectorで画像ごとに指定、Noneは環境変数の既定値）
+current_detector_backend = contextvars.ContextVar('detector_backend', default=None)
+
+
+class ObjectDetector:
+    """ローカルの物体検出のインターフェース"""
+
+    def detect(self, image_bytes: bytes) -> List[Dict[str, Any]]:
+        """
+        画像1枚の物体を検出
+
+        Args:
+            image_bytes: 画像のバイトデータ
+
+        Returns:
+            検出された物体のリスト（label, confidence, bbox）
+        """
+        return self.detect_batch([image_bytes])[0]
+
+    def detect_batch(self, images: List[bytes]) -> List[List[Dict[str, Any]]]:
+        """
+        複数の画像をまとめて検出
+
+        Args:
+            images: 画像のバイトデータのリスト
+
+        Returns:
+            画像ごとの検出結果
+        """
+        raise NotImplementedError
+
+
+class OnnxDetector(ObjectDetector):
+    """onnxruntimeのCPU推論による物体検出"""
+
+    def __init__(
+        self,
+        model_path: str,
+        labels: List[str],
+        input_size: int = ONNX_INPUT_SIZE,
+        score_threshold: float = ONNX_SCORE_THRESHOLD,
+        nms_iou: float = ONNX_NMS_IOU,
+        max_detections: int = ONNX_MAX_DETECTIONS,
+        session: Any = None
+    ):
+        self.labels = labels
+        self.input_size = input_size
+        self.score_threshold = score_threshold
+        self.nms_iou = nms_iou
+        self.max_detections = max_detections
+
+        if session is None:
+            # 使うデプロイだけが依存を持てばよいよう、ここで読み込む
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            # Lambdaの割り当てvCPUに合わせてスレッド数はランタイムに任せる
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    @classmethod
+    def from_env(cls) -> 'OnnxDetector':
+        """環境変数のモデル・クラス名の一覧から作成"""
+        with open(ONNX_LABELS_PATH, 'r', encoding='utf-8') as f:
+            labels = json.load(f)
+        logger.info(f"ONNX検出モデル読み込み: {ONNX_MODEL_PATH} ({len(labels)}クラス)")
+        return cls(ONNX_MODEL_PATH, labels)
+
+    def preprocess(self, image_bytes: bytes) -> Any:
+        """
+        画像をモデルの入力（3 x input_size x input_size、0-1のfloat32）に変換
+
+        縦横比は保たずに引き伸ばす（出力座標をそのままパーセンテージに変換できる）
+        """
+        import numpy as np
+        from PIL import Image
+        from io import BytesIO
+
+        image = Image.open(BytesIO(image_bytes))
+        image.draft('RGB', (self.input_size, self.input_size))
+        image = image.convert('RGB')
+        image = image.resize((self.input_size, self.input_size), Image.Resampling.BILINEAR)
+        return np.asarray(image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+
+    def detect_batch(self, images: List[bytes]) -> List[List[Dict[str, Any]]]:
+        import numpy as np
+
+        if not images:
+            return []
+        batch = np.stack([self.preprocess(image_bytes) for image_bytes in images])
+        outputs = self.session.run(None, {self.input_name: batch})[0]
+        return [self.postprocess(output) for output in outputs]
+
+    def postprocess(self, output: Any) -> List[Dict[str, Any]]:
+        """
+        1枚分のモデル出力（4 + クラス数 x 候補数）を検出結果に変換
+
+        Args:
+            output: 中心x, 中心y, 幅, 高さ（入力ピクセル）とクラスごとのスコア
+
+        Returns:
+            検出された物体のリスト（信頼度の高い順）
+        """
+        import numpy as np
+
+        candidates = output.T
+        boxes, scores = candidates[:, :4], candidates[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+
+        keep = confidences >= self.score_threshold
+        boxes, class_ids, confidences = boxes[keep], class_ids[keep], confidences[keep]
+
+        # 中心座標 -> 左上座標（入力サイズに対するパーセンテージ）
+        scale = 100.0 / self.input_size
+        x = np.clip((boxes[:, 0] - boxes[:, 2] / 2) * scale, 0, 100)
+        y = np.clip((boxes[:, 1] - boxes[:, 3] / 2) * scale, 0, 100)
+        right = np.clip((boxes[:, 0] + boxes[:, 2] / 2) * scale, 0, 100)
+        bottom = np.clip((boxes[:, 1] + boxes[:, 3] / 2) * scale, 0, 100)
+        corners = np.stack([x, y, right, bottom], axis=1)
+
+        detected_objects = []
+        for index in non_max_suppression(corners, confidences, class_ids, self.nms_iou)[:self.max_detections]:
+            left, top, right_edge, bottom_edge = (float(v) for v in corners[index])
+            class_id = int(class_ids[index])
+            detected_objects.append({
+                'label': self.labels[class_id] if class_id < len(self.labels) else str(class_id),
+                'confidence': float(confidences[index]) * 100,
+                'bbox': {
+                    'x': left,
+                    'y': top,
+                    'width': right_edge - left,
+                    'height': bottom_edge - top
+                }
+            })
+        return detected_objects
+
+
+def non_max_suppression(corners: Any, confidences: Any, class_ids: Any, iou_threshold: float) -> List[int]:
+    """
+    クラスごとの重複除去（NMS）
+
+    Args:
+        corners: 左上x, 左上y, 右下x, 右下yの配列
+        confidences: 信頼度の配列
+        class_ids: クラス番号の配列
+        iou_threshold: 同一物体とみなすIoU
+
+    Returns:
+        残す候補のインデックス（信頼度の高い順）
+    """
+    import numpy as np
+
+    areas = (corners[:, 2] - corners[:, 0]) * (corners[:, 3] - corners[:, 1])
+    order = list(np.argsort(-confidences))
+    kept = []
+    while order:
+        best = order.pop(0)
+        kept.append(int(best))
+        if not order:
+            break
+        rest = np.array(order)
+        overlap_width = np.clip(np.minimum(corners[best, 2], corners[rest, 2]) - np.maximum(corners[best, 0], corners[rest, 0]), 0, None)
+        overlap_height = np.clip(np.minimum(corners[best, 3], corners[rest, 3]) - np.maximum(corners[best, 1], corners[rest, 1]), 0, None)
+        intersection = overlap_width * overlap_height
+        iou = intersection / np.maximum(areas[best] + areas[rest] - intersection, 1e-9)
+        # 別のクラスの候補は重なっていても残す
+        suppressed = (iou >= iou_threshold) & (class_ids[rest] == class_ids[best])
+        order = [int(i) for i in rest[~suppressed]]
+    return kept
@@ -0,0 +1,197 @@
+"""
+技術局長 - 機器カタログ
+
+確認済みの機器の正式名・リスクレベル・説明・マニュアルURLを持つカタログ
+Claudeの識別結果の機器名をカタログと照合し、リスクレベルとマニュアルURLを確認済みの値で補う
+（モデルがマニュアルURLを作り出してしまう問題への対策）
+
+- 同梱のdevice_catalog.jsonを初期化時に読み込む（正規化名・別名の索引 + あいまい一致）
+- DynamoDBのカタログテーブル（任意）を2段目として正規化名の完全一致で引く
+"""
+
+import os
+import re
+import json
+import difflib
+import threading
+import logging
+from typing import Dict, List, Any
+
+from inventory import normalize_device_name, risk_rank
+
+logger = logging.getLogger()
+
+# 同梱のカタログファイル
+CATALOG_PATH = os.environ.get(
+    'CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_catalog.json')
+)
+# あいまい一致とみなす類似度（difflibのratio）
+CATALOG_MATCH_CUTOFF = float(os.environ.get('CATALOG_MATCH_CUTOFF', '0.85'))
+# 名前の部分一致に使う索引キーの最小文字数（短い別名による誤一致を防ぐ）
+MIN_CONTAINED_KEY_LENGTH = 5
+
+
+def model_numbers(normalized_name: str) -> List[str]:
+    """正規化名に含まれる数字列（型番の数字が異なる機器は一致させない）"""
+    return re.findall(r'\d+', normalized_name)
+
+
+class DeviceCatalog:
+    """機器カタログ（同梱ファイル + 任意のDynamoDBテーブル）"""
+
+    def __init__(self, devices: List[Dict[str, Any]], table: Any = None):
+        self.table = table
+        self.index = {}
+        for device in devices:
+            for name in [device['name']] + device.get('aliases', []):
+                self.index.setdefault(normalize_device_name(name), device)
+        # 長いキーから部分一致を試す
+        self.contained_keys = sorted(
+            (key for key in self.index if len(key) >= MIN_CONTAINED_KEY_LENGTH), key=len, reverse=True
+        )
+        # DynamoDBの照会結果（見つからなかった名前も記録して何度も引かない）
+        self.remote_cache = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str = None, table: Any = None) -> 'DeviceCatalog':
+        """
+        同梱のカタログファイルから作成
+
+        Args:
+            path: カタログファイル（省略時はCATALOG_PATH）
+            table: DynamoDBのカタログテーブル（任意）
+
+        Returns:
+            機器カタログ
+        """
+        with open(path or CATALOG_PATH, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+        logger.info(f"機器カタログ読み込み: {len(catalog['devices'])}件")
+        return cls(catalog['devices'], table)
+
+    def lookup(self, name: str) -> Dict[str, Any]:
+        """
+        機器名に一致するカタログの項目を探す（完全一致 → 部分一致 → あいまい一致 → DynamoDB）
+
+        Args:
+            name: Claudeが返した機器名
+
+        Returns:
+            カタログの項目（見つからない場合はNone）
+        """
+        normalized = normalize_device_name(name)
+        if not normalized:
+            return None
+
+        if normalized in self.index:
+            return self.index[normalized]
+
+        numbers = model_numbers(normalized)
+
+        # 「Sony PVM-A250モニター」のように一般名詞が付いた名前
+        for key in self.contained_keys:
+            if key in normalized and model_numbers(key) == numbers:
+                return self.index[key]
+
+        for key in difflib.get_close_matches(normalized, self.index.keys(), n=3, cutoff=CATALOG_MATCH_CUTOFF):
+            if model_numbers(key) == numbers:
+                return self.index[key]
+
+        return self.lookup_remote(normalized)
+
+    def find_in_text(self, text: str) -> Dict[str, Any]:
+        """
+        前面パネルの印字（OCR結果）に含まれるカタログの機器名・型番を探す
+
+        あいまい一致とDynamoDBは使わず、索引のキーがそのまま含まれる場合だけ一致とする
+
+        Args:
+            text: 機器の領域内で検出された文字列（複数行を連結したもの）
+
+        Returns:
+            カタログの項目（見つからない場合はNone）
+        """
+        normalized = normalize_device_name(text)
+        if not normalized:
+            return None
+
+        numbers = model_numbers(normalized)
+        # 長いキーから試す（「ATEM Mini Pro」を「ATEM Mini」より優先）
+        for key in self.contained_keys:
+            if key in normalized and all(number in numbers for number in model_numbers(key)):
+                return self.index[key]
+        return None
+
+    def lookup_remote(self, normalized: str) -> Dict[str, Any]:
+        """
+        DynamoDBのカタログテーブルを正規化名で引く
+
+        Args:
+            normalized: 正規化した機器名
+
+        Returns:
+            カタログの項目（テーブルが無い・見つからない場合はNone）
+        """
+        if self.table is None:
+            return None
+
+        with self.lock:
+            if normalized in self.remote_cache:
+                return self.remote_cache[normalized]
+
+        try:
+            item = self.table.get_item(Key={'normalizedName': normalized}).get('Item')
+        except Exception as e:
+            logger.warning(f"カタログテーブルの照会エラー: {e}")
+            return None
+
+        with self.lock:
+            self.remote_cache[normalized] = item
+        return item
+
+    def enrich(
+        self,
+        equipment_list: List[Dict[str, Any]],
+        verified_urls_only: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        識別結果の機器をカタログの確認済みの値で補う
+
+        - name: カタログの正式名
+        - risk_level: カタログとモデルのより危険な方（悲観的AI戦略）
+        - manual_url: カタログの値（カタログに無い機器のURLはverified_urls_onlyなら除く）
+        - description: モデルが返さなかった場合のみカタログの値
+
+        Args:
+            equipment_list: 機器識別結果の機器リスト
+            verified_urls_only: カタログで確認できないマニュアルURLを除く
+
+        Returns:
+            補った機器リスト
+        """
+        enriched = []
+        matched = 0
+        for equipment in equipment_list:
+            entry = self.lookup(equipment.get('name', ''))
+            if entry is None:
+                if verified_urls_only and equipment.get('manual_url'):
+                    equipment = {k: v for k, v in equipment.items() if k != 'manual_url'}
+                enriched.append(equipment)
+                continue
+
+            matched += 1
+            equipment = dict(equipment, name=entry['name'])
+            if risk_rank(entry['risk_level']) > risk_rank(equipment.get('risk_level', 'UNKNOWN')) \
+                    or equipment.get('risk_level') == 'UNKNOWN':
+                equipment['risk_level'] = entry['risk_level']
+            if entry.get('manual_url'):
+                equipment['manual_url'] = entry['manual_url']
+            elif verified_urls_only:
+                equipment.pop('manual_url', None)
+            if not equipment.get('description') and entry.get('description'):
+                equipment['description'] = entry['description']
+            enriched.append(equipment)
+
+        logger.info(f"機器カタログ照合: {matched}/{len(equipment_list)}個が一致")
+        return enriched
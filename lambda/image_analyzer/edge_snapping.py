@@ -0,0 +1,191 @@
+"""
+技術局長 - バウンディングボックスのエッジ吸着
+
+Claudeが推測したバウンディングボックスを、近くの強いエッジ（機器の外枠）に吸着させる
+モデル呼び出しを行わず、縮小画像のエッジマップだけで補正する（CPUのみ・数十ミリ秒）
+"""
+
+import os
+import json
+import logging
+from typing import Dict, List, Any, Tuple
+
+logger = logging.getLogger()
+
+# エッジ計算に使う縮小画像の最大辺（ピクセル）
+SNAP_MAX_SIDE = int(os.environ.get('SNAP_MAX_SIDE', '512'))
+# 探索範囲（ボックスサイズに対する割合）
+SNAP_SEARCH_RATIO = float(os.environ.get('SNAP_SEARCH_RATIO', '0.25'))
+# 吸着に必要なエッジ強度（0-255、探索帯の平均値）
+SNAP_MIN_EDGE_STRENGTH = float(os.environ.get('SNAP_MIN_EDGE_STRENGTH', '24'))
+
+# Sobelフィルタ（縦エッジ: 左右の辺、横エッジ: 上下の辺）
+SOBEL_X = [-1, 0, 1, -2, 0, 2, -1, 0, 1]
+SOBEL_Y = [-1, -2, -1, 0, 0, 0, 1, 2, 1]
+
+
+def compute_edge_maps(image_bytes: bytes) -> Tuple[Any, Any]:
+    """
+    縮小したグレースケール画像から縦エッジ・横エッジの強度マップを計算
+
+    Args:
+        image_bytes: 画像のバイトデータ
+
+    Returns:
+        (縦エッジマップ, 横エッジマップ)のPIL画像
+    """
+    from PIL import Image, ImageChops, ImageFilter, ImageOps
+    from io import BytesIO
+
+    image = Image.open(BytesIO(image_bytes))
+    # JPEGはデコード時に縮小（フル解像度のデコードを避ける）
+    image.draft('L', (SNAP_MAX_SIDE, SNAP_MAX_SIDE))
+    image = image.convert('L')
+    image.thumbnail((SNAP_MAX_SIDE, SNAP_MAX_SIDE))
+
+    def gradient(kernel: List[int]) -> Any:
+        # 正負それぞれの勾配の大きい方 = 勾配の絶対値
+        positive = image.filter(ImageFilter.Kernel((3, 3), kernel, scale=1))
+        negative = image.filter(ImageFilter.Kernel((3, 3), [-k for k in kernel], scale=1))
+        # 外周1ピクセルはフィルタされず元の画素値が残るため、0にする
+        return ImageOps.expand(ImageOps.crop(ImageChops.lighter(positive, negative), 1), 1, fill=0)
+
+    return gradient(SOBEL_X), gradient(SOBEL_Y)
+
+
+def find_strongest_line(edge_map: Any, band: Tuple[int, int, int, int], axis: str) -> Tuple[int, float]:
+    """
+    探索帯の中で最もエッジが強い列（または行）を探す
+
+    Args:
+        edge_map: エッジ強度マップ
+        band: 探索帯 (left, top, right, bottom)
+        axis: 'x'なら列方向、'y'なら行方向に探索
+
+    Returns:
+        (位置, 平均エッジ強度)
+    """
+    from PIL import Image
+
+    left, top, right, bottom = band
+    crop = edge_map.crop(band)
+    if axis == 'x':
+        # 各列の平均値
+        profile = list(crop.resize((right - left, 1), Image.Resampling.BOX).tobytes())
+        offset = left
+    else:
+        # 各行の平均値
+        profile = list(crop.resize((1, bottom - top), Image.Resampling.BOX).tobytes())
+        offset = top
+
+    best = max(range(len(profile)), key=lambda i: profile[i])
+    return offset + best, float(profile[best])
+
+
+def snap_bbox(edge_maps: Tuple[Any, Any], bbox: Dict[str, float]) -> Dict[str, float]:
+    """
+    1つのバウンディングボックスの各辺を近くの強いエッジに吸着
+
+    Args:
+        edge_maps: compute_edge_mapsの結果
+        bbox: バウンディングボックス（パーセンテージ）
+
+    Returns:
+        吸着後のバウンディングボックス（パーセンテージ）
+    """
+    vertical_edges, horizontal_edges = edge_maps
+    width, height = vertical_edges.size
+
+    x1 = int(round(bbox['x'] / 100 * width))
+    y1 = int(round(bbox['y'] / 100 * height))
+    x2 = int(round((bbox['x'] + bbox['width']) / 100 * width))
+    y2 = int(round((bbox['y'] + bbox['height']) / 100 * height))
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return bbox
+
+    dx = max(2, int((x2 - x1) * SNAP_SEARCH_RATIO))
+    dy = max(2, int((y2 - y1) * SNAP_SEARCH_RATIO))
+
+    def snap_side(position: int, delta: int, limit: int, edge_map: Any, span: Tuple[int, int], axis: str) -> int:
+        low = max(0, position - delta)
+        high = min(limit, position + delta + 1)
+        if high - low < 2 or span[1] - span[0] < 1:
+            return position
+        if axis == 'x':
+            band = (low, span[0], high, span[1])
+        else:
+            band = (span[0], low, span[1], high)
+        line, strength = find_strongest_line(edge_map, band, axis)
+        return line if strength >= SNAP_MIN_EDGE_STRENGTH else position
+
+    new_x1 = snap_side(x1, dx, width, vertical_edges, (max(0, y1), min(height, y2)), 'x')
+    new_x2 = snap_side(x2, dx, width, vertical_edges, (max(0, y1), min(height, y2)), 'x')
+    new_y1 = snap_side(y1, dy, height, horizontal_edges, (max(0, x1), min(width, x2)), 'y')
+    new_y2 = snap_side(y2, dy, height, horizontal_edges, (max(0, x1), min(width, x2)), 'y')
+
+    # 潰れたボックスになる場合は吸着しない
+    if new_x2 - new_x1 < (x2 - x1) / 2 or new_y2 - new_y1 < (y2 - y1) / 2:
+        return bbox
+
+    return {
+        'x': new_x1 / width * 100,
+        'y': new_y1 / height * 100,
+        'width': (new_x2 - new_x1) / width * 100,
+        'height': (new_y2 - new_y1) / height * 100
+    }
+
+
+def bbox_shift(before: Dict[str, float], after: Dict[str, float]) -> float:
+    """
+    ボックスの移動量（各辺の移動量の最大値、パーセンテージ）
+
+    Args:
+        before: 吸着前のバウンディングボックス
+        after: 吸着後のバウンディングボックス
+
+    Returns:
+        移動量（パーセンテージ）
+    """
+    return max(
+        abs(after['x'] - before['x']),
+        abs(after['y'] - before['y']),
+        abs(after['x'] + after['width'] - before['x'] - before['width']),
+        abs(after['y'] + after['height'] - before['y'] - before['height'])
+    )
+
+
+def snap_equipment_to_edges(
+    image_bytes: bytes,
+    equipment_list: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Claude検出分のバウンディングボックスを近くの強いエッジに吸着
+
+    Args:
+        image_bytes: 元画像のバイトデータ
+        equipment_list: マージ済みの機器リスト
+
+    Returns:
+        (吸着後の機器リスト, 機器ごとの移動量レポート)
+    """
+    targets = [i for i, equipment in enumerate(equipment_list) if equipment.get('source') == 'claude']
+    if not targets:
+        return equipment_list, []
+
+    try:
+        edge_maps = compute_edge_maps(image_bytes)
+    except Exception as e:
+        logger.error(f"エッジマップ計算エラー: {e}")
+        return equipment_list, []
+
+    snapped_list = list(equipment_list)
+    report = []
+    for i in targets:
+        equipment = equipment_list[i]
+        new_bbox = snap_bbox(edge_maps, equipment['bbox'])
+        shift = bbox_shift(equipment['bbox'], new_bbox)
+        snapped_list[i] = dict(equipment, bbox=new_bbox)
+        report.append({'index': i, 'name': equipment['name'], 'shift': round(shift, 2)})
+
+    logger.info(f"エッジ吸着完了: {json.dumps(report, ensure_ascii=False)}")
+    return snapped_list, report
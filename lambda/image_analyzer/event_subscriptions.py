@@ -0,0 +1,64 @@
+"""
+技術局長 - 分析完了を待つWebSocket接続の登録
+
+フロントエンドはアップロードの前に、WebSocket APIへ`?key=<imageKey>`を付けて接続する。
+$connectルートのこの関数が接続を登録テーブル（imageKey + connectionId）に書き込み、
+分析完了時にnotifier.WebSocketNotifierが登録された接続へ完了イベントを送る。
+
+- 登録はアップロードの前に済むため、接続してから完了するまでのイベントを取りこぼさない
+- 切断時の削除は行わず、送信時の切断済みエラー（GoneException）かTTLで消す
+"""
+
+import os
+import time
+import logging
+from typing import Dict, Any
+
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 接続の登録テーブル
+SUBSCRIPTIONS_TABLE_NAME = os.environ.get('SUBSCRIPTIONS_TABLE_NAME')
+# 登録の有効期間（API GatewayのWebSocket接続のアイドル上限は10分）
+SUBSCRIPTION_TTL_SECONDS = int(os.environ.get('SUBSCRIPTION_TTL_SECONDS', '900'))
+
+# 登録できる画像のキー（アップロード先と同じ）
+UPLOAD_KEY_PREFIX = 'uploads/'
+
+# 遅延初期化
+subscriptions_table = None
+
+
+def get_subscriptions_table():
+    """接続の登録テーブルを取得（遅延初期化）"""
+    global subscriptions_table
+    if subscriptions_table is None:
+        subscriptions_table = boto3.resource('dynamodb').Table(SUBSCRIPTIONS_TABLE_NAME)
+    return subscriptions_table
+
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    WebSocketの$connectルート: 完了を待つ画像と接続を登録
+
+    Args:
+        event: API GatewayのWebSocketイベント
+        context: Lambda実行コンテキスト
+
+    Returns:
+        statusCode 200で接続を受け付け、それ以外は拒否
+    """
+    image_key = (event.get('queryStringParameters') or {}).get('key')
+    if not image_key or not image_key.startswith(UPLOAD_KEY_PREFIX):
+        return {'statusCode': 400, 'body': 'Missing image key'}
+
+    connection_id = event['requestContext']['connectionId']
+    get_subscriptions_table().put_item(Item={
+        'imageKey': image_key,
+        'connectionId': connection_id,
+        'ttl': int(time.time()) + SUBSCRIPTION_TTL_SECONDS
+    })
+    logger.info(f"完了待ちの接続を登録: {image_key} ({connection_id})")
+    return {'statusCode': 200}
@@ -10,10 +10,76 @@ import base64
 import os
 import logging
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any
+from urllib.parse import unquote_plus
 from datetime import datetime, timedelta
 from botocore.exceptions import ClientError
 
+from edge_snapping import snap_equipment_to_edges
+from result_codec import encode_result
+from idempotency import (
+    acquire_lease,
+    release_lease,
+    LEASE_ACQUIRED,
+    LEASE_COMPLETED,
+    LEASE_IN_FLIGHT,
+    LeaseInFlight
+)
+from rate_limiter import (
+    LocalRateLimiter,
+    DynamoDBRateLimiter,
+    RateLimitExceeded,
+    estimate_request_tokens,
+    current_priority,
+    PRIORITY_INTERACTIVE,
+    PRIORITIES
+)
+from inventory import (
+    MemoryInventoryStore,
+    DynamoDBInventoryStore,
+    compute_fingerprints,
+    find_matching_device
+)
+from device_catalog import DeviceCatalog
+from concurrency_limit import AimdConcurrencyLimit
+from detectors import (
+    OnnxDetector,
+    DETECTOR_BACKENDS,
+    DETECTOR_ONNX,
+    ONNX_MODEL_PATH,
+    ONNX_INPUT_SIZE,
+    ONNX_SCORE_THRESHOLD,
+    ONNX_NMS_IOU,
+    ONNX_MAX_DETECTIONS,
+    current_detector_backend
+)
+from image_format import ingest_image, base64_media_type, UnsupportedImageFormat, INGESTION_VERSION
+from metrics import emit_metric
+from quality_gate import (
+    measure_image_quality,
+    evaluate_quality,
+    evaluate_detections,
+    build_rejected_result
+)
+from roi_crop import compute_roi, crop_to_roi, equipment_from_roi
+from stage_cache import (
+    S3StageCache,
+    StageCheckpoint,
+    stage_version,
+    STAGE_DERIVATIVE,
+    STAGE_DETECTIONS,
+    STAGE_IDENTIFICATION
+)
+from notifier import (
+    MemoryNotifier,
+    FileNotifier,
+    SnsNotifier,
+    WebSocketNotifier,
+    build_completion_event
+)
+
 # ロガーの設定
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -22,12 +88,122 @@ logger.setLevel(logging.INFO)
 RESULTS_TABLE_NAME = os.environ.get('RESULTS_TABLE_NAME')
 BEDROCK_REGION = os.environ.get('BEDROCK_REGION', 'us-east-1')
 BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'us.anthropic.claude-sonnet-4-5-20250929-v1:0')
+# 機器識別プロンプトの出力形式
+# verbose: 従来のJSON, compact: 短縮キーのJSON, names: 名前とリスクのみ（説明・URLは機器カタログで補う）
+PROMPT_VERSION = os.environ.get('PROMPT_VERSION', 'verbose')
+
+# 機器識別の出力モード（text: テキストのJSON, tool: tool_useによる構造化出力）
+OUTPUT_MODE = os.environ.get('OUTPUT_MODE', 'text')
+
+# toolモードで宣言するツール名
+EQUIPMENT_TOOL_NAME = 'report_equipment'
+
+# Bedrockの同時呼び出し数の初期値（タイル分析などの並列処理全体で共有し、応答の状況に合わせてAIMDで増減）
+MAX_CONCURRENT_BEDROCK_CALLS = int(os.environ.get('MAX_CONCURRENT_BEDROCK_CALLS', '4'))
+
+# エッジ吸着によるClaude検出分の位置補正（CPUのみ、モデル呼び出しなし）
+ENABLE_EDGE_SNAPPING = os.environ.get('ENABLE_EDGE_SNAPPING', 'false').lower() == 'true'
+
+# 切り出し画像による位置調整（Claude検出分と低信頼度の機器のみ対象）
+ENABLE_CROP_REFINEMENT = os.environ.get('ENABLE_CROP_REFINEMENT', 'false').lower() == 'true'
+REFINEMENT_MIN_CONFIDENCE = float(os.environ.get('REFINEMENT_MIN_CONFIDENCE', '80'))
+REFINEMENT_PADDING = float(os.environ.get('REFINEMENT_PADDING', '0.3'))
+REFINEMENT_MAX_CROPS = int(os.environ.get('REFINEMENT_MAX_CROPS', '8'))
+REFINEMENT_CROP_MAX_SIDE = int(os.environ.get('REFINEMENT_CROP_MAX_SIDE', '512'))
+# 残り実行時間がこれ未満の場合は位置調整をスキップ
+REFINEMENT_MIN_REMAINING_MS = int(os.environ.get('REFINEMENT_MIN_REMAINING_MS', '20000'))
+
+# 重複イベントの排除（imageKey + ETag単位のリース、結果テーブルへの書き込みが増えるため既定は無効）
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'false').lower() == 'true'
+# リースの有効期間（Lambdaのタイムアウトより長くする）
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', '120'))
+
+# SQSバッチで同時に分析する画像数の上限
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '4'))
+
+# 非同期の分析パイプライン（1つのイベントループで複数の画像を分析、aiobotocoreが必要）
+ASYNC_PIPELINE_ENABLED = os.environ.get('ASYNC_PIPELINE_ENABLED', 'false').lower() == 'true'
+
+# 画像の品質チェック（ぶれ・露出不良の画像はRekognition・Claudeを呼ばずに除外）
+QUALITY_GATE_ENABLED = os.environ.get('QUALITY_GATE_ENABLED', 'false').lower() == 'true'
+
+# 段階の出力（圧縮済みの画像・物体検出・Claudeの応答）を記録し、再試行では完了済みの段階を再実行しない
+STAGE_CHECKPOINT_ENABLED = os.environ.get('STAGE_CHECKPOINT_ENABLED', 'false').lower() == 'true'
+
+# Bedrockの1分あたりトークン数の上限（全実行で共有、0で無効）
+RATE_LIMIT_TOKENS_PER_MINUTE = int(os.environ.get('RATE_LIMIT_TOKENS_PER_MINUTE', '0'))
+# レート制限のカウンタを置くテーブル（未設定の場合はプロセス内のカウンタ）
+RATE_LIMIT_TABLE_NAME = os.environ.get('RATE_LIMIT_TABLE_NAME')
+
+# 撮影セッション単位の分析（同じセッションの画像を1回のBedrock呼び出しでまとめて分析、SQSバッチのみ）
+SESSION_MODE_ENABLED = os.environ.get('SESSION_MODE_ENABLED', 'false').lower() == 'true'
+
+# Rekognitionを待たずにClaudeを並行して呼び出し、Claudeの座標を検出結果と照合（先読みの識別）
+SPECULATIVE_IDENTIFICATION_ENABLED = os.environ.get('SPECULATIVE_IDENTIFICATION_ENABLED', 'false').lower() == 'true'
+
+# 関心領域の切り出し（人・家具・壁などを除いた物体の範囲だけをClaudeに送る）
+ROI_CROP_ENABLED = os.environ.get('ROI_CROP_ENABLED', 'false').lower() == 'true'
+
+# 連続撮影の差分分析（撮影セッションの前の写真と重なる部分の結果を引き継ぎ、新しく写った部分だけを分析）
+INCREMENTAL_MODE_ENABLED = os.environ.get('INCREMENTAL_MODE_ENABLED', 'false').lower() == 'true'
+
+# 機器カタログによる識別結果の補完（確認済みの正式名・リスクレベル・マニュアルURL）
+CATALOG_ENABLED = os.environ.get('CATALOG_ENABLED', 'false').lower() == 'true'
+# カタログの2段目のテーブル（任意）
+CATALOG_TABLE_NAME = os.environ.get('CATALOG_TABLE_NAME')
+# カタログで確認できないマニュアルURLを除く
+CATALOG_VERIFIED_URLS_ONLY = os.environ.get('CATALOG_VERIFIED_URLS_ONLY', 'false').lower() == 'true'
+
+# 撮影場所（セッション）ごとの機器台帳（既知の機器はClaudeに送らない）
+INVENTORY_ENABLED = os.environ.get('INVENTORY_ENABLED', 'false').lower() == 'true'
+# 台帳のテーブル（未設定の場合はプロセス内の台帳）
+INVENTORY_TABLE_NAME = os.environ.get('INVENTORY_TABLE_NAME')
+
+# 物体検出のバックエンド（rekognition / onnx、SQSメッセージ属性detectorで画像ごとに上書き可能）
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'rekognition')
+
+# 前面パネルの印字（Rekognition DetectText）による識別（カタログの型番と一致した物体はClaudeに送らない）
+OCR_FAST_PATH_ENABLED = os.environ.get('OCR_FAST_PATH_ENABLED', 'false').lower() == 'true'
+# 照合に使う文字列の最小信頼度
+OCR_MIN_CONFIDENCE = float(os.environ.get('OCR_MIN_CONFIDENCE', '90'))
+# 文字列をその物体の印字とみなす、文字列の領域が物体の領域に含まれる割合
+OCR_MIN_CONTAINMENT = float(os.environ.get('OCR_MIN_CONTAINMENT', '0.8'))
+
+# 全物体を識別済み（台帳・印字など）の場合はClaude呼び出しを省略（追加検出も行わない）
+SKIP_CLAUDE_WHEN_RESOLVED = os.environ.get('SKIP_CLAUDE_WHEN_RESOLVED', 'true').lower() == 'true'
+
+# 分析完了の通知先（none / memory / file / sns / websocket）
+NOTIFIER_BACKEND = os.environ.get('NOTIFIER_BACKEND', 'none')
+NOTIFICATION_TOPIC_ARN = os.environ.get('NOTIFICATION_TOPIC_ARN')
+NOTIFICATION_FILE_PATH = os.environ.get('NOTIFICATION_FILE_PATH', '/tmp/analysis-events.jsonl')
+# websocketの場合の接続の登録テーブルと、WebSocketステージのコールバックURL
+SUBSCRIPTIONS_TABLE_NAME = os.environ.get('SUBSCRIPTIONS_TABLE_NAME')
+WEBSOCKET_CALLBACK_URL = os.environ.get('WEBSOCKET_CALLBACK_URL')
+
+# リスクレベル
+RISK_LEVELS = ['SAFE', 'WARNING', 'DANGER', 'UNKNOWN']
+
+# compact形式のリスクレベルコード
+RISK_LEVEL_CODES = {
+    'S': 'SAFE',
+    'W': 'WARNING',
+    'D': 'DANGER',
+    'U': 'UNKNOWN'
+}
 
 # AWSクライアント（遅延初期化）
 s3_client = None
 bedrock_runtime = None
 dynamodb = None
 rekognition_client = None
+rate_limiter = None
+notifier = None
+inventory_store = None
+device_catalog = None
+local_detector = None
+
+# Bedrock同時呼び出し数の制御（ウォームスタートの実行間で調整した上限を引き継ぐ）
+bedrock_concurrency = AimdConcurrencyLimit(MAX_CONCURRENT_BEDROCK_CALLS)
 
 
 def get_s3_client():
@@ -62,64 +238,171 @@ def get_rekognition_client():
     return rekognition_client
 
 
+def get_rate_limiter():
+    """Bedrockのレート制限を取得（遅延初期化、無効の場合はNone）"""
+    global rate_limiter
+    if rate_limiter is None and RATE_LIMIT_TOKENS_PER_MINUTE > 0:
+        if RATE_LIMIT_TABLE_NAME:
+            table = get_dynamodb().Table(RATE_LIMIT_TABLE_NAME)
+            rate_limiter = DynamoDBRateLimiter(table, RATE_LIMIT_TOKENS_PER_MINUTE)
+        else:
+            rate_limiter = LocalRateLimiter(RATE_LIMIT_TOKENS_PER_MINUTE)
+    return rate_limiter
+
+
+def get_notifier():
+    """分析完了の通知先を取得（遅延初期化、無効の場合はNone）"""
+    global notifier
+    if notifier is None:
+        if NOTIFIER_BACKEND == 'websocket' and SUBSCRIPTIONS_TABLE_NAME and WEBSOCKET_CALLBACK_URL:
+            notifier = WebSocketNotifier(
+                get_dynamodb().Table(SUBSCRIPTIONS_TABLE_NAME),
+                boto3.client('apigatewaymanagementapi', endpoint_url=WEBSOCKET_CALLBACK_URL)
+            )
+        elif NOTIFIER_BACKEND == 'sns' and NOTIFICATION_TOPIC_ARN:
+            notifier = SnsNotifier(boto3.client('sns'), NOTIFICATION_TOPIC_ARN)
+        elif NOTIFIER_BACKEND == 'file':
+            notifier = FileNotifier(NOTIFICATION_FILE_PATH)
+        elif NOTIFIER_BACKEND == 'memory':
+            notifier = MemoryNotifier()
+    return notifier
+
+
+def get_inventory_store():
+    """機器台帳の保存先を取得（遅延初期化）"""
+    global inventory_store
+    if inventory_store is None:
+        if INVENTORY_TABLE_NAME:
+            inventory_store = DynamoDBInventoryStore(get_dynamodb().Table(INVENTORY_TABLE_NAME))
+        else:
+            inventory_store = MemoryInventoryStore()
+    return inventory_store
+
+
+def get_device_catalog():
+    """機器カタログを取得（遅延初期化、同梱ファイルを読み込む）"""
+    global device_catalog
+    if device_catalog is None:
+        table = get_dynamodb().Table(CATALOG_TABLE_NAME) if CATALOG_TABLE_NAME else None
+        device_catalog = DeviceCatalog.from_file(table=table)
+    return device_catalog
+
+
+def get_local_detector():
+    """ローカルの物体検出モデルを取得（遅延初期化、ウォームスタートでは再利用）"""
+    global local_detector
+    if local_detector is None:
+        local_detector = OnnxDetector.from_env()
+    return local_detector
+
+
+def get_stage_checkpoint(bucket: str, key: str, etag: str) -> StageCheckpoint:
+    """画像の段階の出力の記録先を取得（無効・ETagが不明の場合はNone）"""
+    if not STAGE_CHECKPOINT_ENABLED or not bucket or not etag:
+        return None
+    return StageCheckpoint(S3StageCache(get_s3_client(), bucket), key, etag)
+
+
+def enrich_with_catalog(result: Dict[str, Any], prompt_version: str) -> Dict[str, Any]:
+    """
+    機器識別結果を機器カタログで補う（namesプロンプトでは常に補う）
+    
+    Args:
+        result: 機器識別結果
+        prompt_version: プロンプトバージョン
+    
+    Returns:
+        補った機器識別結果
+    """
+    if not (CATALOG_ENABLED or prompt_version == 'names'):
+        return result
+    
+    try:
+        equipment = get_device_catalog().enrich(result.get('equipment', []), CATALOG_VERIFIED_URLS_ONLY)
+        return dict(result, equipment=equipment)
+    except Exception as e:
+        logger.error(f"機器カタログ照合エラー: {e}")
+        return result
+
+
+def invoke_bedrock_model(body: Dict[str, Any], priority: str = None, model_id: str = None) -> Dict[str, Any]:
+    """
+    Bedrockモデルを呼び出す（レート制限の確認と、応答の状況に合わせた同時呼び出し数の制限）
+    
+    Args:
+        body: リクエストボディ
+        priority: 優先度クラス（省略時は現在の処理の優先度）
+        model_id: モデルID（省略時は環境変数BEDROCK_MODEL_ID、再分析で別のモデルを試す場合など）
+    
+    Returns:
+        Bedrock API応答
+    
+    Raises:
+        RateLimitExceeded: レート制限の空きを待ちきれなかった場合
+    """
+    limiter = get_rate_limiter()
+    reservation = None
+    if limiter is not None:
+        reservation = limiter.acquire(estimate_request_tokens(body), priority or current_priority.get())
+    
+    try:
+        with bedrock_concurrency.slot():
+            bedrock = get_bedrock_runtime()
+            response = bedrock.invoke_model(
+                modelId=model_id or BEDROCK_MODEL_ID,
+                body=json.dumps(body)
+            )
+            response_body = json.loads(response['body'].read())
+    except BaseException:
+        # 失敗した呼び出しの見積もりは返す（窓の残りを次の呼び出しに使えるように）
+        if reservation is not None:
+            limiter.refund(reservation)
+        raise
+    
+    if reservation is not None and 'usage' in response_body:
+        usage = response_body['usage']
+        limiter.settle(reservation, usage.get('input_tokens', 0) + usage.get('output_tokens', 0))
+    
+    return response_body
+
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     S3イベントから画像を取得し、RekognitionとBedrockで分析（1段階のみ）
     
+    S3イベント通知の直接呼び出しに加え、S3イベント通知・EventBridgeイベントを
+    本文に持つSQSメッセージのバッチと、EventBridgeイベントの直接呼び出しにも対応
+    
     Args:
-        event: S3イベント通知
+        event: S3イベント通知 / SQSイベント / EventBridgeイベント
         context: Lambda実行コンテキスト
     
     Returns:
-        分析結果のJSON
+        分析結果のJSON（SQSイベントの場合はbatchItemFailures）
     """
+    if is_sqs_event(event):
+        return process_sqs_batch(event, context)
+    
     try:
-        start_time = datetime.now()
         logger.info(f"イベント受信: {json.dumps(event)}")
         
-        # S3イベントから画像情報を取得
-        bucket, key = extract_s3_info(event)
-        logger.info(f"画像取得: bucket={bucket}, key={key}")
-        
-        # S3から画像を取得
-        step_start = datetime.now()
-        image_bytes = get_image_from_s3(bucket, key)
-        logger.info(f"画像サイズ: {len(image_bytes)} bytes (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
-        
-        # 画像をBase64エンコード
-        step_start = datetime.now()
-        image_base64 = encode_image_to_base64(image_bytes)
-        logger.info(f"Base64エンコード完了 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
-        
-        # Rekognitionで物体検出
-        step_start = datetime.now()
-        rekognition_result = detect_objects_with_rekognition(bucket, key)
-        logger.info(f"Rekognition検出: {len(rekognition_result)}個の物体 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
-        
-        # Claudeで機器識別とリスク判定
-        step_start = datetime.now()
-        claude_result = analyze_equipment_with_claude(image_base64, rekognition_result)
-        logger.info(f"Claude識別: {len(claude_result.get('equipment', []))}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
-        
-        # 結果をマージ
-        step_start = datetime.now()
-        final_result = merge_results(rekognition_result, claude_result)
-        logger.info(f"結果マージ完了: {len(final_result['equipment'])}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
-        
-        total_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"分析完了: {len(final_result['equipment'])}個の機器を検出 (合計所要時間: {total_time:.2f}秒)")
+        if is_eventbridge_event(event):
+            image = parse_eventbridge_event(event)
+            bucket, key, etag = image['bucket'], image['key'], image['etag']
+        else:
+            # S3イベントから画像情報を取得
+            bucket, key = extract_s3_info(event)
+            etag = extract_s3_etag(event)
+        logger.info(f"画像取得: bucket={bucket}, key={key}, etag={etag}")
         
-        # DynamoDBに結果を保存
-        save_result_to_dynamodb(key, final_result)
+        if ASYNC_PIPELINE_ENABLED:
+            from async_pipeline import run_async_pipeline
+            outcome = run_async_pipeline([{'bucket': bucket, 'key': key, 'etag': etag}], context)[0]
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
         
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': '分析完了',
-                'imageKey': key,
-                'equipmentCount': len(final_result['equipment'])
-            })
-        }
+        return process_image(bucket, key, etag, context)
         
     except ClientError as e:
         error_code = e.response['Error']['Code']
@@ -132,6 +415,14 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         else:
             return error_response(500, 'サーバーエラーが発生しました')
             
+    except LeaseInFlight as e:
+        # 直接呼び出しでは再試行の仕組みがないため、処理中の実行に任せる
+        return skipped_response(e.image_key, LEASE_IN_FLIGHT)
+    
+    except RateLimitExceeded as e:
+        logger.warning(str(e))
+        return error_response(429, '混雑しているため分析できませんでした')
+    
     except TimeoutError:
         logger.error("Bedrockタイムアウト", exc_info=True)
         return error_response(504, '分析がタイムアウトしました')
@@ -142,6 +433,319 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return error_response(500, '予期しないエラーが発生しました')
 
 
+def process_image(bucket: str, key: str, etag: str, context: Any) -> Dict[str, Any]:
+    """
+    1枚の画像を分析して結果を保存（重複イベントはリースでスキップ）
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        etag: S3オブジェクトのETag
+        context: Lambda実行コンテキスト
+    
+    Returns:
+        分析結果のJSON
+    
+    Raises:
+        LeaseInFlight: 他の実行が処理中の場合
+    """
+    lease_owner = None
+    if IDEMPOTENCY_ENABLED:
+        lease_owner = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+        lease_state = acquire_image_lease(key, etag, lease_owner)
+        if lease_state == LEASE_IN_FLIGHT:
+            raise LeaseInFlight(key)
+        if lease_state != LEASE_ACQUIRED:
+            return skipped_response(key, lease_state)
+    
+    try:
+        final_result = analyze_image(bucket, key, context, etag)
+        
+        # DynamoDBに結果を保存
+        store_result(key, final_result, etag, lease_owner)
+        
+    except BaseException:
+        # 失敗した場合はリースを解放し、再試行ですぐに処理できるようにする
+        if lease_owner is not None:
+            release_image_lease(key, lease_owner)
+        raise
+    
+    return completed_response(key, final_result)
+
+
+def skipped_response(key: str, lease_state: str) -> Dict[str, Any]:
+    """リースを取得できずに分析をスキップした場合のレスポンス"""
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': '処理済みのためスキップ' if lease_state == LEASE_COMPLETED else '処理中のためスキップ',
+            'imageKey': key
+        })
+    }
+
+
+def completed_response(key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """分析が完了した場合のレスポンス（品質チェックで除外した場合はその理由）"""
+    if result.get('rejection'):
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': '品質チェックで除外',
+                'imageKey': key,
+                'reason': result['rejection']['reason']
+            })
+        }
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': '分析完了',
+            'imageKey': key,
+            'equipmentCount': len(result['equipment'])
+        })
+    }
+
+
+def analyze_image(bucket: str, key: str, context: Any, etag: str = None) -> Dict[str, Any]:
+    """
+    画像を取得し、RekognitionとClaudeで分析
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        context: Lambda実行コンテキスト
+        etag: S3オブジェクトのETag（段階の出力の記録に使う）
+    
+    Returns:
+        マージされた最終結果
+    """
+    # 機能ごとの分析はhandlerの関数を使うため、ここで読み込む（循環importを避ける）
+    from session_analysis import extract_session_id
+    from incremental_analysis import make_panning_thumbnail, analyze_frame_incrementally, save_frame_state
+    from tiled_analysis import should_tile_image, analyze_image_tiled
+    from speculative_analysis import analyze_image_speculatively
+    
+    start_time = datetime.now()
+    # 機器台帳の単位（撮影セッション）
+    location_id = extract_session_id(key) if INVENTORY_ENABLED else None
+    # 差分分析の単位（撮影セッション）
+    panning_session_id = extract_session_id(key) if INCREMENTAL_MODE_ENABLED else None
+    # 前回の実行で完了した段階の出力（再試行では続きから分析）
+    checkpoint = get_stage_checkpoint(bucket, key, etag)
+    
+    # S3から画像を取得し、形式・向きを揃える
+    step_start = datetime.now()
+    ingested = load_image(bucket, key)
+    image_bytes = ingested['image_bytes']
+    # 変換した画像はS3上の画像と異なるため、Rekognitionには画像そのものを送る
+    send_bytes = ingested['converted']
+    logger.info(f"画像サイズ: {len(image_bytes)} bytes (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+    
+    # ぶれ・露出不良の画像は分析しない
+    rejected = check_image_quality(key, image_bytes)
+    if rejected:
+        return rejected
+    
+    # 連続撮影: 前の写真と重なる部分の結果を引き継ぎ、新しく写った部分だけを分析
+    thumbnail = make_panning_thumbnail(image_bytes) if panning_session_id else None
+    final_result = None
+    if thumbnail is not None:
+        step_start = datetime.now()
+        final_result = analyze_frame_incrementally(bucket, panning_session_id, key, image_bytes, thumbnail)
+        if final_result is not None:
+            logger.info(f"差分分析完了: {len(final_result['equipment'])}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+    
+    if final_result is None and should_tile_image(image_bytes):
+        # 高解像度画像: タイル分割して並列分析
+        step_start = datetime.now()
+        final_result = analyze_image_tiled(bucket, key, image_bytes, send_bytes)
+        logger.info(f"タイル分析完了: {len(final_result['equipment'])}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+    elif final_result is None and SPECULATIVE_IDENTIFICATION_ENABLED:
+        # RekognitionとClaudeを並行して実行し、座標で照合
+        step_start = datetime.now()
+        final_result = analyze_image_speculatively(bucket, key, image_bytes, checkpoint, send_bytes)
+        if 'rejection' in final_result:
+            return final_result
+        logger.info(f"先読みの識別完了: {len(final_result['equipment'])}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+    elif final_result is None:
+        # Rekognitionで物体検出（印字による識別が有効な場合は文字検出を並行して実行）
+        step_start = datetime.now()
+        text_detections = []
+        if OCR_FAST_PATH_ENABLED:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                text_future = executor.submit(
+                    detect_text_with_rekognition, bucket, key, image_bytes if send_bytes else None
+                )
+                rekognition_result = detect_objects_with_checkpoint(bucket, key, image_bytes, checkpoint, send_bytes)
+                text_detections = wait_for_text_detections(text_future)
+        else:
+            rekognition_result = detect_objects_with_checkpoint(bucket, key, image_bytes, checkpoint, send_bytes)
+        logger.info(f"Rekognition検出: {len(rekognition_result)}個の物体, {len(text_detections)}行の文字 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+        
+        # 物体が1つも無い画像はClaudeを呼ばずに除外（QUALITY_REJECT_EMPTYが有効な場合）
+        reason = evaluate_detections(rekognition_result) if QUALITY_GATE_ENABLED else None
+        if reason:
+            return reject_image(key, reason)
+        
+        # 台帳の既知の機器と照合（一致した物体はClaudeに送らない）
+        resolved = {}
+        if location_id:
+            step_start = datetime.now()
+            resolved = resolve_from_inventory(location_id, image_bytes, rekognition_result)
+            logger.info(f"台帳照合: {len(resolved)}/{len(rekognition_result)}個を識別済み (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+        
+        # 前面パネルの印字をカタログの型番と照合（台帳で識別できなかった物体のみ）
+        if text_detections:
+            panel_resolved = resolve_from_panel_text(text_detections, rekognition_result)
+            for index, equipment in panel_resolved.items():
+                resolved.setdefault(index, equipment)
+            logger.info(f"印字照合: {len(panel_resolved)}/{len(rekognition_result)}個を識別")
+        
+        # Claudeに送る画像をBase64エンコード（関心領域の切り出しが有効な場合は物体の範囲だけ）
+        step_start = datetime.now()
+        image_base64, roi, claude_checkpoint = encode_identification_image(image_bytes, rekognition_result, checkpoint)
+        logger.info(f"Base64エンコード完了 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+        
+        # Claudeで機器識別とリスク判定
+        step_start = datetime.now()
+        claude_result = identify_equipment(image_base64, rekognition_result, resolved, claude_checkpoint)
+        if roi:
+            # Claude追加検出分の座標を切り出し画像から画像全体に戻す
+            claude_result = dict(claude_result, equipment=equipment_from_roi(claude_result.get('equipment', []), roi))
+        logger.info(f"Claude識別: {len(claude_result.get('equipment', []))}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+        
+        # 結果をマージ
+        step_start = datetime.now()
+        final_result = merge_results(rekognition_result, claude_result)
+        if resolved:
+            final_result['equipment'] = drop_duplicates_of_resolved(
+                final_result['equipment'], [rekognition_result[i]['bbox'] for i in resolved]
+            )
+        logger.info(f"結果マージ完了: {len(final_result['equipment'])}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+    
+    # エッジ吸着によるClaude検出分の位置補正
+    if ENABLE_EDGE_SNAPPING:
+        step_start = datetime.now()
+        final_result['equipment'], snap_report = snap_equipment_to_edges(image_bytes, final_result['equipment'])
+        logger.info(f"エッジ吸着完了: {len(snap_report)}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.3f}秒)")
+    
+    # 切り出し画像による位置調整（残り時間に余裕がある場合のみ）
+    if ENABLE_CROP_REFINEMENT and has_time_budget(context, REFINEMENT_MIN_REMAINING_MS):
+        step_start = datetime.now()
+        final_result['equipment'] = refine_positions_with_crops(image_bytes, final_result['equipment'])
+        logger.info(f"位置調整完了 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+    
+    # 機器台帳に統合
+    if location_id:
+        update_location_inventory(location_id, image_bytes, final_result['equipment'])
+    
+    # 次の写真の差分分析のため、この写真の縮小画像と結果を記録
+    if thumbnail is not None:
+        save_frame_state(bucket, panning_session_id, key, image_bytes, thumbnail, final_result['equipment'])
+    
+    total_time = (datetime.now() - start_time).total_seconds()
+    logger.info(f"分析完了: {len(final_result['equipment'])}個の機器を検出 (合計所要時間: {total_time:.2f}秒)")
+    
+    return final_result
+
+
+def check_image_quality(key: str, image_bytes: bytes) -> Dict[str, Any]:
+    """
+    縮小画像で鮮明さ・露出を確認（QUALITY_GATE_ENABLEDが有効な場合のみ）
+    
+    Args:
+        key: S3オブジェクトキー
+        image_bytes: 取り込み済みの画像のバイトデータ
+    
+    Returns:
+        除外した場合は分析結果（status=rejectedで保存される）、分析を続ける場合はNone
+    """
+    if not QUALITY_GATE_ENABLED:
+        return None
+    
+    step_start = datetime.now()
+    metrics = measure_image_quality(image_bytes)
+    reason = evaluate_quality(metrics)
+    logger.info(f"品質チェック: {json.dumps(metrics)} (所要時間: {(datetime.now() - step_start).total_seconds() * 1000:.1f}ミリ秒)")
+    if reason is None:
+        return None
+    return reject_image(key, reason, metrics)
+
+
+def reject_image(key: str, reason: str, metrics: Dict[str, float] = None) -> Dict[str, Any]:
+    """品質チェックで除外した画像の分析結果を作成し、理由をメトリクスに記録"""
+    logger.warning(f"品質チェックで除外: {key} ({reason})")
+    emit_metric('QualityRejected', 1, 'Count', {'Reason': reason})
+    return build_rejected_result(reason, metrics)
+
+
+def acquire_image_lease(key: str, etag: str, owner: str) -> str:
+    """
+    結果テーブルで画像の処理リースを取得
+    
+    Args:
+        key: S3オブジェクトキー
+        etag: S3オブジェクトのETag
+        owner: リースの所有者
+    
+    Returns:
+        LEASE_ACQUIRED / LEASE_COMPLETED / LEASE_IN_FLIGHT
+    """
+    table = get_dynamodb().Table(RESULTS_TABLE_NAME)
+    ttl = int((datetime.now() + timedelta(days=3)).timestamp())
+    return acquire_lease(table, key, etag, owner, LEASE_SECONDS, ttl)
+
+
+def release_image_lease(key: str, owner: str) -> None:
+    """
+    結果テーブルの処理リースを解放
+    
+    Args:
+        key: S3オブジェクトキー
+        owner: リースの所有者
+    """
+    release_lease(get_dynamodb().Table(RESULTS_TABLE_NAME), key, owner)
+
+
+def store_result(key: str, result: Dict[str, Any], etag: str, lease_owner: str) -> bool:
+    """
+    分析結果を保存し、保存できた場合だけ完了を通知
+    
+    Args:
+        key: S3オブジェクトキー
+        result: 分析結果
+        etag: S3オブジェクトのETag
+        lease_owner: リースの所有者
+    
+    Returns:
+        保存した場合True
+    """
+    saved = save_result_to_dynamodb(key, result, etag=etag, lease_owner=lease_owner)
+    # リースを引き継がれた場合は引き継いだ実行が通知する
+    if saved:
+        notify_completion(key, result)
+    return saved
+
+
+def notify_completion(key: str, result: Dict[str, Any]) -> None:
+    """
+    分析完了イベントを発行（通知の失敗は分析結果に影響させない）
+    
+    Args:
+        key: S3オブジェクトキー
+        result: 分析結果
+    """
+    current_notifier = get_notifier()
+    if current_notifier is None:
+        return
+    
+    try:
+        current_notifier.publish(build_completion_event(key, result))
+        logger.info(f"完了通知: {key}")
+    except Exception as e:
+        # クライアントはポーリングで結果を取得できるため、警告のみ
+        logger.warning(f"完了通知エラー: {key}: {e}")
+
+
 def extract_s3_info(event: Dict[str, Any]) -> tuple:
     """
     S3イベントからバケット名とキーを抽出
@@ -152,10 +756,220 @@ def extract_s3_info(event: Dict[str, Any]) -> tuple:
     Returns:
         (bucket, key)のタプル
     """
-    record = event['Records'][0]
-    bucket = record['s3']['bucket']['name']
-    key = record['s3']['object']['key']
-    return bucket, key
+    image = parse_s3_notification_record(event['Records'][0])
+    return image['bucket'], image['key']
+
+
+def extract_s3_etag(event: Dict[str, Any]) -> str:
+    """
+    S3イベントからオブジェクトのETagを抽出
+    
+    Args:
+        event: S3イベント通知
+    
+    Returns:
+        ETag（含まれない場合は空文字）
+    """
+    return parse_s3_notification_record(event['Records'][0])['etag']
+
+
+def parse_s3_notification_record(record: Dict[str, Any]) -> Dict[str, str]:
+    """
+    S3イベント通知のレコードから画像情報を抽出
+    
+    Args:
+        record: S3イベント通知のレコード
+    
+    Returns:
+        画像情報（bucket, key, etag）
+    """
+    s3_object = record['s3']['object']
+    return {
+        'bucket': record['s3']['bucket']['name'],
+        # S3イベント通知のキーはURLエンコードされている
+        'key': unquote_plus(s3_object['key']),
+        'etag': s3_object.get('eTag', '')
+    }
+
+
+def is_sqs_event(event: Dict[str, Any]) -> bool:
+    """SQSイベントかを判定"""
+    records = event.get('Records') or [{}]
+    return records[0].get('eventSource') == 'aws:sqs'
+
+
+def is_eventbridge_event(event: Dict[str, Any]) -> bool:
+    """S3のEventBridgeイベントかを判定"""
+    return event.get('source') == 'aws.s3' and 'detail' in event
+
+
+def parse_eventbridge_event(event: Dict[str, Any]) -> Dict[str, str]:
+    """
+    S3のEventBridgeイベント（Object Created）から画像情報を抽出
+    
+    Args:
+        event: EventBridgeイベント
+    
+    Returns:
+        画像情報（bucket, key, etag）
+    """
+    detail = event['detail']
+    return {
+        'bucket': detail['bucket']['name'],
+        # S3イベント通知と同じくURLエンコードされている
+        'key': unquote_plus(detail['object']['key']),
+        'etag': detail['object'].get('etag', '')
+    }
+
+
+def extract_images_from_sqs_record(record: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    SQSメッセージの本文（S3イベント通知 / EventBridgeイベント）から画像情報を抽出
+    
+    Args:
+        record: SQSイベントのレコード
+    
+    Returns:
+        画像情報のリスト（S3のテストイベントなどは空）
+        メッセージ属性priority / detectorがあれば各画像のpriority / detectorに設定
+    """
+    body = json.loads(record['body'])
+    
+    if is_eventbridge_event(body):
+        images = [parse_eventbridge_event(body)]
+    elif body.get('Event') == 's3:TestEvent':
+        logger.info("S3テストイベントを無視します")
+        return []
+    else:
+        images = [
+            parse_s3_notification_record(s3_record)
+            for s3_record in body.get('Records', [])
+            if 's3' in s3_record
+        ]
+    
+    # 一括再分析などはメッセージ属性でbatch優先度を指定する
+    priority = record.get('messageAttributes', {}).get('priority', {}).get('stringValue')
+    if priority in PRIORITIES:
+        for image in images:
+            image['priority'] = priority
+    
+    # 負荷試験などは物体検出のバックエンドを画像ごとに指定できる
+    detector = record.get('messageAttributes', {}).get('detector', {}).get('stringValue')
+    if detector in DETECTOR_BACKENDS:
+        for image in images:
+            image['detector'] = detector
+    return images
+
+
+def is_settled_failure(image: Dict[str, str], error: Exception) -> bool:
+    """
+    画像の分析エラーを記録し、再試行しても結果が変わらない失敗かを判定
+    
+    Args:
+        image: 画像情報
+        error: 分析中に発生した例外
+    
+    Returns:
+        再試行しない場合True（メッセージを成功として扱う）
+    """
+    if isinstance(error, ClientError):
+        if error.response['Error']['Code'] == 'NoSuchKey':
+            # 削除済みの画像は再試行しても成功しない
+            logger.warning(f"画像が見つかりません（再試行しません）: {image['key']}")
+            return True
+        logger.error(f"AWS APIエラー: {image['key']}: {error}", exc_info=error)
+    elif isinstance(error, UnsupportedImageFormat):
+        # 読み込めない形式の画像は再試行しても成功しない
+        logger.warning(f"画像を読み込めません（再試行しません）: {image['key']}: {error}")
+        return True
+    elif isinstance(error, RateLimitExceeded):
+        # 空きを待ちきれなかった画像は再キューに戻す
+        logger.warning(f"レート制限のため再試行します: {image['key']}: {error}")
+    elif isinstance(error, LeaseInFlight):
+        # リースを持つ実行が異常終了した場合に備え、可視性タイムアウト後に再確認する
+        logger.info(f"処理中のため後で再確認します: {image['key']}")
+    else:
+        logger.error(f"画像分析エラー: {image['key']}: {error}", exc_info=error)
+    return False
+
+
+def process_sqs_batch(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    SQSメッセージのバッチを分析し、失敗したメッセージだけを再試行対象として返す
+    
+    Args:
+        event: SQSイベント
+        context: Lambda実行コンテキスト
+    
+    Returns:
+        部分的なバッチ失敗のレスポンス（batchItemFailures）
+    """
+    from session_analysis import group_jobs_by_session, process_session
+    
+    logger.info(f"SQSバッチ受信: {len(event['Records'])}件")
+    
+    failed_message_ids = []
+    jobs = []
+    for record in event['Records']:
+        try:
+            for image in extract_images_from_sqs_record(record):
+                jobs.append((record['messageId'], image))
+        except Exception as e:
+            logger.error(f"SQSメッセージの解析エラー: {record.get('messageId')}: {e}")
+            failed_message_ids.append(record['messageId'])
+    
+    def run(job: tuple) -> tuple:
+        message_id, image = job
+        # このスレッドでのBedrock呼び出しの優先度
+        current_priority.set(image.get('priority', PRIORITY_INTERACTIVE))
+        current_detector_backend.set(image.get('detector'))
+        try:
+            process_image(image['bucket'], image['key'], image['etag'], context)
+            return message_id, True
+        except Exception as e:
+            return message_id, is_settled_failure(image, e)
+    
+    def run_group(group: List[tuple]) -> List[tuple]:
+        if len(group) == 1:
+            return [run(group[0])]
+        
+        current_priority.set(group[0][1].get('priority', PRIORITY_INTERACTIVE))
+        current_detector_backend.set(group[0][1].get('detector'))
+        try:
+            in_flight_keys = process_session([image for _, image in group], context)
+            # 他の実行が処理中の画像のメッセージは後で再確認する
+            return [(message_id, image['key'] not in in_flight_keys) for message_id, image in group]
+        except Exception as e:
+            # まとめて分析できなかった場合は1枚ずつ分析（保存済みの画像はリースでスキップされる）
+            logger.warning(f"セッション分析エラー、1枚ずつ分析します: {e}", exc_info=True)
+            return [run(job) for job in group]
+    
+    if ASYNC_PIPELINE_ENABLED and not SESSION_MODE_ENABLED:
+        # 1つのイベントループで全画像を分析（画像ごとのスレッドを使わない）
+        from async_pipeline import run_async_pipeline
+        outcomes = run_async_pipeline([image for _, image in jobs], context)
+        for (message_id, image), outcome in zip(jobs, outcomes):
+            if isinstance(outcome, BaseException) and not is_settled_failure(image, outcome):
+                if message_id not in failed_message_ids:
+                    failed_message_ids.append(message_id)
+        logger.info(f"SQSバッチ完了（非同期）: {len(jobs)}枚, 失敗メッセージ{len(failed_message_ids)}件")
+        return {
+            'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+        }
+    
+    groups = group_jobs_by_session(jobs) if SESSION_MODE_ENABLED else [[job] for job in jobs]
+    
+    # 同時に分析する画像数を制限（Bedrockへの負荷を制御）
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_MAX_CONCURRENCY)) as executor:
+        for outcomes in executor.map(run_group, groups):
+            for message_id, succeeded in outcomes:
+                if not succeeded and message_id not in failed_message_ids:
+                    failed_message_ids.append(message_id)
+    
+    logger.info(f"SQSバッチ完了: {len(jobs)}枚, 失敗メッセージ{len(failed_message_ids)}件")
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
 
 
 def get_image_from_s3(bucket: str, key: str) -> bytes:
@@ -178,6 +992,42 @@ def get_image_from_s3(bucket: str, key: str) -> bytes:
         raise
 
 
+# Bedrockの画像サイズ制限: 5MB
+BEDROCK_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+# 圧縮済み画像の段階のバージョン（encode_image_to_base64の圧縮の設定を変えたら上げる）
+DERIVATIVE_STAGE_VERSION = stage_version('encode_image_to_base64', 'jpeg', BEDROCK_MAX_IMAGE_BYTES, 1, INGESTION_VERSION)
+
+
+def load_image(bucket: str, key: str) -> Dict[str, Any]:
+    """
+    S3から画像を取得し、取り込み処理（形式の判定・EXIFの回転・必要な場合の変換）を行う
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+    
+    Returns:
+        ingest_imageの結果（image_bytes, media_type, converted, timing など）
+    """
+    ingested = ingest_image(get_image_from_s3(bucket, key))
+    record_ingestion(key, ingested)
+    return ingested
+
+
+def record_ingestion(key: str, ingested: Dict[str, Any]) -> None:
+    """取り込み処理の内容と処理ごとの所要時間をログ・メトリクスに記録"""
+    timing_ms = {step: round(seconds * 1000, 1) for step, seconds in ingested['timing'].items()}
+    logger.info(
+        f"画像の取り込み: {key} {ingested['source_media_type']} -> {ingested['media_type']} "
+        f"(向き: {ingested['orientation']}, 所要時間: {json.dumps(timing_ms)}ミリ秒)"
+    )
+    emit_metric(
+        'IngestionTime', round(sum(timing_ms.values()), 1), 'Milliseconds',
+        {'SourceFormat': ingested['source_media_type'], 'Converted': str(ingested['converted']).lower()}
+    )
+
+
 def encode_image_to_base64(image_bytes: bytes) -> str:
     """
     画像をBase64エンコード（必要に応じて圧縮）
@@ -188,8 +1038,7 @@ def encode_image_to_base64(image_bytes: bytes) -> str:
     Returns:
         Base64エンコードされた文字列
     """
-    # Bedrockの画像サイズ制限: 5MB
-    MAX_SIZE = 5 * 1024 * 1024  # 5MB
+    MAX_SIZE = BEDROCK_MAX_IMAGE_BYTES
     
     # 画像サイズが5MB以下ならそのままエンコード
     if len(image_bytes) <= MAX_SIZE:
@@ -255,44 +1104,205 @@ def encode_image_to_base64(image_bytes: bytes) -> str:
         return base64.b64encode(image_bytes).decode('utf-8')
 
 
-def detect_objects_with_rekognition(bucket: str, key: str) -> List[Dict[str, Any]]:
+def encode_image_with_checkpoint(image_bytes: bytes, checkpoint: StageCheckpoint) -> str:
+    """
+    画像をBase64エンコード（圧縮が必要な画像は前回の実行で圧縮した画像を再利用）
+    
+    Args:
+        image_bytes: 画像のバイトデータ
+        checkpoint: 段階の出力の記録（無効の場合はNone）
+    
+    Returns:
+        Base64エンコードされた文字列
+    """
+    # 圧縮が不要な画像はエンコードするだけなので記録しない
+    if checkpoint is None or len(image_bytes) <= BEDROCK_MAX_IMAGE_BYTES:
+        return encode_image_to_base64(image_bytes)
+    
+    cached = checkpoint.load(STAGE_DERIVATIVE, DERIVATIVE_STAGE_VERSION)
+    if cached is not None:
+        logger.info("前回圧縮した画像を再利用")
+        return base64.b64encode(cached).decode('utf-8')
+    
+    image_base64 = encode_image_to_base64(image_bytes)
+    checkpoint.save(STAGE_DERIVATIVE, DERIVATIVE_STAGE_VERSION, base64.b64decode(image_base64))
+    return image_base64
+
+
+def encode_identification_image(
+    image_bytes: bytes,
+    detected_objects: List[Dict[str, Any]],
+    checkpoint: StageCheckpoint = None
+) -> tuple:
+    """
+    Claudeに送る画像をエンコード（ROI_CROP_ENABLEDの場合は関心領域だけを切り出す）
+    
+    Args:
+        image_bytes: 画像のバイトデータ
+        detected_objects: 物体検出の結果
+        checkpoint: 段階の出力の記録
+    
+    Returns:
+        (Base64エンコードされた画像, 切り出した関心領域（切り出さない場合はNone）,
+         Claudeの応答の記録（切り出し画像の場合は全体の画像と区別する）)
+    """
+    roi = compute_roi(detected_objects) if ROI_CROP_ENABLED else None
+    if roi is None:
+        return encode_image_with_checkpoint(image_bytes, checkpoint), None, checkpoint
+    
+    try:
+        crop_bytes, roi = crop_to_roi(image_bytes, roi)
+    except Exception as e:
+        logger.error(f"関心領域の切り出しエラー: {e}")
+        return encode_image_with_checkpoint(image_bytes, checkpoint), None, checkpoint
+    
+    area = roi['width'] * roi['height'] / 100
+    logger.info(f"関心領域: {json.dumps(roi)} (面積: {area:.1f}%, {len(image_bytes)} -> {len(crop_bytes)} bytes)")
+    emit_metric('RoiArea', round(area, 1), 'Percent')
+    if checkpoint:
+        checkpoint = checkpoint.for_variant(f"roi-{stage_version(roi)}")
+    return encode_image_to_base64(crop_bytes), roi, checkpoint
+
+
+def detections_stage_version(backend: str) -> str:
+    """物体検出の段階のバージョン（バックエンドと検出のパラメータ）"""
+    if backend == DETECTOR_ONNX:
+        return stage_version(
+            backend, ONNX_MODEL_PATH, ONNX_INPUT_SIZE, ONNX_SCORE_THRESHOLD, ONNX_NMS_IOU, ONNX_MAX_DETECTIONS,
+            INGESTION_VERSION
+        )
+    return stage_version(backend, REKOGNITION_LABEL_PARAMS, INGESTION_VERSION)
+
+
+def detect_objects_with_checkpoint(
+    bucket: str,
+    key: str,
+    image_bytes: bytes,
+    checkpoint: StageCheckpoint,
+    send_bytes: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    物体検出を実行（前回の実行の検出結果があれば再利用）
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        image_bytes: 画像のバイトデータ
+        checkpoint: 段階の出力の記録（無効の場合はNone）
+        send_bytes: S3上の画像ではなくimage_bytesをRekognitionに送る
+    
+    Returns:
+        検出された物体のリスト（label, confidence, bbox）
+    """
+    if checkpoint is None:
+        return detect_objects(bucket, key, image_bytes, send_bytes)
+    
+    version = detections_stage_version(current_detector_backend.get() or DETECTOR_BACKEND)
+    cached = checkpoint.load_json(STAGE_DETECTIONS, version)
+    if cached is not None:
+        logger.info("前回の物体検出の結果を再利用")
+        return cached
+    
+    detected_objects = detect_objects(bucket, key, image_bytes, send_bytes)
+    checkpoint.save_json(STAGE_DETECTIONS, version, detected_objects)
+    return detected_objects
+
+
+def detect_objects(bucket: str, key: str, image_bytes: bytes, send_bytes: bool = False) -> List[Dict[str, Any]]:
+    """
+    選択されたバックエンドで物体検出を実行
+    
+    Args:
+        bucket: S3バケット名（タイルなどS3に無い画像はNone）
+        key: S3オブジェクトキー（同上）
+        image_bytes: 画像のバイトデータ
+        send_bytes: S3上の画像ではなくimage_bytesをRekognitionに送る（取り込みで変換した画像など）
+    
+    Returns:
+        検出された物体のリスト（label, confidence, bbox）
+    """
+    backend = current_detector_backend.get() or DETECTOR_BACKEND
+    if backend == DETECTOR_ONNX:
+        return get_local_detector().detect(image_bytes)
+    # RekognitionはS3上の画像を直接読めるため、画像を送るのはS3に無い場合だけ
+    return detect_objects_with_rekognition(bucket, key, image_bytes if key is None or send_bytes else None)
+
+
+# アプローチC: 検出感度を調整（MinConfidence=30, MaxLabels=50）
+REKOGNITION_LABEL_PARAMS = {
+    'MaxLabels': 50,
+    'MinConfidence': 30,
+    'Features': ['GENERAL_LABELS']
+}
+
+
+def parse_rekognition_labels(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    DetectLabelsの応答を物体リストに変換
+    
+    Args:
+        response: DetectLabelsの応答
+    
+    Returns:
+        検出された物体のリスト（バウンディングボックス付きのインスタンスのみ）
+    """
+    detected_objects = []
+    for label in response['Labels']:
+        # Instancesがある場合のみ（バウンディングボックス付き）
+        for instance in label.get('Instances', []):
+            bbox = instance['BoundingBox']
+            detected_objects.append({
+                'label': label['Name'],
+                'confidence': instance['Confidence'],
+                'bbox': {
+                    'x': bbox['Left'] * 100,      # パーセンテージに変換
+                    'y': bbox['Top'] * 100,
+                    'width': bbox['Width'] * 100,
+                    'height': bbox['Height'] * 100
+                }
+            })
+    return detected_objects
+
+
+def rekognition_image(bucket: str, key: str, image_bytes: bytes = None) -> Dict[str, Any]:
+    """
+    RekognitionのImageパラメータ（画像を送る場合はサイズ制限の5MB以下に圧縮）
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        image_bytes: 画像のバイトデータ（指定時はS3ではなくこちらを送信）
+    
+    Returns:
+        Imageパラメータ
+    """
+    if image_bytes is None:
+        return {'S3Object': {'Bucket': bucket, 'Name': key}}
+    if len(image_bytes) > BEDROCK_MAX_IMAGE_BYTES:
+        # 座標は画像サイズに対する割合のため、縮小しても変わらない
+        image_bytes = base64.b64decode(encode_image_to_base64(image_bytes))
+    return {'Bytes': image_bytes}
+
+
+def detect_objects_with_rekognition(bucket: str, key: str, image_bytes: bytes = None) -> List[Dict[str, Any]]:
     """
     AWS Rekognitionで物体検出を実行
     
     Args:
         bucket: S3バケット名
         key: S3オブジェクトキー
+        image_bytes: 画像のバイトデータ（指定時はS3ではなくこちらを送信、タイルなど）
     
     Returns:
         検出された物体のリスト（バウンディングボックス座標付き）
     """
     try:
         rekognition = get_rekognition_client()
-        
-        # アプローチC: 検出感度を調整（MinConfidence=30, MaxLabels=50）
         response = rekognition.detect_labels(
-            Image={'S3Object': {'Bucket': bucket, 'Name': key}},
-            MaxLabels=50,
-            MinConfidence=30,
-            Features=['GENERAL_LABELS']
+            Image=rekognition_image(bucket, key, image_bytes), **REKOGNITION_LABEL_PARAMS
         )
         
-        detected_objects = []
-        for label in response['Labels']:
-            # Instancesがある場合のみ（バウンディングボックス付き）
-            for instance in label.get('Instances', []):
-                bbox = instance['BoundingBox']
-                detected_objects.append({
-                    'label': label['Name'],
-                    'confidence': instance['Confidence'],
-                    'bbox': {
-                        'x': bbox['Left'] * 100,      # パーセンテージに変換
-                        'y': bbox['Top'] * 100,
-                        'width': bbox['Width'] * 100,
-                        'height': bbox['Height'] * 100
-                    }
-                })
-        
+        detected_objects = parse_rekognition_labels(response)
         logger.info(f"Rekognition検出: {len(detected_objects)}個の物体")
         return detected_objects
         
@@ -304,6 +1314,150 @@ def detect_objects_with_rekognition(bucket: str, key: str) -> List[Dict[str, Any
         raise
 
 
+def detect_text_with_rekognition(bucket: str, key: str, image_bytes: bytes = None) -> List[Dict[str, Any]]:
+    """
+    AWS Rekognitionで画像内の文字（行単位）を検出
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        image_bytes: 画像のバイトデータ（指定時はS3ではなくこちらを送信）
+    
+    Returns:
+        検出された文字列のリスト（text, confidence, bbox（パーセンテージ））
+    """
+    rekognition = get_rekognition_client()
+    response = rekognition.detect_text(Image=rekognition_image(bucket, key, image_bytes))
+    
+    text_detections = []
+    for detection in response.get('TextDetections', []):
+        if detection.get('Type') != 'LINE':
+            continue
+        bbox = detection['Geometry']['BoundingBox']
+        text_detections.append({
+            'text': detection['DetectedText'],
+            'confidence': detection['Confidence'],
+            'bbox': {
+                'x': bbox['Left'] * 100,
+                'y': bbox['Top'] * 100,
+                'width': bbox['Width'] * 100,
+                'height': bbox['Height'] * 100
+            }
+        })
+    return text_detections
+
+
+def wait_for_text_detections(text_future: Any) -> List[Dict[str, Any]]:
+    """
+    並行して実行した文字検出の結果を受け取る（失敗しても分析は続ける）
+    
+    Args:
+        text_future: detect_text_with_rekognitionのFuture
+    
+    Returns:
+        検出された文字列のリスト（失敗した場合は空）
+    """
+    try:
+        return text_future.result()
+    except Exception as e:
+        logger.error(f"Rekognition文字検出エラー: {e}")
+        return []
+
+
+def assign_text_to_objects(
+    text_detections: List[Dict[str, Any]],
+    detected_objects: List[Dict[str, Any]],
+    min_containment: float = None
+) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    検出された文字列を、その領域を含む物体に割り当てる（含む物体が複数ある場合は最も小さい物体）
+    
+    Args:
+        text_detections: 検出された文字列のリスト
+        detected_objects: Rekognitionで検出された物体リスト
+        min_containment: 文字列の領域が物体に含まれる割合の下限（省略時はOCR_MIN_CONTAINMENT）
+    
+    Returns:
+        物体インデックス -> 割り当てた文字列のリスト
+    """
+    min_containment = OCR_MIN_CONTAINMENT if min_containment is None else min_containment
+    assigned = {}
+    for text in text_detections:
+        text_area = text['bbox']['width'] * text['bbox']['height']
+        if text_area <= 0:
+            continue
+        
+        containing = [
+            index for index, obj in enumerate(detected_objects)
+            if bbox_intersection_area(text['bbox'], obj['bbox']) / text_area >= min_containment
+        ]
+        if containing:
+            owner = min(containing, key=lambda i: detected_objects[i]['bbox']['width'] * detected_objects[i]['bbox']['height'])
+            assigned.setdefault(owner, []).append(text)
+    return assigned
+
+
+def resolve_from_panel_text(
+    text_detections: List[Dict[str, Any]],
+    detected_objects: List[Dict[str, Any]]
+) -> Dict[int, Dict[str, Any]]:
+    """
+    物体の領域内の印字を機器カタログの機器名・型番と照合
+    
+    Args:
+        text_detections: 検出された文字列のリスト
+        detected_objects: Rekognitionで検出された物体リスト
+    
+    Returns:
+        印字で識別できた物体（物体インデックス -> 機器情報）
+    """
+    try:
+        confident = [text for text in text_detections if text['confidence'] >= OCR_MIN_CONFIDENCE]
+        if not confident or not detected_objects:
+            return {}
+        
+        catalog = get_device_catalog()
+        resolved = {}
+        for index, texts in assign_text_to_objects(confident, detected_objects).items():
+            # メーカー名と型番が別の行に印字されている場合もあるため、上から順に連結して照合
+            lines = sorted(texts, key=lambda text: (text['bbox']['y'], text['bbox']['x']))
+            entry = catalog.find_in_text(' '.join(text['text'] for text in lines))
+            if entry is not None:
+                resolved[index] = {
+                    'name': entry['name'],
+                    'risk_level': entry['risk_level'],
+                    'description': entry.get('description', ''),
+                    'manual_url': entry.get('manual_url')
+                }
+        return resolved
+        
+    except Exception as e:
+        # 印字による識別は補助的な仕組みのため、失敗してもClaudeで通常どおり識別する
+        logger.error(f"印字照合エラー: {e}")
+        return {}
+
+
+def has_time_budget(context: Any, min_remaining_ms: int) -> bool:
+    """
+    Lambdaの残り実行時間に余裕があるかを判定
+    
+    Args:
+        context: Lambda実行コンテキスト（Noneの場合は制限なし）
+        min_remaining_ms: 必要な残り時間（ミリ秒）
+    
+    Returns:
+        残り時間がmin_remaining_ms以上の場合True
+    """
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return True
+    
+    remaining_ms = context.get_remaining_time_in_millis()
+    if remaining_ms < min_remaining_ms:
+        logger.info(f"残り時間が不足しているためスキップ: {remaining_ms}ms < {min_remaining_ms}ms")
+        return False
+    return True
+
+
 def error_response(status_code: int, message: str) -> dict:
     """
     エラーレスポンスを生成
@@ -368,6 +1522,25 @@ def build_analysis_prompt() -> str:
 JSON形式のみを返し、他の説明文は含めないでください。"""
 
 
+def summarize_detected_objects(detected_objects: List[Dict[str, Any]]) -> str:
+    """
+    機器識別プロンプトに載せる検出物体の一覧
+    
+    Args:
+        detected_objects: Rekognitionで検出された物体リスト
+    
+    Returns:
+        物体ごとの行（物体が無い場合は、すべてを追加検出として返させる旨の1行）
+    """
+    if not detected_objects:
+        # 先読みの識別など、物体検出より先にClaudeを呼ぶ場合
+        return "- （なし。画像内の放送機器はすべて座標付きで追加検出してください）"
+    return "\n".join([
+        f"- 物体{i}: {obj['label']} (信頼度: {obj['confidence']:.1f}%)"
+        for i, obj in enumerate(detected_objects)
+    ])
+
+
 def build_equipment_identification_prompt(detected_objects: List[Dict[str, Any]]) -> str:
     """
     機器識別用のプロンプトを構築（ハイブリッド方式）
@@ -379,10 +1552,7 @@ def build_equipment_identification_prompt(detected_objects: List[Dict[str, Any]]
     Returns:
         プロンプト文字列
     """
-    objects_summary = "\n".join([
-        f"- 物体{i}: {obj['label']} (信頼度: {obj['confidence']:.1f}%)"
-        for i, obj in enumerate(detected_objects)
-    ])
+    objects_summary = summarize_detected_objects(detected_objects)
     
     return f"""あなたは放送設備の専門家です。
 
@@ -423,36 +1593,220 @@ def build_equipment_identification_prompt(detected_objects: List[Dict[str, Any]]
   ]
 }}
 
-**重要: nameとdescriptionの使い分け**
-- **name**: 具体的な製品名（例: "HHKB Professional HYBRIDキーボード", "Sony PVM-A250モニター"）
-  - メーカー名や型番を必ず含める
-  - 一般名詞（キーボード、モニターなど）も含めてOK
-- **description**: 機器の用途や特徴（例: "放送制御や編集に使用する入力機器", "業務用ディスプレイ"）
-  - 製品名は含めない
-  - 用途や特徴を簡潔に説明
+**重要: nameとdescriptionの使い分け**
+- **name**: 具体的な製品名（例: "HHKB Professional HYBRIDキーボード", "Sony PVM-A250モニター"）
+  - メーカー名や型番を必ず含める
+  - 一般名詞（キーボード、モニターなど）も含めてOK
+- **description**: 機器の用途や特徴（例: "放送制御や編集に使用する入力機器", "業務用ディスプレイ"）
+  - 製品名は含めない
+  - 用途や特徴を簡潔に説明
+
+リスクレベルの判定基準：
+- DANGER: 高電圧機器、触ると危険なもの、本番系スイッチャー
+- WARNING: 不明なケーブル、確認が必要なもの、識別できない機器
+- SAFE: 安全に触れるもの、電源オフのもの、低電圧機器
+- UNKNOWN: 機器を識別できない場合
+
+重要な注意事項（悲観的AI戦略）：
+1. **source="rekognition"**: 上記リストの物体が放送機器の場合のみ含める。放送機器でない物体（椅子、机、壁、床、人など）は除外
+2. **source="claude"**: 上記リストに含まれていない放送機器を追加検出。座標も含める
+3. 機器の種類が不明な場合は、推測せずに "UNKNOWN" を使用
+4. ケーブルの種類が判断できない場合は、"WARNING" を使用
+5. 少しでも不確実な場合は、安全側に倒して "WARNING" または "DANGER" を選択
+6. バウンディングボックスの座標は、画像の左上を(0,0)、右下を(100,100)とするパーセンテージで表現
+7. **manual_url（重要）**: 
+   - 実際に存在することが確実な公式マニュアルのURLのみを含めてください
+   - URLを推測したり、作り出したりしないでください
+   - 確実でない場合は、manual_urlフィールド自体を省略してください
+   - 例: HHKBの場合、https://happyhackingkb.com/manual/ は存在しないため含めない
+
+JSON形式のみを返し、他の説明文は含めないでください。"""
+
+
+def build_compact_equipment_identification_prompt(detected_objects: List[Dict[str, Any]]) -> str:
+    """
+    機器識別用のプロンプトを構築（compact形式）
+    出力トークンを減らすため、短縮キー・配列形式のbbox・リスクコードで返させる
+
+    Args:
+        detected_objects: Rekognitionで検出された物体リスト
+
+    Returns:
+        プロンプト文字列
+    """
+    objects_summary = summarize_detected_objects(detected_objects)
+
+    return f"""あなたは放送設備の専門家です。
+
+画像内に以下の物体が検出されました：
+{objects_summary}
+
+**タスク1**: 上記の物体から「放送機器」に該当するものを選別してください。
+**タスク2**: 上記のリストにない放送機器が画像内にあれば追加で検出してください。
+
+以下の短縮JSON形式で返してください（空白・改行なし）：
+
+{{"e":[{{"i":0,"n":"製品名","r":"W","d":"説明"}},{{"b":[10,20,30,40],"n":"製品名","r":"D","d":"説明","u":"URL"}}]}}
+
+キーの意味：
+- i: 上記リストの物体インデックス（タスク1の機器のみ）
+- b: [x, y, width, height]（タスク2の機器のみ、画像の左上を(0,0)、右下を(100,100)とするパーセンテージ）
+- n: 具体的な製品名（メーカー名・型番を含む、日本語）
+- r: リスクレベル（D=DANGER, W=WARNING, S=SAFE, U=UNKNOWN）
+- d: 機器の用途や特徴（50文字以内、日本語、製品名は含めない）
+- u: 公式マニュアルのURL（実在が確実な場合のみ。それ以外はキーごと省略）
+
+リスクレベルの判定基準：
+- D: 高電圧機器、触ると危険なもの、本番系スイッチャー
+- W: 不明なケーブル、確認が必要なもの、識別できない機器
+- S: 安全に触れるもの、電源オフのもの、低電圧機器
+- U: 機器を識別できない場合
+
+重要な注意事項（悲観的AI戦略）：
+1. 放送機器でない物体（椅子、机、壁、床、人など）は含めない
+2. 機器の種類が不明な場合は推測せずに U、ケーブルの種類が不明な場合は W
+3. 少しでも不確実な場合は、安全側に倒して W または D を選択
+4. URLを推測したり、作り出したりしない
+
+JSON形式のみを返し、他の説明文は含めないでください。"""
+
+
+def build_names_equipment_identification_prompt(detected_objects: List[Dict[str, Any]]) -> str:
+    """
+    機器識別用のプロンプトを構築（names形式）
+    説明・マニュアルURLは機器カタログで補うため、製品名とリスクレベルだけを返させる
+
+    Args:
+        detected_objects: Rekognitionで検出された物体リスト
+
+    Returns:
+        プロンプト文字列
+    """
+    objects_summary = summarize_detected_objects(detected_objects)
+
+    return f"""あなたは放送設備の専門家です。
+
+画像内に以下の物体が検出されました：
+{objects_summary}
+
+**タスク1**: 上記の物体から「放送機器」に該当するものを選別してください。
+**タスク2**: 上記のリストにない放送機器が画像内にあれば追加で検出してください。
+
+以下の短縮JSON形式で返してください（空白・改行なし）：
+
+{{"e":[{{"i":0,"n":"製品名","r":"W"}},{{"b":[10,20,30,40],"n":"製品名","r":"D"}}]}}
+
+キーの意味：
+- i: 上記リストの物体インデックス（タスク1の機器のみ）
+- b: [x, y, width, height]（タスク2の機器のみ、画像の左上を(0,0)、右下を(100,100)とするパーセンテージ）
+- n: 具体的な製品名（メーカー名・型番を含む。型番が読み取れる場合は必ず含める）
+- r: リスクレベル（D=DANGER, W=WARNING, S=SAFE, U=UNKNOWN）
 
 リスクレベルの判定基準：
-- DANGER: 高電圧機器、触ると危険なもの、本番系スイッチャー
-- WARNING: 不明なケーブル、確認が必要なもの、識別できない機器
-- SAFE: 安全に触れるもの、電源オフのもの、低電圧機器
-- UNKNOWN: 機器を識別できない場合
+- D: 高電圧機器、触ると危険なもの、本番系スイッチャー
+- W: 不明なケーブル、確認が必要なもの、識別できない機器
+- S: 安全に触れるもの、電源オフのもの、低電圧機器
+- U: 機器を識別できない場合
 
 重要な注意事項（悲観的AI戦略）：
-1. **source="rekognition"**: 上記リストの物体が放送機器の場合のみ含める。放送機器でない物体（椅子、机、壁、床、人など）は除外
-2. **source="claude"**: 上記リストに含まれていない放送機器を追加検出。座標も含める
-3. 機器の種類が不明な場合は、推測せずに "UNKNOWN" を使用
-4. ケーブルの種類が判断できない場合は、"WARNING" を使用
-5. 少しでも不確実な場合は、安全側に倒して "WARNING" または "DANGER" を選択
-6. バウンディングボックスの座標は、画像の左上を(0,0)、右下を(100,100)とするパーセンテージで表現
-7. **manual_url（重要）**: 
-   - 実際に存在することが確実な公式マニュアルのURLのみを含めてください
-   - URLを推測したり、作り出したりしないでください
-   - 確実でない場合は、manual_urlフィールド自体を省略してください
-   - 例: HHKBの場合、https://happyhackingkb.com/manual/ は存在しないため含めない
+1. 放送機器でない物体（椅子、机、壁、床、人など）は含めない
+2. 機器の種類が不明な場合は推測せずに U、ケーブルの種類が不明な場合は W
+3. 少しでも不確実な場合は、安全側に倒して W または D を選択
+4. 説明やURLは返さない
 
 JSON形式のみを返し、他の説明文は含めないでください。"""
 
 
+def build_identification_prompt(
+    detected_objects: List[Dict[str, Any]],
+    prompt_version: str
+) -> str:
+    """
+    プロンプトバージョンに応じて機器識別プロンプトを構築
+
+    Args:
+        detected_objects: Rekognitionで検出された物体リスト
+        prompt_version: プロンプトバージョン（verbose / compact / names）
+
+    Returns:
+        プロンプト文字列
+    """
+    if prompt_version == 'compact':
+        return build_compact_equipment_identification_prompt(detected_objects)
+    if prompt_version == 'names':
+        return build_names_equipment_identification_prompt(detected_objects)
+    return build_equipment_identification_prompt(detected_objects)
+
+
+def build_equipment_tool(prompt_version: str) -> Dict[str, Any]:
+    """
+    toolモード用に機器識別結果のスキーマをツールとして定義
+
+    Args:
+        prompt_version: プロンプトバージョン（verbose / compact / names）
+
+    Returns:
+        Bedrockのtools要素
+    """
+    percentage = {"type": "number", "minimum": 0, "maximum": 100}
+
+    if prompt_version in ('compact', 'names'):
+        item_schema = {
+            "type": "object",
+            "properties": {
+                "i": {"type": "integer", "minimum": 0},
+                "b": {"type": "array", "items": percentage, "minItems": 4, "maxItems": 4},
+                "n": {"type": "string"},
+                "r": {"type": "string", "enum": list(RISK_LEVEL_CODES.keys())},
+                "d": {"type": "string"},
+                "u": {"type": "string"}
+            },
+            "required": ["n", "r", "d"]
+        }
+        if prompt_version == 'names':
+            # 説明・URLは機器カタログで補う
+            del item_schema["properties"]["d"]
+            del item_schema["properties"]["u"]
+            item_schema["required"] = ["n", "r"]
+        list_key = "e"
+    else:
+        item_schema = {
+            "type": "object",
+            "properties": {
+                "source": {"type": "string", "enum": ["rekognition", "claude"]},
+                "object_index": {"type": "integer", "minimum": 0},
+                "name": {"type": "string"},
+                "bbox": {
+                    "type": "object",
+                    "properties": {
+                        "x": percentage,
+                        "y": percentage,
+                        "width": percentage,
+                        "height": percentage
+                    },
+                    "required": ["x", "y", "width", "height"]
+                },
+                "risk_level": {"type": "string", "enum": RISK_LEVELS},
+                "description": {"type": "string"},
+                "manual_url": {"type": "string"}
+            },
+            "required": ["source", "name", "risk_level", "description"]
+        }
+        list_key = "equipment"
+
+    return {
+        "name": EQUIPMENT_TOOL_NAME,
+        "description": "画像内で識別した放送機器を報告する",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                list_key: {"type": "array", "items": item_schema}
+            },
+            "required": [list_key]
+        }
+    }
+
+
 def analyze_with_bedrock(image_base64: str) -> Dict[str, Any]:
     """
     Bedrockで画像を分析（旧バージョン - 座標も含む）
@@ -479,7 +1833,7 @@ def analyze_with_bedrock(image_base64: str) -> Dict[str, Any]:
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": "image/jpeg",
+                                "media_type": base64_media_type(image_base64),
                                 "data": image_base64
                             }
                         },
@@ -493,13 +1847,7 @@ def analyze_with_bedrock(image_base64: str) -> Dict[str, Any]:
         }
         
         logger.info("Bedrock APIを呼び出し中...")
-        bedrock = get_bedrock_runtime()
-        response = bedrock.invoke_model(
-            modelId=BEDROCK_MODEL_ID,
-            body=json.dumps(body)
-        )
-        
-        response_body = json.loads(response['body'].read())
+        response_body = invoke_bedrock_model(body)
         logger.info(f"Bedrock応答: {json.dumps(response_body)}")
         
         # 応答を解析
@@ -513,62 +1861,313 @@ def analyze_with_bedrock(image_base64: str) -> Dict[str, Any]:
         raise
 
 
-def analyze_equipment_with_claude(
-    image_base64: str, 
+def identify_equipment(
+    image_base64: str,
+    detected_objects: List[Dict[str, Any]],
+    resolved: Dict[int, Dict[str, Any]],
+    checkpoint: StageCheckpoint = None
+) -> Dict[str, Any]:
+    """
+    識別済みの物体を除いてClaudeで機器識別し、元のobject_indexに戻して結合
+    
+    Args:
+        image_base64: Base64エンコードされた画像
+        detected_objects: Rekognitionで検出された物体リスト
+        resolved: 識別済みの物体（物体インデックス -> 機器情報）
+        checkpoint: 段階の出力の記録（Claudeの応答を記録・再利用する）
+    
+    Returns:
+        機器識別結果（analyze_equipment_with_claudeと同じ形式）
+    """
+    if not resolved:
+        return analyze_equipment_with_claude(image_base64, detected_objects, checkpoint=checkpoint)
+    
+    unresolved = [i for i in range(len(detected_objects)) if i not in resolved]
+    if not unresolved and SKIP_CLAUDE_WHEN_RESOLVED:
+        logger.info(f"全{len(resolved)}個の物体を識別済みのためClaude呼び出しをスキップ")
+        claude_equipment = []
+    else:
+        # 未識別の物体だけでプロンプトを短くする
+        claude_result = analyze_equipment_with_claude(
+            image_base64, [detected_objects[i] for i in unresolved], checkpoint=checkpoint
+        )
+        claude_equipment = remap_object_indices(claude_result.get('equipment', []), unresolved)
+    
+    resolved_equipment = [
+        dict(equipment, source='rekognition', object_index=index)
+        for index, equipment in sorted(resolved.items())
+    ]
+    return {'equipment': resolved_equipment + claude_equipment}
+
+
+def remap_object_indices(equipment_list: List[Dict[str, Any]], index_map: List[int]) -> List[Dict[str, Any]]:
+    """
+    部分リストで識別した機器のobject_indexを元の物体リストのインデックスに戻す
+    
+    Args:
+        equipment_list: 機器識別結果
+        index_map: 部分リストの位置 -> 元のインデックス
+    
+    Returns:
+        object_indexを戻した機器リスト（範囲外のものは除外）
+    """
+    remapped = []
+    for equipment in equipment_list:
+        if equipment.get('source', 'rekognition') != 'rekognition':
+            remapped.append(equipment)
+            continue
+        object_index = equipment.get('object_index')
+        if not isinstance(object_index, int) or not 0 <= object_index < len(index_map):
+            logger.warning(f"object_indexが範囲外: {object_index} (最大: {len(index_map) - 1})")
+            continue
+        remapped.append(dict(equipment, object_index=index_map[object_index]))
+    return remapped
+
+
+def drop_duplicates_of_resolved(
+    equipment_list: List[Dict[str, Any]],
+    resolved_bboxes: List[Dict[str, float]],
+    iou_threshold: float = 0.5,
+    containment_threshold: float = 0.8
+) -> List[Dict[str, Any]]:
+    """
+    プロンプトから除いた識別済みの機器をClaudeが追加検出した重複を除く
+    
+    Args:
+        equipment_list: マージ済みの機器リスト
+        resolved_bboxes: 識別済みの物体のバウンディングボックス
+        iou_threshold: 同一機器とみなすIoU
+        containment_threshold: 小さい方がこの割合以上含まれていれば同一とみなす
+    
+    Returns:
+        重複を除いた機器リスト
+    """
+    def duplicates_resolved(bbox: Dict[str, float]) -> bool:
+        for resolved_bbox in resolved_bboxes:
+            if bbox_iou(bbox, resolved_bbox) >= iou_threshold:
+                return True
+            smaller_area = min(bbox['width'] * bbox['height'], resolved_bbox['width'] * resolved_bbox['height'])
+            if smaller_area > 0 and bbox_intersection_area(bbox, resolved_bbox) / smaller_area >= containment_threshold:
+                return True
+        return False
+    
+    return [
+        equipment for equipment in equipment_list
+        if equipment['source'] != 'claude' or not duplicates_resolved(equipment['bbox'])
+    ]
+
+
+def resolve_from_inventory(
+    location_id: str,
+    image_bytes: bytes,
     detected_objects: List[Dict[str, Any]]
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Rekognition検出分の切り出し画像の指紋を台帳と照合
+    
+    Args:
+        location_id: 場所（撮影セッション）のID
+        image_bytes: 画像のバイトデータ
+        detected_objects: Rekognitionで検出された物体リスト
+    
+    Returns:
+        台帳で識別できた物体（物体インデックス -> 機器情報）
+    """
+    try:
+        devices, _ = get_inventory_store().load(location_id)
+        if not devices or not detected_objects:
+            return {}
+        
+        fingerprints = compute_fingerprints(image_bytes, [obj['bbox'] for obj in detected_objects])
+        resolved = {}
+        for index, fingerprint in enumerate(fingerprints):
+            device = find_matching_device(devices, fingerprint)
+            if device is not None:
+                resolved[index] = {
+                    'name': device['name'],
+                    'risk_level': device['risk_level'],
+                    'description': device.get('description', ''),
+                    'manual_url': device.get('manual_url')
+                }
+        return resolved
+        
+    except Exception as e:
+        # 台帳は補助的な仕組みのため、失敗してもClaudeで通常どおり識別する
+        logger.error(f"台帳照合エラー: {e}")
+        return {}
+
+
+def update_location_inventory(
+    location_id: str,
+    image_bytes: bytes,
+    equipment_list: List[Dict[str, Any]]
+) -> None:
+    """
+    分析結果を場所の機器台帳に統合
+    
+    Args:
+        location_id: 場所（撮影セッション）のID
+        image_bytes: 画像のバイトデータ
+        equipment_list: 最終的な機器リスト
+    """
+    if not location_id or not equipment_list:
+        return
+    
+    try:
+        fingerprints = compute_fingerprints(image_bytes, [equipment['bbox'] for equipment in equipment_list])
+        devices = get_inventory_store().update(location_id, equipment_list, fingerprints)
+        logger.info(f"台帳更新: {location_id} ({len(devices)}個の機器)")
+    except Exception as e:
+        logger.error(f"台帳更新エラー: {e}")
+
+
+def analyze_equipment_with_claude(
+    image_base64: str,
+    detected_objects: List[Dict[str, Any]],
+    prompt_version: str = None,
+    output_mode: str = None,
+    checkpoint: StageCheckpoint = None
 ) -> Dict[str, Any]:
     """
     Claudeで機器識別とリスク判定を実行（座標は使わない）
+
+    Args:
+        image_base64: Base64エンコードされた画像
+        detected_objects: Rekognitionで検出された物体リスト
+        prompt_version: プロンプトバージョン（省略時は環境変数PROMPT_VERSION）
+        output_mode: 出力モード（省略時は環境変数OUTPUT_MODE）
+        checkpoint: 段階の出力の記録（Claudeの応答を記録・再利用する）
+
+    Returns:
+        機器情報（名前、説明、リスクレベル、object_index）
+    """
+    prompt_version = prompt_version or PROMPT_VERSION
+    output_mode = output_mode or OUTPUT_MODE
+    response_body = invoke_equipment_identification(
+        image_base64, detected_objects, prompt_version, output_mode, checkpoint
+    )
+
+    return parse_equipment_identification_response(response_body, prompt_version, output_mode)
+
+
+def parse_equipment_identification_response(
+    response_body: Dict[str, Any],
+    prompt_version: str,
+    output_mode: str
+) -> Dict[str, Any]:
+    """
+    プロンプトバージョン・出力モードに応じてClaude機器識別の応答を解析し、機器カタログで補う
+
+    Args:
+        response_body: Claude API応答
+        prompt_version: プロンプトバージョン
+        output_mode: 出力モード
+
+    Returns:
+        検証済みの機器識別結果
+    """
+    if output_mode == 'tool':
+        result = parse_tool_equipment_response(response_body, prompt_version)
+    elif prompt_version in ('compact', 'names'):
+        result = parse_compact_equipment_response(response_body, prompt_version)
+    else:
+        result = parse_claude_equipment_response(response_body)
     
+    return enrich_with_catalog(result, prompt_version)
+
+
+def build_equipment_identification_body(
+    image_base64: str,
+    detected_objects: List[Dict[str, Any]],
+    prompt_version: str,
+    output_mode: str = 'text'
+) -> Dict[str, Any]:
+    """
+    Claude機器識別のリクエストボディを構築
+
     Args:
         image_base64: Base64エンコードされた画像
         detected_objects: Rekognitionで検出された物体リスト
+        prompt_version: プロンプトバージョン
+        output_mode: 出力モード（text / tool）
+
+    Returns:
+        Bedrockのリクエストボディ
+    """
+    # プロンプトの構築
+    prompt = build_identification_prompt(detected_objects, prompt_version)
+
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 2000,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": base64_media_type(image_base64),
+                            "data": image_base64
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ]
+            }
+        ]
+    }
     
+    # toolモード: スキーマをツールとして宣言し、tool_choiceで呼び出しを強制
+    if output_mode == 'tool':
+        body["tools"] = [build_equipment_tool(prompt_version)]
+        body["tool_choice"] = {"type": "tool", "name": EQUIPMENT_TOOL_NAME}
+    
+    return body
+
+
+def invoke_equipment_identification(
+    image_base64: str,
+    detected_objects: List[Dict[str, Any]],
+    prompt_version: str,
+    output_mode: str = 'text',
+    checkpoint: StageCheckpoint = None
+) -> Dict[str, Any]:
+    """
+    Claude機器識別APIを呼び出し、生の応答を返す
+
+    Args:
+        image_base64: Base64エンコードされた画像
+        detected_objects: Rekognitionで検出された物体リスト
+        prompt_version: プロンプトバージョン（verbose / compact）
+        output_mode: 出力モード（text / tool）
+        checkpoint: 段階の出力の記録（同じリクエストの応答があれば再利用）
+
     Returns:
-        機器情報（名前、説明、リスクレベル、object_index）
+        Claude API応答（usageを含む）
     """
     try:
-        # プロンプトの構築
-        prompt = build_equipment_identification_prompt(detected_objects)
+        body = build_equipment_identification_body(image_base64, detected_objects, prompt_version, output_mode)
         
-        # Bedrock APIコール
-        body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 2000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": image_base64
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ]
-                }
-            ]
-        }
+        version = identification_stage_version(body, BEDROCK_MODEL_ID) if checkpoint else None
+        if checkpoint:
+            cached = checkpoint.load_json(STAGE_IDENTIFICATION, version)
+            if cached is not None:
+                logger.info("前回のClaude応答を再利用")
+                return cached
         
         logger.info("Claude機器識別APIを呼び出し中...")
-        bedrock = get_bedrock_runtime()
-        response = bedrock.invoke_model(
-            modelId=BEDROCK_MODEL_ID,
-            body=json.dumps(body)
-        )
-        
-        response_body = json.loads(response['body'].read())
+        response_body = invoke_bedrock_model(body)
         logger.info(f"Claude応答: {json.dumps(response_body)}")
         
-        # 応答を解析
-        return parse_claude_equipment_response(response_body)
-        
+        if checkpoint:
+            checkpoint.save_json(STAGE_IDENTIFICATION, version, response_body)
+
+        return response_body
+
     except ClientError as e:
         logger.error(f"Claude APIエラー: {e}")
         raise
@@ -577,6 +2176,22 @@ def analyze_equipment_with_claude(
         raise
 
 
+def identification_stage_version(body: Dict[str, Any], model_id: str) -> str:
+    """
+    機器識別の段階のバージョン（モデルと、画像データを除いたリクエストボディ）
+    
+    画像データは圧縮済み画像の段階のバージョンで表す（画像そのものはETagで決まる）
+    """
+    messages = [
+        dict(message, content=[
+            {'type': 'image', 'derivative': DERIVATIVE_STAGE_VERSION} if block.get('type') == 'image' else block
+            for block in message['content']
+        ])
+        for message in body['messages']
+    ]
+    return stage_version(model_id, dict(body, messages=messages))
+
+
 def parse_bedrock_response(response: Dict[str, Any]) -> Dict[str, Any]:
     """
     Bedrock応答を解析してバリデーション（旧バージョン）
@@ -636,7 +2251,76 @@ def parse_bedrock_response(response: Dict[str, Any]) -> Dict[str, Any]:
             
             validated_equipment.append(equipment)
         
-        return {'equipment': validated_equipment}
+        return {'equipment': validated_equipment}
+        
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON解析エラー: {e}")
+        logger.error(f"応答内容: {content}")
+        return {'equipment': []}
+    except Exception as e:
+        logger.error(f"応答解析エラー: {e}")
+        return {'equipment': []}
+
+
+def parse_claude_equipment_response(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Claude機器識別応答を解析してバリデーション（ハイブリッド方式対応）
+    
+    Args:
+        response: Claude API応答
+    
+    Returns:
+        検証済みの機器識別結果
+    """
+    try:
+        # テキストコンテンツを取得
+        content = response['content'][0]['text']
+        logger.info(f"Claudeテキスト応答: {content}")
+        
+        # JSONをパース（マークダウンコードブロックを除去）
+        result = json.loads(extract_json_text(content))
+        
+        # スキーマ検証
+        if 'equipment' not in result:
+            logger.warning("equipment配列が見つかりません")
+            return {'equipment': []}
+        
+        return {'equipment': validate_equipment_items(result['equipment'])}
+        
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON解析エラー: {e}")
+        logger.error(f"応答内容: {content}")
+        return {'equipment': []}
+    except Exception as e:
+        logger.error(f"応答解析エラー: {e}")
+        return {'equipment': []}
+
+
+def parse_compact_equipment_response(response: Dict[str, Any], prompt_version: str = 'compact') -> Dict[str, Any]:
+    """
+    Claude機器識別応答（compact / names形式）を解析し、従来の形式に展開してバリデーション
+    
+    Args:
+        response: Claude API応答
+        prompt_version: プロンプトバージョン（compact / names）
+    
+    Returns:
+        検証済みの機器識別結果（parse_claude_equipment_responseと同じ形式）
+    """
+    try:
+        # テキストコンテンツを取得
+        content = response['content'][0]['text']
+        logger.info(f"Claudeテキスト応答（compact）: {content}")
+        
+        # JSONをパース（マークダウンコードブロックを除去）
+        result = json.loads(extract_json_text(content))
+        
+        # スキーマ検証
+        if not isinstance(result, dict) or 'e' not in result:
+            logger.warning("e配列が見つかりません")
+            return {'equipment': []}
+        
+        return {'equipment': expand_compact_items(result['e'], prompt_version)}
         
     except json.JSONDecodeError as e:
         logger.error(f"JSON解析エラー: {e}")
@@ -647,119 +2331,270 @@ def parse_bedrock_response(response: Dict[str, Any]) -> Dict[str, Any]:
         return {'equipment': []}
 
 
-def parse_claude_equipment_response(response: Dict[str, Any]) -> Dict[str, Any]:
+def parse_tool_equipment_response(response: Dict[str, Any], prompt_version: str) -> Dict[str, Any]:
     """
-    Claude機器識別応答を解析してバリデーション（ハイブリッド方式対応）
+    Claude機器識別応答（toolモード）を解析してバリデーション
+    tool_useの入力を直接読むため、コードブロックの除去やJSONパースは不要
     
     Args:
         response: Claude API応答
+        prompt_version: プロンプトバージョン（verbose / compact / names）
     
     Returns:
         検証済みの機器識別結果
     """
     try:
-        # テキストコンテンツを取得
-        content = response['content'][0]['text']
-        logger.info(f"Claudeテキスト応答: {content}")
+        tool_input = find_tool_input(response, EQUIPMENT_TOOL_NAME)
+        if tool_input is None:
+            logger.error(f"tool_useブロックが見つかりません: stop_reason={response.get('stop_reason')}")
+            return {'equipment': []}
         
-        # JSONを抽出（マークダウンコードブロックを除去）
-        if '```json' in content:
-            content = content.split('```json')[1].split('```')[0].strip()
-        elif '```' in content:
-            content = content.split('```')[1].split('```')[0].strip()
+        logger.info(f"Claudeツール入力: {json.dumps(tool_input, ensure_ascii=False)}")
         
-        # JSONをパース
-        result = json.loads(content)
+        if prompt_version in ('compact', 'names'):
+            return {'equipment': expand_compact_items(tool_input.get('e', []), prompt_version)}
         
-        # スキーマ検証
-        if 'equipment' not in result:
-            logger.warning("equipment配列が見つかりません")
-            return {'equipment': []}
+        return {'equipment': validate_equipment_items(tool_input.get('equipment', []))}
         
-        validated_equipment = []
-        for equipment in result['equipment']:
-            source = equipment.get('source', 'rekognition')  # デフォルトはrekognition
+    except Exception as e:
+        logger.error(f"応答解析エラー: {e}")
+        return {'equipment': []}
+
+
+def find_tool_input(response: Dict[str, Any], tool_name: str) -> Dict[str, Any]:
+    """
+    Claude応答から指定ツールのtool_use入力を取得
+    
+    Args:
+        response: Claude API応答
+        tool_name: ツール名
+    
+    Returns:
+        ツール入力（見つからない場合はNone）
+    """
+    for block in response.get('content', []):
+        if block.get('type') == 'tool_use' and block.get('name') == tool_name:
+            tool_input = block.get('input')
+            if isinstance(tool_input, dict):
+                return tool_input
+    return None
+
+
+def extract_json_text(content: str) -> str:
+    """
+    テキスト応答からJSON部分を抽出（マークダウンコードブロックを除去）
+    
+    Args:
+        content: Claudeのテキスト応答
+    
+    Returns:
+        JSON文字列
+    """
+    if '```json' in content:
+        return content.split('```json')[1].split('```')[0].strip()
+    elif '```' in content:
+        return content.split('```')[1].split('```')[0].strip()
+    return content
+
+
+def expand_compact_equipment(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    compact形式の機器を従来の形式に展開
+    
+    Args:
+        item: compact形式の機器（i/b, n, r, d, u）
+    
+    Returns:
+        従来形式の機器（展開できない場合はNone）
+    """
+    if not isinstance(item, dict):
+        logger.warning(f"compact機器の形式が不正: {item}")
+        return None
+    
+    equipment = {}
+    if 'i' in item:
+        equipment['source'] = 'rekognition'
+        equipment['object_index'] = item['i']
+    elif 'b' in item:
+        bbox = item['b']
+        if not isinstance(bbox, list) or len(bbox) != 4:
+            logger.warning(f"compact bboxが不正: {bbox}")
+            return None
+        equipment['source'] = 'claude'
+        equipment['bbox'] = dict(zip(['x', 'y', 'width', 'height'], bbox))
+    else:
+        logger.warning(f"iとbの両方が不足: {item}")
+        return None
+    
+    if 'n' in item:
+        equipment['name'] = item['n']
+    if 'r' in item:
+        # 未知のコードはそのまま残し、バリデーションでUNKNOWNに修正
+        equipment['risk_level'] = RISK_LEVEL_CODES.get(item['r'], item['r'])
+    if 'd' in item:
+        equipment['description'] = item['d']
+    if item.get('u'):
+        equipment['manual_url'] = item['u']
+    
+    return equipment
+
+
+def expand_compact_items(items: List[Dict[str, Any]], prompt_version: str = 'compact') -> List[Dict[str, Any]]:
+    """
+    compact / names形式の機器リストを展開してバリデーション
+    
+    Args:
+        items: compact形式の機器のリスト
+        prompt_version: プロンプトバージョン（compact / names）
+    
+    Returns:
+        検証済みの機器リスト
+    """
+    expanded = []
+    for item in items:
+        equipment = expand_compact_equipment(item)
+        if equipment is None:
+            continue
+        if prompt_version == 'names':
+            # names形式は説明を返さないため、機器カタログで補うまで空にしておく
+            equipment.setdefault('description', '')
+        expanded.append(equipment)
+    return validate_equipment_items(expanded)
+
+
+def validate_equipment_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    機器識別結果の各機器をバリデーション（ハイブリッド方式対応）
+    
+    Args:
+        items: 機器のリスト
+    
+    Returns:
+        検証済みの機器リスト
+    """
+    validated_equipment = []
+    for equipment in items:
+        source = equipment.get('source', 'rekognition')  # デフォルトはrekognition
+        
+        if source == 'rekognition':
+            # Rekognition検出分: object_indexが必須
+            if not all(key in equipment for key in ['object_index', 'name', 'risk_level', 'description']):
+                logger.warning(f"必須フィールドが不足（rekognition）: {equipment}")
+                continue
             
-            if source == 'rekognition':
-                # Rekognition検出分: object_indexが必須
-                if not all(key in equipment for key in ['object_index', 'name', 'risk_level', 'description']):
-                    logger.warning(f"必須フィールドが不足（rekognition）: {equipment}")
-                    continue
-                
-                # object_indexの検証
-                if not isinstance(equipment['object_index'], int) or equipment['object_index'] < 0:
-                    logger.warning(f"不正なobject_index: {equipment['object_index']}")
-                    continue
-                
-            elif source == 'claude':
-                # Claude追加検出分: bboxが必須
-                if not all(key in equipment for key in ['name', 'bbox', 'risk_level', 'description']):
-                    logger.warning(f"必須フィールドが不足（claude）: {equipment}")
-                    continue
-                
-                # バウンディングボックスの検証
-                bbox = equipment['bbox']
-                if not all(key in bbox for key in ['x', 'y', 'width', 'height']):
-                    logger.warning(f"バウンディングボックスが不正: {bbox}")
-                    continue
-                
-                # 座標範囲の検証（0-100）
-                if not all(0 <= bbox[key] <= 100 for key in ['x', 'y', 'width', 'height']):
-                    logger.warning(f"座標が範囲外: {bbox}")
-                    continue
-            else:
-                logger.warning(f"不正なsource: {source}")
+            # object_indexの検証
+            if not isinstance(equipment['object_index'], int) or equipment['object_index'] < 0:
+                logger.warning(f"不正なobject_index: {equipment['object_index']}")
                 continue
             
-            # リスクレベルの検証
-            if equipment['risk_level'] not in ['SAFE', 'WARNING', 'DANGER', 'UNKNOWN']:
-                logger.warning(f"不正なリスクレベル: {equipment['risk_level']}")
-                equipment['risk_level'] = 'UNKNOWN'
+        elif source == 'claude':
+            # Claude追加検出分: bboxが必須
+            if not all(key in equipment for key in ['name', 'bbox', 'risk_level', 'description']):
+                logger.warning(f"必須フィールドが不足（claude）: {equipment}")
+                continue
             
-            # 説明の長さ検証（100文字以内）
-            if len(equipment['description']) > 100:
-                logger.warning(f"説明が長すぎます: {len(equipment['description'])}文字")
-                equipment['description'] = equipment['description'][:97] + '...'
+            # バウンディングボックスの検証
+            bbox = equipment['bbox']
+            if not all(key in bbox for key in ['x', 'y', 'width', 'height']):
+                logger.warning(f"バウンディングボックスが不正: {bbox}")
+                continue
             
-            validated_equipment.append(equipment)
+            # 座標範囲の検証（0-100）
+            if not all(0 <= bbox[key] <= 100 for key in ['x', 'y', 'width', 'height']):
+                logger.warning(f"座標が範囲外: {bbox}")
+                continue
+        else:
+            logger.warning(f"不正なsource: {source}")
+            continue
         
-        return {'equipment': validated_equipment}
+        # リスクレベルの検証
+        if equipment['risk_level'] not in RISK_LEVELS:
+            logger.warning(f"不正なリスクレベル: {equipment['risk_level']}")
+            equipment['risk_level'] = 'UNKNOWN'
         
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON解析エラー: {e}")
-        logger.error(f"応答内容: {content}")
-        return {'equipment': []}
-    except Exception as e:
-        logger.error(f"応答解析エラー: {e}")
-        return {'equipment': []}
+        # 説明の長さ検証（100文字以内）
+        if len(equipment['description']) > 100:
+            logger.warning(f"説明が長すぎます: {len(equipment['description'])}文字")
+            equipment['description'] = equipment['description'][:97] + '...'
+        
+        validated_equipment.append(equipment)
+    
+    return validated_equipment
 
 
-def save_result_to_dynamodb(image_key: str, result: Dict[str, Any]) -> None:
+def build_result_item(image_key: str, result: Dict[str, Any], etag: str = None) -> Dict[str, Any]:
+    """
+    結果テーブルの項目を作成
+    
+    Args:
+        image_key: S3オブジェクトキー
+        result: 分析結果
+        etag: S3オブジェクトのETag
+    
+    Returns:
+        結果テーブルの項目
+    """
+    # TTLを設定（3日後）
+    ttl = int((datetime.now() + timedelta(days=3)).timestamp())
+    
+    # result（圧縮バイナリ）、schemaVersion、equipmentCount
+    item = {
+        'imageKey': image_key,
+        **encode_result(result),
+        'ttl': ttl,
+        'createdAt': int(datetime.now().timestamp()),
+        'status': 'completed'
+    }
+    if result.get('rejection'):
+        # 品質チェックで除外した画像（クライアントは理由に応じて撮り直しを促す）
+        item['status'] = 'rejected'
+        item['rejectionReason'] = result['rejection']['reason']
+    if etag is not None:
+        item['etag'] = etag
+    return item
+
+
+def save_result_to_dynamodb(
+    image_key: str,
+    result: Dict[str, Any],
+    etag: str = None,
+    lease_owner: str = None
+) -> bool:
     """
     分析結果をDynamoDBに保存
     
     Args:
         image_key: S3オブジェクトキー
         result: 分析結果
+        etag: S3オブジェクトのETag（重複イベントの判定に使用）
+        lease_owner: リースの所有者（指定時はリースを保持している場合のみ保存）
+    
+    Returns:
+        保存した場合True（リースが引き継がれて保存しなかった場合False）
     """
     try:
         db = get_dynamodb()
         table = db.Table(RESULTS_TABLE_NAME)
+        item = build_result_item(image_key, result, etag)
         
-        # TTLを設定（3日後）
-        ttl = int((datetime.now() + timedelta(days=3)).timestamp())
-        
-        item = {
-            'imageKey': image_key,
-            'result': json.dumps(result),
-            'ttl': ttl,
-            'createdAt': int(datetime.now().timestamp()),
-            'status': 'completed'
-        }
-        
-        table.put_item(Item=item)
+        if lease_owner is None:
+            table.put_item(Item=item)
+        else:
+            # リース期限切れで他の実行に引き継がれた場合は保存しない
+            table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(imageKey) OR leaseOwner = :owner',
+                ExpressionAttributeValues={':owner': lease_owner}
+            )
         logger.info(f"DynamoDBに保存完了: {image_key}")
+        return True
         
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.warning(f"リースが引き継がれたため保存をスキップ: {image_key}")
+            return False
+        logger.error(f"DynamoDB保存エラー: {e}")
+        raise
     except Exception as e:
         logger.error(f"DynamoDB保存エラー: {e}")
         raise
@@ -819,6 +2654,69 @@ def merge_results(
     return {'equipment': equipment_list}
 
 
+def region_bbox_to_global(
+    bbox: Dict[str, float],
+    region: tuple,
+    image_size: tuple
+) -> Dict[str, float]:
+    """
+    領域内のパーセンテージ座標を画像全体のパーセンテージ座標に変換
+    
+    Args:
+        bbox: 領域内のバウンディングボックス（パーセンテージ）
+        region: 領域 (left, top, right, bottom)（ピクセル）
+        image_size: 画像全体のサイズ (width, height)
+    
+    Returns:
+        画像全体に対するバウンディングボックス（パーセンテージ）
+    """
+    left, top, right, bottom = region
+    width, height = image_size
+    region_width = right - left
+    region_height = bottom - top
+    
+    return {
+        'x': (left + bbox['x'] / 100 * region_width) / width * 100,
+        'y': (top + bbox['y'] / 100 * region_height) / height * 100,
+        'width': bbox['width'] / 100 * region_width / width * 100,
+        'height': bbox['height'] / 100 * region_height / height * 100
+    }
+
+
+def bbox_iou(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """
+    2つのバウンディングボックスのIoUを計算
+    
+    Args:
+        a: バウンディングボックス（パーセンテージ）
+        b: バウンディングボックス（パーセンテージ）
+    
+    Returns:
+        IoU（0-1）
+    """
+    intersection = bbox_intersection_area(a, b)
+    union = a['width'] * a['height'] + b['width'] * b['height'] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def bbox_intersection_area(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """
+    2つのバウンディングボックスの共通部分の面積を計算
+    
+    Args:
+        a: バウンディングボックス（パーセンテージ）
+        b: バウンディングボックス（パーセンテージ）
+    
+    Returns:
+        共通部分の面積
+    """
+    overlap_width = min(a['x'] + a['width'], b['x'] + b['width']) - max(a['x'], b['x'])
+    overlap_height = min(a['y'] + a['height'], b['y'] + b['height']) - max(a['y'], b['y'])
+    if overlap_width <= 0 or overlap_height <= 0:
+        return 0.0
+    return overlap_width * overlap_height
+
+
 def draw_bounding_boxes(image_bytes: bytes, equipment_list: List[Dict[str, Any]]) -> bytes:
     """
     画像にバウンディングボックスを描画
@@ -831,8 +2729,13 @@ def draw_bounding_boxes(image_bytes: bytes, equipment_list: List[Dict[str, Any]]
         バウンディングボックスを描画した画像のバイトデータ
     """
     try:
-        # 画像を開く
+        from PIL import Image, ImageDraw
+        from io import BytesIO
+        
+        # 画像を開く（JPEGで保存するためRGBに変換）
         image = Image.open(BytesIO(image_bytes))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
         draw = ImageDraw.Draw(image)
         
         # 画像サイズ
@@ -950,7 +2853,7 @@ def refine_positions_with_claude(
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": "image/jpeg",
+                                "media_type": base64_media_type(annotated_image_base64),
                                 "data": annotated_image_base64
                             }
                         },
@@ -964,13 +2867,7 @@ def refine_positions_with_claude(
         }
         
         logger.info("Claude位置調整APIを呼び出し中...")
-        bedrock = get_bedrock_runtime()
-        response = bedrock.invoke_model(
-            modelId=BEDROCK_MODEL_ID,
-            body=json.dumps(body)
-        )
-        
-        response_body = json.loads(response['body'].read())
+        response_body = invoke_bedrock_model(body)
         logger.info(f"Claude位置調整応答: {json.dumps(response_body)}")
         
         # 応答を解析
@@ -1050,6 +2947,183 @@ def parse_position_refinement_response(response: Dict[str, Any]) -> Dict[str, An
         return {'adjustments': []}
 
 
+def select_refinement_targets(equipment_list: List[Dict[str, Any]]) -> List[int]:
+    """
+    位置調整の対象となる機器を選択（Claude検出分と低信頼度の機器）
+    
+    Args:
+        equipment_list: マージ済みの機器リスト
+    
+    Returns:
+        対象機器のインデックス（信頼度の低い順、最大REFINEMENT_MAX_CROPS個）
+    """
+    targets = [
+        i for i, equipment in enumerate(equipment_list)
+        if equipment.get('source') == 'claude' or equipment.get('confidence', 0) < REFINEMENT_MIN_CONFIDENCE
+    ]
+    targets.sort(key=lambda i: equipment_list[i].get('confidence', 0))
+    return targets[:REFINEMENT_MAX_CROPS]
+
+
+def compute_padded_region(bbox: Dict[str, float], image_size: tuple, padding: float) -> tuple:
+    """
+    バウンディングボックスの周囲に余白を付けた切り出し領域を計算
+    
+    Args:
+        bbox: バウンディングボックス（パーセンテージ）
+        image_size: 画像サイズ (width, height)
+        padding: 余白（ボックスサイズに対する割合）
+    
+    Returns:
+        切り出し領域 (left, top, right, bottom)（ピクセル）
+    """
+    width, height = image_size
+    x1 = bbox['x'] / 100 * width
+    y1 = bbox['y'] / 100 * height
+    x2 = (bbox['x'] + bbox['width']) / 100 * width
+    y2 = (bbox['y'] + bbox['height']) / 100 * height
+    pad_x = (x2 - x1) * padding
+    pad_y = (y2 - y1) * padding
+    
+    left = max(0, int(x1 - pad_x))
+    top = max(0, int(y1 - pad_y))
+    right = min(width, int(x2 + pad_x) + 1)
+    bottom = min(height, int(y2 + pad_y) + 1)
+    return left, top, max(right, left + 1), max(bottom, top + 1)
+
+
+def build_crop_refinement_prompt(names: List[str]) -> str:
+    """
+    切り出し画像による位置調整用のプロンプトを構築
+    
+    Args:
+        names: 各切り出し画像の機器名（画像の順番どおり）
+    
+    Returns:
+        プロンプト文字列
+    """
+    crops_summary = "\n".join([
+        f"- 切り出し#{i}: {name}"
+        for i, name in enumerate(names)
+    ])
+    
+    return f"""あなたは放送設備の専門家です。
+
+上記の画像は、写真から以下の機器の周辺を切り出したものです（画像の順番どおり）：
+{crops_summary}
+
+**タスク: 各切り出し画像の中で、機器の正確な位置を特定**
+
+以下のJSON形式で返してください：
+
+{{
+  "adjustments": [
+    {{
+      "equipment_index": 切り出し画像のインデックス（0から始まる整数）,
+      "needs_adjustment": true/false,
+      "new_bbox": {{
+        "x": X座標（切り出し画像内のパーセンテージ 0-100）,
+        "y": Y座標（切り出し画像内のパーセンテージ 0-100）,
+        "width": 幅（切り出し画像内のパーセンテージ 0-100）,
+        "height": 高さ（切り出し画像内のパーセンテージ 0-100）
+      }}
+    }}
+  ]
+}}
+
+重要な注意事項：
+1. 座標は各切り出し画像の左上を(0,0)、右下を(100,100)とするパーセンテージで表現
+2. 機器全体を囲むように指定してください
+3. 切り出し画像に該当する機器が見当たらない場合は needs_adjustment=false
+
+JSON形式のみを返し、他の説明文は含めないでください。"""
+
+
+def refine_positions_with_crops(
+    image_bytes: bytes,
+    equipment_list: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    対象機器の周辺だけを切り出し、1回のClaude呼び出しでまとめて位置調整
+    
+    Args:
+        image_bytes: 元画像のバイトデータ
+        equipment_list: マージ済みの機器リスト
+    
+    Returns:
+        位置調整後の機器リスト（失敗した場合は元のリスト）
+    """
+    targets = select_refinement_targets(equipment_list)
+    if not targets:
+        logger.info("位置調整の対象がありません")
+        return equipment_list
+    
+    try:
+        from PIL import Image
+        from io import BytesIO
+        
+        image = Image.open(BytesIO(image_bytes))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # 対象機器ごとに余白付きで切り出し
+        content = []
+        regions = []
+        for crop_index, equipment_index in enumerate(targets):
+            region = compute_padded_region(equipment_list[equipment_index]['bbox'], image.size, REFINEMENT_PADDING)
+            crop = image.crop(region)
+            crop.thumbnail((REFINEMENT_CROP_MAX_SIDE, REFINEMENT_CROP_MAX_SIDE))
+            output = BytesIO()
+            crop.save(output, format='JPEG', quality=85)
+            
+            content.append({"type": "text", "text": f"切り出し#{crop_index}"})
+            content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": "image/jpeg",
+                    "data": base64.b64encode(output.getvalue()).decode('utf-8')
+                }
+            })
+            regions.append(region)
+        
+        content.append({
+            "type": "text",
+            "text": build_crop_refinement_prompt([equipment_list[i]['name'] for i in targets])
+        })
+        
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 1000,
+            "messages": [{"role": "user", "content": content}]
+        }
+        
+        logger.info(f"Claude位置調整APIを呼び出し中（切り出し{len(targets)}枚）...")
+        response_body = invoke_bedrock_model(body)
+        adjustments = parse_position_refinement_response(response_body)
+        
+        # 切り出し画像内の座標を画像全体の座標に変換し、元のインデックスに戻す
+        global_adjustments = []
+        for adjustment in adjustments['adjustments']:
+            crop_index = adjustment['equipment_index']
+            if not isinstance(crop_index, int) or not 0 <= crop_index < len(targets):
+                logger.warning(f"不正な切り出しインデックス: {crop_index}")
+                continue
+            if adjustment['needs_adjustment']:
+                global_adjustments.append({
+                    'equipment_index': targets[crop_index],
+                    'needs_adjustment': True,
+                    'new_bbox': region_bbox_to_global(adjustment['new_bbox'], regions[crop_index], image.size)
+                })
+        
+        return apply_position_adjustments(equipment_list, {'adjustments': global_adjustments})
+        
+    except Exception as e:
+        # 位置調整は補助的な処理のため、失敗しても元の結果を返す
+        logger.error(f"切り出し位置調整エラー: {e}")
+        return equipment_list
+
+
 def apply_position_adjustments(
     equipment_list: List[Dict[str, Any]],
     adjustments: Dict[str, Any]
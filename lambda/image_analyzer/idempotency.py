@@ -0,0 +1,133 @@
+"""
+技術局長 - 重複イベントの排除
+
+S3イベント通知は少なくとも1回配信され、非同期呼び出しの失敗時はLambdaが再試行するため、
+同じ画像が複数回分析されることがある。結果テーブルにimageKey + ETag単位のリース（処理中の印）を
+条件付き書き込みで取得し、重複した呼び出しはRekognition・Claudeを呼ぶ前に終了させる。
+
+リースの状態:
+- 項目なし / ETagが異なる / リース期限切れ: 取得できる（期限切れは異常終了した実行の引き継ぎ）
+- status=processing かつ期限内: 処理中のためスキップ
+- status=processing 以外（completedなど）かつ同じETag: 処理済みのためスキップ
+"""
+
+import time
+import logging
+from typing import Any
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# acquire_leaseの結果
+LEASE_ACQUIRED = 'acquired'
+LEASE_COMPLETED = 'completed'
+LEASE_IN_FLIGHT = 'in_flight'
+
+
+class LeaseInFlight(Exception):
+    """
+    他の実行が処理中の画像（SQSではメッセージを失敗として返し、可視性タイムアウト後に再確認する）
+
+    リースを持つ実行が異常終了した場合でも、再配信時にはリースが期限切れになっているため
+    引き継いで分析できる。成功として扱うとメッセージが削除され、画像が分析されないまま残る。
+    """
+
+    def __init__(self, image_key: str):
+        super().__init__(f"処理中の画像です: {image_key}")
+        self.image_key = image_key
+
+
+def acquire_lease(
+    table: Any,
+    image_key: str,
+    etag: str,
+    owner: str,
+    lease_seconds: int,
+    ttl: int
+) -> str:
+    """
+    画像の処理リースを条件付き書き込みで取得
+
+    Args:
+        table: 結果テーブル（boto3のTableリソース）
+        image_key: S3オブジェクトキー
+        etag: S3オブジェクトのETag
+        owner: リースの所有者（Lambdaのリクエストidなど）
+        lease_seconds: リースの有効期間（秒）
+        ttl: 項目のTTL（UNIX秒）
+
+    Returns:
+        LEASE_ACQUIRED / LEASE_COMPLETED / LEASE_IN_FLIGHT
+    """
+    for _ in range(2):
+        now = int(time.time())
+
+        try:
+            table.put_item(
+                Item={
+                    'imageKey': image_key,
+                    'status': 'processing',
+                    'etag': etag,
+                    'leaseOwner': owner,
+                    'leaseExpiresAt': now + lease_seconds,
+                    'ttl': ttl,
+                    'createdAt': now
+                },
+                ConditionExpression=(
+                    'attribute_not_exists(imageKey)'
+                    ' OR (attribute_exists(etag) AND etag <> :etag)'
+                    ' OR (#status = :processing AND leaseExpiresAt < :now)'
+                ),
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':etag': etag,
+                    ':processing': 'processing',
+                    ':now': now
+                }
+            )
+            logger.info(f"リース取得: {image_key} (owner={owner})")
+            return LEASE_ACQUIRED
+
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        # 取得できなかった理由を確認
+        item = table.get_item(Key={'imageKey': image_key}, ConsistentRead=True).get('Item')
+        if item is None:
+            # 確認までの間にリースが解放された場合は取得をやり直す
+            continue
+        if item.get('status') == 'processing':
+            logger.info(f"処理中のためスキップ: {image_key} (owner={item.get('leaseOwner')})")
+            return LEASE_IN_FLIGHT
+
+        logger.info(f"処理済みのためスキップ: {image_key} (status={item.get('status')})")
+        return LEASE_COMPLETED
+
+    return LEASE_IN_FLIGHT
+
+
+def release_lease(table: Any, image_key: str, owner: str) -> None:
+    """
+    処理に失敗した場合にリースを解放（再試行ですぐに処理できるようにする）
+
+    Args:
+        table: 結果テーブル（boto3のTableリソース）
+        image_key: S3オブジェクトキー
+        owner: リースの所有者
+    """
+    try:
+        table.delete_item(
+            Key={'imageKey': image_key},
+            ConditionExpression='leaseOwner = :owner AND #status = :processing',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':owner': owner, ':processing': 'processing'}
+        )
+        logger.info(f"リース解放: {image_key} (owner={owner})")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            # 既に他の実行に引き継がれている
+            logger.warning(f"リースは既に引き継がれています: {image_key}")
+            return
+        logger.error(f"リース解放エラー: {e}")
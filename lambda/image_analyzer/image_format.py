@@ -0,0 +1,233 @@
+"""
+技術局長 - 画像の取り込み（形式の判定・EXIFの回転・必要な場合の変換）
+
+アップロードされる画像はJPEGとは限らない（iPhoneのHEIC、PNG、WebPなど）。
+先頭のバイト列から実際の形式を判定し、BedrockとRekognitionの両方が読める形式（JPEG・PNG）でなければJPEGに変換する。
+EXIFの回転情報は取り込み時に1回だけ画素に反映し、以降の段階（Rekognition・Claude・位置調整）が同じ向きの画像を見るようにする
+"""
+
+import os
+import time
+import base64
+import logging
+from typing import Dict, Any
+
+logger = logging.getLogger()
+
+# BedrockとRekognitionの両方が読める形式（これ以外はJPEGに変換）
+SUPPORTED_MEDIA_TYPES = ('image/jpeg', 'image/png')
+
+# 変換時のJPEG品質
+INGEST_JPEG_QUALITY = int(os.environ.get('INGEST_JPEG_QUALITY', '90'))
+# 写真のPNGをJPEGに変換する最小サイズと、変換後のサイズの割合の上限（十分小さくなる場合のみ変換）
+PNG_TRANSCODE_MIN_BYTES = int(os.environ.get('PNG_TRANSCODE_MIN_BYTES', str(1024 * 1024)))
+PNG_TRANSCODE_MAX_RATIO = float(os.environ.get('PNG_TRANSCODE_MAX_RATIO', '0.5'))
+
+# 取り込み処理のバージョン（段階の出力の記録のバージョンに含める、変換の方法を変えたら上げる）
+INGESTION_VERSION = 1
+
+# EXIFの向きのタグ
+EXIF_ORIENTATION_TAG = 0x0112
+
+# ISO BMFF（HEIF/AVIF）のブランド
+HEIF_BRANDS = (b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1')
+AVIF_BRANDS = (b'avif', b'avis')
+
+
+class UnsupportedImageFormat(ValueError):
+    """読み込めない画像形式（再試行しても成功しない）"""
+
+
+def sniff_media_type(data: bytes) -> str:
+    """
+    先頭のバイト列（マジックナンバー）から画像形式を判定
+
+    Args:
+        data: 画像のバイトデータ（先頭16バイト以上）
+
+    Returns:
+        MIMEタイプ（判定できない場合はNone）
+    """
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp':
+        brand = data[8:12]
+        if brand in HEIF_BRANDS:
+            return 'image/heic'
+        if brand in AVIF_BRANDS:
+            return 'image/avif'
+    if data.startswith((b'II*\x00', b'MM\x00*')):
+        return 'image/tiff'
+    if data.startswith(b'BM'):
+        return 'image/bmp'
+    return None
+
+
+def base64_media_type(image_base64: str, default: str = 'image/jpeg') -> str:
+    """
+    Base64エンコードされた画像の形式を判定（Bedrockのリクエストのmedia_typeに使う）
+
+    Args:
+        image_base64: Base64エンコードされた画像
+        default: 判定できない場合の形式
+
+    Returns:
+        MIMEタイプ
+    """
+    # 先頭32文字（24バイト）だけをデコードする
+    try:
+        head = base64.b64decode(image_base64[:32])
+    except ValueError:
+        return default
+    return sniff_media_type(head) or default
+
+
+def open_image(image_bytes: bytes, media_type: str) -> Any:
+    """
+    画像を開く（HEIF/AVIFはpillow-heifがある場合のみ）
+
+    Raises:
+        UnsupportedImageFormat: 読み込めない場合
+    """
+    from PIL import Image
+    from io import BytesIO
+
+    if media_type in ('image/heic', 'image/avif'):
+        try:
+            import pillow_heif
+            pillow_heif.register_heif_opener()
+        except ImportError:
+            # AVIFはPillow 11.3以降なら単体で読める
+            if media_type == 'image/heic':
+                raise UnsupportedImageFormat('HEIC画像の読み込みにはpillow-heifが必要です')
+
+    try:
+        return Image.open(BytesIO(image_bytes))
+    except Exception as e:
+        raise UnsupportedImageFormat(f"画像を読み込めません（{media_type or '不明な形式'}）: {e}")
+
+
+def encode_jpeg(image: Any) -> bytes:
+    """画像をJPEGにエンコード（透過・パレットはRGBに変換）"""
+    from io import BytesIO
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=INGEST_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def encode_png(image: Any) -> bytes:
+    """画像をPNGにエンコード"""
+    from io import BytesIO
+
+    output = BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def pillow_media_type(image: Any) -> str:
+    """Pillowが判定した形式のMIMEタイプ"""
+    from PIL import Image
+
+    return Image.MIME.get(image.format, 'application/octet-stream')
+
+
+def ingest_image(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    画像の形式を判定し、EXIFの回転を反映して、必要な場合だけ変換
+
+    - JPEG・PNGで回転が不要なら、デコードせずにそのまま返す
+    - EXIFの向きが指定されている場合は画素を回転し、元の形式で保存し直す
+    - それ以外の形式（HEIC・WebP・GIFなど）はJPEGに変換する
+    - 大きな写真のPNGは、JPEGにすると十分小さくなる場合だけJPEGに変換する
+
+    Args:
+        image_bytes: アップロードされた画像のバイトデータ
+
+    Returns:
+        image_bytes, media_type, source_media_type, orientation,
+        converted（S3上の画像と異なるか）, timing（処理ごとの秒数）
+
+    Raises:
+        UnsupportedImageFormat: 読み込めない形式の場合
+    """
+    from PIL import ImageOps
+
+    timing = {}
+    step_start = time.perf_counter()
+    source_media_type = sniff_media_type(image_bytes[:16])
+    timing['sniff'] = time.perf_counter() - step_start
+
+    # ヘッダーだけを読み、向きを確認（画素のデコードは必要な場合のみ）
+    step_start = time.perf_counter()
+    image = open_image(image_bytes, source_media_type)
+    try:
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        orientation = 1
+    timing['open'] = time.perf_counter() - step_start
+
+    if source_media_type is None:
+        # Pillowが読めたが判定できなかった形式
+        source_media_type = pillow_media_type(image)
+
+    supported = source_media_type in SUPPORTED_MEDIA_TYPES
+    png_candidate = (
+        source_media_type == 'image/png'
+        and len(image_bytes) >= PNG_TRANSCODE_MIN_BYTES
+        and 'A' not in image.getbands()
+        and image.mode != 'P'
+    )
+    if supported and orientation == 1 and not png_candidate:
+        return {
+            'image_bytes': image_bytes,
+            'media_type': source_media_type,
+            'source_media_type': source_media_type,
+            'orientation': orientation,
+            'converted': False,
+            'timing': timing
+        }
+
+    step_start = time.perf_counter()
+    image.load()
+    timing['decode'] = time.perf_counter() - step_start
+
+    if orientation != 1:
+        step_start = time.perf_counter()
+        image = ImageOps.exif_transpose(image)
+        timing['transpose'] = time.perf_counter() - step_start
+
+    step_start = time.perf_counter()
+    if source_media_type == 'image/png':
+        media_type, output = 'image/png', None
+        if png_candidate:
+            jpeg_bytes = encode_jpeg(image)
+            if len(jpeg_bytes) <= len(image_bytes) * PNG_TRANSCODE_MAX_RATIO:
+                media_type, output = 'image/jpeg', jpeg_bytes
+        if output is None:
+            output = encode_png(image) if orientation != 1 else image_bytes
+    else:
+        media_type, output = 'image/jpeg', encode_jpeg(image)
+    timing['encode'] = time.perf_counter() - step_start
+
+    logger.info(
+        f"画像の取り込み: {source_media_type} -> {media_type} (向き: {orientation}, "
+        f"{len(image_bytes)} -> {len(output)} bytes)"
+    )
+    return {
+        'image_bytes': output,
+        'media_type': media_type,
+        'source_media_type': source_media_type,
+        'orientation': orientation,
+        'converted': output is not image_bytes,
+        'timing': timing
+    }
+
@@ -0,0 +1,166 @@
+"""
+技術局長 - 連続撮影の差分分析の実行
+
+panningモジュールで前の写真からの移動量と分析し直す領域を求め、
+重なる部分の機器を引き継いで、新しく写った部分・変化した部分だけをタイル分析と同じ方法で分析する
+
+前の写真の状態は撮影セッションごとに保存先（既定は画像バケット）に置き、handler.analyze_imageから呼び出す
+"""
+
+import time
+import logging
+from typing import Dict, List, Any
+
+import handler
+from metrics import emit_metric
+from panning import (
+    MemoryFrameStateStore,
+    S3FrameStateStore,
+    frame_thumbnail,
+    estimate_shift,
+    analysis_region,
+    region_area,
+    reproject_equipment,
+    find_previous_frame,
+    encode_thumbnail,
+    PANNING_MIN_SIMILARITY,
+    PANNING_MIN_OVERLAP,
+    PANNING_MAX_REGION_AREA,
+    MIN_REGION_AREA
+)
+from tiled_analysis import analyze_tile, merge_overlapping_equipment
+
+logger = logging.getLogger()
+
+# 前の写真の状態の保存先（遅延初期化）
+frame_state_store = None
+
+
+def get_frame_state_store(bucket: str):
+    """撮影セッションの前の写真の状態の保存先を取得（遅延初期化、バケットが不明の場合はプロセス内）"""
+    global frame_state_store
+    if frame_state_store is None:
+        if bucket:
+            frame_state_store = S3FrameStateStore(handler.get_s3_client(), bucket)
+        else:
+            frame_state_store = MemoryFrameStateStore()
+    return frame_state_store
+
+
+def make_panning_thumbnail(image_bytes: bytes) -> Any:
+    """差分分析用の縮小画像を作成（NumPyが無い・画像を読めない場合はNone、通常どおり分析する）"""
+    try:
+        return frame_thumbnail(image_bytes)
+    except ImportError:
+        logger.warning("差分分析にはnumpyが必要です（通常どおり分析します）")
+    except Exception as e:
+        logger.warning(f"差分分析用の縮小画像を作成できません: {e}")
+    return None
+
+
+def analyze_frame_incrementally(
+    bucket: str,
+    session_id: str,
+    key: str,
+    image_bytes: bytes,
+    thumbnail: Any
+) -> Dict[str, Any]:
+    """
+    撮影セッションの前の写真からの移動量を推定し、重なる部分の機器を引き継いで、
+    新しく写った部分・変化した部分だけをRekognitionとClaudeで分析
+    
+    Args:
+        bucket: S3バケット名
+        session_id: 撮影セッションのID
+        key: S3オブジェクトキー
+        image_bytes: 取り込み済みの画像のバイトデータ
+        thumbnail: この写真の縮小画像
+    
+    Returns:
+        マージされた最終結果（前の写真が無い・重なりが少ない場合はNone、全体を分析する）
+    """
+    from PIL import Image
+    from io import BytesIO
+    
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        state = get_frame_state_store(bucket).load(session_id)
+        previous = find_previous_frame(state, key, image.size)
+        if previous is None:
+            return None
+        
+        shift = estimate_shift(previous, thumbnail)
+        region = analysis_region(shift)
+        area = region_area(region)
+        logger.info(
+            f"前の写真からの移動: {state['image_key']} dx={shift['dx']:.1f}% dy={shift['dy']:.1f}% "
+            f"(重なり: {shift['overlap']:.2f}, 相関: {shift['similarity']:.2f}, 分析する領域: {area:.2f})"
+        )
+        if shift['similarity'] < PANNING_MIN_SIMILARITY or shift['overlap'] < PANNING_MIN_OVERLAP:
+            emit_metric('IncrementalFallback', 1, 'Count', {'Reason': 'scene_changed'})
+            return None
+        if area > PANNING_MAX_REGION_AREA:
+            emit_metric('IncrementalFallback', 1, 'Count', {'Reason': 'large_region'})
+            return None
+    except Exception as e:
+        # 差分分析は補助的な仕組みのため、失敗した場合は全体を通常どおり分析する
+        logger.error(f"差分分析エラー: {e}")
+        return None
+    
+    carried = reproject_equipment(state.get('equipment', []), shift['dx'], shift['dy'])
+    detected = []
+    if area >= MIN_REGION_AREA:
+        # 領域に大部分が含まれる機器は分析し直す（境界をまたぐ機器は引き継ぎ、重複は統合する）
+        carried = [
+            equipment for equipment in carried
+            if handler.bbox_intersection_area(equipment['bbox'], region)
+            < 0.5 * equipment['bbox']['width'] * equipment['bbox']['height']
+        ]
+        image.load()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        pixel_region = (
+            int(region['x'] / 100 * image.width),
+            int(region['y'] / 100 * image.height),
+            int(round((region['x'] + region['width']) / 100 * image.width)),
+            int(round((region['y'] + region['height']) / 100 * image.height))
+        )
+        detected = analyze_tile(image, pixel_region)
+    
+    emit_metric('IncrementalRegionArea', round(area * 100, 1), 'Percent')
+    logger.info(f"差分分析: 引き継ぎ{len(carried)}個, 新規{len(detected)}個")
+    return {'equipment': merge_overlapping_equipment(carried + detected)}
+
+
+def save_frame_state(
+    bucket: str,
+    session_id: str,
+    key: str,
+    image_bytes: bytes,
+    thumbnail: Any,
+    equipment_list: List[Dict[str, Any]]
+) -> None:
+    """
+    次の写真の差分分析のため、写真の縮小画像と最終的な機器リストを記録
+    
+    Args:
+        bucket: S3バケット名
+        session_id: 撮影セッションのID
+        key: S3オブジェクトキー
+        image_bytes: 取り込み済みの画像のバイトデータ
+        thumbnail: 写真の縮小画像
+        equipment_list: 最終的な機器リスト
+    """
+    from PIL import Image
+    from io import BytesIO
+    
+    try:
+        get_frame_state_store(bucket).save(session_id, {
+            'image_key': key,
+            'thumbnail': encode_thumbnail(thumbnail),
+            'size': list(Image.open(BytesIO(image_bytes)).size),
+            'equipment': equipment_list,
+            'updatedAt': time.time()
+        })
+    except Exception as e:
+        logger.error(f"差分分析の状態の記録エラー: {e}")
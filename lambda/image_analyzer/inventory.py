@@ -0,0 +1,307 @@
+"""
+技術局長 - 撮影場所ごとの機器台帳
+
+同じスタジオを撮影するたびに同じ機器をClaudeで識別し直さないよう、
+撮影セッション（場所）ごとに分析済みの機器を重複なく記録する
+
+- 機器は正規化した名前 + 切り出し画像の視覚指紋（dHash）で区別する
+- 台帳の項目は正式名・リスクレベル・説明・マニュアルURLを持つ
+- 識別の前にRekognition検出分の指紋を台帳と照合し、一致した物体はClaudeに送らない
+"""
+
+import os
+import re
+import json
+import time
+import unicodedata
+import logging
+from typing import Dict, List, Any, Tuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# 同一機器とみなす指紋のハミング距離（64ビット中）
+INVENTORY_MAX_HAMMING = int(os.environ.get('INVENTORY_MAX_HAMMING', '6'))
+# 1機器あたりに保持する指紋の数（撮影角度の違いを吸収）
+INVENTORY_MAX_FINGERPRINTS = int(os.environ.get('INVENTORY_MAX_FINGERPRINTS', '8'))
+# 台帳の保持期間（日）
+INVENTORY_TTL_DAYS = int(os.environ.get('INVENTORY_TTL_DAYS', '30'))
+
+# dHashの一辺（hash_size x hash_sizeビット）
+HASH_SIZE = 8
+
+# 指紋を作る切り出し画像の最小コントラスト（無地の領域はどれも同じ指紋になるため除外）
+MIN_CROP_CONTRAST = 16
+
+
+def normalize_device_name(name: str) -> str:
+    """
+    機器名を照合用に正規化（全角・半角、大文字・小文字、空白・記号の違いを無視）
+
+    Args:
+        name: 機器名
+
+    Returns:
+        正規化した機器名
+    """
+    normalized = unicodedata.normalize('NFKC', name or '').lower()
+    return re.sub(r'[\s\-_/・,.()（）]+', '', normalized)
+
+
+def compute_fingerprints(image_bytes: bytes, bboxes: List[Dict[str, float]]) -> List[str]:
+    """
+    バウンディングボックスごとの切り出し画像の視覚指紋（dHash）を計算
+
+    Args:
+        image_bytes: 画像のバイトデータ
+        bboxes: バウンディングボックス（パーセンテージ）のリスト
+
+    Returns:
+        16桁の16進文字列のリスト（切り出せない・無地の場合はNone）
+    """
+    from PIL import Image
+    from io import BytesIO
+
+    if not bboxes:
+        return []
+
+    image = Image.open(BytesIO(image_bytes))
+    # 指紋は小さな画像で十分なため、JPEGはデコード時に縮小
+    image.draft('L', (1024, 1024))
+    image = image.convert('L')
+    width, height = image.size
+
+    fingerprints = []
+    for bbox in bboxes:
+        left = int(bbox['x'] / 100 * width)
+        top = int(bbox['y'] / 100 * height)
+        right = int((bbox['x'] + bbox['width']) / 100 * width)
+        bottom = int((bbox['y'] + bbox['height']) / 100 * height)
+        if right - left < 2 or bottom - top < 2:
+            fingerprints.append(None)
+            continue
+
+        crop = image.crop((left, top, right, bottom))
+        low, high = crop.getextrema()
+        if high - low < MIN_CROP_CONTRAST:
+            fingerprints.append(None)
+            continue
+
+        # 横方向に隣り合う画素の明暗を比較
+        pixels = crop.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).tobytes()
+        bits = 0
+        for row in range(HASH_SIZE):
+            for column in range(HASH_SIZE):
+                offset = row * (HASH_SIZE + 1) + column
+                bits = (bits << 1) | (1 if pixels[offset] > pixels[offset + 1] else 0)
+        fingerprints.append(f"{bits:016x}")
+
+    return fingerprints
+
+
+def hamming_distance(a: str, b: str) -> int:
+    """2つの指紋のハミング距離"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def find_matching_device(
+    devices: List[Dict[str, Any]],
+    fingerprint: str,
+    max_distance: int = None
+) -> Dict[str, Any]:
+    """
+    指紋が最も近い台帳の機器を探す
+
+    Args:
+        devices: 台帳の機器リスト
+        fingerprint: 切り出し画像の指紋
+        max_distance: 一致とみなす最大ハミング距離
+
+    Returns:
+        一致した機器（見つからない場合はNone）
+    """
+    max_distance = INVENTORY_MAX_HAMMING if max_distance is None else max_distance
+    if fingerprint is None:
+        return None
+
+    best, best_distance = None, max_distance + 1
+    for device in devices:
+        for known in device.get('fingerprints', []):
+            distance = hamming_distance(fingerprint, known)
+            if distance < best_distance:
+                best, best_distance = device, distance
+    return best
+
+
+def merge_into_inventory(
+    devices: List[Dict[str, Any]],
+    equipment_list: List[Dict[str, Any]],
+    fingerprints: List[str]
+) -> List[Dict[str, Any]]:
+    """
+    分析結果（merge_resultsの出力）を台帳に統合
+
+    同じ正規化名で指紋が近い機器は同一機器として指紋を追加し、
+    それ以外は新しい機器として登録する
+
+    Args:
+        devices: 現在の台帳の機器リスト
+        equipment_list: 分析結果の機器リスト
+        fingerprints: 機器ごとの指紋（compute_fingerprintsの結果）
+
+    Returns:
+        更新後の台帳の機器リスト
+    """
+    updated = [dict(device) for device in devices]
+    now = int(time.time())
+
+    for equipment, fingerprint in zip(equipment_list, fingerprints):
+        if fingerprint is None or equipment.get('risk_level') == 'UNKNOWN':
+            # 識別できなかった機器は台帳に載せない
+            continue
+
+        normalized = normalize_device_name(equipment['name'])
+        same_name = [device for device in updated if device['normalizedName'] == normalized]
+        device = find_matching_device(same_name, fingerprint)
+
+        if device is None:
+            updated.append({
+                'deviceId': f"{normalized}#{fingerprint}",
+                'normalizedName': normalized,
+                'name': equipment['name'],
+                'risk_level': equipment['risk_level'],
+                'description': equipment.get('description', ''),
+                'manual_url': equipment.get('manual_url'),
+                'fingerprints': [fingerprint],
+                'seenCount': 1,
+                'lastSeenAt': now
+            })
+            continue
+
+        if fingerprint not in device['fingerprints']:
+            # 新しい指紋を先頭に追加し、古いものから捨てる
+            device['fingerprints'] = ([fingerprint] + device['fingerprints'])[:INVENTORY_MAX_FINGERPRINTS]
+        device['seenCount'] = device.get('seenCount', 0) + 1
+        device['lastSeenAt'] = now
+        # リスクレベルは悲観的に、より危険な判定を残す
+        if risk_rank(equipment['risk_level']) > risk_rank(device['risk_level']):
+            device['risk_level'] = equipment['risk_level']
+        if not device.get('manual_url') and equipment.get('manual_url'):
+            device['manual_url'] = equipment['manual_url']
+
+    return updated
+
+
+def risk_rank(risk_level: str) -> int:
+    """リスクレベルの危険度の順位（大きいほど危険）"""
+    return {'SAFE': 0, 'UNKNOWN': 1, 'WARNING': 2, 'DANGER': 3}.get(risk_level, 1)
+
+
+class InventoryStore:
+    """台帳の保存先のインターフェース"""
+
+    def load(self, location_id: str) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        場所の台帳を読み込む
+
+        Args:
+            location_id: 場所（撮影セッション）のID
+
+        Returns:
+            (機器リスト, バージョン)（台帳が無い場合は([], 0)）
+        """
+        raise NotImplementedError
+
+    def save(self, location_id: str, devices: List[Dict[str, Any]], version: int) -> bool:
+        """
+        読み込んだバージョンから更新されていない場合だけ台帳を保存
+
+        Args:
+            location_id: 場所のID
+            devices: 機器リスト
+            version: loadで得たバージョン
+
+        Returns:
+            保存できた場合True（他の実行が先に更新していた場合False）
+        """
+        raise NotImplementedError
+
+    def update(
+        self,
+        location_id: str,
+        equipment_list: List[Dict[str, Any]],
+        fingerprints: List[str],
+        attempts: int = 3
+    ) -> List[Dict[str, Any]]:
+        """
+        分析結果を台帳に統合して保存（競合した場合は読み込みからやり直す）
+
+        Args:
+            location_id: 場所のID
+            equipment_list: 分析結果の機器リスト
+            fingerprints: 機器ごとの指紋
+            attempts: 競合時の最大試行回数
+
+        Returns:
+            更新後の機器リスト
+        """
+        for _ in range(attempts):
+            devices, version = self.load(location_id)
+            updated = merge_into_inventory(devices, equipment_list, fingerprints)
+            if self.save(location_id, updated, version):
+                return updated
+        logger.warning(f"台帳の更新が競合しました: {location_id}")
+        return updated
+
+
+class MemoryInventoryStore(InventoryStore):
+    """プロセス内の台帳（テスト・ローカル実行用）"""
+
+    def __init__(self):
+        self.items = {}
+
+    def load(self, location_id: str) -> Tuple[List[Dict[str, Any]], int]:
+        devices, version = self.items.get(location_id, ([], 0))
+        return [dict(device) for device in devices], version
+
+    def save(self, location_id: str, devices: List[Dict[str, Any]], version: int) -> bool:
+        if self.items.get(location_id, ([], 0))[1] != version:
+            return False
+        self.items[location_id] = (devices, version + 1)
+        return True
+
+
+class DynamoDBInventoryStore(InventoryStore):
+    """
+    DynamoDBの台帳（1場所1項目）
+
+    項目: locationId, devices（機器リストのJSON）, version, ttl
+    """
+
+    def __init__(self, table: Any):
+        self.table = table
+
+    def load(self, location_id: str) -> Tuple[List[Dict[str, Any]], int]:
+        item = self.table.get_item(Key={'locationId': location_id}, ConsistentRead=True).get('Item')
+        if item is None:
+            return [], 0
+        return json.loads(item['devices']), int(item['version'])
+
+    def save(self, location_id: str, devices: List[Dict[str, Any]], version: int) -> bool:
+        try:
+            self.table.put_item(
+                Item={
+                    'locationId': location_id,
+                    'devices': json.dumps(devices, ensure_ascii=False),
+                    'version': version + 1,
+                    'ttl': int(time.time()) + INVENTORY_TTL_DAYS * 86400
+                },
+                ConditionExpression='attribute_not_exists(locationId) OR version = :version',
+                ExpressionAttributeValues={':version': version}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
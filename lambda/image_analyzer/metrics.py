@@ -0,0 +1,66 @@
+"""
+技術局長 - カスタムメトリクス
+
+CloudWatch Embedded Metric Format（EMF）の構造化ログとしてメトリクスを出力する
+Lambdaの標準出力に書くだけでCloudWatchメトリクスになるため、PutMetricDataの呼び出しは不要
+"""
+
+import os
+import json
+import time
+from typing import Dict
+
+# メトリクスの名前空間
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'GijutsuKyokuchou/ImageAnalyzer')
+
+
+def build_metric_record(
+    name: str,
+    value: float,
+    unit: str = 'None',
+    dimensions: Dict[str, str] = None
+) -> Dict[str, object]:
+    """
+    1つのメトリクスのEMFレコードを作成
+
+    Args:
+        name: メトリクス名
+        value: 値
+        unit: 単位（Milliseconds, Count など）
+        dimensions: ディメンション
+
+    Returns:
+        EMFレコード
+    """
+    dimensions = dimensions or {}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [sorted(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit}]
+            }]
+        },
+        name: value
+    }
+    record.update(dimensions)
+    return record
+
+
+def emit_metric(
+    name: str,
+    value: float,
+    unit: str = 'None',
+    dimensions: Dict[str, str] = None
+) -> None:
+    """
+    メトリクスをEMF形式で標準出力に書き出す
+
+    Args:
+        name: メトリクス名
+        value: 値
+        unit: 単位
+        dimensions: ディメンション
+    """
+    print(json.dumps(build_metric_record(name, value, unit, dimensions), ensure_ascii=False), flush=True)
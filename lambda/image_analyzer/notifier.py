@@ -0,0 +1,159 @@
+"""
+技術局長 - 分析完了の通知
+
+結果テーブルへの保存が成功した時点で完了イベントを発行し、
+クライアントが固定間隔でDynamoDBをポーリングしなくても完了を知れるようにする
+
+バックエンド:
+- memory: プロセス内のリスト（テスト用、wait_forで完了を待てる）
+- file: JSON Linesファイルへの追記（ローカル実行用）
+- sns: SNSトピックへの発行（imageKey属性でサブスクリプションを絞り込める）
+- websocket: 完了を待っているWebSocket接続への送信（本番用、接続はevent_subscriptionsで登録）
+"""
+
+import json
+import time
+import threading
+import logging
+from typing import Dict, List, Any
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# 完了イベントの種類
+EVENT_ANALYSIS_COMPLETED = 'analysis.completed'
+
+
+def build_completion_event(image_key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    分析完了イベントを作成（結果本体は含めず、件数・除外の理由だけを載せる）
+
+    Args:
+        image_key: S3オブジェクトキー
+        result: 分析結果（equipment配列）
+
+    Returns:
+        完了イベント
+    """
+    event = {
+        'type': EVENT_ANALYSIS_COMPLETED,
+        'imageKey': image_key,
+        'status': 'completed',
+        'equipmentCount': len(result.get('equipment', [])),
+        'completedAt': int(time.time())
+    }
+    if result.get('rejection'):
+        # 品質チェックで除外した画像は理由を載せる
+        event['status'] = 'rejected'
+        event['reason'] = result['rejection']['reason']
+    return event
+
+
+class Notifier:
+    """完了イベントの発行先のインターフェース"""
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """
+        イベントを発行
+
+        Args:
+            event: build_completion_eventで作成したイベント
+        """
+        raise NotImplementedError
+
+
+class MemoryNotifier(Notifier):
+    """プロセス内のリストに記録（テスト用）"""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.condition = threading.Condition()
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def wait_for(self, image_key: str, timeout: float) -> Dict[str, Any]:
+        """
+        指定した画像のイベントが発行されるまで待つ
+
+        Args:
+            image_key: S3オブジェクトキー
+            timeout: 最大待ち時間（秒）
+
+        Returns:
+            イベント（タイムアウトした場合はNone）
+        """
+        def find() -> Dict[str, Any]:
+            return next((e for e in self.events if e['imageKey'] == image_key), None)
+
+        with self.condition:
+            self.condition.wait_for(lambda: find() is not None, timeout)
+            return find()
+
+
+class FileNotifier(Notifier):
+    """JSON Linesファイルに追記（ローカル実行用）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+class SnsNotifier(Notifier):
+    """SNSトピックに発行（本番用）"""
+
+    def __init__(self, sns_client: Any, topic_arn: str):
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        self.sns_client.publish(
+            TopicArn=self.topic_arn,
+            Message=json.dumps(event, ensure_ascii=False),
+            MessageAttributes={
+                # サブスクリプションのフィルターポリシーで画像ごとに絞り込めるようにする
+                'imageKey': {'DataType': 'String', 'StringValue': event['imageKey']},
+                'type': {'DataType': 'String', 'StringValue': event['type']}
+            }
+        )
+
+
+class WebSocketNotifier(Notifier):
+    """完了を待っているWebSocket接続に送信（本番用）"""
+
+    def __init__(self, subscriptions_table: Any, management_client: Any):
+        """
+        Args:
+            subscriptions_table: 接続の登録テーブル（imageKey + connectionId）
+            management_client: API Gateway Management APIクライアント（WebSocketステージのコールバックURL）
+        """
+        self.subscriptions_table = subscriptions_table
+        self.management_client = management_client
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        response = self.subscriptions_table.query(
+            KeyConditionExpression=Key('imageKey').eq(event['imageKey'])
+        )
+        data = json.dumps(event, ensure_ascii=False).encode('utf-8')
+        for subscription in response.get('Items', []):
+            connection_id = subscription['connectionId']
+            try:
+                self.management_client.post_to_connection(ConnectionId=connection_id, Data=data)
+            except ClientError as e:
+                # 切断済みの接続は登録を消すだけ（クライアントはポーリングで結果を取得できる）
+                if e.response['Error']['Code'] != 'GoneException':
+                    raise
+                logger.info(f"切断済みの接続: {connection_id}")
+            # 完了は1画像につき1回のため、送信した登録は消す
+            self.subscriptions_table.delete_item(
+                Key={'imageKey': event['imageKey'], 'connectionId': connection_id}
+            )
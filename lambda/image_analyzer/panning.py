@@ -0,0 +1,424 @@
+"""
+技術局長 - 連続撮影の差分分析
+
+撮影セッションでカメラを振りながら連続で撮影すると、隣り合う写真の大部分が重なる。
+前の写真からの移動量を縮小画像の位相限定相関（NumPy）で推定し、
+
+- 重なる部分の機器は前の写真の結果を移動して引き継ぐ
+- 新しく写った部分と、重なる部分のうち変化した部分だけを分析する
+
+ことで、1枚あたりのRekognition・Claudeの処理量を減らす
+NumPyは任意の依存（requirements-incremental.txt、CDKスタックが有効時にレイヤーとして追加する）
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import threading
+import logging
+from typing import Dict, List, Any
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# 移動量の推定に使う縮小画像の一辺（ピクセル、縦横比は無視して正方形に縮小する）
+PANNING_THUMB_SIZE = int(os.environ.get('PANNING_THUMB_SIZE', '128'))
+# 前の写真とみなす最大の経過時間（秒）
+PANNING_MAX_AGE_SECONDS = int(os.environ.get('PANNING_MAX_AGE_SECONDS', '60'))
+# 位置を合わせた重なり部分の相関係数がこれ未満なら、別の場面として全体を分析
+PANNING_MIN_SIMILARITY = float(os.environ.get('PANNING_MIN_SIMILARITY', '0.6'))
+# 前の写真との重なりの面積の割合がこれ未満なら全体を分析
+PANNING_MIN_OVERLAP = float(os.environ.get('PANNING_MIN_OVERLAP', '0.4'))
+# 分析し直す領域の面積の割合がこれを超えたら全体を分析
+PANNING_MAX_REGION_AREA = float(os.environ.get('PANNING_MAX_REGION_AREA', '0.6'))
+# 変化を調べる格子の分割数（一辺あたり）と、変化したとみなす輝度差（標準化した輝度の平均絶対差）
+PANNING_GRID = int(os.environ.get('PANNING_GRID', '8'))
+PANNING_CHANGE_LEVEL = float(os.environ.get('PANNING_CHANGE_LEVEL', '0.5'))
+# これより細い新しい帯は分析しない（横に振る間の縦方向の手ぶれなど、パーセンテージ）
+PANNING_MIN_STRIP = float(os.environ.get('PANNING_MIN_STRIP', '5'))
+# 分析し直す領域の余白（画像に対するパーセンテージ、境界で切れた機器を含めるため）
+PANNING_REGION_PADDING = float(os.environ.get('PANNING_REGION_PADDING', '5'))
+# 引き継ぐ機器の、移動後に画像内に残る面積の最小割合
+PANNING_MIN_VISIBLE = float(os.environ.get('PANNING_MIN_VISIBLE', '0.5'))
+# 前の写真の状態を置くS3のプレフィックス（derived/以下はイベント通知の対象外で、1日で削除される）
+PANNING_STATE_PREFIX = os.environ.get('PANNING_STATE_PREFIX', 'derived/panning/')
+
+# これより小さい領域は分析しない（手ぶれ程度の移動）
+MIN_REGION_AREA = 0.02
+
+
+def frame_thumbnail(image_bytes: bytes) -> Any:
+    """
+    移動量の推定に使う縮小グレースケール画像を作成
+
+    Args:
+        image_bytes: 画像のバイトデータ
+
+    Returns:
+        PANNING_THUMB_SIZE x PANNING_THUMB_SIZE のuint8配列
+    """
+    import numpy as np
+    from PIL import Image
+    from io import BytesIO
+
+    image = Image.open(BytesIO(image_bytes))
+    # JPEGはデコード時に縮小（フル解像度のデコードを避ける）
+    image.draft('L', (PANNING_THUMB_SIZE * 2, PANNING_THUMB_SIZE * 2))
+    image = image.convert('L').resize((PANNING_THUMB_SIZE, PANNING_THUMB_SIZE), Image.BILINEAR)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def phase_correlation(previous: Any, current: Any) -> tuple:
+    """
+    位相限定相関で2枚の縮小画像の平行移動量を推定
+
+    Args:
+        previous: 前の写真の縮小画像
+        current: 今回の写真の縮小画像
+
+    Returns:
+        (dx, dy) 前の写真の内容が今回の写真で移動した量（ピクセル）
+    """
+    import numpy as np
+
+    height, width = previous.shape
+    # 画像の端の不連続が相関の頂点にならないよう窓関数をかける
+    window = np.outer(np.hanning(height), np.hanning(width))
+    a = (previous - previous.mean()) * window
+    b = (current - current.mean()) * window
+
+    cross = np.fft.fft2(b) * np.conj(np.fft.fft2(a))
+    cross /= np.abs(cross) + 1e-9
+    correlation = np.fft.ifft2(cross).real
+
+    dy, dx = np.unravel_index(np.argmax(correlation), correlation.shape)
+    # 半分を超える移動は負の方向
+    if dy > height // 2:
+        dy -= height
+    if dx > width // 2:
+        dx -= width
+    return int(dx), int(dy)
+
+
+def overlap_slices(shape: tuple, dx: int, dy: int) -> tuple:
+    """前の写真と今回の写真で重なる部分のスライス（前の写真側, 今回の写真側）"""
+    height, width = shape
+    previous_x = slice(max(0, -dx), min(width, width - dx))
+    previous_y = slice(max(0, -dy), min(height, height - dy))
+    current_x = slice(max(0, dx), min(width, width + dx))
+    current_y = slice(max(0, dy), min(height, height + dy))
+    return (previous_y, previous_x), (current_y, current_x)
+
+
+def standardize(values: Any) -> Any:
+    """輝度を平均0・標準偏差1に揃える（自動露出による明るさの違いを打ち消す）"""
+    std = values.std()
+    return (values - values.mean()) / (std if std > 1e-6 else 1.0)
+
+
+def estimate_shift(previous: Any, current: Any) -> Dict[str, Any]:
+    """
+    前の写真からの移動量・重なり・変化した部分を推定
+
+    Args:
+        previous: 前の写真の縮小画像
+        current: 今回の写真の縮小画像
+
+    Returns:
+        dx, dy（移動量、画像に対するパーセンテージ）, overlap（重なりの面積の割合）,
+        similarity（位置を合わせた重なり部分の相関係数）,
+        changed（重なり部分のうち変化した格子のリスト、今回の写真のパーセンテージ座標の矩形）
+    """
+    import numpy as np
+
+    previous = previous.astype(np.float64)
+    current = current.astype(np.float64)
+    height, width = current.shape
+    dx, dy = phase_correlation(previous, current)
+
+    overlap = max(0, width - abs(dx)) * max(0, height - abs(dy)) / (width * height)
+    result = {
+        'dx': dx / width * 100,
+        'dy': dy / height * 100,
+        'overlap': round(overlap, 4),
+        'similarity': 0.0,
+        'changed': []
+    }
+    if overlap <= 0:
+        return result
+
+    previous_slices, current_slices = overlap_slices(current.shape, dx, dy)
+    a = standardize(previous[previous_slices])
+    b = standardize(current[current_slices])
+    result['similarity'] = round(float((a * b).mean()), 4)
+
+    # 重なり部分を格子に分け、輝度差の大きい格子を変化した部分とする
+    difference = np.abs(a - b)
+    cell = max(1, PANNING_THUMB_SIZE // PANNING_GRID)
+    offset_x, offset_y = current_slices[1].start, current_slices[0].start
+    for top in range(0, difference.shape[0], cell):
+        for left in range(0, difference.shape[1], cell):
+            block = difference[top:top + cell, left:left + cell]
+            if block.mean() > PANNING_CHANGE_LEVEL:
+                result['changed'].append({
+                    'x': (offset_x + left) / width * 100,
+                    'y': (offset_y + top) / height * 100,
+                    'width': block.shape[1] / width * 100,
+                    'height': block.shape[0] / height * 100
+                })
+    return result
+
+
+def revealed_regions(dx: float, dy: float) -> List[Dict[str, float]]:
+    """
+    前の写真に写っていなかった、今回の写真の帯状の領域
+
+    Args:
+        dx: 横方向の移動量（パーセンテージ、正は内容が右に移動 = 左端に新しい領域）
+        dy: 縦方向の移動量（パーセンテージ）
+
+    Returns:
+        今回の写真のパーセンテージ座標の矩形のリスト
+    """
+    regions = []
+    if dx > 0:
+        regions.append({'x': 0.0, 'y': 0.0, 'width': dx, 'height': 100.0})
+    elif dx < 0:
+        regions.append({'x': 100 + dx, 'y': 0.0, 'width': -dx, 'height': 100.0})
+    if dy > 0:
+        regions.append({'x': 0.0, 'y': 0.0, 'width': 100.0, 'height': dy})
+    elif dy < 0:
+        regions.append({'x': 0.0, 'y': 100 + dy, 'width': 100.0, 'height': -dy})
+    return regions
+
+
+def analysis_region(shift: Dict[str, Any]) -> Dict[str, float]:
+    """
+    分析し直す領域（新しく写った部分と変化した部分の外接矩形に余白を加えたもの）
+    PANNING_MIN_STRIP未満の細い帯は、写っている機器の大部分を前の写真から引き継げるため含めない
+
+    Args:
+        shift: estimate_shiftの結果
+
+    Returns:
+        今回の写真のパーセンテージ座標の矩形（分析する領域が無い場合はNone）
+    """
+    strips = [
+        r for r in revealed_regions(shift['dx'], shift['dy'])
+        if min(r['width'], r['height']) >= PANNING_MIN_STRIP
+    ]
+    rectangles = strips + shift['changed']
+    if not rectangles:
+        return None
+
+    padding = PANNING_REGION_PADDING
+    x1 = max(0.0, min(r['x'] for r in rectangles) - padding)
+    y1 = max(0.0, min(r['y'] for r in rectangles) - padding)
+    x2 = min(100.0, max(r['x'] + r['width'] for r in rectangles) + padding)
+    y2 = min(100.0, max(r['y'] + r['height'] for r in rectangles) + padding)
+    return {'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1}
+
+
+def region_area(region: Dict[str, float]) -> float:
+    """領域の面積の画像全体に対する割合"""
+    if region is None:
+        return 0.0
+    return region['width'] * region['height'] / 10000
+
+
+def reproject_equipment(
+    equipment_list: List[Dict[str, Any]],
+    dx: float,
+    dy: float
+) -> List[Dict[str, Any]]:
+    """
+    前の写真の機器を今回の写真の座標に移動
+
+    Args:
+        equipment_list: 前の写真の機器リスト
+        dx: 横方向の移動量（パーセンテージ）
+        dy: 縦方向の移動量（パーセンテージ）
+
+    Returns:
+        画像内に十分残る機器のリスト（ボックスは画像の範囲に切り詰め、carried_overを付ける）
+    """
+    carried = []
+    for equipment in equipment_list:
+        bbox = equipment['bbox']
+        area = bbox['width'] * bbox['height']
+        x1 = max(0.0, bbox['x'] + dx)
+        y1 = max(0.0, bbox['y'] + dy)
+        x2 = min(100.0, bbox['x'] + bbox['width'] + dx)
+        y2 = min(100.0, bbox['y'] + bbox['height'] + dy)
+        if x2 <= x1 or y2 <= y1 or area <= 0:
+            continue
+        if (x2 - x1) * (y2 - y1) / area < PANNING_MIN_VISIBLE:
+            continue
+        carried.append(dict(
+            equipment,
+            bbox={'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1},
+            carried_over=True
+        ))
+    return carried
+
+
+def encode_thumbnail(thumbnail: Any) -> str:
+    """縮小画像を状態に保存できる文字列に変換"""
+    return base64.b64encode(thumbnail.tobytes()).decode('ascii')
+
+
+def decode_thumbnail(data: str) -> Any:
+    """encode_thumbnailの逆変換（大きさが現在の設定と異なる場合はNone）"""
+    import numpy as np
+
+    raw = base64.b64decode(data)
+    if len(raw) != PANNING_THUMB_SIZE * PANNING_THUMB_SIZE:
+        return None
+    return np.frombuffer(raw, dtype=np.uint8).reshape(PANNING_THUMB_SIZE, PANNING_THUMB_SIZE)
+
+
+# カメラ撮影の写真のファイル名の撮影番号（f<6桁の撮影番号>-<タイムスタンプ>-<uuid>.<拡張子>）
+FRAME_NUMBER_PATTERN = re.compile(r'^f(\d{6})-')
+
+
+def frame_file_name(key: str) -> str:
+    """画像キーのファイル名（[f<撮影番号>-]<タイムスタンプ>-<uuid>.<拡張子>、撮影順に並ぶ）"""
+    return key.rsplit('/', 1)[-1]
+
+
+def frame_number(key: str) -> Any:
+    """
+    画像キーからフロントエンドが付けた撮影番号を取り出す
+
+    Args:
+        key: S3オブジェクトキー
+
+    Returns:
+        撮影セッション内の撮影番号（番号の無いキーの場合はNone）
+    """
+    match = FRAME_NUMBER_PATTERN.match(frame_file_name(key))
+    return int(match.group(1)) if match else None
+
+
+def find_previous_frame(
+    state: Dict[str, Any],
+    key: str,
+    image_size: tuple,
+    now: float = None
+) -> Any:
+    """
+    保存された状態が今回の写真の直前の写真かを確認し、縮小画像を返す
+
+    Args:
+        state: 前の写真の状態（image_key, thumbnail, size, equipment, updatedAt）
+        key: 今回の写真のS3オブジェクトキー
+        image_size: 今回の写真のサイズ (width, height)
+        now: 現在時刻（UNIX秒、テスト用）
+
+    Returns:
+        前の写真の縮小画像（使えない場合はNone）
+    """
+    if not state:
+        return None
+    now = time.time() if now is None else now
+    if now - state.get('updatedAt', 0) > PANNING_MAX_AGE_SECONDS:
+        return None
+    # 後から撮った写真が先に分析された場合（順序の逆転）は使わない
+    if frame_file_name(state.get('image_key', '')) >= frame_file_name(key):
+        return None
+    # 撮影番号がある場合は直前の1枚だけを使う（間の写真の分析が遅れている・失敗した場合は全体を分析）
+    previous_number, number = frame_number(state.get('image_key', '')), frame_number(key)
+    if previous_number is not None and number is not None and previous_number != number - 1:
+        return None
+    # 縦横が変わった（端末を回転した）場合は比較できない
+    width, height = image_size
+    previous_width, previous_height = state.get('size', (0, 0))
+    if previous_height <= 0 or height <= 0 or abs(previous_width / previous_height - width / height) > 0.01:
+        return None
+    return decode_thumbnail(state.get('thumbnail', ''))
+
+
+class FrameStateStore:
+    """撮影セッションごとの前の写真の状態の保存先のインターフェース"""
+
+    def load(self, session_id: str) -> Dict[str, Any]:
+        """
+        前の写真の状態を読み込む
+
+        Args:
+            session_id: 撮影セッションのID
+
+        Returns:
+            状態（記録が無い場合はNone）
+        """
+        raise NotImplementedError
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        """
+        写真の状態を記録（撮影順で後の写真の状態は上書きしない）
+
+        Args:
+            session_id: 撮影セッションのID
+            state: 状態
+        """
+        raise NotImplementedError
+
+
+class MemoryFrameStateStore(FrameStateStore):
+    """プロセス内の保存先（テスト・ローカル実行用）"""
+
+    def __init__(self):
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def load(self, session_id: str) -> Dict[str, Any]:
+        with self.lock:
+            return self.states.get(session_id)
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        with self.lock:
+            current = self.states.get(session_id)
+            if current and frame_file_name(current['image_key']) > frame_file_name(state['image_key']):
+                return
+            self.states[session_id] = state
+
+
+class S3FrameStateStore(FrameStateStore):
+    """
+    S3の保存先
+
+    オブジェクト: <prefix><セッションID>.json
+    """
+
+    def __init__(self, s3_client: Any, bucket: str, prefix: str = PANNING_STATE_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def object_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}.json"
+
+    def load(self, session_id: str) -> Dict[str, Any]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.object_key(session_id))
+            return json.loads(response['Body'].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        # 同じセッションの写真は撮影順に届くことがほとんどのため、読み込んでから比較する
+        # （並行して分析された場合に後の写真の状態を戻さないための簡易的な確認）
+        current = self.load(session_id)
+        if current and frame_file_name(current.get('image_key', '')) > frame_file_name(state['image_key']):
+            return
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.object_key(session_id),
+            Body=json.dumps(state, ensure_ascii=False).encode('utf-8'),
+            ContentType='application/json'
+        )
@@ -0,0 +1,116 @@
+"""
+技術局長 - 画像の品質チェック
+
+ぶれた写真・真っ暗な写真など、分析しても機器を識別できない画像を、
+Rekognition・Claudeを呼ぶ前に判定して除外する
+縮小したグレースケール画像だけで計算する（CPUのみ・数ミリ秒）
+"""
+
+import os
+import logging
+from typing import Dict, List, Any
+
+logger = logging.getLogger()
+
+# 計算に使う縮小画像の最大辺（ピクセル、閾値はこの大きさで調整する）
+QUALITY_MAX_SIDE = int(os.environ.get('QUALITY_MAX_SIDE', '256'))
+# ぶれの判定: ラプラシアンの分散がこれ未満なら除外
+QUALITY_MIN_SHARPNESS = float(os.environ.get('QUALITY_MIN_SHARPNESS', '15'))
+# 露出の判定: 暗い（明るい）画素の割合がこれを超えたら除外
+QUALITY_DARK_LEVEL = int(os.environ.get('QUALITY_DARK_LEVEL', '24'))
+QUALITY_BRIGHT_LEVEL = int(os.environ.get('QUALITY_BRIGHT_LEVEL', '232'))
+QUALITY_MAX_DARK_RATIO = float(os.environ.get('QUALITY_MAX_DARK_RATIO', '0.95'))
+QUALITY_MAX_BRIGHT_RATIO = float(os.environ.get('QUALITY_MAX_BRIGHT_RATIO', '0.95'))
+# 物体が1つも検出されない画像を除外（Claudeの呼び出しを省く）
+QUALITY_REJECT_EMPTY = os.environ.get('QUALITY_REJECT_EMPTY', 'false').lower() == 'true'
+
+# 除外の理由（結果テーブルのrejectionReason）
+REJECT_TOO_DARK = 'too_dark'
+REJECT_TOO_BRIGHT = 'too_bright'
+REJECT_BLURRY = 'blurry'
+REJECT_NO_OBJECTS = 'no_objects'
+
+# ラプラシアンフィルタ
+LAPLACIAN = [0, 1, 0, 1, -4, 1, 0, 1, 0]
+
+
+def measure_image_quality(image_bytes: bytes) -> Dict[str, float]:
+    """
+    縮小したグレースケール画像から鮮明さと露出を計測
+
+    Args:
+        image_bytes: 画像のバイトデータ
+
+    Returns:
+        sharpness（ラプラシアンの分散）, dark_ratio, bright_ratio（暗い・明るい画素の割合）
+    """
+    from PIL import Image, ImageFilter, ImageOps, ImageStat
+    from io import BytesIO
+
+    image = Image.open(BytesIO(image_bytes))
+    # JPEGはデコード時に縮小（フル解像度のデコードを避ける）
+    image.draft('L', (QUALITY_MAX_SIDE, QUALITY_MAX_SIDE))
+    image = image.convert('L')
+    image.thumbnail((QUALITY_MAX_SIDE, QUALITY_MAX_SIDE))
+
+    histogram = image.histogram()
+    total = sum(histogram) or 1
+
+    # 負の値を残すため128を中心にする（外周1ピクセルはフィルタされないため除く）
+    laplacian = image.filter(ImageFilter.Kernel((3, 3), LAPLACIAN, scale=1, offset=128))
+    if laplacian.width > 2 and laplacian.height > 2:
+        laplacian = ImageOps.crop(laplacian, 1)
+
+    return {
+        'sharpness': round(ImageStat.Stat(laplacian).var[0], 2),
+        'dark_ratio': round(sum(histogram[:QUALITY_DARK_LEVEL]) / total, 4),
+        'bright_ratio': round(sum(histogram[QUALITY_BRIGHT_LEVEL + 1:]) / total, 4)
+    }
+
+
+def evaluate_quality(metrics: Dict[str, float]) -> str:
+    """
+    計測値から除外の理由を判定（露出を先に判定する。真っ暗な画像はぶれとしても検出されるため）
+
+    Args:
+        metrics: measure_image_qualityの結果
+
+    Returns:
+        除外の理由（分析できる場合はNone）
+    """
+    if metrics['dark_ratio'] > QUALITY_MAX_DARK_RATIO:
+        return REJECT_TOO_DARK
+    if metrics['bright_ratio'] > QUALITY_MAX_BRIGHT_RATIO:
+        return REJECT_TOO_BRIGHT
+    if metrics['sharpness'] < QUALITY_MIN_SHARPNESS:
+        return REJECT_BLURRY
+    return None
+
+
+def evaluate_detections(detected_objects: List[Dict[str, Any]]) -> str:
+    """
+    物体検出の結果から除外の理由を判定（QUALITY_REJECT_EMPTYが有効な場合のみ）
+
+    Args:
+        detected_objects: 検出された物体のリスト
+
+    Returns:
+        除外の理由（分析を続ける場合はNone）
+    """
+    if QUALITY_REJECT_EMPTY and not detected_objects:
+        return REJECT_NO_OBJECTS
+    return None
+
+
+def build_rejected_result(reason: str, metrics: Dict[str, float] = None) -> Dict[str, Any]:
+    """
+    除外した画像の分析結果を作成
+
+    Args:
+        reason: 除外の理由
+        metrics: 判定に使った計測値
+
+    Returns:
+        分析結果（equipmentは空、rejectionに理由と計測値）
+    """
+    return {'equipment': [], 'rejection': {'reason': reason, 'metrics': metrics or {}}}
@@ -0,0 +1,254 @@
+"""
+技術局長 - Bedrockのレート制限
+
+同時に動くLambda実行すべてで、Bedrockの1分あたりトークン数（TPM）のクォータを共有する。
+1分ごとに補充されるトークンバケットを、DynamoDBのアトミックカウンタ（1分単位の窓ごとの消費量）で表す。
+
+優先度クラス:
+- interactive: カメラからのアップロード。クォータの全量まで使える（batchの未使用分を借りられる）
+- batch: 一括再分析など。クォータのRATE_LIMIT_BATCH_SHAREまでしか使えず、
+  上限に達した場合は短時間待ち、それでも空かなければRateLimitExceededで再キューに戻す
+
+テストやローカル実行ではLocalRateLimiter（プロセス内のカウンタ）を使う
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+import logging
+from typing import Dict, Any, Callable
+
+from botocore.exceptions import ClientError
+
+from metrics import emit_metric
+
+logger = logging.getLogger()
+
+# 優先度クラス
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+PRIORITIES = [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+# batchクラスが使えるクォータの割合
+RATE_LIMIT_BATCH_SHARE = float(os.environ.get('RATE_LIMIT_BATCH_SHARE', '0.7'))
+# 空きを待つ最大時間（秒）
+RATE_LIMIT_INTERACTIVE_MAX_WAIT = float(os.environ.get('RATE_LIMIT_INTERACTIVE_MAX_WAIT', '20'))
+RATE_LIMIT_BATCH_MAX_WAIT = float(os.environ.get('RATE_LIMIT_BATCH_MAX_WAIT', '5'))
+# 空きを確認する間隔（秒）
+RATE_LIMIT_POLL_SECONDS = float(os.environ.get('RATE_LIMIT_POLL_SECONDS', '1'))
+# 画像1枚あたりの入力トークン数の見積もり
+IMAGE_TOKEN_ESTIMATE = int(os.environ.get('IMAGE_TOKEN_ESTIMATE', '1600'))
+
+# 窓の長さ（秒）
+WINDOW_SECONDS = 60
+
+# 現在の処理の優先度（スレッドプールへはcontextvars.copy_contextで引き継ぐ）
+current_priority = contextvars.ContextVar('bedrock_priority', default=PRIORITY_INTERACTIVE)
+
+
+class RateLimitExceeded(Exception):
+    """待ち時間の上限までにクォータの空きが出なかった"""
+
+
+def estimate_request_tokens(body: Dict[str, Any]) -> int:
+    """
+    Bedrockリクエストの消費トークン数を見積もる（入力 + max_tokens）
+
+    Args:
+        body: リクエストボディ
+
+    Returns:
+        見積もりトークン数
+    """
+    input_tokens = 0
+    for message in body.get('messages', []):
+        content = message.get('content', [])
+        if isinstance(content, str):
+            content = [{'type': 'text', 'text': content}]
+        for block in content:
+            if block.get('type') == 'image':
+                input_tokens += IMAGE_TOKEN_ESTIMATE
+            elif block.get('type') == 'text':
+                # 日本語混じりのプロンプトは1文字あたり約1トークンとして安全側に見積もる
+                input_tokens += len(block.get('text', ''))
+    if 'tools' in body:
+        input_tokens += len(json.dumps(body['tools'], ensure_ascii=False))
+    return input_tokens + int(body.get('max_tokens', 0))
+
+
+class TokenRateLimiter:
+    """
+    1分単位の窓ごとに消費トークン数を数えるレート制限の基底クラス
+
+    サブクラスは_try_consume（条件付きの加算）と_add（無条件の加算）を実装する
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: int,
+        batch_share: float = RATE_LIMIT_BATCH_SHARE,
+        max_wait: Dict[str, float] = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.tokens_per_minute = tokens_per_minute
+        self.batch_share = batch_share
+        self.max_wait = max_wait or {
+            PRIORITY_INTERACTIVE: RATE_LIMIT_INTERACTIVE_MAX_WAIT,
+            PRIORITY_BATCH: RATE_LIMIT_BATCH_MAX_WAIT
+        }
+        self.clock = clock
+        self.sleep = sleep
+
+    def limit_for(self, priority: str) -> int:
+        """優先度クラスが使える1分あたりのトークン数"""
+        if priority == PRIORITY_BATCH:
+            return int(self.tokens_per_minute * self.batch_share)
+        return self.tokens_per_minute
+
+    def acquire(self, cost: int, priority: str = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+        """
+        トークンを確保する（空きが出るまで最大max_wait秒待つ）
+
+        Args:
+            cost: 見積もりトークン数
+            priority: 優先度クラス
+
+        Returns:
+            確保の記録（window, cost, priority, waited）
+
+        Raises:
+            RateLimitExceeded: 待ち時間の上限までに確保できなかった場合
+        """
+        limit = self.limit_for(priority)
+        start = self.clock()
+        deadline = start + self.max_wait.get(priority, 0)
+
+        while True:
+            now = self.clock()
+            window = int(now // WINDOW_SECONDS)
+            if self._try_consume(window, cost, limit):
+                waited = now - start
+                emit_metric('BedrockRateLimitWait', round(waited * 1000, 1), 'Milliseconds', {'Priority': priority})
+                if waited > 0:
+                    logger.info(f"レート制限で待機: {waited:.1f}秒 (priority={priority}, cost={cost})")
+                return {'window': window, 'cost': cost, 'priority': priority, 'waited': waited}
+
+            remaining = deadline - now
+            if remaining <= 0:
+                emit_metric('BedrockRateLimitRejected', 1, 'Count', {'Priority': priority})
+                raise RateLimitExceeded(
+                    f"Bedrockのレート制限を超過しました (priority={priority}, cost={cost}, limit={limit}/分)"
+                )
+
+            # 次の窓の開始まで、または確認間隔だけ待つ（複数の実行が同時に再試行しないよう揺らす）
+            until_next_window = (window + 1) * WINDOW_SECONDS - now
+            self.sleep(max(0.0, min(remaining, until_next_window, RATE_LIMIT_POLL_SECONDS) * random.uniform(0.8, 1.0)))
+
+    def settle(self, reservation: Dict[str, Any], actual_tokens: int) -> None:
+        """
+        実際の消費トークン数で見積もりを補正
+
+        Args:
+            reservation: acquireの戻り値
+            actual_tokens: 応答のusageから求めた消費トークン数
+        """
+        delta = actual_tokens - reservation['cost']
+        if delta:
+            self._add(reservation['window'], delta)
+
+    def refund(self, reservation: Dict[str, Any]) -> None:
+        """
+        呼び出しが失敗した場合に確保した見積もりを返す
+
+        スロットリング・検証エラーではトークンは消費されない。タイムアウトでは消費された
+        可能性もあるが、確保したままにすると再試行が窓の終わりまで待たされるため返す。
+
+        Args:
+            reservation: acquireの戻り値
+        """
+        self.settle(reservation, 0)
+
+    def _try_consume(self, window: int, cost: int, limit: int) -> bool:
+        """窓の消費量がlimitを超えない場合だけcostを加算"""
+        raise NotImplementedError
+
+    def _add(self, window: int, delta: int) -> None:
+        """窓の消費量にdeltaを加算"""
+        raise NotImplementedError
+
+
+class LocalRateLimiter(TokenRateLimiter):
+    """プロセス内のカウンタによるレート制限（テスト・ローカル実行用）"""
+
+    def __init__(self, tokens_per_minute: int, **kwargs):
+        super().__init__(tokens_per_minute, **kwargs)
+        self.used = {}
+        self.lock = threading.Lock()
+
+    def _try_consume(self, window: int, cost: int, limit: int) -> bool:
+        with self.lock:
+            used = self.used.get(window)
+            # 空の窓では上限を超える大きなリクエストも通す（永久に通らなくなるのを防ぐ）
+            if used is not None and used > limit - cost:
+                return False
+            self.used[window] = (used or 0) + cost
+            return True
+
+    def _add(self, window: int, delta: int) -> None:
+        with self.lock:
+            self.used[window] = self.used.get(window, 0) + delta
+
+
+class DynamoDBRateLimiter(TokenRateLimiter):
+    """
+    DynamoDBのアトミックカウンタによるレート制限（同時に動くLambda実行すべてで共有）
+
+    項目: limiterKey = "<name>#<窓番号>", used = 消費トークン数, ttl = 窓の終了から1時間後
+    """
+
+    def __init__(self, table: Any, tokens_per_minute: int, name: str = 'bedrock', **kwargs):
+        super().__init__(tokens_per_minute, **kwargs)
+        self.table = table
+        self.name = name
+
+    def _key(self, window: int) -> Dict[str, str]:
+        return {'limiterKey': f"{self.name}#{window}"}
+
+    def _ttl(self, window: int) -> int:
+        return (window + 1) * WINDOW_SECONDS + 3600
+
+    def _try_consume(self, window: int, cost: int, limit: int) -> bool:
+        try:
+            self.table.update_item(
+                Key=self._key(window),
+                UpdateExpression='ADD #used :cost SET #ttl = if_not_exists(#ttl, :ttl)',
+                # 空の窓では上限を超える大きなリクエストも通す
+                ConditionExpression='attribute_not_exists(#used) OR #used <= :threshold',
+                ExpressionAttributeNames={'#used': 'used', '#ttl': 'ttl'},
+                ExpressionAttributeValues={
+                    ':cost': cost,
+                    ':threshold': limit - cost,
+                    ':ttl': self._ttl(window)
+                }
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def _add(self, window: int, delta: int) -> None:
+        try:
+            self.table.update_item(
+                Key=self._key(window),
+                UpdateExpression='ADD #used :delta SET #ttl = if_not_exists(#ttl, :ttl)',
+                ExpressionAttributeNames={'#used': 'used', '#ttl': 'ttl'},
+                ExpressionAttributeValues={':delta': delta, ':ttl': self._ttl(window)}
+            )
+        except ClientError as e:
+            # 補正に失敗しても分析は続ける（見積もりのまま残るだけ）
+            logger.warning(f"レート制限の補正に失敗: {e}")
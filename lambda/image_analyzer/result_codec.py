@@ -0,0 +1,87 @@
+"""
+技術局長 - 分析結果の保存形式
+
+DynamoDBの結果テーブルに保存する分析結果のエンコード・デコード
+
+- スキーマバージョン2: bboxを量子化し、null項目を省いたJSONをzlib圧縮してバイナリ属性に保存
+- 旧形式（schemaVersion無し）: resultにjson.dumpsの文字列を保存
+"""
+
+import json
+import zlib
+import logging
+from typing import Dict, Any
+
+logger = logging.getLogger()
+
+# 現在のスキーマバージョン
+RESULT_SCHEMA_VERSION = 2
+
+# bbox座標の小数点以下の桁数（0.01%単位）
+BBOX_PRECISION = 2
+
+
+def compact_equipment(equipment: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    保存用に機器情報を縮小（bboxの量子化、null項目の除去）
+
+    Args:
+        equipment: 機器情報
+
+    Returns:
+        縮小した機器情報
+    """
+    compacted = {}
+    for key, value in equipment.items():
+        if value is None:
+            continue
+        if key == 'bbox':
+            value = {k: round(float(v), BBOX_PRECISION) for k, v in value.items()}
+        elif isinstance(value, float):
+            value = round(value, BBOX_PRECISION)
+        compacted[key] = value
+    return compacted
+
+
+def encode_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    分析結果を結果テーブルの属性にエンコード
+
+    Args:
+        result: 分析結果（equipment配列）
+
+    Returns:
+        DynamoDB属性（result, schemaVersion, equipmentCount）
+    """
+    equipment = result.get('equipment', [])
+    payload = dict(result, equipment=[compact_equipment(e) for e in equipment])
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    return {
+        'result': zlib.compress(encoded, 9),
+        'schemaVersion': RESULT_SCHEMA_VERSION,
+        'equipmentCount': len(equipment)
+    }
+
+
+def decode_result(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    結果テーブルの項目から分析結果をデコード（旧形式のJSON文字列にも対応）
+
+    Args:
+        item: DynamoDB項目
+
+    Returns:
+        分析結果（equipment配列）
+    """
+    raw = item.get('result')
+    if raw is None:
+        return {'equipment': []}
+
+    schema_version = int(item.get('schemaVersion', 1))
+    if schema_version >= 2:
+        # boto3のBinary型は.valueにバイト列を持つ
+        data = raw.value if hasattr(raw, 'value') else bytes(raw)
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    return json.loads(raw) if isinstance(raw, str) else raw
@@ -0,0 +1,154 @@
+"""
+技術局長 - 関心領域の切り出し
+
+調整室の写真は床・天井・人が大部分を占めることが多い。
+物体検出の結果から人・家具・壁などを除いた物体の外接矩形（余白付き）を関心領域とし、
+その範囲だけをClaudeに送ることで画像のトークン数を減らす
+
+Claudeが返す座標は切り出し画像に対するパーセンテージのため、画像全体の座標に戻す
+"""
+
+import os
+import logging
+from typing import Dict, List, Any
+
+logger = logging.getLogger()
+
+# 関心領域の余白（物体の外接矩形の大きさに対する割合）と最小の余白（画像に対するパーセンテージ）
+ROI_PADDING = float(os.environ.get('ROI_PADDING', '0.15'))
+ROI_MIN_PADDING = float(os.environ.get('ROI_MIN_PADDING', '3'))
+# 関心領域の面積の割合がこれを超える場合は切り出さない（トークン数がほとんど減らないため）
+ROI_MAX_AREA = float(os.environ.get('ROI_MAX_AREA', '0.8'))
+# 関心領域の一辺の最小値（画像に対するパーセンテージ、小さな検出1つで切り詰めすぎないため）
+ROI_MIN_SIDE = float(os.environ.get('ROI_MIN_SIDE', '30'))
+# 関心領域に含める物体の最小信頼度
+ROI_MIN_CONFIDENCE = float(os.environ.get('ROI_MIN_CONFIDENCE', '50'))
+# 関心領域に含めない物体のラベル（放送機器ではない人・家具・建物の部分など、カンマ区切り）
+ROI_EXCLUDED_LABELS = {
+    label.strip().lower()
+    for label in os.environ.get(
+        'ROI_EXCLUDED_LABELS',
+        'Person,Human,Man,Woman,Boy,Girl,Face,Head,Hand,Clothing,Apparel,Footwear,Shoe,'
+        'Chair,Table,Desk,Furniture,Couch,Bench,Stool,Door,Window,Wall,Floor,Flooring,Ceiling,'
+        'Plant,Potted Plant,Bag,Handbag,Backpack,Bottle,Cup'
+    ).split(',')
+    if label.strip()
+}
+
+# 切り出し画像のJPEG品質
+ROI_JPEG_QUALITY = 90
+
+
+def is_relevant_detection(obj: Dict[str, Any]) -> bool:
+    """関心領域に含める物体か（除外するラベル・低い信頼度の物体を除く）"""
+    return (
+        obj['label'].lower() not in ROI_EXCLUDED_LABELS
+        and obj.get('confidence', 0) >= ROI_MIN_CONFIDENCE
+    )
+
+
+def expand_span(start: float, end: float, min_length: float) -> tuple:
+    """範囲を最小の長さまで中心から広げ、0-100に収める"""
+    if end - start < min_length:
+        center = (start + end) / 2
+        start, end = center - min_length / 2, center + min_length / 2
+    if start < 0:
+        start, end = 0.0, min(100.0, end - start)
+    if end > 100:
+        start, end = max(0.0, start - (end - 100)), 100.0
+    return start, end
+
+
+def compute_roi(detected_objects: List[Dict[str, Any]]) -> Dict[str, float]:
+    """
+    関心領域を計算
+
+    Args:
+        detected_objects: 物体検出の結果（label, confidence, bbox）
+
+    Returns:
+        関心領域（画像全体に対するパーセンテージ）
+        対象の物体が無い・領域が広く切り出す意味が無い場合はNone
+    """
+    relevant = [obj['bbox'] for obj in detected_objects if is_relevant_detection(obj)]
+    if not relevant:
+        return None
+
+    x1 = min(bbox['x'] for bbox in relevant)
+    y1 = min(bbox['y'] for bbox in relevant)
+    x2 = max(bbox['x'] + bbox['width'] for bbox in relevant)
+    y2 = max(bbox['y'] + bbox['height'] for bbox in relevant)
+
+    pad_x = max((x2 - x1) * ROI_PADDING, ROI_MIN_PADDING)
+    pad_y = max((y2 - y1) * ROI_PADDING, ROI_MIN_PADDING)
+    x1, x2 = expand_span(max(0.0, x1 - pad_x), min(100.0, x2 + pad_x), ROI_MIN_SIDE)
+    y1, y2 = expand_span(max(0.0, y1 - pad_y), min(100.0, y2 + pad_y), ROI_MIN_SIDE)
+
+    roi = {'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1}
+    if roi['width'] * roi['height'] / 10000 > ROI_MAX_AREA:
+        return None
+    return roi
+
+
+def crop_to_roi(image_bytes: bytes, roi: Dict[str, float]) -> tuple:
+    """
+    画像を関心領域で切り出す
+
+    Args:
+        image_bytes: 画像のバイトデータ
+        roi: 関心領域（パーセンテージ）
+
+    Returns:
+        (切り出し画像のJPEG, ピクセル単位に丸めた関心領域（パーセンテージ）)
+    """
+    from PIL import Image
+    from io import BytesIO
+
+    image = Image.open(BytesIO(image_bytes))
+    width, height = image.size
+    left = int(roi['x'] / 100 * width)
+    top = int(roi['y'] / 100 * height)
+    right = max(left + 1, int(round((roi['x'] + roi['width']) / 100 * width)))
+    bottom = max(top + 1, int(round((roi['y'] + roi['height']) / 100 * height)))
+
+    crop = image.crop((left, top, right, bottom))
+    if crop.mode != 'RGB':
+        crop = crop.convert('RGB')
+    output = BytesIO()
+    crop.save(output, format='JPEG', quality=ROI_JPEG_QUALITY)
+
+    # 座標の変換は実際に切り出した範囲で行う
+    actual = {
+        'x': left / width * 100,
+        'y': top / height * 100,
+        'width': (right - left) / width * 100,
+        'height': (bottom - top) / height * 100
+    }
+    return output.getvalue(), actual
+
+
+def bbox_from_roi(bbox: Dict[str, float], roi: Dict[str, float]) -> Dict[str, float]:
+    """関心領域（切り出し画像）のパーセンテージ座標を画像全体のパーセンテージ座標に変換"""
+    return {
+        'x': roi['x'] + bbox['x'] / 100 * roi['width'],
+        'y': roi['y'] + bbox['y'] / 100 * roi['height'],
+        'width': bbox['width'] / 100 * roi['width'],
+        'height': bbox['height'] / 100 * roi['height']
+    }
+
+
+def equipment_from_roi(equipment_list: List[Dict[str, Any]], roi: Dict[str, float]) -> List[Dict[str, Any]]:
+    """
+    Claudeが切り出し画像で返した機器の座標を画像全体の座標に戻す
+
+    Args:
+        equipment_list: Claudeの識別結果（座標はClaude追加検出分のみ）
+        roi: 切り出した関心領域
+
+    Returns:
+        座標を変換した機器リスト（座標の無いRekognition検出分はそのまま）
+    """
+    return [
+        dict(equipment, bbox=bbox_from_roi(equipment['bbox'], roi)) if equipment.get('bbox') else equipment
+        for equipment in equipment_list
+    ]
@@ -0,0 +1,462 @@
+"""
+技術局長 - 撮影セッション単位の分析
+
+SESSION_MODE_ENABLEDの場合、SQSバッチ内の同じ撮影セッション（uploads/sessions/<セッションID>/）の画像を
+SESSION_MAX_IMAGES枚ずつまとめ、1回のBedrock呼び出しで識別して、画像ごとに結果を保存する
+
+画像の取得・物体検出・結果の保存などはhandlerの関数を使い、handler.process_sqs_batchから呼び出す
+"""
+
+import os
+import json
+import uuid
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Any, Set
+
+from botocore.exceptions import ClientError
+
+import handler
+from edge_snapping import snap_equipment_to_edges
+from idempotency import LEASE_ACQUIRED, LEASE_IN_FLIGHT
+from image_format import base64_media_type
+from quality_gate import evaluate_detections
+from rate_limiter import PRIORITY_INTERACTIVE
+from tiled_analysis import should_tile_image, analyze_image_tiled
+
+logger = logging.getLogger()
+
+# 1回のBedrock呼び出しでまとめて分析する画像数の上限
+SESSION_MAX_IMAGES = int(os.environ.get('SESSION_MAX_IMAGES', '6'))
+# 画像の取得・物体検出の並列数
+SESSION_MAX_WORKERS = int(os.environ.get('SESSION_MAX_WORKERS', '4'))
+# セッションの画像のキー: uploads/sessions/<セッションID>/<ファイル名>
+SESSION_KEY_PREFIX = 'uploads/sessions/'
+
+
+def extract_session_id(key: str) -> str:
+    """
+    撮影セッションの画像キーからセッションIDを取り出す
+    
+    Args:
+        key: S3オブジェクトキー（uploads/sessions/<セッションID>/<ファイル名>）
+    
+    Returns:
+        セッションID（セッションの画像でない場合はNone）
+    """
+    if not key.startswith(SESSION_KEY_PREFIX):
+        return None
+    parts = key[len(SESSION_KEY_PREFIX):].split('/')
+    return parts[0] if len(parts) >= 2 and parts[0] else None
+
+
+def group_jobs_by_session(jobs: List[tuple]) -> List[List[tuple]]:
+    """
+    SQSバッチのジョブを撮影セッションごとにまとめる
+    
+    Args:
+        jobs: (メッセージID, 画像情報)のリスト
+    
+    Returns:
+        ジョブのグループ（同じセッション・優先度の画像はSESSION_MAX_IMAGES枚まで1グループ）
+    """
+    groups = []
+    open_groups = {}
+    for job in jobs:
+        _, image = job
+        session_id = extract_session_id(image['key'])
+        if session_id is None:
+            groups.append([job])
+            continue
+        
+        group_key = (image['bucket'], session_id, image.get('priority', PRIORITY_INTERACTIVE))
+        group = open_groups.get(group_key)
+        if group is None or len(group) >= max(1, SESSION_MAX_IMAGES):
+            group = []
+            open_groups[group_key] = group
+            groups.append(group)
+        group.append(job)
+    
+    return groups
+
+
+# プロンプトバージョンごとの、画像ごとの結果の例とキーの意味
+SESSION_OUTPUT_FORMATS = {
+    'verbose': {
+        'example': '{"equipment":[{"source":"rekognition","object_index":0,"name":"製品名","risk_level":"WARNING","description":"説明"}]},'
+                   '{"equipment":[{"source":"claude","bbox":{"x":10,"y":20,"width":30,"height":40},"name":"製品名","risk_level":"DANGER","description":"説明","manual_url":"URL"}]}',
+        'keys': """- source: rekognition（タスク1の機器）または claude（タスク2の機器）
+- object_index: その画像のリストの物体インデックス（タスク1の機器のみ）
+- bbox: 位置（タスク2の機器のみ、その画像の左上を(0,0)、右下を(100,100)とするパーセンテージ）
+- name: 具体的な製品名（メーカー名・型番を含む、日本語）
+- risk_level: リスクレベル（DANGER / WARNING / SAFE / UNKNOWN）
+- description: 機器の用途や特徴（50文字以内、日本語、製品名は含めない）
+- manual_url: 公式マニュアルのURL（実在が確実な場合のみ。それ以外はキーごと省略）""",
+        'risks': ('DANGER', 'WARNING', 'SAFE', 'UNKNOWN')
+    },
+    'compact': {
+        'example': '{"e":[{"i":0,"n":"製品名","r":"W","d":"説明"}]},{"e":[{"b":[10,20,30,40],"n":"製品名","r":"D","d":"説明","u":"URL"}]}',
+        'keys': """- i: その画像のリストの物体インデックス（タスク1の機器のみ）
+- b: [x, y, width, height]（タスク2の機器のみ、その画像の左上を(0,0)、右下を(100,100)とするパーセンテージ）
+- n: 具体的な製品名（メーカー名・型番を含む、日本語）
+- r: リスクレベル（D=DANGER, W=WARNING, S=SAFE, U=UNKNOWN）
+- d: 機器の用途や特徴（50文字以内、日本語、製品名は含めない）
+- u: 公式マニュアルのURL（実在が確実な場合のみ。それ以外はキーごと省略）""",
+        'risks': ('D', 'W', 'S', 'U')
+    },
+    'names': {
+        'example': '{"e":[{"i":0,"n":"製品名","r":"W"}]},{"e":[{"b":[10,20,30,40],"n":"製品名","r":"D"}]}',
+        'keys': """- i: その画像のリストの物体インデックス（タスク1の機器のみ）
+- b: [x, y, width, height]（タスク2の機器のみ、その画像の左上を(0,0)、右下を(100,100)とするパーセンテージ）
+- n: 具体的な製品名（メーカー名・型番を含む。型番が読み取れる場合は必ず含める）
+- r: リスクレベル（D=DANGER, W=WARNING, S=SAFE, U=UNKNOWN）""",
+        'risks': ('D', 'W', 'S', 'U')
+    }
+}
+
+
+def build_session_identification_prompt(
+    detections_per_image: List[List[Dict[str, Any]]],
+    prompt_version: str = 'compact',
+    output_mode: str = 'text'
+) -> str:
+    """
+    撮影セッションの複数画像をまとめて識別するプロンプトを構築
+    
+    Args:
+        detections_per_image: 画像ごとのRekognition検出結果
+        prompt_version: プロンプトバージョン（verbose / compact / names）
+        output_mode: 出力モード（text / tool）
+    
+    Returns:
+        プロンプト文字列
+    """
+    sections = []
+    for number, detected_objects in enumerate(detections_per_image, start=1):
+        objects_summary = "\n".join([
+            f"- 物体{i}: {obj['label']} (信頼度: {obj['confidence']:.1f}%)"
+            for i, obj in enumerate(detected_objects)
+        ]) or "（検出なし）"
+        sections.append(f"画像{number}:\n{objects_summary}")
+    detections_text = "\n\n".join(sections)
+    image_count = len(detections_per_image)
+    
+    output_format = SESSION_OUTPUT_FORMATS.get(prompt_version, SESSION_OUTPUT_FORMATS['verbose'])
+    danger, warning, safe, unknown = output_format['risks']
+    if output_mode == 'tool':
+        output_instruction = f"""{handler.EQUIPMENT_TOOL_NAME}ツールで報告してください。pには画像1から順に、画像ごとの結果を{image_count}個並べてください。"""
+        closing = f"結果は必ず{handler.EQUIPMENT_TOOL_NAME}ツールで報告してください。"
+    else:
+        output_instruction = f"""以下のJSON形式で返してください（空白・改行なし）。pには画像1から順に、画像ごとの結果を{image_count}個並べてください：
+
+{{"p":[{output_format['example']}]}}"""
+        closing = "JSON形式のみを返し、他の説明文は含めないでください。"
+    
+    return f"""あなたは放送設備の専門家です。
+
+同じ部屋を続けて撮影した{image_count}枚の画像を、画像1から順に送ります。
+画像ごとに以下の物体が検出されました：
+
+{detections_text}
+
+画像ごとに次のタスクを行ってください。
+**タスク1**: その画像のリストの物体から「放送機器」に該当するものを選別してください。
+**タスク2**: その画像のリストにない放送機器が画像内にあれば追加で検出してください。
+
+{output_instruction}
+
+キーの意味：
+{output_format['keys']}
+
+リスクレベルの判定基準：
+- {danger}: 高電圧機器、触ると危険なもの、本番系スイッチャー
+- {warning}: 不明なケーブル、確認が必要なもの、識別できない機器
+- {safe}: 安全に触れるもの、電源オフのもの、低電圧機器
+- {unknown}: 機器を識別できない場合
+
+重要な注意事項（悲観的AI戦略）：
+1. 放送機器でない物体（椅子、机、壁、床、人など）は含めない
+2. 機器の種類が不明な場合は推測せずに {unknown}、ケーブルの種類が不明な場合は {warning}
+3. 少しでも不確実な場合は、安全側に倒して {warning} または {danger} を選択
+4. URLを推測したり、作り出したりしない
+5. 同じ機器が複数の画像に写っている場合は、写っている画像それぞれに含める
+
+{closing}"""
+
+
+def build_session_equipment_tool(prompt_version: str, image_count: int) -> Dict[str, Any]:
+    """
+    toolモード用に、画像ごとの機器識別結果を並べたスキーマをツールとして定義
+    
+    Args:
+        prompt_version: プロンプトバージョン（verbose / compact / names）
+        image_count: まとめて送る画像の数
+    
+    Returns:
+        Bedrockのtools要素（画像1枚分のスキーマはhandler.build_equipment_toolと同じ）
+    """
+    tool = handler.build_equipment_tool(prompt_version)
+    return dict(tool, description="画像ごとに識別した放送機器を、画像の順に報告する", input_schema={
+        "type": "object",
+        "properties": {
+            "p": {
+                "type": "array",
+                "items": tool["input_schema"],
+                "minItems": image_count,
+                "maxItems": image_count
+            }
+        },
+        "required": ["p"]
+    })
+
+
+def analyze_session_with_claude(
+    images_base64: List[str],
+    detections_per_image: List[List[Dict[str, Any]]],
+    prompt_version: str = None,
+    output_mode: str = None
+) -> List[Dict[str, Any]]:
+    """
+    撮影セッションの複数画像を1回のClaude呼び出しで識別
+    
+    Args:
+        images_base64: Base64エンコードされた画像のリスト
+        detections_per_image: 画像ごとのRekognition検出結果
+        prompt_version: プロンプトバージョン（省略時は環境変数PROMPT_VERSION）
+        output_mode: 出力モード（省略時は環境変数OUTPUT_MODE）
+    
+    Returns:
+        画像ごとの機器識別結果（analyze_equipment_with_claudeと同じ形式）
+    """
+    prompt_version = prompt_version or handler.PROMPT_VERSION
+    output_mode = output_mode or handler.OUTPUT_MODE
+    
+    content = []
+    for number, image_base64 in enumerate(images_base64, start=1):
+        content.append({"type": "text", "text": f"画像{number}:"})
+        content.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": base64_media_type(image_base64),
+                "data": image_base64
+            }
+        })
+    content.append({
+        "type": "text",
+        "text": build_session_identification_prompt(detections_per_image, prompt_version, output_mode)
+    })
+    
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": min(1500 * len(images_base64), 8000),
+        "messages": [{"role": "user", "content": content}]
+    }
+    
+    # toolモード: スキーマをツールとして宣言し、tool_choiceで呼び出しを強制
+    if output_mode == 'tool':
+        body["tools"] = [build_session_equipment_tool(prompt_version, len(images_base64))]
+        body["tool_choice"] = {"type": "tool", "name": handler.EQUIPMENT_TOOL_NAME}
+    
+    try:
+        response_body = handler.invoke_bedrock_model(body)
+        logger.info(f"Claude応答（セッション）: {json.dumps(response_body)}")
+    except ClientError as e:
+        logger.error(f"Claude APIエラー（セッション）: {e}")
+        raise
+    
+    results = parse_session_equipment_response(
+        response_body,
+        [len(detections) for detections in detections_per_image],
+        prompt_version,
+        output_mode
+    )
+    return [handler.enrich_with_catalog(result, prompt_version) for result in results]
+
+
+def parse_session_equipment_response(
+    response: Dict[str, Any],
+    object_counts: List[int],
+    prompt_version: str = 'compact',
+    output_mode: str = 'text'
+) -> List[Dict[str, Any]]:
+    """
+    セッション識別応答を画像ごとの機器識別結果に分割
+    
+    Args:
+        response: Claude API応答
+        object_counts: 画像ごとのRekognition検出数（送った画像の順）
+        prompt_version: プロンプトバージョン（verbose / compact / names）
+        output_mode: 出力モード（text / tool）
+    
+    Returns:
+        画像ごとの検証済みの機器識別結果（その画像の検出数の範囲外のobject_indexは除く）
+    
+    Raises:
+        ValueError: 応答を解析できない、または画像の枚数と結果の数が合わない場合
+    """
+    if output_mode == 'tool':
+        result = handler.find_tool_input(response, handler.EQUIPMENT_TOOL_NAME)
+        if result is None:
+            raise ValueError(f"セッション応答にtool_useブロックがありません: stop_reason={response.get('stop_reason')}")
+    else:
+        content = response['content'][0]['text']
+        result = json.loads(handler.extract_json_text(content))
+    image_count = len(object_counts)
+    
+    per_image = result.get('p') if isinstance(result, dict) else None
+    if not isinstance(per_image, list) or len(per_image) != image_count:
+        # 画像と結果の対応が取れない場合は誤った画像に保存しないよう失敗させる
+        raise ValueError(f"セッション応答の画像数が一致しません: {image_count}枚に対して{len(per_image) if isinstance(per_image, list) else 'なし'}")
+    
+    results = []
+    for number, (entry, object_count) in enumerate(zip(per_image, object_counts), start=1):
+        if not isinstance(entry, dict):
+            entry = {}
+        if prompt_version in ('compact', 'names'):
+            items = handler.expand_compact_items(entry.get('e', []), prompt_version)
+        else:
+            items = handler.validate_equipment_items(entry.get('equipment', []))
+        equipment_list = []
+        for equipment in items:
+            # 他の画像の物体インデックスを取り違えた結果は座標を決められないため除く
+            if equipment.get('source', 'rekognition') == 'rekognition' and equipment['object_index'] >= object_count:
+                logger.warning(f"object_indexが範囲外（画像{number}）: {equipment['object_index']} (最大: {object_count - 1})")
+                continue
+            equipment_list.append(equipment)
+        results.append({'equipment': equipment_list})
+    return results
+
+
+def finish_session_result(image: Dict[str, str], image_bytes: bytes, final_result: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    セッション分析の画像ごとの結果に、analyze_imageと同じ識別後の処理を行う
+    
+    Args:
+        image: 画像情報（bucket, key, etag）
+        image_bytes: 取り込み済みの画像のバイトデータ
+        final_result: マージ済みの分析結果
+        context: Lambda実行コンテキスト
+    
+    Returns:
+        位置を補正した分析結果
+    """
+    if handler.ENABLE_EDGE_SNAPPING:
+        final_result['equipment'], _ = snap_equipment_to_edges(image_bytes, final_result['equipment'])
+    # 画像ごとにBedrockを呼ぶため、残り時間に余裕がある間だけ
+    if handler.ENABLE_CROP_REFINEMENT and handler.has_time_budget(context, handler.REFINEMENT_MIN_REMAINING_MS):
+        final_result['equipment'] = handler.refine_positions_with_crops(image_bytes, final_result['equipment'])
+    if handler.INVENTORY_ENABLED:
+        handler.update_location_inventory(extract_session_id(image['key']), image_bytes, final_result['equipment'])
+    return final_result
+
+
+def process_session(images: List[Dict[str, str]], context: Any) -> Set[str]:
+    """
+    同じ撮影セッションの画像をまとめて分析し、画像ごとに結果を保存
+    
+    識別後のエッジ吸着・切り出し画像による位置調整・機器台帳への統合はanalyze_imageと同じく行う。
+    識別前の処理のうち、以下は1回の呼び出しで全画像を識別するこの経路では使わない:
+    - 機器台帳・前面パネルの印字による識別の省略（画像ごとにプロンプトの物体リストを変える必要がある）
+    - 関心領域の切り出し（切り出し後の座標を画像ごとに戻す必要がある）
+    - 段階の出力の記録（識別の出力が画像ごとではなくバッチ単位になる）
+    - 連続撮影の差分分析（同じバッチの画像は前の写真の結果を待たずに識別する）
+    
+    Args:
+        images: 画像情報のリスト（bucket, key, etag）
+        context: Lambda実行コンテキスト
+    
+    Returns:
+        他の実行が処理中のため分析しなかった画像のキー
+    
+    Raises:
+        Exception: 分析に失敗した場合（未保存の画像のリースは解放済み）
+    """
+    lease_owner = None
+    pending = images
+    in_flight_keys = set()
+    if handler.IDEMPOTENCY_ENABLED:
+        lease_owner = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+        pending = []
+        for image in images:
+            lease_state = handler.acquire_image_lease(image['key'], image['etag'], lease_owner)
+            if lease_state == LEASE_ACQUIRED:
+                pending.append(image)
+            elif lease_state == LEASE_IN_FLIGHT:
+                in_flight_keys.add(image['key'])
+    if not pending:
+        return in_flight_keys
+    
+    stored_keys = set()
+    try:
+        start_time = datetime.now()
+        
+        # 画像の取得と物体検出は画像ごとに並列実行（並列数はSESSION_MAX_WORKERSまで）
+        with ThreadPoolExecutor(max_workers=max(1, min(len(pending), SESSION_MAX_WORKERS))) as executor:
+            ingested_list = list(executor.map(
+                lambda image: handler.load_image(image['bucket'], image['key']), pending
+            ))
+        
+        # 高解像度画像はタイル分析で個別に処理
+        batched = []
+        for image, ingested in zip(pending, ingested_list):
+            image_bytes = ingested['image_bytes']
+            rejected = handler.check_image_quality(image['key'], image_bytes)
+            if rejected:
+                handler.store_result(image['key'], rejected, image['etag'], lease_owner)
+                stored_keys.add(image['key'])
+            elif should_tile_image(image_bytes):
+                final_result = analyze_image_tiled(image['bucket'], image['key'], image_bytes, ingested['converted'])
+                final_result = finish_session_result(image, image_bytes, final_result, context)
+                handler.store_result(image['key'], final_result, image['etag'], lease_owner)
+                stored_keys.add(image['key'])
+            else:
+                batched.append((image, image_bytes, ingested['converted']))
+        
+        if batched:
+            with ThreadPoolExecutor(max_workers=max(1, min(len(batched), SESSION_MAX_WORKERS))) as executor:
+                # 検出バックエンドの指定を引き継ぐため、呼び出し元のコンテキストで実行する
+                detections_per_image = list(executor.map(
+                    lambda entry: contextvars.copy_context().run(
+                        handler.detect_objects, entry[0]['bucket'], entry[0]['key'], entry[1], entry[2]
+                    ),
+                    batched
+                ))
+            
+            # 物体が1つも無い画像はまとめる前に除外（QUALITY_REJECT_EMPTYが有効な場合）
+            identified = []
+            for entry, detections in zip(batched, detections_per_image):
+                image = entry[0]
+                reason = evaluate_detections(detections) if handler.QUALITY_GATE_ENABLED else None
+                if reason:
+                    handler.store_result(image['key'], handler.reject_image(image['key'], reason), image['etag'], lease_owner)
+                    stored_keys.add(image['key'])
+                else:
+                    identified.append((entry, detections))
+            batched = [entry for entry, _ in identified]
+            detections_per_image = [detections for _, detections in identified]
+        
+        if batched:
+            claude_results = analyze_session_with_claude(
+                [handler.encode_image_to_base64(image_bytes) for _, image_bytes, _ in batched],
+                detections_per_image
+            )
+            
+            for (image, image_bytes, _), detections, claude_result in zip(batched, detections_per_image, claude_results):
+                final_result = finish_session_result(image, image_bytes, handler.merge_results(detections, claude_result), context)
+                handler.store_result(image['key'], final_result, image['etag'], lease_owner)
+                stored_keys.add(image['key'])
+        
+        logger.info(f"セッション分析完了: {len(pending)}枚 (Claude呼び出し{1 if batched else 0}回, 合計所要時間: {(datetime.now() - start_time).total_seconds():.2f}秒)")
+        
+    except BaseException:
+        # 保存していない画像のリースを解放し、再試行ですぐに処理できるようにする
+        if lease_owner is not None:
+            for image in pending:
+                if image['key'] not in stored_keys:
+                    handler.release_image_lease(image['key'], lease_owner)
+        raise
+    
+    return in_flight_keys
@@ -0,0 +1,134 @@
+"""
+技術局長 - 先読みの識別
+
+通常の分析では、Claudeのプロンプトに検出した物体を並べるため、物体検出の完了を待ってからClaudeを呼び出す。
+SPECULATIVE_IDENTIFICATION_ENABLEDの場合は物体検出とClaudeを同時に開始し、
+Claudeが座標付きで返した機器を、両方の完了後に検出した物体と座標で照合する
+
+物体検出・機器識別はhandlerの関数を使い、handler.analyze_imageから呼び出す
+"""
+
+import os
+import math
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Any
+
+import handler
+from quality_gate import evaluate_detections
+from stage_cache import StageCheckpoint
+
+logger = logging.getLogger()
+
+# 照合で同一の物体とみなすIoU、またはボックスの中心の距離（大きい方のボックスの対角線に対する割合）
+SPECULATIVE_MIN_IOU = float(os.environ.get('SPECULATIVE_MIN_IOU', '0.3'))
+SPECULATIVE_MAX_CENTER_DISTANCE = float(os.environ.get('SPECULATIVE_MAX_CENTER_DISTANCE', '0.25'))
+# 中心の距離で照合する場合の、小さい方のボックスの面積の最小割合（ラックと中のモニターを取り違えないため）
+SPECULATIVE_MIN_AREA_RATIO = float(os.environ.get('SPECULATIVE_MIN_AREA_RATIO', '0.25'))
+
+
+def analyze_image_speculatively(
+    bucket: str,
+    key: str,
+    image_bytes: bytes,
+    checkpoint: StageCheckpoint = None,
+    send_bytes: bool = False
+) -> Dict[str, Any]:
+    """
+    Rekognitionの結果を待たずに画像だけでClaudeに識別させ、両方の完了後に座標で照合
+    （所要時間は両者の合計ではなく長い方になる）
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        image_bytes: 取り込み済みの画像のバイトデータ
+        checkpoint: 段階の出力の記録
+        send_bytes: 物体検出でS3上の画像ではなくimage_bytesを送る
+    
+    Returns:
+        マージされた最終結果（merge_resultsと同じ形式、除外した場合はrejectionを含む）
+    """
+    # RekognitionはS3上の画像を読めるため、エンコードより先に開始する
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        detect_future = executor.submit(
+            contextvars.copy_context().run,
+            handler.detect_objects_with_checkpoint, bucket, key, image_bytes, checkpoint, send_bytes
+        )
+        step_start = datetime.now()
+        image_base64 = handler.encode_image_with_checkpoint(image_bytes, checkpoint)
+        # 通常の分析と同じプロンプト・出力モードで、物体の一覧を空にして座標付きの追加検出として返させる
+        claude_result = handler.analyze_equipment_with_claude(image_base64, [], checkpoint=checkpoint)
+        equipment_list = [e for e in claude_result.get('equipment', []) if e.get('source') == 'claude']
+        logger.info(f"Claude識別（画像のみ）: {len(equipment_list)}個の機器 (所要時間: {(datetime.now() - step_start).total_seconds():.2f}秒)")
+        rekognition_result = detect_future.result()
+    
+    # 物体が1つも無い画像は除外（QUALITY_REJECT_EMPTYが有効な場合、Claudeの応答は使わない）
+    reason = evaluate_detections(rekognition_result) if handler.QUALITY_GATE_ENABLED else None
+    if reason:
+        return handler.reject_image(key, reason)
+    
+    return reconcile_with_detections({'equipment': equipment_list}, rekognition_result)
+
+
+def bbox_center_distance(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """
+    2つのバウンディングボックスの中心の距離（大きい方のボックスの対角線に対する割合）
+    
+    Args:
+        a: バウンディングボックス（パーセンテージ）
+        b: バウンディングボックス（パーセンテージ）
+    
+    Returns:
+        距離（0で中心が一致）
+    """
+    dx = (a['x'] + a['width'] / 2) - (b['x'] + b['width'] / 2)
+    dy = (a['y'] + a['height'] / 2) - (b['y'] + b['height'] / 2)
+    diagonal = max(math.hypot(a['width'], a['height']), math.hypot(b['width'], b['height']))
+    return math.hypot(dx, dy) / diagonal if diagonal > 0 else float('inf')
+
+
+def reconcile_with_detections(
+    claude_result: Dict[str, Any],
+    detected_objects: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    画像だけで識別したClaudeの機器を物体検出の結果と照合
+    
+    IoU、またはボックスの中心の距離（大きさが近い場合のみ）で対応付け、IoUの大きい組から1対1で決める
+    対応した機器はRekognitionの正確な座標を使い、対応しない機器はClaudeの追加検出として扱う
+    
+    Args:
+        claude_result: Claudeの識別結果（機器ごとに座標を含む）
+        detected_objects: Rekognitionで検出された物体リスト
+    
+    Returns:
+        マージされた最終結果（merge_resultsと同じ形式）
+    """
+    equipment_list = claude_result.get('equipment', [])
+    candidates = []
+    for i, equipment in enumerate(equipment_list):
+        for j, obj in enumerate(detected_objects):
+            a, b = equipment['bbox'], obj['bbox']
+            iou = handler.bbox_iou(a, b)
+            distance = bbox_center_distance(a, b)
+            areas = sorted([a['width'] * a['height'], b['width'] * b['height']])
+            similar_size = areas[1] > 0 and areas[0] / areas[1] >= SPECULATIVE_MIN_AREA_RATIO
+            if iou >= SPECULATIVE_MIN_IOU or (similar_size and distance <= SPECULATIVE_MAX_CENTER_DISTANCE):
+                candidates.append((-iou, distance, i, j))
+    
+    matches = {}
+    for _, _, i, j in sorted(candidates):
+        if i not in matches and j not in matches.values():
+            matches[i] = j
+    
+    identified = []
+    for i, equipment in enumerate(equipment_list):
+        if i in matches:
+            identified.append(dict(equipment, source='rekognition', object_index=matches[i]))
+        else:
+            identified.append(dict(equipment, source='claude'))
+    
+    logger.info(f"座標の照合: {len(matches)}/{len(equipment_list)}個の機器を検出結果と対応付け")
+    return handler.merge_results(detected_objects, {'equipment': identified})
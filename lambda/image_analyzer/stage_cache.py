@@ -0,0 +1,182 @@
+"""
+技術局長 - 分析の段階ごとの出力のキャッシュ
+
+プロンプトやモデルを変えて再分析する場合に、変わっていない決定的な段階
+（圧縮した画像・物体検出の結果など）を再実行しないよう、段階ごとの出力を記録する
+
+キーは 段階名 / 段階のバージョン / ETag / imageKey で、段階のバージョンは
+その段階の出力を決めるパラメータ（圧縮の設定・検出のパラメータ・リクエストボディなど）のハッシュ
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+from typing import Dict, Any
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# 段階の出力を置くS3のプレフィックス（アップロードのイベント通知の対象外にする）
+STAGE_CACHE_PREFIX = os.environ.get('STAGE_CACHE_PREFIX', 'derived/stages/')
+
+# 段階名
+STAGE_DERIVATIVE = 'derivative'          # モデルに送る圧縮済みの画像（JPEGなど）
+STAGE_DETECTIONS = 'detections'          # 物体検出の結果（JSON）
+STAGE_IDENTIFICATION = 'identification'  # Claude機器識別の生の応答（JSON）
+
+
+def stage_version(*parameters: Any) -> str:
+    """
+    段階の出力を決めるパラメータからバージョンを求める
+
+    Args:
+        parameters: JSONに変換できるパラメータ
+
+    Returns:
+        16桁の16進文字列
+    """
+    encoded = json.dumps(parameters, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+class StageCache:
+    """段階ごとの出力の保存先のインターフェース"""
+
+    def get(self, stage: str, image_key: str, etag: str, version: str) -> bytes:
+        """
+        記録済みの出力を読み込む
+
+        Args:
+            stage: 段階名
+            image_key: S3オブジェクトキー
+            etag: S3オブジェクトのETag
+            version: 段階のバージョン
+
+        Returns:
+            出力のバイトデータ（記録が無い場合はNone）
+        """
+        raise NotImplementedError
+
+    def put(self, stage: str, image_key: str, etag: str, version: str, data: bytes) -> None:
+        """
+        出力を記録
+
+        Args:
+            stage: 段階名
+            image_key: S3オブジェクトキー
+            etag: S3オブジェクトのETag
+            version: 段階のバージョン
+            data: 出力のバイトデータ
+        """
+        raise NotImplementedError
+
+    def get_json(self, stage: str, image_key: str, etag: str, version: str) -> Any:
+        """JSONの出力を読み込む（記録が無い・壊れている場合はNone）"""
+        data = self.get(stage, image_key, etag, version)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            logger.warning(f"段階の出力を読み込めません: {stage} {image_key}")
+            return None
+
+    def put_json(self, stage: str, image_key: str, etag: str, version: str, value: Any) -> None:
+        """JSONの出力を記録"""
+        self.put(stage, image_key, etag, version, json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+class MemoryStageCache(StageCache):
+    """プロセス内のキャッシュ（テスト・ローカル実行用）"""
+
+    def __init__(self):
+        self.items: Dict[tuple, bytes] = {}
+        self.lock = threading.Lock()
+
+    def get(self, stage: str, image_key: str, etag: str, version: str) -> bytes:
+        with self.lock:
+            return self.items.get((stage, version, etag, image_key))
+
+    def put(self, stage: str, image_key: str, etag: str, version: str, data: bytes) -> None:
+        with self.lock:
+            self.items[(stage, version, etag, image_key)] = data
+
+
+class S3StageCache(StageCache):
+    """
+    S3のキャッシュ
+
+    オブジェクト: <prefix><段階名>/<バージョン>/<ETag>/<imageKey>
+    """
+
+    def __init__(self, s3_client: Any, bucket: str, prefix: str = STAGE_CACHE_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def object_key(self, stage: str, image_key: str, etag: str, version: str) -> str:
+        etag = (etag or 'unknown').strip('"')
+        return f"{self.prefix}{stage}/{version}/{etag}/{image_key}"
+
+    def get(self, stage: str, image_key: str, etag: str, version: str) -> bytes:
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self.object_key(stage, image_key, etag, version)
+            )
+            return response['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def put(self, stage: str, image_key: str, etag: str, version: str, data: bytes) -> None:
+        self.s3_client.put_object(
+            Bucket=self.bucket, Key=self.object_key(stage, image_key, etag, version), Body=data
+        )
+
+
+class StageCheckpoint:
+    """
+    1枚の画像の段階の出力の記録（キャッシュ・imageKey・ETagをまとめる）
+
+    記録の読み書きに失敗しても分析は続ける（記録が無いものとして扱う）
+    """
+
+    def __init__(self, cache: StageCache, image_key: str, etag: str):
+        self.cache = cache
+        self.image_key = image_key
+        self.etag = etag
+
+    def for_variant(self, variant: str) -> 'StageCheckpoint':
+        """同じ画像から作った別の入力（関心領域の切り出し画像など）の出力の記録"""
+        return StageCheckpoint(self.cache, f"{self.image_key}#{variant}", self.etag)
+
+    def load(self, stage: str, version: str) -> bytes:
+        """記録済みの出力を読み込む（記録が無い場合はNone）"""
+        try:
+            return self.cache.get(stage, self.image_key, self.etag, version)
+        except Exception as e:
+            logger.warning(f"段階の出力の読み込みエラー: {stage} {self.image_key}: {e}")
+            return None
+
+    def save(self, stage: str, version: str, data: bytes) -> None:
+        """出力を記録"""
+        try:
+            self.cache.put(stage, self.image_key, self.etag, version, data)
+        except Exception as e:
+            logger.warning(f"段階の出力の記録エラー: {stage} {self.image_key}: {e}")
+
+    def load_json(self, stage: str, version: str) -> Any:
+        """JSONの出力を読み込む（記録が無い・壊れている場合はNone）"""
+        try:
+            return self.cache.get_json(stage, self.image_key, self.etag, version)
+        except Exception as e:
+            logger.warning(f"段階の出力の読み込みエラー: {stage} {self.image_key}: {e}")
+            return None
+
+    def save_json(self, stage: str, version: str, value: Any) -> None:
+        """JSONの出力を記録"""
+        self.save(stage, version, json.dumps(value, ensure_ascii=False).encode('utf-8'))
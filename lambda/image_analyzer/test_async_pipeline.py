@@ -0,0 +1,253 @@
+"""
+非同期の分析パイプラインのユニットテスト
+"""
+
+import json
+import asyncio
+import pytest
+from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError
+
+import handler
+from concurrency_limit import AimdConcurrencyLimit
+from async_pipeline import process_images_async, save_result_to_dynamodb_async, invoke_bedrock_model_async
+from test_handler import make_jpeg
+
+
+class FakeBody:
+    """aiobotocoreのStreamingBody"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def read(self) -> bytes:
+        return self.data
+
+
+class FakeS3:
+    async def get_object(self, Bucket: str, Key: str) -> dict:
+        return {'Body': FakeBody(make_jpeg(64, 48))}
+
+
+class FakeRekognition:
+    async def detect_labels(self, Image: dict, **kwargs) -> dict:
+        return {'Labels': [{'Name': 'Monitor', 'Instances': [{
+            'Confidence': 95.0,
+            'BoundingBox': {'Left': 0.1, 'Top': 0.2, 'Width': 0.3, 'Height': 0.4}
+        }]}]}
+
+
+class FakeBedrock:
+    """呼び出しの同時実行数を記録するBedrock"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def invoke_model(self, modelId: str, body: str) -> dict:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return {'body': FakeBody(json.dumps({'content': [{'text': json.dumps({'equipment': [{
+            'source': 'rekognition', 'object_index': 0,
+            'name': 'モニター', 'risk_level': 'SAFE', 'description': '表示'
+        }]})}]}).encode())}
+
+
+class FakeDynamoDB:
+    def __init__(self, error_code: str = None):
+        self.items = []
+        self.error_code = error_code
+
+    async def put_item(self, **kwargs) -> dict:
+        if self.error_code:
+            raise ClientError({'Error': {'Code': self.error_code}}, 'PutItem')
+        self.items.append(kwargs)
+        return {}
+
+
+def make_clients(bedrock: FakeBedrock = None, dynamodb: FakeDynamoDB = None) -> dict:
+    return {
+        's3': FakeS3(),
+        'rekognition': FakeRekognition(),
+        'bedrock': bedrock or FakeBedrock(),
+        'dynamodb': dynamodb or FakeDynamoDB()
+    }
+
+
+def make_images(count: int) -> list:
+    return [{'bucket': 'b', 'key': f"uploads/{i}.jpg", 'etag': f"e{i}"} for i in range(count)]
+
+
+@patch('handler.IDEMPOTENCY_ENABLED', False)
+@patch('handler.RESULTS_TABLE_NAME', 'results')
+class TestProcessImagesAsync:
+    """複数画像の非同期分析のテスト"""
+
+    def test_results_saved_per_image(self):
+        """画像ごとにマージした結果を保存し、process_imageと同じレスポンスを返す"""
+        dynamodb = FakeDynamoDB()
+        outcomes = asyncio.run(process_images_async(make_images(3), None, make_clients(dynamodb=dynamodb)))
+
+        assert [json.loads(o['body'])['equipmentCount'] for o in outcomes] == [1, 1, 1]
+        saved = {item['Item']['imageKey']['S']: item for item in dynamodb.items}
+        assert set(saved) == {'uploads/0.jpg', 'uploads/1.jpg', 'uploads/2.jpg'}
+        assert saved['uploads/0.jpg']['TableName'] == 'results'
+        assert saved['uploads/0.jpg']['Item']['etag'] == {'S': 'e0'}
+        assert 'B' in saved['uploads/0.jpg']['Item']['result']
+
+    @patch('handler.notify_completion')
+    def test_completion_notified_after_save(self, mock_notify):
+        """保存した画像ごとに完了を通知"""
+        asyncio.run(process_images_async(make_images(2), None, make_clients()))
+
+        assert sorted(c[0][0] for c in mock_notify.call_args_list) == ['uploads/0.jpg', 'uploads/1.jpg']
+
+    def test_bedrock_concurrency_bounded(self):
+        """全画像で共有するBedrock同時呼び出し数の上限（同期版と同じAIMDの上限）を守る"""
+        bedrock = FakeBedrock(delay=0.02)
+        with patch('handler.bedrock_concurrency', AimdConcurrencyLimit(2, max_limit=2)):
+            asyncio.run(process_images_async(make_images(8), None, make_clients(bedrock=bedrock)))
+        assert bedrock.max_in_flight == 2
+
+    def test_one_failure_isolated(self):
+        """1枚の失敗は他の画像に影響しない"""
+        clients = make_clients()
+
+        async def failing_get_object(Bucket: str, Key: str) -> dict:
+            if Key == 'uploads/1.jpg':
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            return {'Body': FakeBody(make_jpeg(64, 48))}
+        clients['s3'].get_object = failing_get_object
+
+        outcomes = asyncio.run(process_images_async(make_images(3), None, clients))
+
+        assert isinstance(outcomes[1], ClientError)
+        assert outcomes[0]['statusCode'] == 200 and outcomes[2]['statusCode'] == 200
+
+    @patch('handler.INVENTORY_ENABLED', True)
+    @patch('handler.process_image')
+    def test_sync_only_features_fall_back(self, mock_process):
+        """同期版にしか無い処理が必要な場合は同期版で分析"""
+        mock_process.return_value = {'statusCode': 200}
+        outcomes = asyncio.run(process_images_async(make_images(1), None, make_clients()))
+        mock_process.assert_called_once_with('b', 'uploads/0.jpg', 'e0', None)
+        assert outcomes == [{'statusCode': 200}]
+
+    @patch('handler.ROI_CROP_ENABLED', True)
+    @patch('handler.ENABLE_CROP_REFINEMENT', True)
+    @patch('handler.refine_positions_with_crops', side_effect=lambda image_bytes, equipment: equipment)
+    @patch('handler.process_image')
+    def test_roi_and_refinement_stay_async(self, mock_process, mock_refine):
+        """関心領域の切り出し・位置調整は同期版に切り替えずに行う"""
+        outcomes = asyncio.run(process_images_async(make_images(1), None, make_clients()))
+        mock_process.assert_not_called()
+        mock_refine.assert_called_once()
+        assert json.loads(outcomes[0]['body'])['equipmentCount'] == 1
+
+    @patch('handler.DETECTOR_BACKEND', 'onnx')
+    @patch('handler.detect_objects')
+    @patch('handler.process_image')
+    def test_local_detector_stays_async(self, mock_process, mock_detect):
+        """ローカル検出の画像も非同期版で分析（検出はスレッドで実行）"""
+        mock_detect.return_value = [{'label': 'Monitor', 'confidence': 90.0, 'bbox': {'x': 1, 'y': 2, 'width': 3, 'height': 4}}]
+        outcomes = asyncio.run(process_images_async(make_images(1), None, make_clients()))
+        mock_process.assert_not_called()
+        mock_detect.assert_called_once()
+        assert json.loads(outcomes[0]['body'])['equipmentCount'] == 1
+
+
+@patch('handler.RESULTS_TABLE_NAME', 'results')
+@patch('handler.IDEMPOTENCY_ENABLED', True)
+@patch('handler.release_image_lease')
+@patch('handler.acquire_image_lease', return_value='acquired')
+def test_deadline_cancels_and_releases_lease(mock_acquire, mock_release):
+    """実行期限を過ぎた画像はキャンセルしてリースを解放"""
+    context = Mock(aws_request_id='req-1')
+    context.get_remaining_time_in_millis.return_value = 5050
+
+    outcomes = asyncio.run(process_images_async(
+        make_images(2), context, make_clients(bedrock=FakeBedrock(delay=5))
+    ))
+
+    assert all(isinstance(outcome, TimeoutError) for outcome in outcomes)
+    assert sorted(call[0][0] for call in mock_release.call_args_list) == ['uploads/0.jpg', 'uploads/1.jpg']
+
+
+@patch('handler.IDEMPOTENCY_ENABLED', True)
+@patch('handler.acquire_image_lease', return_value='in_flight')
+def test_in_flight_image_reported_as_failure(mock_acquire):
+    """他の実行が処理中の画像は成功にせず、再試行対象として返す"""
+    from idempotency import LeaseInFlight
+    bedrock = FakeBedrock()
+    outcomes = asyncio.run(process_images_async(make_images(1), None, make_clients(bedrock=bedrock)))
+    assert isinstance(outcomes[0], LeaseInFlight)
+    assert bedrock.max_in_flight == 0
+
+
+@patch('handler.get_rate_limiter')
+def test_failed_invoke_refunds_reservation(mock_get_limiter):
+    """呼び出しに失敗した場合は確保した見積もりを返す"""
+    limiter = Mock()
+    limiter.acquire.return_value = {'window': 1, 'cost': 3000}
+    mock_get_limiter.return_value = limiter
+
+    class ThrottledBedrock:
+        async def invoke_model(self, modelId: str, body: str) -> dict:
+            raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'InvokeModel')
+
+    with pytest.raises(ClientError):
+        with patch('handler.bedrock_concurrency', AimdConcurrencyLimit(4)):
+            asyncio.run(invoke_bedrock_model_async(ThrottledBedrock(), {'max_tokens': 10, 'messages': []}))
+
+    limiter.refund.assert_called_once_with({'window': 1, 'cost': 3000})
+    limiter.settle.assert_not_called()
+
+
+@patch('handler.get_rate_limiter', return_value=None)
+def test_throttling_lowers_shared_limit(mock_get_limiter):
+    """過負荷の応答は同期版と共有する同時呼び出し数の上限を減らす"""
+    class ThrottledBedrock:
+        async def invoke_model(self, modelId: str, body: str) -> dict:
+            raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'InvokeModel')
+
+    concurrency = AimdConcurrencyLimit(4)
+    with patch('handler.bedrock_concurrency', concurrency), patch('concurrency_limit.emit_metric'):
+        with pytest.raises(ClientError):
+            asyncio.run(invoke_bedrock_model_async(ThrottledBedrock(), {'max_tokens': 10, 'messages': []}))
+
+    assert concurrency.current_limit == 2
+    assert concurrency.in_flight == 0
+
+
+def test_save_skipped_when_lease_taken_over():
+    """リースが引き継がれた場合は保存しない"""
+    dynamodb = FakeDynamoDB(error_code='ConditionalCheckFailedException')
+    saved = asyncio.run(save_result_to_dynamodb_async(dynamodb, 'uploads/a.jpg', {'equipment': []}, 'e', 'owner'))
+    assert saved is False
+
+
+@patch('handler.ASYNC_PIPELINE_ENABLED', True)
+@patch('async_pipeline.run_async_pipeline')
+def test_sqs_batch_uses_async_pipeline(mock_run):
+    """SQSバッチを非同期パイプラインで分析し、失敗した画像のメッセージだけを返す"""
+    mock_run.return_value = [
+        {'statusCode': 200},
+        RuntimeError('Bedrock timeout'),
+        ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+    ]
+    records = [
+        {'messageId': f"m{i}", 'body': json.dumps({'Records': [{'s3': {
+            'bucket': {'name': 'b'}, 'object': {'key': f"uploads/{i}.jpg", 'eTag': 'e'}
+        }}]})}
+        for i in range(3)
+    ]
+
+    response = handler.lambda_handler({'Records': [dict(r, eventSource='aws:sqs') for r in records]}, None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    assert len(mock_run.call_args[0][0]) == 3
@@ -0,0 +1,122 @@
+"""
+再分析（バックフィル）のユニットテスト
+"""
+
+import json
+import boto3
+import pytest
+from unittest.mock import patch
+from moto import mock_aws
+
+import handler
+from backfill import run_backfill, load_checkpoint
+from result_codec import decode_result
+from stage_cache import MemoryStageCache
+from test_handler import make_jpeg
+
+
+DETECTIONS = [{'label': 'Monitor', 'confidence': 90.0, 'bbox': {'x': 1, 'y': 2, 'width': 3, 'height': 4}}]
+RESPONSE = {'content': [{'type': 'text', 'text': json.dumps({'equipment': [
+    {'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': '表示'}
+]})}]}
+OPTIONS = {'label': 'new-prompt', 'prompt_version': 'verbose', 'output_mode': 'text', 'model_id': 'model-a'}
+
+
+@pytest.fixture
+def aws():
+    """moto上の画像バケット・結果テーブル"""
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='images')
+        for name in ('a', 'b', 'c'):
+            s3.put_object(Bucket='images', Key=f"uploads/{name}.jpg", Body=make_jpeg(64, 48))
+        table = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+            TableName='results',
+            KeySchema=[{'AttributeName': 'imageKey', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'imageKey', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        table.put_item(Item={'imageKey': 'uploads/a.jpg', 'status': 'completed', 'equipmentCount': 3})
+        with patch('handler.s3_client', s3), \
+                patch('handler.dynamodb', boto3.resource('dynamodb', region_name='us-east-1')), \
+                patch('handler.RESULTS_TABLE_NAME', 'results'), \
+                patch('handler.CATALOG_ENABLED', False):
+            yield table
+
+
+@patch('handler.invoke_bedrock_model', return_value=RESPONSE)
+@patch('handler.detect_objects', return_value=DETECTIONS)
+class TestRunBackfill:
+    """キーの範囲の再分析のテスト"""
+
+    def test_versioned_result_alongside_existing(self, mock_detect, mock_invoke, aws):
+        """再分析の結果は既存の結果を変えずに別の属性に書き込む"""
+        stats = run_backfill('images', 'uploads/', OPTIONS, MemoryStageCache(), workers=2)
+
+        assert stats['processed'] == 3 and stats['failed'] == 0
+        item = aws.get_item(Key={'imageKey': 'uploads/a.jpg'})['Item']
+        assert item['status'] == 'completed' and item['equipmentCount'] == 3
+        version = item['backfill:new-prompt']
+        assert version['modelId'] == 'model-a'
+        assert decode_result(version)['equipment'][0]['name'] == 'モニター'
+        assert mock_invoke.call_args[0][1:] == ('batch', 'model-a')
+
+    def test_unchanged_stages_reused(self, mock_detect, mock_invoke, aws):
+        """モデルだけを変えた再分析では圧縮・物体検出をやり直さない"""
+        cache = MemoryStageCache()
+        run_backfill('images', 'uploads/', OPTIONS, cache)
+        stats = run_backfill('images', 'uploads/', dict(OPTIONS, label='model-b', model_id='model-b'), cache)
+
+        assert mock_detect.call_count == 3
+        assert mock_invoke.call_count == 6
+        assert stats['derivative_hits'] == 3 and stats['detections_hits'] == 3
+        assert stats['identification_hits'] == 0
+
+    def test_same_prompt_and_model_not_reinvoked(self, mock_detect, mock_invoke, aws):
+        """同じプロンプト・モデルの機器識別は記録済みの応答を使う"""
+        cache = MemoryStageCache()
+        run_backfill('images', 'uploads/', OPTIONS, cache)
+        stats = run_backfill('images', 'uploads/', dict(OPTIONS, label='again'), cache)
+
+        assert mock_invoke.call_count == 3
+        assert stats['identification_hits'] == 3
+
+    def test_key_range(self, mock_detect, mock_invoke, aws):
+        """start_after・end_beforeの範囲だけを処理"""
+        stats = run_backfill('images', 'uploads/', OPTIONS, MemoryStageCache(),
+                             start_after='uploads/a.jpg', end_before='uploads/c.jpg')
+        assert stats['processed'] == 1
+        assert 'backfill:new-prompt' in aws.get_item(Key={'imageKey': 'uploads/b.jpg'})['Item']
+        assert 'Item' not in aws.get_item(Key={'imageKey': 'uploads/c.jpg'})
+
+    def test_resume_from_checkpoint(self, mock_detect, mock_invoke, aws, tmp_path):
+        """チェックポイントの続きから再開し、失敗した画像を再試行"""
+        checkpoint = tmp_path / 'new-prompt.checkpoint.json'
+        checkpoint.write_text(json.dumps({
+            'label': 'new-prompt', 'lastKey': 'uploads/b.jpg', 'failedKeys': ['uploads/a.jpg'], 'processed': 2
+        }))
+
+        stats = run_backfill('images', 'uploads/', OPTIONS, MemoryStageCache(), checkpoint_path=str(checkpoint))
+
+        assert stats['processed'] == 2
+        assert sorted(call[0][1] for call in mock_detect.call_args_list) == ['uploads/a.jpg', 'uploads/c.jpg']
+        saved = json.loads(checkpoint.read_text())
+        assert saved['lastKey'] == 'uploads/c.jpg' and saved['failedKeys'] == []
+
+    def test_failures_recorded(self, mock_detect, mock_invoke, aws, tmp_path):
+        """失敗した画像はチェックポイントに記録して続行"""
+        mock_invoke.side_effect = [RESPONSE, RuntimeError('throttled'), RESPONSE]
+        checkpoint = tmp_path / 'cp.json'
+
+        stats = run_backfill('images', 'uploads/', OPTIONS, MemoryStageCache(),
+                             checkpoint_path=str(checkpoint), workers=1)
+
+        assert stats['failed'] == 1
+        assert json.loads(checkpoint.read_text())['failedKeys'] == ['uploads/b.jpg']
+
+
+def test_checkpoint_of_other_label_ignored(tmp_path):
+    """別のラベルのチェックポイントからは再開しない"""
+    checkpoint = tmp_path / 'cp.json'
+    checkpoint.write_text(json.dumps({'label': 'old', 'lastKey': 'uploads/z.jpg', 'failedKeys': []}))
+    assert load_checkpoint(str(checkpoint), 'new')['lastKey'] is None
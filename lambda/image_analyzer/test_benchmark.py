@@ -0,0 +1,109 @@
+"""
+ベンチマークのユニットテスト
+"""
+
+import json
+from unittest.mock import patch
+from benchmark import load_corpus, run_prompt_benchmark, run_detector_benchmark, detection_recall, summarize
+
+
+class TestLoadCorpus:
+    """コーパス読み込みのテスト"""
+    
+    def test_load_corpus_with_detections(self, tmp_path):
+        """画像と記録済みRekognition結果を読み込む"""
+        (tmp_path / 'rack.jpg').write_bytes(b'image')
+        (tmp_path / 'rack.rekognition.json').write_text(json.dumps([{'label': 'Monitor'}]))
+        (tmp_path / 'notes.txt').write_text('ignored')
+        
+        corpus = load_corpus(str(tmp_path))
+        assert len(corpus) == 1
+        assert corpus[0]['name'] == 'rack.jpg'
+        assert corpus[0]['detections'] == [{'label': 'Monitor'}]
+        assert corpus[0]['truth'] is None
+
+
+class TestRunPromptBenchmark:
+    """プロンプトベンチマークのテスト"""
+    
+    @patch('handler.invoke_equipment_identification')
+    def test_compare_versions(self, mock_invoke):
+        """バージョンごとに出力トークン数を集計"""
+        def fake_invoke(image_base64, detections, prompt_version, output_mode):
+            if prompt_version == 'compact':
+                return {
+                    'content': [{'text': json.dumps({'e': [{'i': 0, 'n': 'A', 'r': 'S', 'd': 'x'}]})}],
+                    'usage': {'input_tokens': 1000, 'output_tokens': 20}
+                }
+            return {
+                'content': [{'text': json.dumps({'equipment': [{
+                    'source': 'rekognition', 'object_index': 0,
+                    'name': 'A', 'risk_level': 'SAFE', 'description': 'x'
+                }]})}],
+                'usage': {'input_tokens': 1200, 'output_tokens': 60}
+            }
+        mock_invoke.side_effect = fake_invoke
+        
+        corpus = [{'name': 'a.jpg', 'image_bytes': b'img', 'detections': []}]
+        results = run_prompt_benchmark(corpus, ['verbose', 'compact'], repeat=2)
+        
+        assert results['verbose/text']['calls'] == 2
+        assert results['verbose/text']['output_tokens_mean'] == 60
+        assert results['compact/text']['output_tokens_mean'] == 20
+        assert results['compact/text']['equipment_mean'] == 1
+    
+    @patch('handler.invoke_equipment_identification')
+    def test_parse_failure_rate(self, mock_invoke):
+        """textモードとtoolモードの解析失敗率を集計"""
+        def fake_invoke(image_base64, detections, prompt_version, output_mode):
+            if output_mode == 'tool':
+                return {'content': [{
+                    'type': 'tool_use',
+                    'name': 'report_equipment',
+                    'input': {'equipment': []}
+                }]}
+            return {'content': [{'type': 'text', 'text': '{"equipment": [ 途中で切れた'}]}
+        mock_invoke.side_effect = fake_invoke
+        
+        corpus = [{'name': 'a.jpg', 'image_bytes': b'img', 'detections': []}]
+        results = run_prompt_benchmark(corpus, ['verbose'], output_modes=['text', 'tool'])
+        
+        assert results['verbose/text']['parse_failure_rate'] == 1.0
+        assert results['verbose/tool']['parse_failure_rate'] == 0.0
+
+
+class TestDetectorBenchmark:
+    """物体検出ベンチマークのテスト"""
+    
+    def box(self, x: float, y: float) -> dict:
+        return {'label': 'Monitor', 'confidence': 90.0, 'bbox': {'x': x, 'y': y, 'width': 20, 'height': 20}}
+    
+    def test_recall_one_to_one(self):
+        """1つの検出は1つの基準にだけ対応させる"""
+        reference = [self.box(0, 0), self.box(2, 2)]
+        assert detection_recall(reference, [self.box(1, 1)]) == 0.5
+        assert detection_recall(reference, [self.box(0, 0), self.box(2, 2)]) == 1.0
+        assert detection_recall([], []) == 1.0
+    
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_local_detector')
+    def test_compare_backends(self, mock_local, mock_rekognition):
+        """バックエンドごとに再現率を集計し、onnxはまとめて推論する"""
+        mock_rekognition.return_value = [self.box(0, 0)]
+        mock_local.return_value.detect_batch.side_effect = lambda images: [[] for _ in images]
+        corpus = [
+            {'name': f"{i}.jpg", 'image_bytes': b'img', 'detections': [self.box(0, 0)], 'truth': None}
+            for i in range(3)
+        ]
+        
+        results = run_detector_benchmark(corpus, ['rekognition', 'onnx'], batch_size=2)
+        
+        assert results['detector/rekognition']['recall_mean'] == 1.0
+        assert results['detector/onnx']['recall_mean'] == 0.0
+        assert results['detector/onnx']['images'] == 3
+        assert mock_local.return_value.detect_batch.call_count == 2
+
+
+def test_summarize_empty():
+    """サンプルが無い場合も集計できる"""
+    assert summarize([])['calls'] == 0
@@ -0,0 +1,86 @@
+"""
+一括分析のユニットテスト
+"""
+
+import json
+from unittest.mock import patch
+from bulk_analyze import list_images, load_completed, run_bulk, analyze_prepared
+from rate_limiter import PRIORITY_BATCH
+from test_handler import make_jpeg
+
+
+CLAUDE_RESULT = {'equipment': [
+    {'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': '表示'}
+]}
+DETECTIONS = [{'label': 'Monitor', 'confidence': 90.0, 'bbox': {'x': 1, 'y': 2, 'width': 3, 'height': 4}}]
+
+
+class TestListImages:
+    """画像の列挙のテスト"""
+    
+    def test_directory_recursive(self, tmp_path):
+        """ディレクトリを再帰的に探し、画像以外は除く"""
+        (tmp_path / 'room-b').mkdir()
+        (tmp_path / 'room-b' / '1.JPG').write_bytes(b'x')
+        (tmp_path / 'a.png').write_bytes(b'x')
+        (tmp_path / 'notes.txt').write_text('x')
+        
+        paths = list_images(str(tmp_path))
+        assert [p.replace(str(tmp_path), '') for p in paths] == ['/a.png', '/room-b/1.JPG']
+    
+    def test_manifest_relative_paths(self, tmp_path):
+        """マニフェストの相対パスはマニフェストの場所から解決し、コメント・重複は除く"""
+        manifest = tmp_path / 'photos.txt'
+        manifest.write_text('# 1階\nrack.jpg\n\nrack.jpg\n/abs/desk.jpg\n')
+        assert list_images(manifest=str(manifest)) == [str(tmp_path / 'rack.jpg'), '/abs/desk.jpg']
+
+
+def test_load_completed_ignores_failed_and_truncated(tmp_path):
+    """完了した画像だけを記録し、途中で切れた行は無視"""
+    output = tmp_path / 'results.jsonl'
+    output.write_text(
+        json.dumps({'path': 'a.jpg', 'status': 'completed'}) + '\n'
+        + json.dumps({'path': 'b.jpg', 'status': 'failed'}) + '\n'
+        + '{"path": "c.jpg", "sta'
+    )
+    assert load_completed(str(output)) == {'a.jpg'}
+
+
+@patch('handler.analyze_equipment_with_claude')
+@patch('handler.detect_objects')
+def test_analyze_prepared_uses_batch_priority(mock_detect, mock_claude):
+    """Bedrockはbatch優先度で呼び出し、段階ごとの所要時間を記録"""
+    from rate_limiter import current_priority
+    priorities = []
+    mock_detect.return_value = DETECTIONS
+    mock_claude.side_effect = lambda *args: priorities.append(current_priority.get()) or CLAUDE_RESULT
+    
+    record = analyze_prepared('a.jpg', {'image_base64': 'aW1n', 'source_bytes': 3, 'preprocess_seconds': 0.1})
+    
+    assert priorities == [PRIORITY_BATCH]
+    assert mock_detect.call_args[0] == (None, None, b'img')
+    assert record['status'] == 'completed'
+    assert record['equipment'][0]['bbox'] == DETECTIONS[0]['bbox']
+    assert set(record['timing']) == {'preprocess', 'detect', 'identify'}
+
+
+@patch('handler.analyze_equipment_with_claude', return_value=CLAUDE_RESULT)
+@patch('handler.detect_objects', return_value=DETECTIONS)
+def test_run_bulk_resumes(mock_detect, mock_claude, tmp_path):
+    """結果を追記し、再実行では完了済みの画像をスキップ"""
+    paths = []
+    for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+        (tmp_path / name).write_bytes(make_jpeg(32, 24))
+        paths.append(str(tmp_path / name))
+    paths.append(str(tmp_path / 'missing.jpg'))
+    output = str(tmp_path / 'results.jsonl')
+    
+    first = run_bulk(paths, output, cpu_workers=2, io_workers=2)
+    second = run_bulk(paths, output, cpu_workers=1, io_workers=1)
+    
+    assert first == {'total': 4, 'skipped': 0, 'completed': 3, 'failed': 1}
+    assert second == {'total': 4, 'skipped': 3, 'completed': 0, 'failed': 1}
+    assert mock_claude.call_count == 3
+    with open(output, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(r['path'] for r in records if r['status'] == 'completed') == sorted(paths[:3])
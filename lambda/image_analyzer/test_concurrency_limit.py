@@ -0,0 +1,218 @@
+"""
+Bedrockの同時呼び出し数の自動調整（AIMD）のユニットテスト
+"""
+
+import asyncio
+import threading
+import pytest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+
+from concurrency_limit import (
+    AimdConcurrencyLimit,
+    classify_error,
+    OUTCOME_SUCCESS,
+    OUTCOME_OVERLOADED,
+    OUTCOME_ERROR
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def throttling_error() -> ClientError:
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}}, 'InvokeModel')
+
+
+def make_limit(initial: int = 4, **kwargs) -> tuple:
+    clock = FakeClock()
+    return AimdConcurrencyLimit(initial, min_limit=1, max_limit=8, clock=clock, **kwargs), clock
+
+
+def run_calls(limit: AimdConcurrencyLimit, clock: FakeClock, count: int, latency: float = 1.0,
+              outcome: str = OUTCOME_SUCCESS) -> None:
+    """上限いっぱいまで同時に呼び出し、同じ遅延で返す"""
+    for _ in range(count):
+        started = [limit.acquire() for _ in range(limit.current_limit)]
+        clock.now += latency
+        for start in started:
+            limit.release(start, outcome)
+
+
+@patch('concurrency_limit.emit_metric')
+class TestAimdConcurrencyLimit:
+    """上限の増減のテスト"""
+
+    def test_additive_increase(self, mock_metric):
+        """上限を使い切って正常に返る間は、1往復ごとに1ずつ増やす"""
+        limit, clock = make_limit(4)
+        run_calls(limit, clock, 1)
+        assert limit.current_limit == 5
+        run_calls(limit, clock, 1)
+        assert limit.current_limit == 6
+        mock_metric.assert_any_call('BedrockConcurrencyLimit', 6, 'Count')
+
+    def test_capped_at_max(self, mock_metric):
+        """上限の最大値を超えない"""
+        limit, clock = make_limit(4)
+        run_calls(limit, clock, 20)
+        assert limit.current_limit == 8
+
+    def test_no_increase_when_underused(self, mock_metric):
+        """上限の半分も使っていない間は増やさない"""
+        limit, clock = make_limit(4)
+        for _ in range(10):
+            start = limit.acquire()
+            clock.now += 1
+            limit.release(start, OUTCOME_SUCCESS)
+        assert limit.current_limit == 4
+
+    def test_multiplicative_decrease_with_cooldown(self, mock_metric):
+        """過負荷では半分にし、同時に返った一連の過負荷では1回しか減らさない"""
+        limit, clock = make_limit(8)
+        started = [limit.acquire() for _ in range(8)]
+        clock.now += 1
+        for start in started:
+            limit.release(start, OUTCOME_OVERLOADED)
+        assert limit.current_limit == 4
+
+        clock.now += 10
+        run_calls(limit, clock, 1, outcome=OUTCOME_OVERLOADED)
+        assert limit.current_limit == 2
+        mock_metric.assert_any_call('BedrockThrottled', 1, 'Count')
+
+    def test_never_below_min(self, mock_metric):
+        """下限より小さくしない"""
+        limit, clock = make_limit(2)
+        for _ in range(5):
+            clock.now += 10
+            run_calls(limit, clock, 1, outcome=OUTCOME_OVERLOADED)
+        assert limit.current_limit == 1
+
+    def test_slow_responses_hold(self, mock_metric):
+        """遅延が基準の2倍を超える応答では増やさない"""
+        limit, clock = make_limit(4)
+        limit.baseline_latency = 1.0
+        run_calls(limit, clock, 1, latency=5.0)
+        assert limit.current_limit == 4
+
+    def test_errors_hold(self, mock_metric):
+        """過負荷以外のエラーが続く間は増やさない（減らしもしない）"""
+        limit, clock = make_limit(4)
+        run_calls(limit, clock, 3, outcome=OUTCOME_ERROR)
+        assert limit.current_limit == 4
+        run_calls(limit, clock, 1)
+        assert limit.current_limit == 4
+
+
+@patch('concurrency_limit.emit_metric')
+class TestSlot:
+    """呼び出しの囲み方のテスト"""
+
+    def test_throttling_classified_and_reraised(self, mock_metric):
+        """ThrottlingExceptionは過負荷として上限を減らし、例外はそのまま伝える"""
+        limit, clock = make_limit(4)
+        with pytest.raises(ClientError):
+            with limit.slot():
+                raise throttling_error()
+        assert limit.current_limit == 2
+        assert limit.in_flight == 0
+
+    def test_waits_for_free_slot(self, mock_metric):
+        """上限に達している間は、枠が返されるまで待つ"""
+        limit, _ = make_limit(1, latency_tolerance=1000)
+        entered = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with limit.slot():
+                entered.set()
+                release.wait(timeout=5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        assert entered.wait(timeout=5)
+
+        waiter_done = threading.Event()
+        waiter = threading.Thread(target=lambda: (limit.acquire(), waiter_done.set()))
+        waiter.start()
+        assert not waiter_done.wait(timeout=0.1)
+
+        release.set()
+        assert waiter_done.wait(timeout=5)
+        holder.join()
+        waiter.join()
+
+    def test_classify_error(self, mock_metric):
+        """過負荷のエラーコードだけを過負荷とみなす"""
+        assert classify_error(throttling_error()) == OUTCOME_OVERLOADED
+        validation = ClientError({'Error': {'Code': 'ValidationException', 'Message': ''}}, 'InvokeModel')
+        assert classify_error(validation) == OUTCOME_ERROR
+        assert classify_error(ValueError('x')) == OUTCOME_ERROR
+
+
+@patch('concurrency_limit.emit_metric')
+class TestAsyncSlot:
+    """非同期の呼び出しの囲み方のテスト"""
+
+    def test_bounded_and_feeds_back(self, mock_metric):
+        """同時に入れるのは上限の数までで、過負荷の応答で上限を減らす"""
+        limit, _ = make_limit(2, latency_tolerance=1000)
+        in_flight = []
+        peak = []
+
+        async def call():
+            async with limit.async_slot():
+                in_flight.append(1)
+                peak.append(len(in_flight))
+                await asyncio.sleep(0.01)
+                in_flight.pop()
+                raise throttling_error()
+
+        async def main():
+            return await asyncio.gather(*[call() for _ in range(6)], return_exceptions=True)
+
+        outcomes = asyncio.run(main())
+
+        assert max(peak) == 2
+        assert all(isinstance(outcome, ClientError) for outcome in outcomes)
+        assert limit.current_limit == 1
+        assert limit.in_flight == 0
+
+    def test_woken_by_thread_release(self, mock_metric):
+        """スレッドで確保した枠が返されると、待っている非同期の呼び出しが進む"""
+        limit, _ = make_limit(1)
+        started = limit.acquire()
+
+        async def main():
+            waiter = asyncio.create_task(limit.acquire_async())
+            await asyncio.sleep(0.05)
+            assert not waiter.done()
+            threading.Thread(target=limit.release, args=(started, OUTCOME_SUCCESS)).start()
+            await asyncio.wait_for(waiter, timeout=5)
+
+        asyncio.run(main())
+        assert limit.in_flight == 1
+
+    def test_cancelled_waiter_removed(self, mock_metric):
+        """キャンセルされた待機は枠を確保しない"""
+        limit, _ = make_limit(1)
+        started = limit.acquire()
+
+        async def main():
+            waiter = asyncio.create_task(limit.acquire_async())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(main())
+        limit.release(started, OUTCOME_SUCCESS)
+        assert limit.async_waiters == []
+        assert limit.in_flight == 0
+
@@ -0,0 +1,78 @@
+"""
+物体検出のバックエンドのユニットテスト
+"""
+
+import pytest
+from unittest.mock import Mock
+from detectors import ObjectDetector, OnnxDetector, non_max_suppression
+
+try:
+    import numpy as np
+except ImportError:
+    # onnxバックエンドを使うデプロイだけが依存を持つ
+    np = None
+
+requires_numpy = pytest.mark.skipif(np is None, reason='numpyが必要です')
+
+
+def make_output(candidates: list, class_count: int = 2) -> 'np.ndarray':
+    """YOLOv8形式の1枚分の出力（4 + クラス数 x 候補数）を作成"""
+    output = np.zeros((4 + class_count, len(candidates)), dtype=np.float32)
+    for column, (cx, cy, w, h, class_id, score) in enumerate(candidates):
+        output[:4, column] = [cx, cy, w, h]
+        output[4 + class_id, column] = score
+    return output
+
+
+def make_detector(**kwargs) -> OnnxDetector:
+    """推論セッションをモックにしたOnnxDetector"""
+    session = Mock()
+    session.get_inputs.return_value = [Mock(name='images')]
+    return OnnxDetector('model.onnx', ['Monitor', 'Keyboard'], input_size=100, session=session, **kwargs)
+
+
+@requires_numpy
+class TestPostprocess:
+    """モデル出力の変換のテスト"""
+
+    def test_same_shape_as_rekognition(self):
+        """Rekognitionと同じ {label, confidence, bbox（パーセンテージ）} を返す"""
+        detector = make_detector()
+        detections = detector.postprocess(make_output([(50, 50, 20, 10, 0, 0.9)]))
+        assert detections == [{
+            'label': 'Monitor',
+            'confidence': pytest.approx(90.0),
+            'bbox': {'x': pytest.approx(40.0), 'y': pytest.approx(45.0), 'width': pytest.approx(20.0), 'height': pytest.approx(10.0)}
+        }]
+
+    def test_low_score_dropped(self):
+        """最小スコア未満の候補は除く"""
+        detector = make_detector(score_threshold=0.5)
+        assert detector.postprocess(make_output([(50, 50, 20, 10, 0, 0.4)])) == []
+
+    def test_overlapping_same_class_suppressed(self):
+        """同じクラスの重なった候補は信頼度の高い方だけ残し、別クラスは残す"""
+        detector = make_detector()
+        detections = detector.postprocess(make_output([
+            (50, 50, 20, 20, 0, 0.6),
+            (51, 51, 20, 20, 0, 0.9),
+            (50, 50, 20, 20, 1, 0.7)
+        ]))
+        assert [(d['label'], round(d['confidence'])) for d in detections] == [('Monitor', 90), ('Keyboard', 70)]
+
+
+@requires_numpy
+def test_non_max_suppression_keeps_disjoint():
+    """重ならない候補はすべて残す"""
+    corners = np.array([[0, 0, 10, 10], [50, 50, 60, 60]], dtype=np.float32)
+    kept = non_max_suppression(corners, np.array([0.5, 0.8]), np.array([0, 0]), 0.5)
+    assert kept == [1, 0]
+
+
+def test_detect_uses_batch():
+    """detectは1枚のバッチとして推論する"""
+    class FakeDetector(ObjectDetector):
+        def detect_batch(self, images):
+            return [[{'label': 'Monitor'}] for _ in images]
+
+    assert FakeDetector().detect(b'img') == [{'label': 'Monitor'}]
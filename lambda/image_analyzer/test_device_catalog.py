@@ -0,0 +1,120 @@
+"""
+機器カタログのユニットテスト
+"""
+
+from unittest.mock import Mock
+from device_catalog import DeviceCatalog
+
+
+DEVICES = [
+    {
+        'name': 'Blackmagic Design ATEM Mini Pro',
+        'aliases': ['ATEM Mini Pro'],
+        'risk_level': 'DANGER',
+        'description': 'ライブプロダクションスイッチャー',
+        'manual_url': 'https://www.blackmagicdesign.com/support'
+    },
+    {
+        'name': 'Sony PVM-A250',
+        'aliases': ['PVM-A250'],
+        'risk_level': 'SAFE',
+        'description': '業務用の有機ELモニター'
+    }
+]
+
+
+class TestLookup:
+    """カタログ照合のテスト"""
+    
+    def test_alias_exact(self):
+        """別名の表記揺れ（全角・空白・大文字小文字）を吸収"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.lookup('ａｔｅｍ  mini pro')['name'] == 'Blackmagic Design ATEM Mini Pro'
+    
+    def test_generic_suffix(self):
+        """一般名詞が付いた名前も部分一致"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.lookup('Sony PVM-A250 モニター')['name'] == 'Sony PVM-A250'
+    
+    def test_fuzzy_typo(self):
+        """軽微な綴り違いはあいまい一致"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.lookup('Blackmagic Desgin ATEM Mini Pro')['name'] == 'Blackmagic Design ATEM Mini Pro'
+    
+    def test_different_model_number_not_matched(self):
+        """型番の数字が異なる機器は一致させない"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.lookup('Sony PVM-A170') is None
+    
+    def test_remote_tier_cached(self):
+        """DynamoDBのテーブルを2段目として引き、結果を記録する"""
+        table = Mock()
+        table.get_item.return_value = {'Item': {'name': 'Roland V-8HD', 'risk_level': 'DANGER'}}
+        catalog = DeviceCatalog(DEVICES, table)
+        
+        assert catalog.lookup('Roland V-8HD')['name'] == 'Roland V-8HD'
+        assert catalog.lookup('roland v8hd')['name'] == 'Roland V-8HD'
+        table.get_item.assert_called_once_with(Key={'normalizedName': 'rolandv8hd'})
+    
+    def test_bundled_file(self):
+        """同梱のカタログファイルを読み込める"""
+        catalog = DeviceCatalog.from_file()
+        assert catalog.lookup('ATEM Mini Pro') is not None
+
+
+class TestFindInText:
+    """前面パネルの印字の照合のテスト"""
+
+    def test_longest_key_in_panel_text(self):
+        """メーカー名などと連結した印字から長い型番を優先して見つける"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.find_in_text('Blackmagicdesign ATEM Mini Pro')['name'] == 'Blackmagic Design ATEM Mini Pro'
+
+    def test_other_numbers_on_panel_allowed(self):
+        """入力番号など他の数字があっても型番の数字が揃えば一致"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.find_in_text('1 2 3 4 PVM-A250 SONY')['name'] == 'Sony PVM-A250'
+
+    def test_longer_model_number_not_matched(self):
+        """型番の数字が途中で切れる場合（A2500）は一致させない"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.find_in_text('PVM-A2500') is None
+
+    def test_no_fuzzy_match(self):
+        """OCRの読み違いはあいまい一致させない"""
+        catalog = DeviceCatalog(DEVICES)
+        assert catalog.find_in_text('ATEM Mlni Pro') is None
+
+
+class TestEnrich:
+    """識別結果の補完のテスト"""
+    
+    def test_fill_from_catalog(self):
+        """正式名・マニュアルURLを補い、リスクレベルはより危険な方を残す"""
+        catalog = DeviceCatalog(DEVICES)
+        equipment = [{'name': 'ATEM Mini Pro', 'risk_level': 'WARNING', 'description': '', 'manual_url': 'https://example.com/fake'}]
+        
+        enriched = catalog.enrich(equipment)[0]
+        
+        assert enriched['name'] == 'Blackmagic Design ATEM Mini Pro'
+        assert enriched['risk_level'] == 'DANGER'
+        assert enriched['manual_url'] == 'https://www.blackmagicdesign.com/support'
+        assert enriched['description'] == 'ライブプロダクションスイッチャー'
+    
+    def test_model_risk_kept_when_more_dangerous(self):
+        """モデルの判定の方が危険ならそのまま"""
+        catalog = DeviceCatalog(DEVICES)
+        enriched = catalog.enrich([{'name': 'PVM-A250', 'risk_level': 'WARNING', 'description': '電源が入っている'}])[0]
+        assert enriched['risk_level'] == 'WARNING'
+        assert enriched['description'] == '電源が入っている'
+    
+    def test_verified_urls_only(self):
+        """カタログで確認できないURLを除く"""
+        catalog = DeviceCatalog(DEVICES)
+        equipment = [
+            {'name': '謎のラック', 'risk_level': 'WARNING', 'description': 'x', 'manual_url': 'https://example.com/a'},
+            {'name': 'PVM-A250', 'risk_level': 'SAFE', 'description': 'x', 'manual_url': 'https://example.com/b'}
+        ]
+        enriched = catalog.enrich(equipment, verified_urls_only=True)
+        assert 'manual_url' not in enriched[0]
+        assert 'manual_url' not in enriched[1]
@@ -0,0 +1,83 @@
+"""
+エッジ吸着のユニットテスト
+"""
+
+import time
+import pytest
+from io import BytesIO
+from PIL import Image, ImageDraw
+from edge_snapping import snap_equipment_to_edges, bbox_shift
+
+
+def make_panel_image(width: int = 1000, height: int = 800) -> bytes:
+    """暗い背景に明るい機器パネル (300,200)-(700,600) を描いたJPEG"""
+    image = Image.new('RGB', (width, height), (20, 20, 20))
+    ImageDraw.Draw(image).rectangle([300, 200, 700, 600], fill=(220, 220, 220))
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+
+class TestSnapEquipmentToEdges:
+    """エッジ吸着のテスト"""
+    
+    def test_snap_claude_box_to_panel(self):
+        """ずれたClaude検出分のボックスがパネルの外枠に吸着する"""
+        equipment = [{
+            'name': 'パネル',
+            'bbox': {'x': 33.0, 'y': 22.0, 'width': 36.0, 'height': 53.0},
+            'source': 'claude',
+            'confidence': 75.0
+        }]
+        snapped, report = snap_equipment_to_edges(make_panel_image(), equipment)
+        
+        bbox = snapped[0]['bbox']
+        assert bbox['x'] == pytest.approx(30.0, abs=0.5)
+        assert bbox['y'] == pytest.approx(25.0, abs=0.5)
+        assert bbox['x'] + bbox['width'] == pytest.approx(70.0, abs=0.5)
+        assert bbox['y'] + bbox['height'] == pytest.approx(75.0, abs=0.5)
+        assert report[0]['index'] == 0
+        assert report[0]['shift'] > 2
+        # 元のリストは変更しない
+        assert equipment[0]['bbox']['x'] == 33.0
+    
+    def test_rekognition_boxes_untouched(self):
+        """Rekognition検出分は対象外"""
+        equipment = [{
+            'name': 'モニター',
+            'bbox': {'x': 33.0, 'y': 22.0, 'width': 36.0, 'height': 53.0},
+            'source': 'rekognition',
+            'confidence': 95.0
+        }]
+        snapped, report = snap_equipment_to_edges(make_panel_image(), equipment)
+        assert snapped == equipment
+        assert report == []
+    
+    def test_no_edges_keeps_box(self):
+        """エッジが無い場合はボックスを動かさない"""
+        output = BytesIO()
+        Image.new('RGB', (400, 400), (128, 128, 128)).save(output, format='JPEG')
+        bbox = {'x': 10.0, 'y': 10.0, 'width': 50.0, 'height': 50.0}
+        snapped, report = snap_equipment_to_edges(
+            output.getvalue(), [{'name': 'A', 'bbox': bbox, 'source': 'claude'}]
+        )
+        assert snapped[0]['bbox'] == bbox
+        assert report[0]['shift'] == 0
+    
+    def test_runs_fast_on_large_image(self):
+        """大きな画像でも縮小デコードで高速に処理する"""
+        image_bytes = make_panel_image(4000, 3000)
+        equipment = [
+            {'name': f'機器{i}', 'bbox': {'x': 5 + i * 8, 'y': 20, 'width': 7, 'height': 30}, 'source': 'claude'}
+            for i in range(10)
+        ]
+        start = time.perf_counter()
+        snap_equipment_to_edges(image_bytes, equipment)
+        assert time.perf_counter() - start < 0.5
+
+
+def test_bbox_shift():
+    """各辺の移動量の最大値"""
+    before = {'x': 10, 'y': 10, 'width': 10, 'height': 10}
+    after = {'x': 12, 'y': 10, 'width': 10, 'height': 11}
+    assert bbox_shift(before, after) == 2
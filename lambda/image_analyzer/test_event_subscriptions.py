@@ -0,0 +1,52 @@
+"""
+分析完了を待つWebSocket接続の登録のユニットテスト
+"""
+
+import boto3
+import pytest
+from unittest.mock import patch
+from moto import mock_aws
+
+from event_subscriptions import lambda_handler
+
+
+@pytest.fixture
+def subscriptions():
+    """moto上の接続の登録テーブル"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        table = dynamodb.create_table(
+            TableName='subscriptions',
+            KeySchema=[
+                {'AttributeName': 'imageKey', 'KeyType': 'HASH'},
+                {'AttributeName': 'connectionId', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'imageKey', 'AttributeType': 'S'},
+                {'AttributeName': 'connectionId', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with patch('event_subscriptions.subscriptions_table', table):
+            yield table
+
+
+def connect_event(query: dict) -> dict:
+    """テスト用の$connectイベント"""
+    return {'queryStringParameters': query, 'requestContext': {'connectionId': 'conn-1', 'routeKey': '$connect'}}
+
+
+class TestConnect:
+    """接続の登録のテスト"""
+    
+    def test_registers_connection(self, subscriptions):
+        """画像キーと接続を有効期限付きで登録"""
+        assert lambda_handler(connect_event({'key': 'uploads/a.jpg'}), None) == {'statusCode': 200}
+        item = subscriptions.get_item(Key={'imageKey': 'uploads/a.jpg', 'connectionId': 'conn-1'})['Item']
+        assert item['ttl'] > 0
+    
+    def test_rejects_missing_or_foreign_key(self, subscriptions):
+        """画像キーが無い・アップロード先以外の場合は接続を拒否"""
+        assert lambda_handler(connect_event(None), None)['statusCode'] == 400
+        assert lambda_handler(connect_event({'key': 'derived/a.json'}), None)['statusCode'] == 400
+        assert subscriptions.scan()['Items'] == []
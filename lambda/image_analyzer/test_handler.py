@@ -13,8 +13,32 @@ from handler import (
     encode_image_to_base64,
     build_analysis_prompt,
     parse_bedrock_response,
-    save_result_to_dynamodb
+    parse_compact_equipment_response,
+    build_identification_prompt,
+    select_refinement_targets,
+    refine_positions_with_crops,
+    draw_bounding_boxes,
+    has_time_budget,
+    analyze_equipment_with_claude,
+    parse_tool_equipment_response,
+    save_result_to_dynamodb,
+    invoke_bedrock_model,
+    identify_equipment,
+    analyze_image,
+    assign_text_to_objects,
+    resolve_from_panel_text,
+    detect_objects,
+    extract_images_from_sqs_record,
+    get_stage_checkpoint,
+    encode_image_with_checkpoint,
+    identification_stage_version,
+    build_equipment_identification_body,
+    is_settled_failure,
+    build_result_item
 )
+from image_format import UnsupportedImageFormat, EXIF_ORIENTATION_TAG
+from detectors import current_detector_backend
+from stage_cache import MemoryStageCache, StageCheckpoint
 
 
 # テスト用のサンプルデータ
@@ -208,6 +232,218 @@ class TestParsBedrockResponse:
         assert len(result['equipment'][0]['description']) == 100
 
 
+class TestParseCompactEquipmentResponse:
+    """compact形式の応答解析のテスト"""
+    
+    def test_expand_to_verbose_shape(self):
+        """短縮キーを従来の形式に展開"""
+        response = {
+            'content': [{
+                'text': json.dumps({
+                    'e': [
+                        {'i': 2, 'n': 'Sony PVM-A250', 'r': 'S', 'd': '業務用モニター'},
+                        {'b': [10, 20, 30, 40], 'n': 'SDIコンバーター', 'r': 'D', 'd': '信号変換', 'u': 'https://example.com'}
+                    ]
+                })
+            }]
+        }
+        result = parse_compact_equipment_response(response)
+        assert result['equipment'] == [
+            {
+                'source': 'rekognition',
+                'object_index': 2,
+                'name': 'Sony PVM-A250',
+                'risk_level': 'SAFE',
+                'description': '業務用モニター'
+            },
+            {
+                'source': 'claude',
+                'bbox': {'x': 10, 'y': 20, 'width': 30, 'height': 40},
+                'name': 'SDIコンバーター',
+                'risk_level': 'DANGER',
+                'description': '信号変換',
+                'manual_url': 'https://example.com'
+            }
+        ]
+    
+    def test_invalid_items_are_skipped(self):
+        """不正なbboxや不明なリスクコードを検証"""
+        response = {
+            'content': [{
+                'text': '```json\n' + json.dumps({
+                    'e': [
+                        {'b': [10, 20, 30], 'n': 'A', 'r': 'S', 'd': 'NG'},
+                        {'i': 0, 'n': 'B', 'r': 'X', 'd': 'OK'}
+                    ]
+                }) + '\n```'
+            }]
+        }
+        result = parse_compact_equipment_response(response)
+        assert len(result['equipment']) == 1
+        assert result['equipment'][0]['risk_level'] == 'UNKNOWN'
+    
+    def test_invalid_json(self):
+        """不正なJSONの場合は空配列を返す"""
+        result = parse_compact_equipment_response({'content': [{'text': 'invalid'}]})
+        assert result == {'equipment': []}
+    
+    def test_prompt_version_switch(self):
+        """プロンプトバージョンで形式を切り替え"""
+        objects = [{'label': 'Monitor', 'confidence': 90.0}]
+        assert '"e"' in build_identification_prompt(objects, 'compact')
+        assert '"object_index"' in build_identification_prompt(objects, 'verbose')
+
+
+class TestToolOutputMode:
+    """toolモード（構造化出力）のテスト"""
+    
+    def test_parse_tool_input(self):
+        """tool_useの入力を直接検証"""
+        response = {
+            'content': [{
+                'type': 'tool_use',
+                'name': 'report_equipment',
+                'input': {
+                    'equipment': [
+                        {'source': 'rekognition', 'object_index': 0, 'name': 'A', 'risk_level': 'SAFE', 'description': 'x'},
+                        {'source': 'claude', 'name': 'B', 'risk_level': 'DANGER', 'description': 'y'}
+                    ]
+                }
+            }],
+            'stop_reason': 'tool_use'
+        }
+        result = parse_tool_equipment_response(response, 'verbose')
+        # bboxの無いclaude検出分は除外される
+        assert [e['name'] for e in result['equipment']] == ['A']
+    
+    def test_parse_compact_tool_input(self):
+        """compact形式のtool入力を展開"""
+        response = {
+            'content': [{
+                'type': 'tool_use',
+                'name': 'report_equipment',
+                'input': {'e': [{'b': [1, 2, 3, 4], 'n': 'A', 'r': 'W', 'd': 'x'}]}
+            }]
+        }
+        result = parse_tool_equipment_response(response, 'compact')
+        assert result['equipment'][0]['bbox'] == {'x': 1, 'y': 2, 'width': 3, 'height': 4}
+        assert result['equipment'][0]['risk_level'] == 'WARNING'
+    
+    def test_missing_tool_use(self):
+        """tool_useブロックが無い場合は空配列"""
+        response = {'content': [{'type': 'text', 'text': 'no tool'}], 'stop_reason': 'max_tokens'}
+        assert parse_tool_equipment_response(response, 'verbose') == {'equipment': []}
+    
+    @patch('handler.get_bedrock_runtime')
+    def test_request_forces_tool_choice(self, mock_get_bedrock):
+        """リクエストでツールを宣言し、tool_choiceで強制する"""
+        mock_bedrock = MagicMock()
+        mock_get_bedrock.return_value = mock_bedrock
+        mock_bedrock.invoke_model.return_value = {
+            'body': MagicMock(read=MagicMock(return_value=json.dumps({
+                'content': [{'type': 'tool_use', 'name': 'report_equipment', 'input': {'equipment': []}}]
+            })))
+        }
+        
+        analyze_equipment_with_claude('aW1n', [], prompt_version='verbose', output_mode='tool')
+        
+        body = json.loads(mock_bedrock.invoke_model.call_args[1]['body'])
+        assert body['tool_choice'] == {'type': 'tool', 'name': 'report_equipment'}
+        assert body['tools'][0]['name'] == 'report_equipment'
+
+
+class TestNamesPromptVersion:
+    """namesプロンプト（名前とリスクのみ）のテスト"""
+    
+    def test_prompt_omits_description_and_url(self):
+        """説明・URLを返させない"""
+        prompt = build_identification_prompt([{'label': 'Monitor', 'confidence': 90.0}], 'names')
+        assert '"i":0,"n":"製品名","r":"W"' in prompt
+        assert '"d"' not in prompt
+    
+    @patch('handler.invoke_equipment_identification')
+    def test_filled_from_catalog(self, mock_invoke):
+        """説明・マニュアルURLは機器カタログで補う"""
+        mock_invoke.return_value = {'content': [{'text': json.dumps({'e': [
+            {'i': 0, 'n': 'ATEM Mini Pro', 'r': 'W'},
+            {'b': [1, 2, 3, 4], 'n': '謎のラック', 'r': 'W'}
+        ]})}]}
+        
+        result = analyze_equipment_with_claude('b64', [{'label': 'Electronics', 'confidence': 90.0}], 'names', 'text')
+        
+        switcher, rack = result['equipment']
+        assert switcher['name'] == 'Blackmagic Design ATEM Mini Pro'
+        assert switcher['risk_level'] == 'DANGER'
+        assert switcher['manual_url'].startswith('https://www.blackmagicdesign.com/')
+        assert rack['description'] == ''
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    """テスト用のJPEG画像を生成"""
+    from PIL import Image
+    from io import BytesIO
+    
+    output = BytesIO()
+    Image.new('RGB', (width, height), 'white').save(output, format='JPEG')
+    return output.getvalue()
+
+
+class TestCropRefinement:
+    """切り出し画像による位置調整のテスト"""
+    
+    EQUIPMENT = [
+        {'name': 'A', 'bbox': {'x': 10, 'y': 10, 'width': 20, 'height': 20}, 'confidence': 95.0, 'source': 'rekognition'},
+        {'name': 'B', 'bbox': {'x': 50, 'y': 50, 'width': 20, 'height': 20}, 'confidence': 75.0, 'source': 'claude'},
+        {'name': 'C', 'bbox': {'x': 0, 'y': 60, 'width': 10, 'height': 10}, 'confidence': 40.0, 'source': 'rekognition'}
+    ]
+    
+    def test_select_targets(self):
+        """Claude検出分と低信頼度の機器のみ、信頼度の低い順に選択"""
+        assert select_refinement_targets(self.EQUIPMENT) == [2, 1]
+    
+    @patch('handler.invoke_bedrock_model')
+    def test_refine_maps_crop_boxes_to_global(self, mock_invoke):
+        """切り出し画像内の座標を画像全体の座標に戻して適用"""
+        mock_invoke.return_value = {'content': [{'text': json.dumps({'adjustments': [
+            {'equipment_index': 1, 'needs_adjustment': True,
+             'new_bbox': {'x': 0, 'y': 0, 'width': 100, 'height': 100}},
+            {'equipment_index': 0, 'needs_adjustment': False}
+        ]})}]}
+        equipment = [dict(e) for e in self.EQUIPMENT]
+        
+        with patch('handler.REFINEMENT_PADDING', 0.5):
+            result = refine_positions_with_crops(make_jpeg(1000, 1000), equipment)
+        
+        # 1回の呼び出しに2枚の切り出し画像
+        body = mock_invoke.call_args[0][0]
+        assert sum(1 for c in body['messages'][0]['content'] if c['type'] == 'image') == 2
+        # 機器Bの切り出し領域（余白込み）全体 = (40, 40) - (80, 80)
+        bbox = result[1]['bbox']
+        assert bbox['x'] == pytest.approx(40.0)
+        assert bbox['width'] == pytest.approx(40.1)
+        assert result[2]['bbox'] == self.EQUIPMENT[2]['bbox']
+    
+    @patch('handler.invoke_bedrock_model')
+    def test_refine_failure_keeps_original(self, mock_invoke):
+        """位置調整に失敗した場合は元の結果を返す"""
+        mock_invoke.side_effect = RuntimeError('boom')
+        equipment = [dict(e) for e in self.EQUIPMENT]
+        assert refine_positions_with_crops(make_jpeg(100, 100), equipment) == equipment
+    
+    def test_has_time_budget(self):
+        """残り時間に応じて実行可否を判定"""
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 5000
+        assert has_time_budget(context, 10000) is False
+        assert has_time_budget(context, 1000) is True
+        assert has_time_budget(None, 10000) is True
+    
+    def test_draw_bounding_boxes(self):
+        """バウンディングボックスを描画したJPEGを返す"""
+        result = draw_bounding_boxes(make_jpeg(100, 100), self.EQUIPMENT)
+        assert result[:2] == b'\xff\xd8'
+
+
 @patch('handler.get_s3_client')
 class TestGetImageFromS3:
     """S3画像取得のテスト"""
@@ -253,18 +489,30 @@ class TestSaveResultToDynamoDB:
         assert 'ttl' in item
         assert 'createdAt' in item
         assert item['status'] == 'completed'
+        assert item['schemaVersion'] == 2
+        assert item['equipmentCount'] == 0
+        assert isinstance(item['result'], bytes)
 
 
+@patch('handler.acquire_image_lease', return_value='acquired')
 @patch('handler.save_result_to_dynamodb')
-@patch('handler.analyze_with_bedrock')
+@patch('handler.analyze_equipment_with_claude')
+@patch('handler.detect_objects_with_rekognition')
 @patch('handler.get_image_from_s3')
 class TestLambdaHandler:
     """Lambda関数全体のテスト"""
     
-    def test_lambda_handler_success(self, mock_get_image, mock_analyze, mock_save):
+    def test_lambda_handler_success(self, mock_get_image, mock_detect, mock_analyze, mock_save, mock_lease):
         """正常なフロー"""
-        mock_get_image.return_value = SAMPLE_IMAGE_BYTES
-        mock_analyze.return_value = {'equipment': [{'name': 'test'}]}
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_detect.return_value = []
+        mock_analyze.return_value = {'equipment': [{
+            'source': 'claude',
+            'name': 'test',
+            'bbox': {'x': 0, 'y': 0, 'width': 10, 'height': 10},
+            'risk_level': 'SAFE',
+            'description': 'テスト'
+        }]}
         
         result = lambda_handler(SAMPLE_S3_EVENT, None)
         
@@ -272,7 +520,649 @@ class TestLambdaHandler:
         body = json.loads(result['body'])
         assert body['message'] == '分析完了'
         assert 'imageKey' in body
-        assert 'equipmentCount' in body
+        assert body['equipmentCount'] == 1
+    
+    @patch('handler.IDEMPOTENCY_ENABLED', True)
+    def test_duplicate_event_skipped(self, mock_get_image, mock_detect, mock_analyze, mock_save, mock_lease):
+        """処理済み・処理中の画像は分析せずに終了"""
+        for state, message in [('completed', '処理済みのためスキップ'), ('in_flight', '処理中のためスキップ')]:
+            mock_lease.return_value = state
+            result = lambda_handler(SAMPLE_S3_EVENT, None)
+            assert result['statusCode'] == 200
+            assert json.loads(result['body'])['message'] == message
+        
+        mock_get_image.assert_not_called()
+        mock_analyze.assert_not_called()
+        mock_save.assert_not_called()
+    
+    @patch('handler.IDEMPOTENCY_ENABLED', True)
+    @patch('handler.release_lease')
+    @patch('handler.get_dynamodb')
+    def test_failure_releases_lease(self, mock_get_dynamodb, mock_release, mock_get_image, mock_detect, mock_analyze, mock_save, mock_lease):
+        """分析に失敗した場合はリースを解放"""
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_detect.side_effect = RuntimeError('boom')
+        context = MagicMock(aws_request_id='req-1')
+        
+        result = lambda_handler(SAMPLE_S3_EVENT, context)
+        
+        assert result['statusCode'] == 500
+        assert mock_release.call_args[0][1:] == ('uploads/test-image.jpg', 'req-1')
+    
+    @patch('handler.get_notifier')
+    def test_completion_notified_after_save(self, mock_get_notifier, mock_get_image, mock_detect, mock_analyze, mock_save, mock_lease):
+        """保存に成功した場合だけ完了イベントを発行"""
+        from notifier import MemoryNotifier
+        memory = MemoryNotifier()
+        mock_get_notifier.return_value = memory
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_detect.return_value = []
+        mock_analyze.return_value = {'equipment': []}
+        
+        mock_save.return_value = False
+        lambda_handler(SAMPLE_S3_EVENT, None)
+        assert memory.events == []
+        
+        mock_save.return_value = True
+        lambda_handler(SAMPLE_S3_EVENT, None)
+        assert memory.wait_for('uploads/test-image.jpg', 0)['status'] == 'completed'
+    
+    @patch('handler.get_notifier')
+    def test_notification_failure_ignored(self, mock_get_notifier, mock_get_image, mock_detect, mock_analyze, mock_save, mock_lease):
+        """通知に失敗しても分析は成功として返す"""
+        mock_get_notifier.return_value.publish.side_effect = RuntimeError('sns down')
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_detect.return_value = []
+        mock_analyze.return_value = {'equipment': []}
+        mock_save.return_value = True
+        
+        assert lambda_handler(SAMPLE_S3_EVENT, None)['statusCode'] == 200
+
+
+def make_sqs_record(message_id: str, body: dict) -> dict:
+    """テスト用のSQSレコード"""
+    return {'messageId': message_id, 'eventSource': 'aws:sqs', 'body': json.dumps(body)}
+
+
+@patch('handler.process_image')
+class TestSqsIngestion:
+    """SQS・EventBridge経由の取り込みのテスト"""
+    
+    def test_batch_reports_only_failed_messages(self, mock_process):
+        """失敗した画像のメッセージだけをbatchItemFailuresで返す"""
+        def fake_process(bucket, key, etag, context):
+            if key == 'uploads/bad.jpg':
+                raise RuntimeError('throttled')
+            return {'statusCode': 200}
+        mock_process.side_effect = fake_process
+        
+        event = {'Records': [
+            make_sqs_record('m1', {'Records': [{'s3': {
+                'bucket': {'name': 'b'}, 'object': {'key': 'uploads/good.jpg', 'eTag': 'e1'}
+            }}]}),
+            make_sqs_record('m2', {'Records': [{'s3': {
+                'bucket': {'name': 'b'}, 'object': {'key': 'uploads/bad.jpg', 'eTag': 'e2'}
+            }}]}),
+            make_sqs_record('m3', {
+                'source': 'aws.s3',
+                'detail-type': 'Object Created',
+                'detail': {'bucket': {'name': 'b'}, 'object': {'key': 'uploads/eb.jpg', 'etag': 'e3'}}
+            }),
+            make_sqs_record('m4', {'Event': 's3:TestEvent'})
+        ]}
+        
+        result = lambda_handler(event, None)
+        
+        assert result == {'batchItemFailures': [{'itemIdentifier': 'm2'}]}
+        processed = sorted(call[0][1] for call in mock_process.call_args_list)
+        assert processed == ['uploads/bad.jpg', 'uploads/eb.jpg', 'uploads/good.jpg']
+    
+    def test_malformed_message_fails(self, mock_process):
+        """本文を解析できないメッセージは失敗として返す"""
+        event = {'Records': [{'messageId': 'm1', 'eventSource': 'aws:sqs', 'body': 'not json'}]}
+        assert lambda_handler(event, None) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    
+    def test_missing_image_not_retried(self, mock_process):
+        """削除済みの画像は再試行しない"""
+        from botocore.exceptions import ClientError
+        mock_process.side_effect = ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        event = {'Records': [make_sqs_record('m1', {'Records': [{'s3': {
+            'bucket': {'name': 'b'}, 'object': {'key': 'uploads/gone.jpg'}
+        }}]})]}
+        assert lambda_handler(event, None) == {'batchItemFailures': []}
+    
+    def test_eventbridge_direct(self, mock_process):
+        """EventBridgeからの直接呼び出し"""
+        mock_process.return_value = {'statusCode': 200}
+        event = {
+            'source': 'aws.s3',
+            'detail-type': 'Object Created',
+            'detail': {'bucket': {'name': 'b'}, 'object': {'key': 'uploads/a.jpg', 'etag': 'e1'}}
+        }
+        assert lambda_handler(event, None) == {'statusCode': 200}
+        mock_process.assert_called_once_with('b', 'uploads/a.jpg', 'e1', None)
+    
+    def test_url_encoded_key(self, mock_process):
+        """S3イベント通知のURLエンコードされたキーを復元"""
+        mock_process.return_value = {'statusCode': 200}
+        event = {'Records': [{'s3': {
+            'bucket': {'name': 'b'}, 'object': {'key': 'uploads/rack+01%281%29.jpg', 'eTag': 'e1'}
+        }}]}
+        lambda_handler(event, None)
+        mock_process.assert_called_once_with('b', 'uploads/rack 01(1).jpg', 'e1', None)
+    
+    def test_url_encoded_eventbridge_key(self, mock_process):
+        """EventBridgeイベントのキーもS3イベント通知と同じく復元"""
+        mock_process.return_value = {'statusCode': 200}
+        event = {
+            'source': 'aws.s3',
+            'detail-type': 'Object Created',
+            'detail': {'bucket': {'name': 'b'}, 'object': {'key': 'uploads/rack+01%281%29.jpg', 'etag': 'e1'}}
+        }
+        lambda_handler(event, None)
+        mock_process.assert_called_once_with('b', 'uploads/rack 01(1).jpg', 'e1', None)
+    
+    def test_in_flight_message_requeued(self, mock_process):
+        """他の実行が処理中の画像のメッセージは成功にせず再試行"""
+        from idempotency import LeaseInFlight
+        mock_process.side_effect = LeaseInFlight('uploads/a.jpg')
+        event = {'Records': [make_sqs_record('m1', {'Records': [{'s3': {
+            'bucket': {'name': 'b'}, 'object': {'key': 'uploads/a.jpg', 'eTag': 'e1'}
+        }}]})]}
+        assert lambda_handler(event, None) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    
+    def test_batch_priority_attribute(self, mock_process):
+        """メッセージ属性priority=batchの画像はbatch優先度でBedrockを呼ぶ"""
+        from rate_limiter import current_priority
+        seen = []
+        mock_process.side_effect = lambda *args: seen.append(current_priority.get())
+        
+        record = make_sqs_record('m1', {'Records': [{'s3': {
+            'bucket': {'name': 'b'}, 'object': {'key': 'uploads/a.jpg', 'eTag': 'e1'}
+        }}]})
+        record['messageAttributes'] = {'priority': {'stringValue': 'batch', 'dataType': 'String'}}
+        plain = make_sqs_record('m2', {'Records': [{'s3': {
+            'bucket': {'name': 'b'}, 'object': {'key': 'uploads/b.jpg', 'eTag': 'e2'}
+        }}]})
+        
+        lambda_handler({'Records': [record, plain]}, None)
+        
+        assert sorted(seen) == ['batch', 'interactive']
+    
+    def test_rate_limited_message_requeued(self, mock_process):
+        """レート制限で待ちきれなかった画像のメッセージは再試行"""
+        from rate_limiter import RateLimitExceeded
+        mock_process.side_effect = RateLimitExceeded('busy')
+        event = {'Records': [make_sqs_record('m1', {'Records': [{'s3': {
+            'bucket': {'name': 'b'}, 'object': {'key': 'uploads/a.jpg', 'eTag': 'e1'}
+        }}]})]}
+        assert lambda_handler(event, None) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+
+
+class TestBedrockRateLimit:
+    """Bedrock呼び出し前のレート制限のテスト"""
+    
+    @patch('handler.get_bedrock_runtime')
+    @patch('handler.get_rate_limiter')
+    def test_acquire_and_settle(self, mock_get_limiter, mock_get_bedrock):
+        """呼び出し前に見積もりで確保し、応答のusageで補正"""
+        limiter = Mock()
+        limiter.acquire.return_value = {'window': 1, 'cost': 3000}
+        mock_get_limiter.return_value = limiter
+        response_body = {'content': [], 'usage': {'input_tokens': 1800, 'output_tokens': 200}}
+        mock_get_bedrock.return_value.invoke_model.return_value = {
+            'body': Mock(read=Mock(return_value=json.dumps(response_body).encode()))
+        }
+        
+        body = {'max_tokens': 1000, 'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': 'hi'}]}]}
+        assert invoke_bedrock_model(body, priority='batch') == response_body
+        
+        limiter.acquire.assert_called_once_with(1002, 'batch')
+        limiter.settle.assert_called_once_with({'window': 1, 'cost': 3000}, 2000)
+    
+    @patch('handler.get_bedrock_runtime')
+    @patch('handler.get_rate_limiter')
+    def test_rejected_before_invoke(self, mock_get_limiter, mock_get_bedrock):
+        """空きを待ちきれなければBedrockを呼ばない"""
+        from rate_limiter import RateLimitExceeded
+        mock_get_limiter.return_value.acquire.side_effect = RateLimitExceeded('busy')
+        with pytest.raises(RateLimitExceeded):
+            invoke_bedrock_model({'max_tokens': 10, 'messages': []})
+        mock_get_bedrock.return_value.invoke_model.assert_not_called()
+
+    @patch('handler.get_bedrock_runtime')
+    @patch('handler.get_rate_limiter')
+    def test_failed_invoke_refunds_reservation(self, mock_get_limiter, mock_get_bedrock):
+        """呼び出しに失敗した場合は確保した見積もりを返す"""
+        from botocore.exceptions import ClientError
+        limiter = Mock()
+        limiter.acquire.return_value = {'window': 1, 'cost': 3000}
+        mock_get_limiter.return_value = limiter
+        mock_get_bedrock.return_value.invoke_model.side_effect = ClientError(
+            {'Error': {'Code': 'ValidationException', 'Message': 'bad request'}}, 'InvokeModel'
+        )
+        
+        with pytest.raises(ClientError):
+            invoke_bedrock_model({'max_tokens': 10, 'messages': []})
+        
+        limiter.refund.assert_called_once_with({'window': 1, 'cost': 3000})
+        limiter.settle.assert_not_called()
+    
+    @patch('concurrency_limit.emit_metric')
+    @patch('handler.get_bedrock_runtime')
+    @patch('handler.get_rate_limiter')
+    def test_throttling_lowers_concurrency(self, mock_get_limiter, mock_get_bedrock, mock_metric):
+        """ThrottlingExceptionを受けると同時呼び出し数の上限を下げる"""
+        from botocore.exceptions import ClientError
+        from concurrency_limit import AimdConcurrencyLimit
+        mock_get_limiter.return_value.acquire.return_value = None
+        mock_get_bedrock.return_value.invoke_model.side_effect = ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}}, 'InvokeModel'
+        )
+
+        with patch('handler.bedrock_concurrency', AimdConcurrencyLimit(4)) as concurrency:
+            with pytest.raises(ClientError):
+                invoke_bedrock_model({'max_tokens': 10, 'messages': []})
+            assert concurrency.current_limit == 2
+            assert concurrency.in_flight == 0
+        mock_metric.assert_any_call('BedrockThrottled', 1, 'Count')
+
+
+class TestInventoryFastPath:
+    """機器台帳による識別の省略のテスト"""
+    
+    DETECTIONS = [
+        {'label': 'Monitor', 'confidence': 95.0, 'bbox': {'x': 0, 'y': 0, 'width': 40, 'height': 40}},
+        {'label': 'Electronics', 'confidence': 90.0, 'bbox': {'x': 50, 'y': 50, 'width': 40, 'height': 40}}
+    ]
+    
+    @patch('handler.analyze_equipment_with_claude')
+    def test_shortened_prompt_remaps_indices(self, mock_claude):
+        """未識別の物体だけをClaudeに送り、object_indexを元に戻す"""
+        mock_claude.return_value = {'equipment': [
+            {'source': 'rekognition', 'object_index': 0, 'name': 'ラック', 'risk_level': 'WARNING', 'description': 'x'}
+        ]}
+        resolved = {0: {'name': 'モニター', 'risk_level': 'SAFE', 'description': 'y', 'manual_url': None}}
+        
+        result = identify_equipment('b64', self.DETECTIONS, resolved)
+        
+        assert mock_claude.call_args[0][1] == [self.DETECTIONS[1]]
+        assert [(e['object_index'], e['name']) for e in result['equipment']] == [(0, 'モニター'), (1, 'ラック')]
+    
+    @patch('handler.analyze_equipment_with_claude')
+    def test_all_resolved_skips_claude(self, mock_claude):
+        """全物体を識別済みならClaudeを呼ばない"""
+        resolved = {
+            0: {'name': 'モニター', 'risk_level': 'SAFE', 'description': 'y'},
+            1: {'name': 'ラック', 'risk_level': 'WARNING', 'description': 'x'}
+        }
+        result = identify_equipment('b64', self.DETECTIONS, resolved)
+        mock_claude.assert_not_called()
+        assert len(result['equipment']) == 2
+    
+    @patch('handler.INVENTORY_ENABLED', True)
+    @patch('handler.inventory_store', None)
+    @patch('handler.INVENTORY_TABLE_NAME', None)
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_second_photo_of_session_uses_inventory(self, mock_get_image, mock_detect, mock_claude):
+        """同じセッションの2枚目は台帳の機器をClaudeに送らない"""
+        from test_inventory import make_rack_image
+        mock_get_image.return_value = make_rack_image()
+        mock_detect.return_value = self.DETECTIONS
+        mock_claude.return_value = {'equipment': [
+            {'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': 'y'},
+            {'source': 'rekognition', 'object_index': 1, 'name': 'ラック', 'risk_level': 'WARNING', 'description': 'x'}
+        ]}
+        
+        first = analyze_image('b', 'uploads/sessions/room-1/1.jpg', None)
+        second = analyze_image('b', 'uploads/sessions/room-1/2.jpg', None)
+        
+        assert mock_claude.call_count == 1
+        assert [e['name'] for e in second['equipment']] == [e['name'] for e in first['equipment']]
+
+
+class TestPanelTextFastPath:
+    """前面パネルの印字による識別のテスト"""
+    
+    DETECTIONS = [
+        {'label': 'Electronics', 'confidence': 95.0, 'bbox': {'x': 0, 'y': 0, 'width': 100, 'height': 60}},
+        {'label': 'Monitor', 'confidence': 90.0, 'bbox': {'x': 10, 'y': 10, 'width': 30, 'height': 20}}
+    ]
+    
+    def text(self, value: str, x: float, y: float, confidence: float = 99.0) -> dict:
+        return {'text': value, 'confidence': confidence, 'bbox': {'x': x, 'y': y, 'width': 10, 'height': 2}}
+    
+    def test_text_assigned_to_smallest_containing_object(self):
+        """文字列は含む物体のうち最も小さい物体に割り当てる"""
+        assigned = assign_text_to_objects(
+            [self.text('PVM-A250', 15, 12), self.text('1 2 3', 60, 40), self.text('EXIT', 60, 80)],
+            self.DETECTIONS
+        )
+        assert [t['text'] for t in assigned[1]] == ['PVM-A250']
+        assert [t['text'] for t in assigned[0]] == ['1 2 3']
+    
+    def test_lines_joined_top_to_bottom(self):
+        """別の行に印字されたメーカー名と型番を連結して照合"""
+        resolved = resolve_from_panel_text(
+            [self.text('Mini Pro', 15, 14), self.text('ATEM', 15, 12)],
+            self.DETECTIONS
+        )
+        assert resolved[1]['name'] == 'Blackmagic Design ATEM Mini Pro'
+        assert resolved[1]['risk_level'] == 'DANGER'
+    
+    def test_low_confidence_text_ignored(self):
+        """信頼度の低い文字列では識別しない"""
+        assert resolve_from_panel_text([self.text('ATEM Mini Pro', 15, 12, confidence=60.0)], self.DETECTIONS) == {}
+    
+    @patch('handler.OCR_FAST_PATH_ENABLED', True)
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_text_with_rekognition')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_all_labeled_skips_claude(self, mock_get_image, mock_detect, mock_detect_text, mock_claude):
+        """全物体の印字がカタログと一致すればClaudeを呼ばない"""
+        mock_get_image.return_value = make_jpeg(400, 300)
+        mock_detect.return_value = [self.DETECTIONS[1]]
+        mock_detect_text.return_value = [self.text('YAMAHA MG10XU', 15, 12)]
+        
+        result = analyze_image('b', 'uploads/test.jpg', None)
+        
+        mock_claude.assert_not_called()
+        assert [e['name'] for e in result['equipment']] == ['YAMAHA MG10XU']
+        assert result['equipment'][0]['bbox'] == self.DETECTIONS[1]['bbox']
+    
+    @patch('handler.OCR_FAST_PATH_ENABLED', True)
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_text_with_rekognition')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_text_detection_failure_falls_back(self, mock_get_image, mock_detect, mock_detect_text, mock_claude):
+        """文字検出が失敗してもClaudeで通常どおり識別する"""
+        mock_get_image.return_value = make_jpeg(400, 300)
+        mock_detect.return_value = [self.DETECTIONS[1]]
+        mock_detect_text.side_effect = Exception('throttled')
+        mock_claude.return_value = {'equipment': [
+            {'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': 'y'}
+        ]}
+        
+        result = analyze_image('b', 'uploads/test.jpg', None)
+        
+        mock_claude.assert_called_once()
+        assert [e['name'] for e in result['equipment']] == ['モニター']
+
+
+class TestDetectorBackend:
+    """物体検出のバックエンド選択のテスト"""
+    
+    @patch('handler.get_local_detector')
+    @patch('handler.detect_objects_with_rekognition')
+    def test_default_rekognition_reads_s3(self, mock_rekognition, mock_local):
+        """既定はRekognitionで、S3上の画像は送らずに参照する"""
+        detect_objects('b', 'uploads/a.jpg', b'img')
+        mock_rekognition.assert_called_once_with('b', 'uploads/a.jpg', None)
+        mock_local.assert_not_called()
+    
+    @patch('handler.detect_objects_with_rekognition')
+    def test_tile_sends_bytes(self, mock_rekognition):
+        """S3に無い画像（タイル）はバイトデータを送る"""
+        detect_objects(None, None, b'tile')
+        mock_rekognition.assert_called_once_with(None, None, b'tile')
+    
+    @patch('handler.DETECTOR_BACKEND', 'onnx')
+    @patch('handler.get_local_detector')
+    @patch('handler.detect_objects_with_rekognition')
+    def test_deployment_onnx(self, mock_rekognition, mock_local):
+        """環境変数でローカルの検出モデルを選べる"""
+        mock_local.return_value.detect.return_value = [{'label': 'Monitor'}]
+        assert detect_objects('b', 'uploads/a.jpg', b'img') == [{'label': 'Monitor'}]
+        mock_local.return_value.detect.assert_called_once_with(b'img')
+        mock_rekognition.assert_not_called()
+    
+    @patch('handler.get_local_detector')
+    @patch('handler.detect_objects_with_rekognition')
+    def test_per_request_override(self, mock_rekognition, mock_local):
+        """処理ごとの指定が環境変数より優先される"""
+        token = current_detector_backend.set('onnx')
+        try:
+            detect_objects('b', 'uploads/a.jpg', b'img')
+        finally:
+            current_detector_backend.reset(token)
+        mock_local.return_value.detect.assert_called_once()
+        mock_rekognition.assert_not_called()
+    
+    def test_sqs_message_attribute(self):
+        """SQSメッセージ属性detectorを画像ごとの指定にする（不明な値は無視）"""
+        body = {'Records': [{'s3': {'bucket': {'name': 'b'}, 'object': {'key': 'uploads/a.jpg', 'eTag': 'e'}}}]}
+        record = {'body': json.dumps(body), 'messageAttributes': {'detector': {'stringValue': 'onnx'}}}
+        assert extract_images_from_sqs_record(record)[0]['detector'] == 'onnx'
+        record['messageAttributes']['detector']['stringValue'] = 'yolo'
+        assert 'detector' not in extract_images_from_sqs_record(record)[0]
+
+
+class TestStageCheckpoint:
+    """段階の出力の記録による再開のテスト"""
+    
+    DETECTIONS = [{'label': 'Monitor', 'confidence': 90.0, 'bbox': {'x': 10, 'y': 10, 'width': 30, 'height': 30}}]
+    RESPONSE = {'content': [{'type': 'text', 'text': json.dumps({'equipment': [
+        {'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': 'x'}
+    ]})}]}
+    
+    @patch('handler.STAGE_CHECKPOINT_ENABLED', True)
+    @patch('handler.invoke_bedrock_model')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_retry_resumes_after_claude_failure(self, mock_get_image, mock_detect, mock_invoke):
+        """Claudeで失敗した再試行では物体検出をやり直さず、完了後の再実行ではClaudeも呼ばない"""
+        mock_get_image.return_value = make_jpeg(400, 300)
+        mock_detect.return_value = self.DETECTIONS
+        mock_invoke.side_effect = [RuntimeError('timeout'), self.RESPONSE]
+        
+        with patch('handler.S3StageCache', return_value=MemoryStageCache()):
+            with pytest.raises(RuntimeError):
+                analyze_image('b', 'uploads/test.jpg', None, 'etag1')
+            analyze_image('b', 'uploads/test.jpg', None, 'etag1')
+            result = analyze_image('b', 'uploads/test.jpg', None, 'etag1')
+        
+        assert mock_detect.call_count == 1
+        assert mock_invoke.call_count == 2
+        assert [e['name'] for e in result['equipment']] == ['モニター']
+    
+    @patch('handler.STAGE_CHECKPOINT_ENABLED', True)
+    @patch('handler.invoke_bedrock_model')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_new_object_version_not_reused(self, mock_get_image, mock_detect, mock_invoke):
+        """同じキーでも上書きされた画像（ETagが異なる）は最初から分析"""
+        mock_get_image.return_value = make_jpeg(400, 300)
+        mock_detect.return_value = self.DETECTIONS
+        mock_invoke.return_value = self.RESPONSE
+        
+        with patch('handler.S3StageCache', return_value=MemoryStageCache()):
+            analyze_image('b', 'uploads/test.jpg', None, 'etag1')
+            analyze_image('b', 'uploads/test.jpg', None, 'etag2')
+        
+        assert mock_detect.call_count == 2
+        assert mock_invoke.call_count == 2
+    
+    def test_disabled_without_etag(self):
+        """ETagが不明な場合は記録しない"""
+        with patch('handler.STAGE_CHECKPOINT_ENABLED', True):
+            assert get_stage_checkpoint('b', 'uploads/test.jpg', None) is None
+            assert get_stage_checkpoint('b', 'uploads/test.jpg', 'etag1') is not None
+        assert get_stage_checkpoint('b', 'uploads/test.jpg', 'etag1') is None
+    
+    @patch('handler.BEDROCK_MAX_IMAGE_BYTES', 1000)
+    def test_compressed_image_reused(self):
+        """圧縮した画像だけを記録し、再試行では圧縮をやり直さない"""
+        checkpoint = StageCheckpoint(MemoryStageCache(), 'uploads/test.jpg', 'etag1')
+        with patch('handler.encode_image_to_base64', return_value=base64.b64encode(b'small').decode()) as mock_encode:
+            first = encode_image_with_checkpoint(b'x' * 2000, checkpoint)
+            second = encode_image_with_checkpoint(b'x' * 2000, checkpoint)
+            encode_image_with_checkpoint(b'x' * 10, checkpoint)
+        
+        assert first == second
+        assert mock_encode.call_count == 2
+        assert len(checkpoint.cache.items) == 1
+    
+    def test_identification_version(self):
+        """機器識別のバージョンはモデル・プロンプトで変わり、画像データには依存しない"""
+        body = build_equipment_identification_body('aaaa', self.DETECTIONS, 'verbose')
+        same_image = build_equipment_identification_body('bbbb', self.DETECTIONS, 'verbose')
+        other_prompt = build_equipment_identification_body('aaaa', self.DETECTIONS, 'compact')
+        
+        version = identification_stage_version(body, 'model-a')
+        assert identification_stage_version(same_image, 'model-a') == version
+        assert identification_stage_version(other_prompt, 'model-a') != version
+        assert identification_stage_version(body, 'model-b') != version
+
+
+class TestImageIngestion:
+    """画像の取り込み（形式・向き）のテスト"""
+    
+    DETECTIONS = [{'label': 'Monitor', 'confidence': 90.0, 'bbox': {'x': 10, 'y': 10, 'width': 30, 'height': 30}}]
+    
+    def test_media_type_follows_image(self):
+        """リクエストのmedia_typeは実際の画像の形式"""
+        from PIL import Image
+        from io import BytesIO
+        
+        output = BytesIO()
+        Image.new('RGB', (8, 8)).save(output, format='PNG')
+        body = build_equipment_identification_body(base64.b64encode(output.getvalue()).decode(), [], 'verbose')
+        assert body['messages'][0]['content'][0]['source']['media_type'] == 'image/png'
+        
+        body = build_equipment_identification_body(base64.b64encode(make_jpeg(8, 8)).decode(), [], 'verbose')
+        assert body['messages'][0]['content'][0]['source']['media_type'] == 'image/jpeg'
+    
+    @patch('handler.analyze_equipment_with_claude', return_value={'equipment': []})
+    @patch('handler.get_rekognition_client')
+    @patch('handler.get_image_from_s3')
+    def test_rotated_photo_sent_to_rekognition(self, mock_get_image, mock_rekognition, mock_claude):
+        """回転を反映した画像はS3上の画像ではなく画像そのものをRekognitionに送る"""
+        from PIL import Image
+        from io import BytesIO
+        
+        image = Image.new('RGB', (40, 20), 'white')
+        exif = image.getexif()
+        exif[EXIF_ORIENTATION_TAG] = 6
+        output = BytesIO()
+        image.save(output, format='JPEG', exif=exif.tobytes())
+        mock_get_image.return_value = output.getvalue()
+        mock_rekognition.return_value.detect_labels.return_value = {'Labels': []}
+        
+        analyze_image('b', 'uploads/phone.jpg', None)
+        
+        sent = mock_rekognition.return_value.detect_labels.call_args[1]['Image']
+        assert Image.open(BytesIO(sent['Bytes'])).size == (20, 40)
+        claude_image = base64.b64decode(mock_claude.call_args[0][0])
+        assert Image.open(BytesIO(claude_image)).size == (20, 40)
+    
+    @patch('handler.analyze_equipment_with_claude', return_value={'equipment': []})
+    @patch('handler.get_rekognition_client')
+    @patch('handler.get_image_from_s3')
+    def test_upright_jpeg_read_from_s3(self, mock_get_image, mock_rekognition, mock_claude):
+        """変換していない画像はRekognitionがS3から直接読む"""
+        mock_get_image.return_value = make_jpeg(40, 20)
+        mock_rekognition.return_value.detect_labels.return_value = {'Labels': []}
+        
+        analyze_image('b', 'uploads/a.jpg', None)
+        
+        sent = mock_rekognition.return_value.detect_labels.call_args[1]['Image']
+        assert sent == {'S3Object': {'Bucket': 'b', 'Name': 'uploads/a.jpg'}}
+    
+    def test_unreadable_image_not_retried(self):
+        """読み込めない形式の画像は再試行しない"""
+        assert is_settled_failure({'key': 'uploads/a.heic'}, UnsupportedImageFormat('HEIC')) is True
+
+
+class TestQualityGate:
+    """品質チェックによる除外のテスト"""
+    
+    @patch('handler.QUALITY_GATE_ENABLED', True)
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_dark_photo_rejected_before_paid_calls(self, mock_get_image, mock_detect, mock_claude):
+        """真っ暗な写真はRekognition・Claudeを呼ばずに除外"""
+        from PIL import Image
+        from io import BytesIO
+        
+        output = BytesIO()
+        Image.new('RGB', (400, 300), (3, 3, 3)).save(output, format='JPEG')
+        mock_get_image.return_value = output.getvalue()
+        
+        result = analyze_image('b', 'uploads/dark.jpg', None)
+        
+        mock_detect.assert_not_called()
+        mock_claude.assert_not_called()
+        assert result['rejection']['reason'] == 'too_dark'
+        assert result['equipment'] == []
+    
+    @patch('handler.QUALITY_GATE_ENABLED', True)
+    @patch('quality_gate.QUALITY_REJECT_EMPTY', True)
+    @patch('quality_gate.QUALITY_MIN_SHARPNESS', 0)
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_objects_with_rekognition', return_value=[])
+    @patch('handler.get_image_from_s3')
+    def test_empty_photo_skips_claude(self, mock_get_image, mock_detect, mock_claude):
+        """物体が検出されない写真はClaudeを呼ばずに除外（設定で有効にした場合）"""
+        from PIL import Image
+        from io import BytesIO
+        
+        output = BytesIO()
+        Image.new('RGB', (400, 300), (128, 128, 128)).save(output, format='JPEG')
+        mock_get_image.return_value = output.getvalue()
+        
+        result = analyze_image('b', 'uploads/wall.jpg', None)
+        
+        mock_claude.assert_not_called()
+        assert result['rejection']['reason'] == 'no_objects'
+    
+    def test_rejected_item(self):
+        """除外した画像はstatus=rejectedと理由を保存"""
+        item = build_result_item('uploads/a.jpg', {'equipment': [], 'rejection': {'reason': 'blurry', 'metrics': {}}}, 'e')
+        assert item['status'] == 'rejected'
+        assert item['rejectionReason'] == 'blurry'
+        assert build_result_item('uploads/a.jpg', {'equipment': []})['status'] == 'completed'
+
+
+class TestRoiCrop:
+    """関心領域の切り出しのテスト"""
+    
+    @patch('handler.ROI_CROP_ENABLED', True)
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_claude_sees_only_equipment_area(self, mock_get_image, mock_detect, mock_claude):
+        """Claudeには機器の範囲だけを送り、追加検出の座標は画像全体に戻す"""
+        from PIL import Image
+        from io import BytesIO
+        
+        output = BytesIO()
+        Image.new('RGB', (1000, 800), (90, 90, 90)).save(output, format='JPEG')
+        mock_get_image.return_value = output.getvalue()
+        mock_detect.return_value = [
+            {'label': 'Monitor', 'confidence': 95.0, 'bbox': {'x': 50, 'y': 10, 'width': 30, 'height': 20}},
+            {'label': 'Person', 'confidence': 99.0, 'bbox': {'x': 0, 'y': 0, 'width': 30, 'height': 100}}
+        ]
+        mock_claude.return_value = {'equipment': [
+            {'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': 'x'},
+            {'source': 'claude', 'name': 'ルーター', 'risk_level': 'WARNING', 'description': 'y',
+             'bbox': {'x': 0, 'y': 0, 'width': 50, 'height': 50}}
+        ]}
+        
+        result = analyze_image('b', 'uploads/a.jpg', None)
+        
+        crop = Image.open(BytesIO(base64.b64decode(mock_claude.call_args[0][0])))
+        assert crop.width < 1000 * 0.5 and crop.height < 800 * 0.5
+        
+        monitor, router = result['equipment']
+        assert monitor['bbox'] == {'x': 50, 'y': 10, 'width': 30, 'height': 20}
+        # 切り出し画像の左上の四分の一 -> 画像全体では関心領域の左上
+        assert router['bbox']['x'] == pytest.approx(45.5, abs=0.2)
+        assert router['bbox']['width'] == pytest.approx(19.5, abs=0.2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,87 @@
+"""
+重複イベント排除のユニットテスト
+"""
+
+import time
+import boto3
+import pytest
+from moto import mock_aws
+from idempotency import (
+    acquire_lease,
+    release_lease,
+    LEASE_ACQUIRED,
+    LEASE_COMPLETED,
+    LEASE_IN_FLIGHT
+)
+
+
+@pytest.fixture
+def table():
+    """moto上の結果テーブル"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        yield dynamodb.create_table(
+            TableName='results',
+            KeySchema=[{'AttributeName': 'imageKey', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'imageKey', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+
+class TestAcquireLease:
+    """リース取得のテスト"""
+    
+    def test_first_delivery_acquires(self, table):
+        """最初の配信はリースを取得"""
+        assert acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-1', 120, 0) == LEASE_ACQUIRED
+        item = table.get_item(Key={'imageKey': 'uploads/a.jpg'})['Item']
+        assert item['status'] == 'processing'
+        assert item['leaseOwner'] == 'req-1'
+    
+    def test_duplicate_in_flight(self, table):
+        """処理中の重複配信はスキップ"""
+        acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-1', 120, 0)
+        assert acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-2', 120, 0) == LEASE_IN_FLIGHT
+    
+    def test_duplicate_after_completion(self, table):
+        """処理済みの重複配信はスキップ"""
+        table.put_item(Item={'imageKey': 'uploads/a.jpg', 'status': 'completed', 'etag': 'etag1'})
+        assert acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-2', 120, 0) == LEASE_COMPLETED
+    
+    def test_legacy_completed_item(self, table):
+        """ETagを持たない旧形式の完了項目も処理済みとみなす"""
+        table.put_item(Item={'imageKey': 'uploads/a.jpg', 'status': 'completed', 'result': '{}'})
+        assert acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-2', 120, 0) == LEASE_COMPLETED
+    
+    def test_new_object_version(self, table):
+        """同じキーでもETagが異なれば再処理"""
+        table.put_item(Item={'imageKey': 'uploads/a.jpg', 'status': 'completed', 'etag': 'etag1'})
+        assert acquire_lease(table, 'uploads/a.jpg', 'etag2', 'req-2', 120, 0) == LEASE_ACQUIRED
+    
+    def test_expired_lease_taken_over(self, table):
+        """異常終了した実行の期限切れリースは引き継ぐ"""
+        table.put_item(Item={
+            'imageKey': 'uploads/a.jpg',
+            'status': 'processing',
+            'etag': 'etag1',
+            'leaseOwner': 'crashed',
+            'leaseExpiresAt': int(time.time()) - 1
+        })
+        assert acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-2', 120, 0) == LEASE_ACQUIRED
+        assert table.get_item(Key={'imageKey': 'uploads/a.jpg'})['Item']['leaseOwner'] == 'req-2'
+
+
+class TestReleaseLease:
+    """リース解放のテスト"""
+    
+    def test_release_own_lease(self, table):
+        """自分のリースは解放できる"""
+        acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-1', 120, 0)
+        release_lease(table, 'uploads/a.jpg', 'req-1')
+        assert 'Item' not in table.get_item(Key={'imageKey': 'uploads/a.jpg'})
+    
+    def test_taken_over_lease_not_released(self, table):
+        """引き継がれたリースは解放しない"""
+        acquire_lease(table, 'uploads/a.jpg', 'etag1', 'req-2', 120, 0)
+        release_lease(table, 'uploads/a.jpg', 'req-1')
+        assert table.get_item(Key={'imageKey': 'uploads/a.jpg'})['Item']['leaseOwner'] == 'req-2'
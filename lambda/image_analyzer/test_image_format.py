@@ -0,0 +1,114 @@
+"""
+画像の取り込みのユニットテスト
+"""
+
+import base64
+import pytest
+from io import BytesIO
+from unittest.mock import patch
+from PIL import Image
+
+from image_format import (
+    sniff_media_type,
+    base64_media_type,
+    ingest_image,
+    UnsupportedImageFormat,
+    EXIF_ORIENTATION_TAG
+)
+
+
+def encode(image: Image.Image, format: str, orientation: int = None) -> bytes:
+    """テスト用の画像をエンコード（EXIFの向きを指定可能）"""
+    output = BytesIO()
+    kwargs = {}
+    if orientation is not None:
+        exif = image.getexif()
+        exif[EXIF_ORIENTATION_TAG] = orientation
+        kwargs['exif'] = exif.tobytes()
+    image.save(output, format=format, **kwargs)
+    return output.getvalue()
+
+
+class TestSniffMediaType:
+    """先頭のバイト列による形式の判定のテスト"""
+
+    def test_common_formats(self):
+        """JPEG・PNG・GIF・WebPを判定"""
+        image = Image.new('RGB', (8, 8))
+        assert sniff_media_type(encode(image, 'JPEG')) == 'image/jpeg'
+        assert sniff_media_type(encode(image, 'PNG')) == 'image/png'
+        assert sniff_media_type(encode(image, 'GIF')) == 'image/gif'
+        assert sniff_media_type(encode(image, 'WEBP')) == 'image/webp'
+
+    def test_heif_brands(self):
+        """ISO BMFFのブランドでHEICとAVIFを区別"""
+        assert sniff_media_type(b'\x00\x00\x00\x18ftypheic\x00\x00\x00\x00') == 'image/heic'
+        assert sniff_media_type(b'\x00\x00\x00\x18ftypmif1\x00\x00\x00\x00') == 'image/heic'
+        assert sniff_media_type(b'\x00\x00\x00\x1cftypavif\x00\x00\x00\x00') == 'image/avif'
+        assert sniff_media_type(b'\x00\x00\x00\x18ftypisom\x00\x00\x00\x00') is None
+
+    def test_base64(self):
+        """Base64のまま判定し、判定できない場合は既定の形式"""
+        png = base64.b64encode(encode(Image.new('RGB', (8, 8)), 'PNG')).decode()
+        assert base64_media_type(png) == 'image/png'
+        assert base64_media_type(base64.b64encode(b'unknown data').decode()) == 'image/jpeg'
+
+
+class TestIngestImage:
+    """取り込み処理のテスト"""
+
+    def test_upright_jpeg_untouched(self):
+        """向きの指定が無いJPEGはデコードせずにそのまま返す"""
+        data = encode(Image.new('RGB', (40, 20)), 'JPEG')
+        ingested = ingest_image(data)
+        assert ingested['image_bytes'] is data
+        assert ingested['converted'] is False
+        assert 'decode' not in ingested['timing']
+
+    def test_exif_rotation_applied(self):
+        """EXIFの向きを画素に反映し、向きの指定を取り除く"""
+        data = encode(Image.new('RGB', (40, 20)), 'JPEG', orientation=6)
+        ingested = ingest_image(data)
+
+        rotated = Image.open(BytesIO(ingested['image_bytes']))
+        assert rotated.size == (20, 40)
+        assert rotated.getexif().get(EXIF_ORIENTATION_TAG, 1) == 1
+        assert ingested['converted'] is True
+        assert ingested['media_type'] == 'image/jpeg'
+        assert 'transpose' in ingested['timing']
+
+    def test_webp_transcoded_to_jpeg(self):
+        """Rekognitionが読めない形式はJPEGに変換"""
+        ingested = ingest_image(encode(Image.new('RGBA', (16, 16)), 'WEBP'))
+        assert ingested['source_media_type'] == 'image/webp'
+        assert ingested['media_type'] == 'image/jpeg'
+        assert sniff_media_type(ingested['image_bytes']) == 'image/jpeg'
+
+    def test_small_png_kept(self):
+        """小さいPNG・透過のあるPNGはPNGのまま"""
+        data = encode(Image.new('RGBA', (16, 16)), 'PNG')
+        ingested = ingest_image(data)
+        assert ingested['media_type'] == 'image/png'
+        assert ingested['converted'] is False
+
+    @patch('image_format.PNG_TRANSCODE_MIN_BYTES', 0)
+    def test_photo_png_transcoded_only_when_smaller(self):
+        """写真のPNGはJPEGにすると十分小さくなる場合だけ変換"""
+        data = encode(Image.effect_noise((64, 64), 64).convert('RGB'), 'PNG')
+        with patch('image_format.PNG_TRANSCODE_MAX_RATIO', 1.0):
+            assert ingest_image(data)['media_type'] == 'image/jpeg'
+        with patch('image_format.PNG_TRANSCODE_MAX_RATIO', 0.0):
+            ingested = ingest_image(data)
+            assert ingested['media_type'] == 'image/png'
+            assert ingested['image_bytes'] is data
+
+    def test_unreadable_data(self):
+        """読み込めないデータは再試行しない失敗にする"""
+        with pytest.raises(UnsupportedImageFormat):
+            ingest_image(b'not an image')
+
+    def test_heic_without_decoder(self):
+        """pillow-heifが無い環境ではHEICを読み込めない"""
+        with patch.dict('sys.modules', {'pillow_heif': None}):
+            with pytest.raises(UnsupportedImageFormat):
+                ingest_image(b'\x00\x00\x00\x18ftypheic\x00\x00\x00\x00mif1heic')
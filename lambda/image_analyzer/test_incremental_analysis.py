@@ -0,0 +1,76 @@
+"""
+連続撮影の差分分析のユニットテスト
+"""
+
+import base64
+import pytest
+from unittest.mock import patch
+
+from handler import analyze_image
+
+
+class TestIncrementalMode:
+    """連続撮影の差分分析のテスト"""
+    
+    @patch('handler.INCREMENTAL_MODE_ENABLED', True)
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_panned_photo_analyzes_revealed_region_only(self, mock_get_image, mock_detect, mock_claude):
+        """右に振った2枚目は右端の新しい領域だけを分析し、重なる部分の機器を引き継ぐ"""
+        pytest.importorskip('numpy')
+        from PIL import Image
+        from io import BytesIO
+        from panning import MemoryFrameStateStore
+        from test_panning import make_wall, take_photo
+        
+        wall = make_wall()
+        photos = {
+            'uploads/sessions/room-1/1000-a.jpg': take_photo(wall, 0),
+            'uploads/sessions/room-1/1001-b.jpg': take_photo(wall, 240)
+        }
+        mock_get_image.side_effect = lambda bucket, key: photos[key]
+        mock_detect.side_effect = lambda bucket, key, image_bytes=None: [
+            {'label': 'Monitor', 'confidence': 95.0, 'bbox': {'x': 40, 'y': 20, 'width': 20, 'height': 20}}
+        ]
+        mock_claude.return_value = {'equipment': [
+            {'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': 'y'}
+        ]}
+        
+        with patch('incremental_analysis.frame_state_store', MemoryFrameStateStore()):
+            first = analyze_image('b', 'uploads/sessions/room-1/1000-a.jpg', None)
+            second = analyze_image('b', 'uploads/sessions/room-1/1001-b.jpg', None)
+        
+        assert first['equipment'][0]['bbox']['x'] == 40
+        # 2回目のClaudeには右端の領域の切り出し画像だけを送る
+        crop = Image.open(BytesIO(base64.b64decode(mock_claude.call_args_list[1][0][0])))
+        assert crop.width < 1200 * 0.35 and crop.height == 900
+        
+        carried = [e for e in second['equipment'] if e.get('carried_over')]
+        assert len(carried) == 1
+        assert carried[0]['bbox']['x'] == pytest.approx(20, abs=1.5)
+        # 新しい領域で検出した機器は画像全体の座標に変換する
+        detected = [e for e in second['equipment'] if not e.get('carried_over')]
+        assert len(detected) == 1 and detected[0]['bbox']['x'] > 70
+    
+    @patch('handler.INCREMENTAL_MODE_ENABLED', True)
+    @patch('handler.analyze_equipment_with_claude', return_value={'equipment': []})
+    @patch('handler.detect_objects_with_rekognition', return_value=[])
+    @patch('handler.get_image_from_s3')
+    def test_different_scene_analyzed_in_full(self, mock_get_image, mock_detect, mock_claude):
+        """別の場所を撮った写真は全体を通常どおり分析"""
+        pytest.importorskip('numpy')
+        from test_panning import make_wall, take_photo
+        from panning import MemoryFrameStateStore
+        
+        photos = {
+            'uploads/sessions/room-1/1000-a.jpg': take_photo(make_wall(1), 0),
+            'uploads/sessions/room-1/1001-b.jpg': take_photo(make_wall(2), 0)
+        }
+        mock_get_image.side_effect = lambda bucket, key: photos[key]
+        
+        with patch('incremental_analysis.frame_state_store', MemoryFrameStateStore()):
+            analyze_image('b', 'uploads/sessions/room-1/1000-a.jpg', None)
+            analyze_image('b', 'uploads/sessions/room-1/1001-b.jpg', None)
+        
+        assert [c[0][1] for c in mock_detect.call_args_list] == list(photos)
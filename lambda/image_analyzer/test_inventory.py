@@ -0,0 +1,124 @@
+"""
+機器台帳のユニットテスト
+"""
+
+import boto3
+from io import BytesIO
+from moto import mock_aws
+from PIL import Image, ImageDraw
+from inventory import (
+    normalize_device_name,
+    compute_fingerprints,
+    hamming_distance,
+    find_matching_device,
+    merge_into_inventory,
+    MemoryInventoryStore,
+    DynamoDBInventoryStore
+)
+
+
+def make_rack_image(shift: int = 0) -> bytes:
+    """機器の前面パネルを模した模様を持つテスト画像"""
+    image = Image.new('RGB', (400, 300), (40, 40, 40))
+    draw = ImageDraw.Draw(image)
+    for i in range(6):
+        draw.rectangle([20 + i * 25 + shift, 30, 30 + i * 25 + shift, 120], fill=(230, 230, 230))
+    draw.ellipse([250, 150, 350, 250], fill=(200, 30, 30))
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=95)
+    return buffer.getvalue()
+
+
+PANEL_BBOX = {'x': 0, 'y': 0, 'width': 50, 'height': 50}
+KNOB_BBOX = {'x': 60, 'y': 45, 'width': 30, 'height': 40}
+
+
+class TestNormalizeDeviceName:
+    """機器名の正規化のテスト"""
+    
+    def test_width_case_and_spaces(self):
+        """全角・大文字小文字・空白の違いを無視"""
+        assert normalize_device_name('Ｓｏｎｙ PVM-A250 モニター') == normalize_device_name('sony pvma250モニター')
+
+
+class TestFingerprints:
+    """視覚指紋のテスト"""
+    
+    def test_same_crop_matches(self):
+        """同じ機器の切り出しは近い指紋になる"""
+        first = compute_fingerprints(make_rack_image(), [PANEL_BBOX])[0]
+        second = compute_fingerprints(make_rack_image(shift=1), [PANEL_BBOX])[0]
+        assert hamming_distance(first, second) <= 6
+    
+    def test_different_crop_differs(self):
+        """異なる機器の切り出しは離れた指紋になる"""
+        panel, knob = compute_fingerprints(make_rack_image(), [PANEL_BBOX, KNOB_BBOX])
+        assert hamming_distance(panel, knob) > 6
+    
+    def test_flat_crop(self):
+        """無地の領域は指紋なし（どれとも一致させない）"""
+        blank = BytesIO()
+        Image.new('RGB', (100, 100), 'white').save(blank, format='JPEG')
+        assert compute_fingerprints(blank.getvalue(), [PANEL_BBOX]) == [None]
+    
+    def test_degenerate_bbox(self):
+        """潰れたボックスは指紋なし"""
+        assert compute_fingerprints(make_rack_image(), [{'x': 10, 'y': 10, 'width': 0, 'height': 5}]) == [None]
+
+
+class TestMergeIntoInventory:
+    """台帳への統合のテスト"""
+    
+    def test_deduplicates_same_device(self):
+        """同じ名前・近い指紋は同一機器として数える"""
+        equipment = {'name': 'ATEM Mini', 'risk_level': 'SAFE', 'description': 'スイッチャー'}
+        devices = merge_into_inventory([], [equipment], ['ffff000000000000'])
+        devices = merge_into_inventory(devices, [dict(equipment, name='ATEM  mini', risk_level='DANGER')], ['ffff000000000001'])
+        
+        assert len(devices) == 1
+        assert devices[0]['seenCount'] == 2
+        assert devices[0]['risk_level'] == 'DANGER'
+        assert devices[0]['fingerprints'] == ['ffff000000000001', 'ffff000000000000']
+    
+    def test_unknown_not_recorded(self):
+        """識別できなかった機器は載せない"""
+        equipment = {'name': '不明な機器', 'risk_level': 'UNKNOWN', 'description': ''}
+        assert merge_into_inventory([], [equipment], ['ffff000000000000']) == []
+    
+    def test_find_matching_device(self):
+        """最も近い指紋の機器を返す"""
+        devices = [
+            {'name': 'A', 'fingerprints': ['0000000000000000']},
+            {'name': 'B', 'fingerprints': ['00000000000000ff']}
+        ]
+        assert find_matching_device(devices, '000000000000000f', max_distance=4)['name'] == 'A'
+        assert find_matching_device(devices, '0f0f0f0f00000000', max_distance=4) is None
+
+
+class TestInventoryStores:
+    """台帳の保存先のテスト"""
+    
+    def test_memory_version_conflict(self):
+        """読み込み後に他の実行が更新していたら保存しない"""
+        store = MemoryInventoryStore()
+        _, version = store.load('room-1')
+        assert store.save('room-1', [], version)
+        assert not store.save('room-1', [], version)
+    
+    def test_dynamodb_update(self):
+        """DynamoDBの台帳に統合して保存"""
+        with mock_aws():
+            table = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+                TableName='inventory',
+                KeySchema=[{'AttributeName': 'locationId', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'locationId', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+            store = DynamoDBInventoryStore(table)
+            equipment = {'name': 'ATEM Mini', 'risk_level': 'SAFE', 'description': 'スイッチャー'}
+            store.update('room-1', [equipment], ['ffff000000000000'])
+            store.update('room-1', [equipment], ['ffff000000000000'])
+            
+            devices, version = store.load('room-1')
+            assert version == 2
+            assert devices[0]['seenCount'] == 2
@@ -0,0 +1,130 @@
+"""
+分析完了通知のユニットテスト
+"""
+
+import json
+import boto3
+import pytest
+import threading
+from unittest.mock import Mock
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from notifier import (
+    MemoryNotifier,
+    FileNotifier,
+    SnsNotifier,
+    WebSocketNotifier,
+    build_completion_event,
+    EVENT_ANALYSIS_COMPLETED
+)
+
+
+class TestBuildCompletionEvent:
+    """完了イベント作成のテスト"""
+    
+    def test_event_fields(self):
+        """結果本体は含めず件数だけを載せる"""
+        event = build_completion_event('uploads/a.jpg', {'equipment': [{'name': 'x'}, {'name': 'y'}]})
+        assert event['type'] == EVENT_ANALYSIS_COMPLETED
+        assert event['imageKey'] == 'uploads/a.jpg'
+        assert event['equipmentCount'] == 2
+        assert 'equipment' not in event
+    
+    def test_rejected_event(self):
+        """品質チェックで除外した画像は理由を載せる"""
+        event = build_completion_event('uploads/a.jpg', {'equipment': [], 'rejection': {'reason': 'blurry'}})
+        assert event['status'] == 'rejected'
+        assert event['reason'] == 'blurry'
+
+
+class TestMemoryNotifier:
+    """プロセス内の通知のテスト"""
+    
+    def test_wait_for_published_event(self):
+        """別スレッドからの発行を待てる"""
+        notifier = MemoryNotifier()
+        event = build_completion_event('uploads/a.jpg', {'equipment': []})
+        threading.Timer(0.05, notifier.publish, args=[event]).start()
+        assert notifier.wait_for('uploads/a.jpg', 2) == event
+    
+    def test_wait_for_timeout(self):
+        """発行されなければNone"""
+        assert MemoryNotifier().wait_for('uploads/a.jpg', 0.01) is None
+
+
+class TestFileNotifier:
+    """ファイルへの通知のテスト"""
+    
+    def test_appends_json_lines(self, tmp_path):
+        """1イベント1行で追記"""
+        path = tmp_path / 'events.jsonl'
+        notifier = FileNotifier(str(path))
+        notifier.publish(build_completion_event('uploads/a.jpg', {'equipment': []}))
+        notifier.publish(build_completion_event('uploads/b.jpg', {'equipment': []}))
+        lines = path.read_text(encoding='utf-8').splitlines()
+        assert [json.loads(line)['imageKey'] for line in lines] == ['uploads/a.jpg', 'uploads/b.jpg']
+
+
+class TestSnsNotifier:
+    """SNSへの通知のテスト"""
+    
+    def test_publish_with_attributes(self):
+        """imageKeyをメッセージ属性に載せて発行"""
+        client = Mock()
+        SnsNotifier(client, 'arn:aws:sns:us-east-1:123:topic').publish(
+            build_completion_event('uploads/a.jpg', {'equipment': []})
+        )
+        kwargs = client.publish.call_args.kwargs
+        assert kwargs['TopicArn'] == 'arn:aws:sns:us-east-1:123:topic'
+        assert kwargs['MessageAttributes']['imageKey']['StringValue'] == 'uploads/a.jpg'
+        assert json.loads(kwargs['Message'])['status'] == 'completed'
+
+
+@pytest.fixture
+def subscriptions():
+    """moto上の接続の登録テーブル"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        yield dynamodb.create_table(
+            TableName='subscriptions',
+            KeySchema=[
+                {'AttributeName': 'imageKey', 'KeyType': 'HASH'},
+                {'AttributeName': 'connectionId', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'imageKey', 'AttributeType': 'S'},
+                {'AttributeName': 'connectionId', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+
+class TestWebSocketNotifier:
+    """WebSocket接続への通知のテスト"""
+    
+    def test_sends_to_subscribed_connections_only(self, subscriptions):
+        """その画像を待っている接続にだけ送り、送った登録は消す"""
+        subscriptions.put_item(Item={'imageKey': 'uploads/a.jpg', 'connectionId': 'c1'})
+        subscriptions.put_item(Item={'imageKey': 'uploads/b.jpg', 'connectionId': 'c2'})
+        client = Mock()
+        
+        WebSocketNotifier(subscriptions, client).publish(build_completion_event('uploads/a.jpg', {'equipment': []}))
+        
+        assert [c.kwargs['ConnectionId'] for c in client.post_to_connection.call_args_list] == ['c1']
+        assert json.loads(client.post_to_connection.call_args.kwargs['Data'])['imageKey'] == 'uploads/a.jpg'
+        assert subscriptions.scan()['Items'] == [{'imageKey': 'uploads/b.jpg', 'connectionId': 'c2'}]
+    
+    def test_gone_connection_removed(self, subscriptions):
+        """切断済みの接続は登録を消して続ける"""
+        subscriptions.put_item(Item={'imageKey': 'uploads/a.jpg', 'connectionId': 'c1'})
+        subscriptions.put_item(Item={'imageKey': 'uploads/a.jpg', 'connectionId': 'c2'})
+        client = Mock()
+        client.post_to_connection.side_effect = [
+            ClientError({'Error': {'Code': 'GoneException'}}, 'PostToConnection'),
+            None
+        ]
+        
+        WebSocketNotifier(subscriptions, client).publish(build_completion_event('uploads/a.jpg', {'equipment': []}))
+        
+        assert client.post_to_connection.call_count == 2
+        assert subscriptions.scan()['Items'] == []
@@ -0,0 +1,175 @@
+"""
+連続撮影の差分分析のユニットテスト
+"""
+
+import random
+import pytest
+from io import BytesIO
+from PIL import Image, ImageDraw
+
+from panning import (
+    frame_thumbnail,
+    estimate_shift,
+    revealed_regions,
+    analysis_region,
+    region_area,
+    reproject_equipment,
+    encode_thumbnail,
+    frame_number,
+    find_previous_frame,
+    MemoryFrameStateStore
+)
+
+try:
+    import numpy as np
+except ImportError:
+    # 差分分析を使うデプロイだけが依存を持つ
+    np = None
+
+requires_numpy = pytest.mark.skipif(np is None, reason='numpyが必要です')
+
+
+def make_wall(seed: int = 1) -> Image.Image:
+    """機器の並んだ横長の壁を模したテスト画像（ここから写真を切り出す）"""
+    rng = random.Random(seed)
+    wall = Image.new('RGB', (2400, 1200), (120, 120, 120))
+    draw = ImageDraw.Draw(wall)
+    for _ in range(150):
+        x, y = rng.randint(0, 2300), rng.randint(0, 1100)
+        color = tuple(rng.randint(0, 255) for _ in range(3))
+        draw.rectangle([x, y, x + rng.randint(20, 200), y + rng.randint(20, 200)], fill=color)
+    return wall
+
+
+def take_photo(wall: Image.Image, left: int, top: int = 100) -> bytes:
+    """壁の一部を1200x900の写真として切り出す（カメラを振った位置）"""
+    output = BytesIO()
+    wall.crop((left, top, left + 1200, top + 900)).save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+@requires_numpy
+class TestEstimateShift:
+    """前の写真からの移動量の推定のテスト"""
+
+    def test_horizontal_pan(self):
+        """右に振ると内容は左に移動し、右端が新しく写る"""
+        wall = make_wall()
+        shift = estimate_shift(frame_thumbnail(take_photo(wall, 0)), frame_thumbnail(take_photo(wall, 240)))
+
+        assert shift['dx'] == pytest.approx(-20, abs=1.5)
+        assert shift['dy'] == pytest.approx(0, abs=1.5)
+        assert shift['similarity'] > 0.9
+        assert shift['changed'] == []
+
+        region = analysis_region(shift)
+        assert region['x'] + region['width'] == pytest.approx(100)
+        assert region_area(region) < 0.3
+
+    def test_small_vertical_jitter_ignored(self):
+        """横に振る間の小さな縦方向の手ぶれの帯は分析し直さない"""
+        wall = make_wall()
+        shift = estimate_shift(frame_thumbnail(take_photo(wall, 0)), frame_thumbnail(take_photo(wall, 360, 130)))
+
+        assert shift['dy'] < 0
+        region = analysis_region(shift)
+        assert region['height'] == pytest.approx(100)
+        assert region['x'] > 60
+
+    def test_changed_area_detected(self):
+        """重なる部分で変化した場所だけを分析し直す"""
+        wall = make_wall()
+        changed = wall.copy()
+        ImageDraw.Draw(changed).rectangle([500, 500, 700, 700], fill=(255, 0, 0))
+
+        shift = estimate_shift(frame_thumbnail(take_photo(wall, 0)), frame_thumbnail(take_photo(changed, 0)))
+
+        assert shift['dx'] == 0 and shift['dy'] == 0
+        region = analysis_region(shift)
+        assert region is not None
+        assert region['x'] < 500 / 12 < region['x'] + region['width']
+        assert region_area(region) < 0.3
+
+    def test_different_scene(self):
+        """別の場所を撮った写真は相関が低い（全体を分析する）"""
+        shift = estimate_shift(
+            frame_thumbnail(take_photo(make_wall(1), 0)),
+            frame_thumbnail(take_photo(make_wall(2), 0))
+        )
+        assert shift['similarity'] < 0.5
+
+
+class TestReprojectEquipment:
+    """前の写真の機器の引き継ぎのテスト"""
+
+    def test_shift_and_clip(self):
+        """移動量だけずらし、画像から大きくはみ出す機器は引き継がない"""
+        equipment = [
+            {'name': 'モニター', 'bbox': {'x': 40, 'y': 10, 'width': 20, 'height': 20}},
+            {'name': 'ラック', 'bbox': {'x': 5, 'y': 10, 'width': 20, 'height': 20}},
+            {'name': 'ルーター', 'bbox': {'x': 15, 'y': 10, 'width': 20, 'height': 20}}
+        ]
+        carried = reproject_equipment(equipment, -20, 0)
+
+        assert [e['name'] for e in carried] == ['モニター', 'ルーター']
+        assert carried[0]['bbox'] == {'x': 20, 'y': 10, 'width': 20, 'height': 20}
+        # 一部がはみ出す機器は画像の範囲に切り詰める
+        assert carried[1]['bbox']['x'] == 0 and carried[1]['bbox']['width'] == 15
+        assert all(e['carried_over'] for e in carried)
+
+    def test_revealed_regions(self):
+        """移動の向きと反対側の端が新しく写る"""
+        assert revealed_regions(-20, 0) == [{'x': 80, 'y': 0.0, 'width': 20, 'height': 100.0}]
+        assert revealed_regions(0, 10) == [{'x': 0.0, 'y': 0.0, 'width': 100.0, 'height': 10}]
+        assert revealed_regions(0, 0) == []
+
+
+class TestFrameNumber:
+    """撮影番号の取り出しのテスト"""
+
+    def test_frame_number(self):
+        """f<6桁>-で始まるファイル名から撮影番号を取り出す"""
+        assert frame_number('uploads/sessions/s/f000012-1700000000000-a.jpg') == 12
+        assert frame_number('uploads/sessions/s/1700000000000-a.jpg') is None
+
+
+@requires_numpy
+class TestFrameState:
+    """前の写真の状態の確認のテスト"""
+
+    def make_state(self, **overrides):
+        state = {
+            'image_key': 'uploads/sessions/s/1000-a.jpg',
+            'thumbnail': encode_thumbnail(np.zeros((128, 128), dtype=np.uint8)),
+            'size': [1200, 900],
+            'equipment': [],
+            'updatedAt': 100.0
+        }
+        state.update(overrides)
+        return state
+
+    def test_previous_frame_used(self):
+        """同じ向きで直前に撮った写真の縮小画像を返す"""
+        previous = find_previous_frame(self.make_state(), 'uploads/sessions/s/1001-b.jpg', (1200, 900), now=110)
+        assert previous.shape == (128, 128)
+
+    def test_unusable_states(self):
+        """古い・順序が逆・向きが違う場合は使わない"""
+        key = 'uploads/sessions/s/1001-b.jpg'
+        assert find_previous_frame(None, key, (1200, 900), now=110) is None
+        assert find_previous_frame(self.make_state(), key, (1200, 900), now=1000) is None
+        assert find_previous_frame(self.make_state(image_key='uploads/sessions/s/1002-c.jpg'), key, (1200, 900), now=110) is None
+        assert find_previous_frame(self.make_state(), key, (900, 1200), now=110) is None
+
+    def test_frame_numbers_must_be_adjacent(self):
+        """撮影番号がある場合は直前の番号の写真だけを使う"""
+        state = self.make_state(image_key='uploads/sessions/s/f000001-1000-a.jpg')
+        assert find_previous_frame(state, 'uploads/sessions/s/f000002-1001-b.jpg', (1200, 900), now=110) is not None
+        assert find_previous_frame(state, 'uploads/sessions/s/f000003-1002-c.jpg', (1200, 900), now=110) is None
+
+    def test_store_keeps_latest_frame(self):
+        """後の写真の状態を前の写真の状態で上書きしない"""
+        store = MemoryFrameStateStore()
+        store.save('s', self.make_state(image_key='uploads/sessions/s/1002-c.jpg'))
+        store.save('s', self.make_state(image_key='uploads/sessions/s/1001-b.jpg'))
+        assert store.load('s')['image_key'] == 'uploads/sessions/s/1002-c.jpg'
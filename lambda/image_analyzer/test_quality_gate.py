@@ -0,0 +1,78 @@
+"""
+画像の品質チェックのユニットテスト
+"""
+
+import random
+from io import BytesIO
+from unittest.mock import patch
+from PIL import Image, ImageDraw, ImageFilter
+
+from quality_gate import (
+    measure_image_quality,
+    evaluate_quality,
+    evaluate_detections,
+    build_rejected_result,
+    REJECT_TOO_DARK,
+    REJECT_TOO_BRIGHT,
+    REJECT_BLURRY,
+    REJECT_NO_OBJECTS
+)
+
+
+def make_scene(blur: float = 0) -> bytes:
+    """機器の並んだ棚を模したテスト画像（blurを指定するとぼかす）"""
+    rng = random.Random(1)
+    image = Image.new('RGB', (1200, 900), (120, 120, 120))
+    draw = ImageDraw.Draw(image)
+    for _ in range(50):
+        x, y = rng.randint(0, 1100), rng.randint(0, 800)
+        color = tuple(rng.randint(0, 255) for _ in range(3))
+        draw.rectangle([x, y, x + rng.randint(20, 200), y + rng.randint(20, 200)], fill=color)
+    if blur:
+        image = image.filter(ImageFilter.GaussianBlur(blur))
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def make_flat(level: int) -> bytes:
+    output = BytesIO()
+    Image.new('RGB', (800, 600), (level, level, level)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+class TestEvaluateQuality:
+    """鮮明さ・露出の判定のテスト"""
+
+    def test_sharp_photo_passes(self):
+        """鮮明で露出の適切な写真は除外しない"""
+        assert evaluate_quality(measure_image_quality(make_scene())) is None
+
+    def test_blurry_photo_rejected(self):
+        """大きくぶれた写真はblurry"""
+        metrics = measure_image_quality(make_scene(blur=8))
+        assert evaluate_quality(metrics) == REJECT_BLURRY
+
+    def test_exposure(self):
+        """真っ暗・真っ白な写真はぶれより先に露出で判定"""
+        assert evaluate_quality(measure_image_quality(make_flat(5))) == REJECT_TOO_DARK
+        assert evaluate_quality(measure_image_quality(make_flat(250))) == REJECT_TOO_BRIGHT
+
+    @patch('quality_gate.QUALITY_MIN_SHARPNESS', 0)
+    def test_thresholds_configurable(self):
+        """閾値を変えれば除外しない"""
+        assert evaluate_quality(measure_image_quality(make_scene(blur=8))) is None
+
+
+def test_empty_detections_rejected_only_when_enabled():
+    """物体が検出されない画像の除外は設定で有効にした場合のみ"""
+    assert evaluate_detections([]) is None
+    with patch('quality_gate.QUALITY_REJECT_EMPTY', True):
+        assert evaluate_detections([]) == REJECT_NO_OBJECTS
+        assert evaluate_detections([{'label': 'Monitor'}]) is None
+
+
+def test_rejected_result():
+    """除外した画像の結果は機器が空で、理由と計測値を持つ"""
+    result = build_rejected_result(REJECT_BLURRY, {'sharpness': 3.2})
+    assert result == {'equipment': [], 'rejection': {'reason': 'blurry', 'metrics': {'sharpness': 3.2}}}
@@ -0,0 +1,153 @@
+"""
+Bedrockのレート制限のユニットテスト
+"""
+
+import boto3
+import pytest
+from moto import mock_aws
+from rate_limiter import (
+    LocalRateLimiter,
+    DynamoDBRateLimiter,
+    RateLimitExceeded,
+    estimate_request_tokens,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BATCH
+)
+
+
+class FakeClock:
+    """sleepで進むテスト用の時計"""
+
+    def __init__(self, now: float = 6000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_local_limiter(tokens_per_minute: int, clock: FakeClock, **kwargs) -> LocalRateLimiter:
+    """テスト用の時計を使うLocalRateLimiter"""
+    return LocalRateLimiter(tokens_per_minute, clock=clock.time, sleep=clock.sleep, **kwargs)
+
+
+@pytest.fixture
+def table():
+    """moto上のレート制限テーブル"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        yield dynamodb.create_table(
+            TableName='rate-limit',
+            KeySchema=[{'AttributeName': 'limiterKey', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'limiterKey', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+
+class TestEstimateRequestTokens:
+    """消費トークン数の見積もりのテスト"""
+
+    def test_image_text_and_max_tokens(self):
+        """画像・テキスト・max_tokensを合計"""
+        body = {
+            'max_tokens': 2000,
+            'messages': [{'role': 'user', 'content': [
+                {'type': 'image', 'source': {}},
+                {'type': 'text', 'text': 'a' * 500}
+            ]}]
+        }
+        assert estimate_request_tokens(body) == 1600 + 500 + 2000
+
+
+class TestLocalRateLimiter:
+    """プロセス内のレート制限のテスト"""
+
+    def test_within_limit_no_wait(self):
+        """上限内なら待たずに確保"""
+        clock = FakeClock()
+        limiter = make_local_limiter(10000, clock)
+        reservation = limiter.acquire(4000, PRIORITY_INTERACTIVE)
+        assert reservation['waited'] == 0
+        assert clock.slept == []
+
+    def test_interactive_borrows_batch_share(self):
+        """interactiveはbatchの上限を超えてクォータの全量まで使える"""
+        clock = FakeClock()
+        limiter = make_local_limiter(10000, clock, batch_share=0.5, max_wait={
+            PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0
+        })
+        limiter.acquire(5000, PRIORITY_BATCH)
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire(1000, PRIORITY_BATCH)
+        limiter.acquire(5000, PRIORITY_INTERACTIVE)
+
+    def test_waits_for_next_window(self):
+        """上限に達した場合は次の窓まで待つ"""
+        clock = FakeClock(now=6050.0)
+        limiter = make_local_limiter(10000, clock, max_wait={PRIORITY_INTERACTIVE: 30})
+        limiter.acquire(9000, PRIORITY_INTERACTIVE)
+        reservation = limiter.acquire(2000, PRIORITY_INTERACTIVE)
+        assert clock.now >= 6060.0
+        assert reservation['window'] == 101
+        assert reservation['waited'] > 0
+
+    def test_batch_gives_up_after_max_wait(self):
+        """batchは待ち時間の上限を超えたら例外（再キュー）"""
+        clock = FakeClock(now=6000.0)
+        limiter = make_local_limiter(10000, clock, max_wait={PRIORITY_BATCH: 5})
+        limiter.acquire(7000, PRIORITY_BATCH)
+        with pytest.raises(RateLimitExceeded):
+            limiter.acquire(1000, PRIORITY_BATCH)
+        assert clock.now - 6000.0 <= 5.0
+
+    def test_oversized_request_in_empty_window(self):
+        """上限を超える大きなリクエストも空の窓なら通す"""
+        limiter = make_local_limiter(1000, FakeClock())
+        assert limiter.acquire(5000)['cost'] == 5000
+
+    def test_settle_returns_unused_tokens(self):
+        """実際の消費量が見積もりより少なければ空きが戻る"""
+        clock = FakeClock()
+        limiter = make_local_limiter(10000, clock, max_wait={PRIORITY_INTERACTIVE: 0})
+        reservation = limiter.acquire(8000)
+        limiter.settle(reservation, 3000)
+        limiter.acquire(7000)
+
+    def test_refund_returns_whole_reservation(self):
+        """失敗した呼び出しの見積もりはすべて空きに戻る"""
+        limiter = make_local_limiter(10000, FakeClock(), max_wait={PRIORITY_INTERACTIVE: 0})
+        reservation = limiter.acquire(8000)
+        limiter.refund(reservation)
+        limiter.acquire(10000)
+
+
+class TestDynamoDBRateLimiter:
+    """DynamoDBのアトミックカウンタによるレート制限のテスト"""
+
+    def test_shared_counter(self, table):
+        """複数のインスタンス（別のLambda実行）で消費量を共有"""
+        clock = FakeClock()
+        kwargs = {'clock': clock.time, 'sleep': clock.sleep, 'max_wait': {PRIORITY_INTERACTIVE: 0}}
+        first = DynamoDBRateLimiter(table, 10000, **kwargs)
+        second = DynamoDBRateLimiter(table, 10000, **kwargs)
+
+        first.acquire(6000)
+        with pytest.raises(RateLimitExceeded):
+            second.acquire(6000)
+        second.acquire(4000)
+
+        item = table.get_item(Key={'limiterKey': 'bedrock#100'})['Item']
+        assert item['used'] == 10000
+        assert item['ttl'] > 6060
+
+    def test_settle(self, table):
+        """実際の消費量で補正"""
+        clock = FakeClock()
+        limiter = DynamoDBRateLimiter(table, 10000, clock=clock.time, sleep=clock.sleep)
+        reservation = limiter.acquire(6000)
+        limiter.settle(reservation, 2500)
+        assert table.get_item(Key={'limiterKey': 'bedrock#100'})['Item']['used'] == 2500
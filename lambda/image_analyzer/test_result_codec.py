@@ -0,0 +1,74 @@
+"""
+分析結果の保存形式のユニットテスト
+"""
+
+import json
+import zlib
+import pytest
+from boto3.dynamodb.types import Binary
+from result_codec import encode_result, decode_result, RESULT_SCHEMA_VERSION
+
+
+SAMPLE_RESULT = {
+    'equipment': [
+        {
+            'name': 'Sony PVM-A250モニター',
+            'bbox': {'x': 12.345678901234567, 'y': 0.1, 'width': 30.0, 'height': 40.987654321},
+            'risk_level': 'SAFE',
+            'description': '業務用モニター',
+            'manual_url': None,
+            'confidence': 98.76543210987654,
+            'source': 'rekognition'
+        }
+    ]
+}
+
+
+class TestEncodeResult:
+    """エンコードのテスト"""
+    
+    def test_summary_attributes(self):
+        """スキーマバージョンと機器数を最上位の属性に持つ"""
+        item = encode_result(SAMPLE_RESULT)
+        assert item['schemaVersion'] == RESULT_SCHEMA_VERSION
+        assert item['equipmentCount'] == 1
+        assert isinstance(item['result'], bytes)
+    
+    def test_smaller_than_legacy(self):
+        """旧形式のJSON文字列より小さい"""
+        result = {'equipment': SAMPLE_RESULT['equipment'] * 20}
+        assert len(encode_result(result)['result']) < len(json.dumps(result)) / 4
+    
+    def test_quantize_and_omit_null(self):
+        """bboxを量子化し、null項目を省く"""
+        payload = json.loads(zlib.decompress(encode_result(SAMPLE_RESULT)['result']))
+        equipment = payload['equipment'][0]
+        assert equipment['bbox'] == {'x': 12.35, 'y': 0.1, 'width': 30.0, 'height': 40.99}
+        assert equipment['confidence'] == 98.77
+        assert 'manual_url' not in equipment
+
+
+class TestDecodeResult:
+    """デコードのテスト"""
+    
+    def test_round_trip(self):
+        """エンコードした結果を復元"""
+        item = encode_result(SAMPLE_RESULT)
+        result = decode_result(item)
+        assert result['equipment'][0]['name'] == 'Sony PVM-A250モニター'
+        assert result['equipment'][0]['bbox']['x'] == pytest.approx(12.35)
+    
+    def test_boto3_binary(self):
+        """boto3のBinary型から復元"""
+        item = encode_result(SAMPLE_RESULT)
+        item['result'] = Binary(item['result'])
+        assert decode_result(item)['equipment'][0]['risk_level'] == 'SAFE'
+    
+    def test_legacy_json_string(self):
+        """旧形式（json.dumpsの文字列）も読める"""
+        item = {'imageKey': 'uploads/a.jpg', 'result': json.dumps(SAMPLE_RESULT), 'status': 'completed'}
+        assert decode_result(item) == SAMPLE_RESULT
+    
+    def test_missing_result(self):
+        """結果が無い項目は空配列"""
+        assert decode_result({'status': 'processing'}) == {'equipment': []}
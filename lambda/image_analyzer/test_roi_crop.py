@@ -0,0 +1,74 @@
+"""
+関心領域の切り出しのユニットテスト
+"""
+
+import pytest
+from io import BytesIO
+from PIL import Image
+
+from roi_crop import compute_roi, crop_to_roi, bbox_from_roi, equipment_from_roi
+
+
+def detection(label: str, x: float, y: float, width: float, height: float, confidence: float = 90.0) -> dict:
+    return {'label': label, 'confidence': confidence, 'bbox': {'x': x, 'y': y, 'width': width, 'height': height}}
+
+
+class TestComputeRoi:
+    """関心領域の計算のテスト"""
+
+    def test_union_of_equipment_with_padding(self):
+        """人・家具を除いた物体の外接矩形に余白を加える"""
+        roi = compute_roi([
+            detection('Monitor', 40, 30, 20, 10),
+            detection('Electronics', 50, 45, 20, 10),
+            detection('Person', 0, 0, 30, 100),
+            detection('Chair', 70, 70, 30, 30)
+        ])
+
+        # 外接矩形 x: 40-70, y: 30-55 に余白（大きさの15%、最小3%）
+        assert roi['x'] == pytest.approx(35.5)
+        assert roi['y'] == pytest.approx(26.25)
+        assert roi['x'] + roi['width'] == pytest.approx(74.5)
+        assert roi['y'] + roi['height'] == pytest.approx(58.75)
+
+    def test_small_roi_expanded_to_min_side(self):
+        """小さな物体1つでも一辺は最小値まで広げ、画像の範囲に収める"""
+        roi = compute_roi([detection('Monitor', 90, 2, 5, 5)])
+        assert roi['width'] == pytest.approx(30)
+        assert roi['height'] == pytest.approx(30)
+        assert roi['x'] + roi['width'] == pytest.approx(100)
+        assert roi['y'] == 0
+
+    def test_no_crop(self):
+        """対象の物体が無い・領域が広すぎる場合は切り出さない"""
+        assert compute_roi([]) is None
+        assert compute_roi([detection('Person', 10, 10, 30, 30)]) is None
+        assert compute_roi([detection('Monitor', 10, 10, 30, 30, confidence=35)]) is None
+        assert compute_roi([detection('Monitor', 2, 2, 10, 10), detection('Monitor', 85, 85, 10, 10)]) is None
+
+
+class TestCropToRoi:
+    """切り出しと座標の変換のテスト"""
+
+    def test_crop_and_map_back(self):
+        """切り出し画像の座標を画像全体の座標に戻す"""
+        output = BytesIO()
+        Image.new('RGB', (1000, 800), (90, 90, 90)).save(output, format='JPEG')
+
+        crop_bytes, roi = crop_to_roi(output.getvalue(), {'x': 20, 'y': 25, 'width': 50, 'height': 50})
+
+        assert Image.open(BytesIO(crop_bytes)).size == (500, 400)
+        assert bbox_from_roi({'x': 50, 'y': 50, 'width': 10, 'height': 20}, roi) == {
+            'x': 45, 'y': 50, 'width': 5, 'height': 10
+        }
+
+    def test_only_boxes_are_mapped(self):
+        """座標の無いRekognition検出分はそのまま"""
+        roi = {'x': 50, 'y': 0, 'width': 50, 'height': 100}
+        result = equipment_from_roi([
+            {'source': 'rekognition', 'object_index': 0, 'name': 'モニター'},
+            {'source': 'claude', 'name': 'ルーター', 'bbox': {'x': 0, 'y': 10, 'width': 20, 'height': 10}}
+        ], roi)
+
+        assert 'bbox' not in result[0]
+        assert result[1]['bbox'] == {'x': 50, 'y': 10, 'width': 10, 'height': 10}
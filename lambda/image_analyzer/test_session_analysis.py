@@ -0,0 +1,230 @@
+"""
+撮影セッション単位の分析のユニットテスト
+"""
+
+import json
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from handler import lambda_handler
+from session_analysis import (
+    extract_session_id,
+    group_jobs_by_session,
+    analyze_session_with_claude,
+    parse_session_equipment_response,
+    finish_session_result
+)
+from test_handler import make_jpeg, make_sqs_record
+
+
+def make_session_record(message_id: str, key: str) -> dict:
+    """テスト用のセッション画像のSQSレコード"""
+    return make_sqs_record(message_id, {'Records': [{'s3': {
+        'bucket': {'name': 'b'}, 'object': {'key': key, 'eTag': f'etag-{message_id}'}
+    }}]})
+
+
+class TestSessionMode:
+    """撮影セッション単位の分析のテスト"""
+    
+    def test_extract_session_id(self):
+        """セッションの画像キーからIDを取り出す"""
+        assert extract_session_id('uploads/sessions/room-1/1-a.jpg') == 'room-1'
+        assert extract_session_id('uploads/1-a.jpg') is None
+        assert extract_session_id('uploads/sessions/1-a.jpg') is None
+    
+    @patch('session_analysis.SESSION_MAX_IMAGES', 2)
+    def test_group_jobs_by_session(self):
+        """同じセッションの画像を上限枚数までまとめる"""
+        jobs = [
+            ('m1', {'bucket': 'b', 'key': 'uploads/sessions/s1/1.jpg'}),
+            ('m2', {'bucket': 'b', 'key': 'uploads/single.jpg'}),
+            ('m3', {'bucket': 'b', 'key': 'uploads/sessions/s1/2.jpg'}),
+            ('m4', {'bucket': 'b', 'key': 'uploads/sessions/s2/1.jpg'}),
+            ('m5', {'bucket': 'b', 'key': 'uploads/sessions/s1/3.jpg'})
+        ]
+        groups = [[message_id for message_id, _ in group] for group in group_jobs_by_session(jobs)]
+        assert groups == [['m1', 'm3'], ['m2'], ['m4'], ['m5']]
+    
+    def test_parse_splits_per_image(self):
+        """応答を画像ごとの機器リストに分割"""
+        response = {'content': [{'text': json.dumps({'p': [
+            {'e': [{'i': 0, 'n': 'スイッチャー', 'r': 'D', 'd': '本番系'}]},
+            {'e': []}
+        ]})}]}
+        results = parse_session_equipment_response(response, [1, 0])
+        assert results[0]['equipment'][0]['risk_level'] == 'DANGER'
+        assert results[1] == {'equipment': []}
+    
+    def test_parse_drops_out_of_range_index(self):
+        """その画像の検出数を超えるobject_indexは除く"""
+        response = {'content': [{'text': json.dumps({'p': [
+            {'e': [{'i': 0, 'n': 'モニター', 'r': 'S', 'd': '表示'}, {'i': 2, 'n': 'ルーター', 'r': 'W', 'd': '配信'}]},
+            {'e': [{'i': 2, 'n': 'スイッチャー', 'r': 'D', 'd': '本番系'}]}
+        ]})}]}
+        results = parse_session_equipment_response(response, [1, 3])
+        assert [e['name'] for e in results[0]['equipment']] == ['モニター']
+        assert [e['name'] for e in results[1]['equipment']] == ['スイッチャー']
+    
+    def test_parse_count_mismatch(self):
+        """画像数と結果の数が合わない場合は失敗"""
+        response = {'content': [{'text': json.dumps({'p': [{'e': []}]})}]}
+        with pytest.raises(ValueError):
+            parse_session_equipment_response(response, [0, 0])
+    
+    @patch('handler.SESSION_MODE_ENABLED', True)
+    @patch('handler.PROMPT_VERSION', 'compact')
+    @patch('handler.acquire_image_lease', return_value='acquired')
+    @patch('handler.store_result')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    @patch('handler.invoke_bedrock_model')
+    def test_one_call_per_session(self, mock_invoke, mock_get_image, mock_detect, mock_store, mock_lease):
+        """同じセッションの画像は1回のBedrock呼び出しで分析し、画像ごとに保存"""
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_detect.side_effect = lambda bucket, key, image_bytes=None: [
+            {'label': key, 'confidence': 90.0, 'bbox': {'x': 1, 'y': 2, 'width': 3, 'height': 4}}
+        ]
+        mock_invoke.return_value = {'content': [{'text': json.dumps({'p': [
+            {'e': [{'i': 0, 'n': 'モニターA', 'r': 'S', 'd': '表示'}]},
+            {'e': [{'i': 0, 'n': 'モニターB', 'r': 'S', 'd': '表示'}]}
+        ]})}]}
+        
+        event = {'Records': [
+            make_session_record('m1', 'uploads/sessions/s1/1.jpg'),
+            make_session_record('m2', 'uploads/sessions/s1/2.jpg')
+        ]}
+        assert lambda_handler(event, None) == {'batchItemFailures': []}
+        
+        assert mock_invoke.call_count == 1
+        content = mock_invoke.call_args[0][0]['messages'][0]['content']
+        assert sum(1 for block in content if block['type'] == 'image') == 2
+        saved = {call[0][0]: call[0][1]['equipment'][0]['name'] for call in mock_store.call_args_list}
+        assert saved == {'uploads/sessions/s1/1.jpg': 'モニターA', 'uploads/sessions/s1/2.jpg': 'モニターB'}
+    
+    def test_parse_verbose_format(self):
+        """verboseのプロンプトでは画像ごとにequipment配列を読む"""
+        response = {'content': [{'text': json.dumps({'p': [
+            {'equipment': [{'source': 'rekognition', 'object_index': 0, 'name': 'モニター', 'risk_level': 'SAFE', 'description': '表示'}]},
+            {'equipment': []}
+        ]})}]}
+        results = parse_session_equipment_response(response, [1, 0], 'verbose')
+        assert [e['name'] for e in results[0]['equipment']] == ['モニター']
+        assert results[1] == {'equipment': []}
+    
+    @patch('handler.invoke_bedrock_model')
+    def test_tool_mode(self, mock_invoke):
+        """toolモードでは画像ごとの結果を並べたツールで報告させる"""
+        mock_invoke.return_value = {'content': [{'type': 'tool_use', 'name': 'report_equipment', 'input': {'p': [
+            {'e': [{'i': 0, 'n': 'スイッチャー', 'r': 'D', 'd': '本番系'}]},
+            {'e': []}
+        ]}}]}
+        detections = [[{'label': 'Switch', 'confidence': 90.0}], []]
+        results = analyze_session_with_claude(['aW1n', 'aW1n'], detections, 'compact', 'tool')
+        
+        body = mock_invoke.call_args[0][0]
+        assert body['tool_choice'] == {'type': 'tool', 'name': 'report_equipment'}
+        p_schema = body['tools'][0]['input_schema']['properties']['p']
+        assert p_schema['minItems'] == p_schema['maxItems'] == 2
+        assert 'e' in p_schema['items']['properties']
+        assert results[0]['equipment'][0]['risk_level'] == 'DANGER'
+        assert results[1] == {'equipment': []}
+    
+    @patch('handler.SESSION_MODE_ENABLED', True)
+    @patch('handler.PROMPT_VERSION', 'compact')
+    @patch('handler.QUALITY_GATE_ENABLED', True)
+    @patch('quality_gate.QUALITY_REJECT_EMPTY', True)
+    @patch('handler.check_image_quality', return_value=None)
+    @patch('handler.acquire_image_lease', return_value='acquired')
+    @patch('handler.store_result')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    @patch('handler.invoke_bedrock_model')
+    def test_empty_images_rejected_before_session_call(
+        self, mock_invoke, mock_get_image, mock_detect, mock_store, mock_lease, mock_quality
+    ):
+        """物体が検出されなかった画像はまとめる前に除外し、残りの画像だけを送る"""
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_detect.side_effect = lambda bucket, key, image_bytes=None: [] if key.endswith('2.jpg') else [
+            {'label': key, 'confidence': 90.0, 'bbox': {'x': 1, 'y': 2, 'width': 3, 'height': 4}}
+        ]
+        mock_invoke.return_value = {'content': [{'text': json.dumps({'p': [
+            {'e': [{'i': 0, 'n': 'モニターA', 'r': 'S', 'd': '表示'}]}
+        ]})}]}
+        
+        event = {'Records': [
+            make_session_record('m1', 'uploads/sessions/s1/1.jpg'),
+            make_session_record('m2', 'uploads/sessions/s1/2.jpg')
+        ]}
+        assert lambda_handler(event, None) == {'batchItemFailures': []}
+        
+        content = mock_invoke.call_args[0][0]['messages'][0]['content']
+        assert sum(1 for block in content if block['type'] == 'image') == 1
+        saved = {call[0][0]: call[0][1] for call in mock_store.call_args_list}
+        assert saved['uploads/sessions/s1/2.jpg']['rejection']['reason'] == 'no_objects'
+        assert saved['uploads/sessions/s1/1.jpg']['equipment'][0]['name'] == 'モニターA'
+    
+    @patch('handler.SESSION_MODE_ENABLED', True)
+    @patch('session_analysis.SESSION_MAX_IMAGES', 6)
+    @patch('session_analysis.SESSION_MAX_WORKERS', 2)
+    @patch('session_analysis.ThreadPoolExecutor', wraps=ThreadPoolExecutor)
+    @patch('handler.acquire_image_lease', return_value='acquired')
+    @patch('handler.store_result')
+    @patch('handler.detect_objects_with_rekognition', return_value=[])
+    @patch('handler.get_image_from_s3')
+    @patch('handler.invoke_bedrock_model')
+    def test_worker_count_capped(self, mock_invoke, mock_get_image, mock_detect, mock_store, mock_lease, mock_executor):
+        """画像の取得・物体検出の並列数はSESSION_MAX_WORKERSまで"""
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_invoke.return_value = {'content': [{'text': json.dumps({'p': [{'e': []}] * 5})}]}
+        event = {'Records': [
+            make_session_record(f'm{i}', f'uploads/sessions/s1/{i}.jpg') for i in range(5)
+        ]}
+        assert lambda_handler(event, None) == {'batchItemFailures': []}
+        assert [call.kwargs['max_workers'] for call in mock_executor.call_args_list] == [2, 2]
+    
+    @patch('handler.SESSION_MODE_ENABLED', True)
+    @patch('handler.IDEMPOTENCY_ENABLED', True)
+    @patch('handler.store_result')
+    @patch('handler.get_image_from_s3')
+    @patch('handler.invoke_bedrock_model')
+    @patch('handler.acquire_image_lease')
+    def test_in_flight_images_requeued(self, mock_lease, mock_invoke, mock_get_image, mock_store):
+        """他の実行が処理中の画像のメッセージだけを再試行対象として返す"""
+        mock_lease.side_effect = lambda key, etag, owner: 'in_flight' if key.endswith('2.jpg') else 'completed'
+        event = {'Records': [
+            make_session_record('m1', 'uploads/sessions/s1/1.jpg'),
+            make_session_record('m2', 'uploads/sessions/s1/2.jpg')
+        ]}
+        assert lambda_handler(event, None) == {'batchItemFailures': [{'itemIdentifier': 'm2'}]}
+        mock_get_image.assert_not_called()
+        mock_invoke.assert_not_called()
+    
+    @patch('handler.ENABLE_EDGE_SNAPPING', False)
+    @patch('handler.ENABLE_CROP_REFINEMENT', True)
+    @patch('handler.has_time_budget', return_value=True)
+    @patch('handler.refine_positions_with_crops')
+    def test_session_results_refined_like_single_images(self, mock_refine, mock_budget):
+        """セッション分析の結果も切り出し画像で位置調整する"""
+        refined = [{'name': 'モニター', 'bbox': {'x': 1, 'y': 1, 'width': 5, 'height': 5}}]
+        mock_refine.return_value = refined
+        result = finish_session_result(
+            {'bucket': 'b', 'key': 'uploads/sessions/s1/1.jpg'}, b'jpeg', {'equipment': [{'name': 'モニター'}]}, None
+        )
+        assert result['equipment'] == refined
+        mock_refine.assert_called_once_with(b'jpeg', [{'name': 'モニター'}])
+    
+    @patch('handler.SESSION_MODE_ENABLED', True)
+    @patch('handler.process_image')
+    @patch('session_analysis.process_session')
+    def test_fallback_to_single_images(self, mock_session, mock_process):
+        """まとめて分析できなかった場合は1枚ずつ分析"""
+        mock_session.side_effect = ValueError('mismatch')
+        mock_process.return_value = {'statusCode': 200}
+        event = {'Records': [
+            make_session_record('m1', 'uploads/sessions/s1/1.jpg'),
+            make_session_record('m2', 'uploads/sessions/s1/2.jpg')
+        ]}
+        assert lambda_handler(event, None) == {'batchItemFailures': []}
+        assert mock_process.call_count == 2
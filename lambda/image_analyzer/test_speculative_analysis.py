@@ -0,0 +1,127 @@
+"""
+先読みの識別のユニットテスト
+"""
+
+import json
+from unittest.mock import patch
+
+from handler import analyze_image
+from speculative_analysis import reconcile_with_detections
+from test_handler import make_jpeg
+
+
+class TestSpeculativeIdentification:
+    """Rekognitionを待たない先読みの識別のテスト"""
+    
+    DETECTIONS = [
+        {'label': 'Monitor', 'confidence': 95.0, 'bbox': {'x': 10, 'y': 10, 'width': 30, 'height': 20}},
+        {'label': 'Electronics', 'confidence': 88.0, 'bbox': {'x': 60, 'y': 50, 'width': 30, 'height': 40}}
+    ]
+    
+    def claude_item(self, name: str, bbox: dict) -> dict:
+        return {'name': name, 'bbox': bbox, 'risk_level': 'SAFE', 'description': '説明'}
+    
+    def test_matched_items_use_rekognition_boxes(self):
+        """IoU・中心の距離で対応した機器はRekognitionの座標と信頼度を使う"""
+        claude_result = {'equipment': [
+            # IoUで対応
+            self.claude_item('モニター', {'x': 12, 'y': 11, 'width': 28, 'height': 20}),
+            # IoUは小さいが中心が近く大きさも近い
+            self.claude_item('スイッチャー', {'x': 68, 'y': 58, 'width': 16, 'height': 26}),
+            # 対応する検出が無い
+            self.claude_item('パッチパネル', {'x': 0, 'y': 80, 'width': 20, 'height': 10})
+        ]}
+        result = reconcile_with_detections(claude_result, self.DETECTIONS)
+        
+        by_name = {e['name']: e for e in result['equipment']}
+        assert by_name['モニター']['bbox'] == self.DETECTIONS[0]['bbox']
+        assert by_name['モニター']['source'] == 'rekognition'
+        assert by_name['スイッチャー']['bbox'] == self.DETECTIONS[1]['bbox']
+        assert by_name['スイッチャー']['confidence'] == 88.0
+        assert by_name['パッチパネル']['source'] == 'claude'
+        assert by_name['パッチパネル']['confidence'] == 75.0
+    
+    def test_one_to_one_and_size_check(self):
+        """1つの検出には1つの機器だけを対応付け、大きさの違う物体とは中心が近くても対応させない"""
+        claude_result = {'equipment': [
+            self.claude_item('モニターA', {'x': 11, 'y': 10, 'width': 30, 'height': 20}),
+            self.claude_item('モニターB', {'x': 10, 'y': 12, 'width': 30, 'height': 20}),
+            self.claude_item('ラック', {'x': 30, 'y': 10, 'width': 70, 'height': 90})
+        ]}
+        result = reconcile_with_detections(claude_result, self.DETECTIONS)
+        
+        assert [e['source'] for e in result['equipment']] == ['rekognition', 'claude', 'claude']
+    
+    @patch('handler.SPECULATIVE_IDENTIFICATION_ENABLED', True)
+    @patch('handler.invoke_bedrock_model')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_claude_runs_alongside_rekognition(self, mock_get_image, mock_detect, mock_invoke):
+        """ClaudeはRekognitionの完了を待たずに呼ばれる"""
+        import threading
+        
+        claude_started = threading.Event()
+        mock_get_image.return_value = make_jpeg(64, 48)
+        
+        def detect(bucket, key, image_bytes=None):
+            # Claudeが先に呼ばれなければタイムアウトする
+            assert claude_started.wait(timeout=5)
+            return self.DETECTIONS
+        
+        def invoke(body, priority=None, model_id=None):
+            claude_started.set()
+            return {'content': [{'type': 'text', 'text': json.dumps({'equipment': [
+                dict(self.claude_item('モニター', {'x': 12, 'y': 11, 'width': 28, 'height': 20}), source='claude')
+            ]})}]}
+        
+        mock_detect.side_effect = detect
+        mock_invoke.side_effect = invoke
+        
+        result = analyze_image('b', 'uploads/a.jpg', None)
+        
+        assert result['equipment'][0]['bbox'] == self.DETECTIONS[0]['bbox']
+        assert result['equipment'][0]['source'] == 'rekognition'
+    
+    @patch('handler.SPECULATIVE_IDENTIFICATION_ENABLED', True)
+    @patch('handler.PROMPT_VERSION', 'compact')
+    @patch('handler.invoke_bedrock_model')
+    @patch('handler.detect_objects_with_rekognition')
+    @patch('handler.get_image_from_s3')
+    def test_uses_configured_prompt_version(self, mock_get_image, mock_detect, mock_invoke):
+        """通常の分析と同じPROMPT_VERSIONのプロンプト・解析を使う"""
+        mock_get_image.return_value = make_jpeg(64, 48)
+        mock_detect.return_value = self.DETECTIONS
+        mock_invoke.return_value = {'content': [{'type': 'text', 'text': json.dumps({'e': [
+            {'b': [12, 11, 28, 20], 'n': 'モニター', 'r': 'S', 'd': '説明'}
+        ]})}]}
+        
+        result = analyze_image('b', 'uploads/a.jpg', None)
+        
+        prompt = mock_invoke.call_args[0][0]['messages'][0]['content'][1]['text']
+        assert '短縮JSON形式' in prompt
+        assert result['equipment'][0]['name'] == 'モニター'
+        assert result['equipment'][0]['bbox'] == self.DETECTIONS[0]['bbox']
+    
+    @patch('handler.SPECULATIVE_IDENTIFICATION_ENABLED', True)
+    @patch('handler.QUALITY_GATE_ENABLED', True)
+    @patch('quality_gate.QUALITY_REJECT_EMPTY', True)
+    @patch('quality_gate.QUALITY_MIN_SHARPNESS', 0)
+    @patch('handler.invoke_bedrock_model')
+    @patch('handler.detect_objects_with_rekognition', return_value=[])
+    @patch('handler.get_image_from_s3')
+    def test_empty_photo_rejected(self, mock_get_image, mock_detect, mock_invoke):
+        """物体が検出されない写真は、Claudeの応答を使わずに除外"""
+        from PIL import Image
+        from io import BytesIO
+        
+        output = BytesIO()
+        Image.new('RGB', (400, 300), (128, 128, 128)).save(output, format='JPEG')
+        mock_get_image.return_value = output.getvalue()
+        mock_invoke.return_value = {'content': [{'type': 'text', 'text': json.dumps({'equipment': [
+            dict(self.claude_item('モニター', {'x': 12, 'y': 11, 'width': 28, 'height': 20}), source='claude')
+        ]})}]}
+        
+        result = analyze_image('b', 'uploads/wall.jpg', None)
+        
+        assert result['rejection']['reason'] == 'no_objects'
+        assert result['equipment'] == []
@@ -0,0 +1,71 @@
+"""
+段階ごとの出力のキャッシュのユニットテスト
+"""
+
+import boto3
+from unittest.mock import Mock
+from moto import mock_aws
+from stage_cache import MemoryStageCache, S3StageCache, StageCheckpoint, stage_version, STAGE_DETECTIONS
+
+
+def test_stage_version_depends_on_parameters():
+    """パラメータが同じならバージョンも同じ（辞書のキーの順序は問わない）"""
+    assert stage_version({'a': 1, 'b': 2}, 'x') == stage_version({'b': 2, 'a': 1}, 'x')
+    assert stage_version({'a': 1}, 'x') != stage_version({'a': 1}, 'y')
+    assert len(stage_version('x')) == 16
+
+
+def test_memory_cache_keyed_by_version_and_etag():
+    """バージョン・ETagが違う出力は別に記録"""
+    cache = MemoryStageCache()
+    cache.put_json(STAGE_DETECTIONS, 'uploads/a.jpg', 'e1', 'v1', [{'label': 'Monitor'}])
+    assert cache.get_json(STAGE_DETECTIONS, 'uploads/a.jpg', 'e1', 'v1') == [{'label': 'Monitor'}]
+    assert cache.get_json(STAGE_DETECTIONS, 'uploads/a.jpg', 'e2', 'v1') is None
+    assert cache.get_json(STAGE_DETECTIONS, 'uploads/a.jpg', 'e1', 'v2') is None
+
+
+def test_s3_cache_round_trip():
+    """S3に記録した出力を読み込み、記録が無ければNone"""
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='images')
+        cache = S3StageCache(s3, 'images')
+
+        assert cache.get(STAGE_DETECTIONS, 'uploads/a.jpg', '"e1"', 'v1') is None
+        cache.put(STAGE_DETECTIONS, 'uploads/a.jpg', '"e1"', 'v1', b'[]')
+
+        # ETagの引用符の有無は区別しない
+        assert cache.get(STAGE_DETECTIONS, 'uploads/a.jpg', 'e1', 'v1') == b'[]'
+        keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket='images')['Contents']]
+        assert keys == ['derived/stages/detections/v1/e1/uploads/a.jpg']
+
+
+def test_corrupt_json_treated_as_missing():
+    """壊れたJSONは記録が無いものとして扱う"""
+    cache = MemoryStageCache()
+    cache.put(STAGE_DETECTIONS, 'uploads/a.jpg', 'e1', 'v1', b'{not json')
+    assert cache.get_json(STAGE_DETECTIONS, 'uploads/a.jpg', 'e1', 'v1') is None
+
+
+def test_checkpoint_errors_treated_as_missing():
+    """記録の読み書きに失敗しても分析は続ける"""
+    cache = Mock()
+    cache.get.side_effect = RuntimeError('AccessDenied')
+    cache.get_json.side_effect = RuntimeError('AccessDenied')
+    cache.put.side_effect = RuntimeError('AccessDenied')
+    checkpoint = StageCheckpoint(cache, 'uploads/a.jpg', 'e1')
+
+    assert checkpoint.load(STAGE_DETECTIONS, 'v1') is None
+    assert checkpoint.load_json(STAGE_DETECTIONS, 'v1') is None
+    checkpoint.save_json(STAGE_DETECTIONS, 'v1', [])
+
+
+def test_checkpoint_variant_recorded_separately():
+    """切り出し画像など別の入力の出力は、元の画像の出力と区別して記録"""
+    checkpoint = StageCheckpoint(MemoryStageCache(), 'uploads/a.jpg', 'e1')
+    checkpoint.save_json(STAGE_DETECTIONS, 'v1', ['full'])
+    checkpoint.for_variant('roi-1').save_json(STAGE_DETECTIONS, 'v1', ['crop'])
+
+    assert checkpoint.load_json(STAGE_DETECTIONS, 'v1') == ['full']
+    assert checkpoint.for_variant('roi-1').load_json(STAGE_DETECTIONS, 'v1') == ['crop']
+    assert checkpoint.for_variant('roi-2').load_json(STAGE_DETECTIONS, 'v1') is None
@@ -0,0 +1,95 @@
+"""
+高解像度画像のタイル分析のユニットテスト
+"""
+
+from unittest.mock import patch
+
+from handler import region_bbox_to_global
+from tiled_analysis import compute_tile_regions, merge_overlapping_equipment, analyze_image_tiled, should_tile_image
+from test_handler import make_jpeg
+
+
+class TestTiledAnalysis:
+    """タイル分析のテスト"""
+    
+    def test_compute_tile_regions_cover_image(self):
+        """タイルが重なりを持って画像全体を覆う"""
+        regions = compute_tile_regions(5000, 3000, 2048, 0.15)
+        assert max(r[2] for r in regions) == 5000
+        assert max(r[3] for r in regions) == 3000
+        assert all(r[2] - r[0] == 2048 and r[3] - r[1] == 2048 for r in regions)
+        lefts = sorted({r[0] for r in regions})
+        assert all(b - a < 2048 for a, b in zip(lefts, lefts[1:]))
+    
+    def test_disabled_by_default(self):
+        """既定ではタイルに分割しない"""
+        assert should_tile_image(make_jpeg(3000, 2000)) is False
+    
+    @patch('tiled_analysis.TILING_MIN_MEGAPIXELS', 1)
+    @patch('tiled_analysis.TILE_SIZE', 1000)
+    def test_tile_count_cap_falls_back(self):
+        """タイル数が上限を超える画像は通常どおり分析"""
+        image_bytes = make_jpeg(3000, 2000)
+        with patch('tiled_analysis.TILE_MAX_TILES', 12):
+            assert should_tile_image(image_bytes) is True
+        with patch('tiled_analysis.TILE_MAX_TILES', 4):
+            assert should_tile_image(image_bytes) is False
+    
+    def test_small_image_single_tile(self):
+        """タイルより小さい画像は1タイル"""
+        assert compute_tile_regions(1000, 800, 2048, 0.15) == [(0, 0, 1000, 800)]
+    
+    def test_region_bbox_to_global(self):
+        """タイル内の座標を画像全体の座標に変換"""
+        bbox = region_bbox_to_global(
+            {'x': 50, 'y': 0, 'width': 50, 'height': 100},
+            (1000, 500, 2000, 1500),
+            (4000, 2000)
+        )
+        assert bbox == {'x': 37.5, 'y': 25.0, 'width': 12.5, 'height': 50.0}
+    
+    def test_merge_overlapping_equipment(self):
+        """重なり部分の重複を統合し、分断された同一機器は外接矩形にする"""
+        equipment = [
+            {'name': 'A', 'bbox': {'x': 10, 'y': 10, 'width': 10, 'height': 10}, 'confidence': 90.0},
+            {'name': 'A', 'bbox': {'x': 11, 'y': 10, 'width': 10, 'height': 10}, 'confidence': 80.0},
+            {'name': 'B', 'bbox': {'x': 50, 'y': 50, 'width': 10, 'height': 10}, 'confidence': 75.0}
+        ]
+        merged = merge_overlapping_equipment(equipment)
+        assert [e['name'] for e in merged] == ['A', 'B']
+        assert merged[0]['bbox'] == {'x': 10, 'y': 10, 'width': 11, 'height': 10}
+    
+    def test_merge_keeps_adjacent_devices_with_different_names(self):
+        """ボックスが大きく重なっても名前が異なる機器（積み重ねたラック機器など）は両方残す"""
+        equipment = [
+            {'name': 'ルーター RT-1', 'bbox': {'x': 10, 'y': 10, 'width': 40, 'height': 10}, 'confidence': 90.0},
+            {'name': 'スイッチ SW-2', 'bbox': {'x': 10, 'y': 12, 'width': 40, 'height': 10}, 'confidence': 80.0},
+            {'name': 'ルーター　rt 1', 'bbox': {'x': 11, 'y': 10, 'width': 40, 'height': 10}, 'confidence': 70.0}
+        ]
+        merged = merge_overlapping_equipment(equipment)
+        # 表記の違い（全角空白・大文字小文字・記号）だけの名前は同じ機器として統合する
+        assert [e['name'] for e in merged] == ['ルーター RT-1', 'スイッチ SW-2']
+    
+    @patch('handler.analyze_equipment_with_claude')
+    @patch('handler.detect_objects_with_rekognition')
+    def test_analyze_image_tiled(self, mock_detect, mock_analyze):
+        """全体像と各タイルを分析し、全体座標でマージ"""
+        from PIL import Image
+        from io import BytesIO
+        
+        output = BytesIO()
+        Image.new('RGB', (300, 200)).save(output, format='JPEG')
+        
+        mock_detect.return_value = [
+            {'label': 'Monitor', 'confidence': 95.0, 'bbox': {'x': 0, 'y': 0, 'width': 10, 'height': 10}}
+        ]
+        mock_analyze.return_value = {'equipment': [
+            {'source': 'rekognition', 'object_index': 0, 'name': 'Monitor', 'risk_level': 'SAFE', 'description': 'x'}
+        ]}
+        
+        with patch('tiled_analysis.TILE_SIZE', 200):
+            result = analyze_image_tiled('bucket', 'key', output.getvalue())
+        
+        # 全体像1回 + タイル2枚
+        assert mock_analyze.call_count == 3
+        assert all(0 <= e['bbox']['x'] <= 100 for e in result['equipment'])
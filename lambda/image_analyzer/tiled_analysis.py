@@ -0,0 +1,219 @@
+"""
+技術局長 - 高解像度画像のタイル分析
+
+TILING_MIN_MEGAPIXELS（既定は0で無効）を超える画像を重なりのあるタイルに分割し、タイルごとの物体検出・機器識別と
+画像全体の分析を並列に実行して、画像全体の座標でマージする
+
+- 1枚あたりのBedrock呼び出しはタイル数 + 1回に増えるため、タイル数がTILE_MAX_TILESを超える画像は通常どおり分析する
+- タイルの境界で分断された機器は、名前（正規化後）が同じ場合だけ外接矩形に統合する
+- 段階の出力の記録・印字による識別・関心領域の切り出しは行わない（タイルはそれ自体が画像の一部分のため）
+
+物体検出・機器識別はhandlerの関数を使い、handler.analyze_imageから呼び出す
+"""
+
+import os
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any
+
+import handler
+from inventory import normalize_device_name
+
+logger = logging.getLogger()
+
+# タイル分析（この画素数を超える画像は重なりのあるタイルに分割して分析、0で無効）
+TILING_MIN_MEGAPIXELS = float(os.environ.get('TILING_MIN_MEGAPIXELS', '0'))
+TILE_SIZE = int(os.environ.get('TILE_SIZE', '2048'))
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', '0.15'))
+TILE_MAX_WORKERS = int(os.environ.get('TILE_MAX_WORKERS', '4'))
+# 1枚あたりのタイル数の上限（超える画像はタイルに分割せず通常どおり分析）
+TILE_MAX_TILES = int(os.environ.get('TILE_MAX_TILES', '8'))
+
+
+def should_tile_image(image_bytes: bytes) -> bool:
+    """
+    タイル分析の対象となる高解像度画像かを判定
+    
+    Args:
+        image_bytes: 画像のバイトデータ
+    
+    Returns:
+        TILING_MIN_MEGAPIXELSを超え、タイル数がTILE_MAX_TILES以下の場合True
+    """
+    if TILING_MIN_MEGAPIXELS <= 0:
+        return False
+    
+    try:
+        from PIL import Image
+        from io import BytesIO
+        
+        # ヘッダのみ読み込んでサイズを取得（デコードしない）
+        width, height = Image.open(BytesIO(image_bytes)).size
+    except Exception as e:
+        logger.warning(f"画像サイズを取得できません: {e}")
+        return False
+    
+    if width * height <= TILING_MIN_MEGAPIXELS * 1_000_000:
+        return False
+    
+    tile_count = len(compute_tile_regions(width, height, TILE_SIZE, TILE_OVERLAP))
+    if tile_count > TILE_MAX_TILES:
+        logger.info(f"タイル数が上限を超えるため通常どおり分析: {width}x{height} -> {tile_count}タイル")
+        return False
+    return True
+
+
+def compute_tile_regions(width: int, height: int, tile_size: int, overlap: float) -> List[tuple]:
+    """
+    重なりのあるタイル領域を計算
+    
+    Args:
+        width: 画像の幅（ピクセル）
+        height: 画像の高さ（ピクセル）
+        tile_size: タイルの一辺（ピクセル）
+        overlap: 隣接タイルとの重なり（タイルサイズに対する割合）
+    
+    Returns:
+        (left, top, right, bottom)のリスト
+    """
+    def positions(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        stride = max(1, int(tile_size * (1 - overlap)))
+        starts = list(range(0, length - tile_size, stride))
+        # 最後のタイルは画像の端に揃える
+        starts.append(length - tile_size)
+        return starts
+    
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in positions(height)
+        for left in positions(width)
+    ]
+
+
+def merge_overlapping_equipment(
+    equipment_list: List[Dict[str, Any]],
+    iou_threshold: float = 0.5,
+    containment_threshold: float = 0.8
+) -> List[Dict[str, Any]]:
+    """
+    タイルの重なり部分で重複した機器を統合
+    
+    名前（正規化後）が同じ機器だけを統合する。積み重ねたラック機器のように隣接する別の機器は
+    ボックスが大きく重なっても名前が異なるため、両方を残す
+    
+    Args:
+        equipment_list: 画像全体の座標に変換済みの機器リスト
+        iou_threshold: 同名の機器で、同一機器とみなすIoU
+        containment_threshold: 同名の機器で、小さい方がこの割合以上含まれていれば同一とみなす
+    
+    Returns:
+        重複を除いた機器リスト
+    """
+    merged = []
+    for equipment in sorted(equipment_list, key=lambda e: e['confidence'], reverse=True):
+        bbox = equipment['bbox']
+        name = normalize_device_name(equipment['name'])
+        duplicate = None
+        for kept in merged:
+            if name != normalize_device_name(kept['name']):
+                continue
+            if handler.bbox_iou(bbox, kept['bbox']) >= iou_threshold:
+                duplicate = kept
+                break
+            smaller_area = min(bbox['width'] * bbox['height'], kept['bbox']['width'] * kept['bbox']['height'])
+            if smaller_area > 0 and handler.bbox_intersection_area(bbox, kept['bbox']) / smaller_area >= containment_threshold:
+                duplicate = kept
+                break
+        
+        if duplicate is None:
+            merged.append(dict(equipment))
+        else:
+            # タイル境界で分断された同一機器は外接矩形に広げる
+            kept_bbox = duplicate['bbox']
+            x1 = min(bbox['x'], kept_bbox['x'])
+            y1 = min(bbox['y'], kept_bbox['y'])
+            x2 = max(bbox['x'] + bbox['width'], kept_bbox['x'] + kept_bbox['width'])
+            y2 = max(bbox['y'] + bbox['height'], kept_bbox['y'] + kept_bbox['height'])
+            duplicate['bbox'] = {'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1}
+    
+    logger.info(f"重複統合: {len(equipment_list)}個 -> {len(merged)}個")
+    return merged
+
+
+def analyze_tile(image: Any, region: tuple) -> List[Dict[str, Any]]:
+    """
+    1タイル分の物体検出と機器識別を実行
+    
+    Args:
+        image: PIL画像（画像全体）
+        region: タイル領域 (left, top, right, bottom)
+    
+    Returns:
+        画像全体の座標に変換した機器リスト
+    """
+    from io import BytesIO
+    
+    # タイルを切り出してJPEGに変換
+    tile = image.crop(region)
+    output = BytesIO()
+    tile.save(output, format='JPEG', quality=90)
+    tile_bytes = output.getvalue()
+    
+    rekognition_result = handler.detect_objects(None, None, tile_bytes)
+    claude_result = handler.analyze_equipment_with_claude(handler.encode_image_to_base64(tile_bytes), rekognition_result)
+    tile_result = handler.merge_results(rekognition_result, claude_result)
+    
+    for equipment in tile_result['equipment']:
+        equipment['bbox'] = handler.region_bbox_to_global(equipment['bbox'], region, image.size)
+    return tile_result['equipment']
+
+
+def analyze_image_tiled(bucket: str, key: str, image_bytes: bytes, send_bytes: bool = False) -> Dict[str, Any]:
+    """
+    高解像度画像をタイルに分割して並列分析（縮小した全体像の分析も同時に実行）
+    
+    タイルはそれ自体が画像の一部分のため、段階の出力の記録・印字による識別・
+    関心領域の切り出しは行わない。エッジ吸着などの後処理はanalyze_imageで
+    マージ後の結果に対して行う。
+    
+    Args:
+        bucket: S3バケット名
+        key: S3オブジェクトキー
+        image_bytes: 画像のバイトデータ
+        send_bytes: 全体像の物体検出でS3上の画像ではなくimage_bytesを送る
+    
+    Returns:
+        マージされた最終結果
+    """
+    from PIL import Image
+    from io import BytesIO
+    
+    image = Image.open(BytesIO(image_bytes))
+    # スレッド間で共有するため、先にデコードしておく
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    regions = compute_tile_regions(image.width, image.height, TILE_SIZE, TILE_OVERLAP)
+    logger.info(f"タイル分析: {image.width}x{image.height} -> {len(regions)}タイル")
+    
+    def analyze_overview() -> List[Dict[str, Any]]:
+        # タイルをまたぐ大型機器のため、画像全体も通常どおり分析
+        rekognition_result = handler.detect_objects(bucket, key, image_bytes, send_bytes)
+        claude_result = handler.analyze_equipment_with_claude(handler.encode_image_to_base64(image_bytes), rekognition_result)
+        return handler.merge_results(rekognition_result, claude_result)['equipment']
+    
+    # Bedrockの同時呼び出し数はbedrock_concurrencyで全体として制限される
+    # 各タイルの処理に優先度を引き継ぐため、呼び出し元のコンテキストで実行する
+    with ThreadPoolExecutor(max_workers=TILE_MAX_WORKERS) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, analyze_overview)]
+        futures += [
+            executor.submit(contextvars.copy_context().run, analyze_tile, image, region)
+            for region in regions
+        ]
+        equipment_list = [equipment for future in futures for equipment in future.result()]
+    
+    return {'equipment': merge_overlapping_equipment(equipment_list)}